@@ -0,0 +1,151 @@
+import threading
+import time
+
+from protocol import ProtocolError
+
+# === KIỂM SOÁT TIẾP NHẬN (phía nhận của server) ===
+#
+# Header của mỗi frame khai báo độ dài payload TRƯỚC khi payload tới, nên server quyết định ngay khi
+# đọc xong header (v1: header + vài byte đầu payload để biết KIND), trước khi cấp buffer:
+# - payload dài hơn giới hạn của loại tin đó -> từ chối: ngắt kết nối, payload không được đọc;
+# - kết nối vượt tốc độ cho phép (frame/s, byte/s) -> ngừng đọc kết nối đó cho tới khi trả đủ "nợ",
+#   dữ liệu nằm lại trong bộ đệm TCP và TCP tự đẩy ngược về người gửi;
+# - tổng payload đang nằm trong buffer nhận (kể cả frame còn chờ trong hàng đợi gửi của người nhận)
+#   chạm ngân sách chung -> mọi kết nối chờ trước khi nhận payload mới, tới khi có buffer được trả.
+# Bộ nhớ buffer nhận của server vì vậy bị chặn bởi ngân sách chung, bất kể client khai báo gì.
+
+CONTROL_FRAME_BYTES = 64 * 1024            # tin điều khiển / loại không xác định
+DEFAULT_INFLIGHT_BYTES = 256 * 1024 * 1024
+BUDGET_RETRY_INTERVAL = 0.01               # giây giữa các lần thử lại khi ngân sách đang đầy
+RATE_BURST = 1.0                           # dung lượng token bucket, tính bằng số giây ở tốc độ tối đa
+
+# Giới hạn payload mặc định theo loại tin (loại không có ở đây: CONTROL_FRAME_BYTES)
+DEFAULT_MAX_FRAME = {
+    "TEXTMSG": 1024 * 1024,
+    "VOICEMSG": 32 * 1024 * 1024,           # tin thoại cũ gửi một lần (tối đa MAX_RECORD_SECONDS của client)
+    "FILE": 32 * 1024 * 1024,               # file nhỏ gửi một lần (file lớn đi dạng luồng, xem transfer.py)
+    "FILECHUNK": 1024 * 1024,
+    "VOICECHUNK": 1024 * 1024,
+}
+
+
+class FrameRejected(ProtocolError):
+    """Frame vượt giới hạn tiếp nhận (kết nối bị ngắt trước khi nhận payload)."""
+
+
+def parse_frame_limits(items):
+    """["TEXTMSG=65536", "FILE=0"] -> {"TEXTMSG": 65536, "FILE": 0}. Lỗi format gây ValueError."""
+    limits = {}
+    for item in items:
+        kind, sep, value = item.partition("=")
+        if not sep or not kind.strip():
+            raise ValueError(f"giới hạn frame không hợp lệ: {item!r} (cần KIND=BYTES)")
+        limits[kind.strip().upper()] = int(value)
+    return limits
+
+
+class RateLimiter:
+    """
+    Token bucket của MỘT kết nối: frame/s và byte/s (0 = không giới hạn).
+    Cho phép nợ: frame lớn hơn dung lượng bucket vẫn đi được, kết nối chỉ phải chờ lâu hơn.
+    Chỉ luồng đọc của kết nối dùng đối tượng này nên không cần khóa.
+    """
+
+    __slots__ = ("frame_rate", "byte_rate", "frame_tokens", "byte_tokens", "stamp")
+
+    def __init__(self, frame_rate, byte_rate):
+        self.frame_rate = frame_rate
+        self.byte_rate = byte_rate
+        self.frame_tokens = frame_rate * RATE_BURST
+        self.byte_tokens = byte_rate * RATE_BURST
+        self.stamp = time.monotonic()
+
+    def charge(self, nbytes):
+        """Trừ 1 frame + nbytes. Trả về số giây phải chờ trước khi đọc payload (0 = ngay)."""
+        now = time.monotonic()
+        elapsed, self.stamp = now - self.stamp, now
+        wait = 0.0
+        if self.frame_rate:
+            self.frame_tokens = min(self.frame_rate * RATE_BURST, self.frame_tokens + elapsed * self.frame_rate) - 1
+            if self.frame_tokens < 0:
+                wait = -self.frame_tokens / self.frame_rate
+        if self.byte_rate:
+            self.byte_tokens = min(self.byte_rate * RATE_BURST, self.byte_tokens + elapsed * self.byte_rate) - nbytes
+            if self.byte_tokens < 0:
+                wait = max(wait, -self.byte_tokens / self.byte_rate)
+        return wait
+
+
+class AdmissionPolicy:
+    """
+    Giới hạn tiếp nhận dùng chung cho mọi kết nối của server. Ngân sách byte nằm ở 'pool'
+    (BufferPool có budget); mỗi kết nối lấy một Admission riêng bằng connection().
+    """
+
+    def __init__(self, pool, max_frame=None, default_max=CONTROL_FRAME_BYTES, frame_rate=0, byte_rate=0):
+        self.pool = pool
+        self.max_frame = dict(DEFAULT_MAX_FRAME)
+        self.max_frame.update(max_frame or {})
+        self.default_max = default_max
+        self.frame_rate = frame_rate
+        self.byte_rate = byte_rate
+        self._lock = threading.Lock()
+        self.rejected = 0        # frame bị từ chối vì quá lớn
+        self.throttled = 0       # frame phải chờ vì vượt tốc độ
+        self.throttled_s = 0.0   # tổng thời gian chờ do vượt tốc độ
+        self.budget_waits = 0    # frame phải chờ vì ngân sách chung đầy
+
+    def limit_for(self, kind):
+        limit = self.max_frame.get(kind, self.default_max)
+        if self.pool.budget:
+            limit = min(limit, self.pool.budget)
+        return limit
+
+    def connection(self):
+        return Admission(self)
+
+    def _count(self, name, seconds=0.0):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+            if seconds:
+                self.throttled_s += seconds
+
+    def stats(self):
+        with self._lock:
+            counters = {"rejected": self.rejected, "throttled": self.throttled,
+                        "throttled_s": round(self.throttled_s, 3), "budget_waits": self.budget_waits}
+        return {"inflight_bytes": self.pool.in_use, "inflight_peak_bytes": self.pool.peak,
+                "budget_bytes": self.pool.budget, **counters}
+
+
+class Admission:
+    """Kiểm soát tiếp nhận của MỘT kết nối (FrameAssembler gọi trước khi cấp buffer payload)."""
+
+    __slots__ = ("policy", "limiter")
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.limiter = RateLimiter(policy.frame_rate, policy.byte_rate) \
+            if policy.frame_rate or policy.byte_rate else None
+
+    def admit(self, kind, length):
+        """
+        Header của frame 'kind' dài 'length' bytes vừa tới. Quá giới hạn -> FrameRejected;
+        ngược lại trả về số giây phải chờ (vượt tốc độ) trước khi nhận payload.
+        """
+        limit = self.policy.limit_for(kind)
+        if length > limit:
+            self.policy._count("rejected")
+            raise FrameRejected(f"frame {kind or '?'} {length} bytes vượt giới hạn {limit} bytes")
+        if self.limiter is None:
+            return 0.0
+        wait = self.limiter.charge(length)
+        if wait:
+            self.policy._count("throttled", wait)
+        return wait
+
+    def budget_full(self, first):
+        """Ngân sách chung đang đầy: trả về số giây chờ trước khi thử lại ('first': lần đầu của frame này)."""
+        if first:
+            self.policy._count("budget_waits")
+        return BUDGET_RETRY_INTERVAL
@@ -0,0 +1,162 @@
+import asyncio
+from collections import deque
+
+from protocol import FrameAssembler, ProtocolError
+
+# Số tin nhắn đã nhận nhưng chưa xử lý tối đa trước khi ngừng đọc socket (pause_reading)
+MAX_PENDING_MESSAGES = 64
+
+
+class FrameConnection(asyncio.BufferedProtocol):
+    """
+    Kết nối của engine asyncio, nhận bằng asyncio.BufferedProtocol:
+    event loop gọi recv_into thẳng vào buffer do FrameAssembler cấp
+    (vùng đọc trước dùng lại, payload lớn nhận thẳng vào buffer của BufferPool), không qua
+    bộ đệm của StreamReader; một lần nhận có thể cho nhiều tin nhắn.
+
+    Phía ghi giữ giao diện giống asyncio.StreamWriter (write / drain / close /
+    get_extra_info / transport), nên phần còn lại của engine không cần biết sự khác biệt.
+    'on_connect(conn)' được gọi khi kết nối được thiết lập (server tạo task xử lý ở đó).
+
+    'admission' (admission.Admission, tùy chọn): khi FrameAssembler bắt chờ trước khi nhận payload
+    (vượt tốc độ / ngân sách byte chung đầy), kết nối ngừng đọc và hẹn giờ thử lại trên event loop.
+    """
+
+    def __init__(self, pool, on_connect, admission=None):
+        self._assembler = FrameAssembler(pool, admission)
+        self._on_connect = on_connect
+        self._messages = deque()
+        self._waiter = None
+        self._eof = False
+        self._reading_paused = False
+        self._stalled = False   # đang chờ kiểm soát tiếp nhận (cũng đã pause_reading)
+        self._retry = None
+        self._lost = False
+        self._closed = None
+        self._can_write = asyncio.Event()
+        self._can_write.set()
+        self.transport = None
+
+    # --- Callback của event loop ---
+    def connection_made(self, transport):
+        self.transport = transport
+        self._on_connect(self)
+
+    def get_buffer(self, sizehint):
+        return self._assembler.buffer()
+
+    def buffer_updated(self, nbytes):
+        self._collect(self._assembler.advance, nbytes)
+
+    def _collect(self, step, *args):
+        # Một lần nhận có thể chứa nhiều frame: nhận hết các tin đã nằm trong vùng đọc trước
+        try:
+            msg = step(*args)
+            while self._accept(msg):
+                msg = self._assembler.pop()
+        except ProtocolError as e:
+            print(f"[LỖI GIAO THỨC] {self.get_extra_info('peername')}: {e}")
+            self.transport.abort()
+
+    def _accept(self, msg):
+        """Nhận kết quả của FrameAssembler; True nếu có thể còn tin khác trong phần đã đọc."""
+        if self._assembler.wait:
+            # Chưa được nhận payload: ngừng đọc, thử lại sau 'wait' giây
+            self._stalled = True
+            self._pause()
+            self._retry = asyncio.get_running_loop().call_later(self._assembler.wait, self._resume_admission)
+            return False
+        if self._stalled:
+            self._stalled = False
+            self._maybe_resume()
+        if msg is None:
+            return False
+        self._messages.append(msg)
+        self._wake()
+        # Người xử lý (route + backpressure) chưa kịp: ngừng đọc để TCP đẩy ngược về người gửi
+        if len(self._messages) >= MAX_PENDING_MESSAGES:
+            self._pause()
+        return True
+
+    def _resume_admission(self):
+        self._retry = None
+        if self.transport.is_closing():
+            return
+        self._collect(self._assembler.resume)
+
+    def _pause(self):
+        if not self._reading_paused:
+            self._reading_paused = True
+            self.transport.pause_reading()
+
+    def _maybe_resume(self):
+        if self._reading_paused and not self._stalled and len(self._messages) < MAX_PENDING_MESSAGES // 2:
+            self._reading_paused = False
+            self.transport.resume_reading()
+
+    def eof_received(self):
+        self._eof = True
+        self._wake()
+        return False  # Đóng transport
+
+    def connection_lost(self, exc):
+        self._eof = self._lost = True
+        if self._retry is not None:
+            self._retry.cancel()
+        self._assembler.discard()
+        self._wake()
+        self._can_write.set()  # Không để drain() chờ mãi
+        if self._closed is not None and not self._closed.done():
+            self._closed.set_result(None)
+
+    def pause_writing(self):
+        self._can_write.clear()
+
+    def resume_writing(self):
+        self._can_write.set()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    # --- Giao diện cho engine ---
+    async def read_message(self):
+        """Tin nhắn tiếp theo (Message), hoặc None nếu client đã ngắt kết nối."""
+        while not self._messages:
+            if self._eof:
+                return None
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        msg = self._messages.popleft()
+        self._maybe_resume()
+        return msg
+
+    def release_pending(self):
+        """Người xử lý dừng sớm: trả buffer của các tin đã nhận mà chưa đọc."""
+        while self._messages:
+            self._messages.popleft().release()
+
+    def write(self, data):
+        self.transport.write(data)
+
+    async def drain(self):
+        if self.transport.is_closing():
+            raise ConnectionResetError("kết nối đã đóng")
+        await self._can_write.wait()
+
+    def close(self):
+        self.transport.close()
+
+    async def wait_closed(self):
+        """Chờ transport đóng hẳn (sau đó không còn giữ dữ liệu chờ gửi nào)."""
+        if self._lost:
+            return
+        if self._closed is None:
+            self._closed = asyncio.get_running_loop().create_future()
+        await self._closed
+
+    def get_extra_info(self, name, default=None):
+        return self.transport.get_extra_info(name, default)
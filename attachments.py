@@ -0,0 +1,154 @@
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# === KHO TỆP ĐÍNH KÈM TRÊN ĐĨA (phía client) ===
+#
+# Payload voice / file nhận được không còn nằm trong RAM suốt đời tiến trình (lambda của nút phát,
+# "Lưu...", "Mở" giữ bytes). Payload được ghi xuống thư mục cache theo địa chỉ nội dung
+# (tên file = SHA-256 của dữ liệu, cùng nội dung chỉ lưu một lần); giao diện chỉ giữ Attachment
+# (mã băm + kích thước). Khi phát / lưu / mở, dữ liệu được đọc bằng mmap.
+# Cache có giới hạn dung lượng: vượt quá thì xóa các tệp lâu không dùng nhất (LRU). Thứ tự LRU
+# được ghi vào mtime của tệp nên vẫn đúng sau khi client khởi động lại.
+
+ATTACHMENT_DIR = os.path.join(tempfile.gettempdir(), "voicechat_attachments")
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+class AttachmentMissing(Exception):
+    """Tệp đính kèm đã bị xóa khỏi cache (LRU) hoặc thư mục cache."""
+
+
+class Attachment:
+    """Tham chiếu tới một payload trong AttachmentStore (không giữ dữ liệu)."""
+
+    __slots__ = ("digest", "size")
+
+    def __init__(self, digest, size):
+        self.digest = digest
+        self.size = size
+
+    def __repr__(self):
+        return f"Attachment({self.digest[:12]}, {self.size})"
+
+
+class AttachmentStore:
+    """
+    Cache payload theo nội dung, giới hạn 'max_bytes', xóa theo LRU. Thread-safe
+    (luồng nhận ghi vào, luồng giao diện / phát âm thanh đọc ra).
+    """
+
+    def __init__(self, directory=ATTACHMENT_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._lru = OrderedDict()  # digest -> size, cũ nhất ở đầu
+        self.total = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest)
+
+    def _load(self):
+        """Đọc lại cache có sẵn trên đĩa, sắp theo mtime (lần dùng gần nhất)."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and len(entry.name) == 64:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+            elif entry.name.endswith(".tmp"):
+                os.remove(entry.path)  # ghi dở từ lần chạy trước
+        for _, digest, size in sorted(entries):
+            self._lru[digest] = size
+            self.total += size
+
+    def put(self, data):
+        """Lưu 'data' (bytes / memoryview), trả về Attachment. Nội dung đã có thì chỉ cập nhật LRU."""
+        digest = hashlib.sha256(data).hexdigest()
+        size = len(data)
+        with self._lock:
+            if digest in self._lru:
+                self._touch_locked(digest)
+                return Attachment(digest, size)
+        path = self._path(digest)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if digest not in self._lru:
+                self._lru[digest] = size
+                self.total += size
+            self._evict_locked(keep=digest)
+        return Attachment(digest, size)
+
+    def __contains__(self, attachment):
+        with self._lock:
+            return attachment.digest in self._lru
+
+    @contextmanager
+    def open(self, attachment):
+        """
+        memoryview (mmap, chỉ đọc) của tệp đính kèm, dùng trong khối with.
+        Raise AttachmentMissing nếu tệp đã bị xóa.
+        """
+        with self._lock:
+            if attachment.digest not in self._lru:
+                raise AttachmentMissing(attachment.digest)
+            self._touch_locked(attachment.digest)
+        try:
+            f = open(self._path(attachment.digest), "rb")
+        except FileNotFoundError:
+            self._forget(attachment.digest)
+            raise AttachmentMissing(attachment.digest) from None
+        with f:
+            if attachment.size == 0:
+                yield memoryview(b"")
+                return
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mm)
+            try:
+                yield view
+            finally:
+                try:
+                    view.release()
+                    mm.close()
+                except BufferError:
+                    pass  # còn view con (ví dụ mảng NumPy) đang dùng: để GC đóng sau
+
+    def save_to(self, attachment, path):
+        """Ghi tệp đính kèm ra 'path' (từ mmap, không nạp cả tệp vào RAM)."""
+        with self.open(attachment) as data, open(path, "wb") as out:
+            out.write(data)
+
+    def _touch_locked(self, digest):
+        self._lru.move_to_end(digest)
+        try:
+            os.utime(self._path(digest))
+        except OSError:
+            pass
+
+    def _forget(self, digest):
+        with self._lock:
+            size = self._lru.pop(digest, None)
+            if size is not None:
+                self.total -= size
+
+    def _evict_locked(self, keep=None):
+        """Xóa các tệp lâu không dùng nhất cho tới khi tổng dung lượng <= max_bytes."""
+        while self.total > self.max_bytes and len(self._lru) > 1:
+            digest, size = next(iter(self._lru.items()))
+            if digest == keep:
+                self._lru.move_to_end(digest)
+                continue
+            del self._lru[digest]
+            self.total -= size
+            try:
+                os.remove(self._path(digest))
+            except OSError:
+                pass
@@ -0,0 +1,114 @@
+"""
+Benchmark fan-out: nối header + payload cho TỪNG người nhận (cách cũ)
+so với đóng gói frame MỘT lần và gửi bằng vectored I/O (protocol.send_frame).
+
+Chạy:  python benchmarks/bench_broadcast.py --payload-mb 5 --recipients 1 10 50 100
+"""
+import argparse
+import json
+import os
+import selectors
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocol import encode_frame, encode_header, send_frame  # noqa: E402
+
+
+class Sink:
+    """Đầu nhận của N socketpair, được 1 luồng đọc liên tục bằng recv_into (không cấp phát)."""
+
+    def __init__(self, n):
+        self.pairs = [socket.socketpair() for _ in range(n)]
+        self.received = 0
+        self._buf = bytearray(1 << 20)
+        self._stop = False
+        self._sel = selectors.DefaultSelector()
+        for _, rx in self.pairs:
+            rx.setblocking(False)
+            self._sel.register(rx, selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        view = memoryview(self._buf)
+        while not self._stop:
+            for key, _ in self._sel.select(0.05):
+                try:
+                    self.received += key.fileobj.recv_into(view)
+                except BlockingIOError:
+                    pass
+
+    def wait_for(self, total, timeout=60):
+        deadline = time.monotonic() + timeout
+        while self.received < total and time.monotonic() < deadline:
+            time.sleep(0.001)
+
+    def close(self):
+        self._stop = True
+        self._thread.join()
+        for tx, rx in self.pairs:
+            tx.close()
+            rx.close()
+
+
+def old_fanout(senders, payload):
+    # Cách cũ (send_message): mỗi người nhận một lần nối msg_len + message_bytes
+    for sock in senders:
+        sock.sendall(encode_header(len(payload)) + payload)
+    return len(senders) * (10 + len(payload))
+
+
+def new_fanout(senders, payload):
+    # Cách mới: 1 Frame dùng chung, header + payload đi qua sendmsg
+    frame = encode_frame(payload)
+    for sock in senders:
+        send_frame(sock, frame)
+    return len(frame.header)
+
+
+def run_case(fanout, n, payload):
+    sink = Sink(n)
+    senders = [tx for tx, _ in sink.pairs]
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    copied = fanout(senders, payload)
+    sink.wait_for(n * (10 + len(payload)))
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    sink.close()
+    return {"bytes_copied": copied, "peak_alloc": peak, "seconds": elapsed}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--payload-mb", type=float, default=5)
+    parser.add_argument("--recipients", type=int, nargs="+", default=[1, 10, 50, 100])
+    parser.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    args = parser.parse_args(argv)
+
+    payload = os.urandom(int(args.payload_mb * 1024 * 1024))
+    results = []
+    for n in args.recipients:
+        for name, fanout in (("concat", old_fanout), ("sendmsg", new_fanout)):
+            r = run_case(fanout, n, payload)
+            r.update(recipients=n, method=name, payload_bytes=len(payload))
+            results.append(r)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"payload = {len(payload) / 1e6:.1f} MB")
+    print(f"{'N':>5} {'method':>8} {'copied MB':>10} {'peak alloc MB':>14} {'latency ms':>11}")
+    for r in results:
+        print(f"{r['recipients']:>5} {r['method']:>8} {r['bytes_copied'] / 1e6:>10.1f} "
+              f"{r['peak_alloc'] / 1e6:>14.1f} {r['seconds'] * 1000:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Benchmark khung chat: đổ N tin nhắn vào một tab rồi đo độ trễ thêm tin và cuộn.
+  - virtual: ChatView (chat_view.py), chỉ dựng widget cho vùng nhìn thấy
+  - legacy : CTkScrollableFrame, mỗi tin một frame + bong bóng + 2 label (cách cũ), chạy với ít tin hơn
+Mỗi lần thêm / cuộn được đo tới khi Tk vẽ xong (update()), giống độ trễ người dùng thấy.
+Cần customtkinter và màn hình (DISPLAY / Xvfb trên Linux).
+
+Chạy:  python benchmarks/bench_chat_view.py --messages 50000 --legacy-messages 2000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tkinter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import customtkinter as ctk  # noqa: E402
+
+from chat_view import ChatItem, ChatView  # noqa: E402
+
+WORDS = "xin chào mọi người hôm nay họp lúc mấy giờ nhớ gửi file báo cáo nhé ok".split()
+
+
+def random_text(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 40)))
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000  # noqa: E731
+    return {"p50_ms": pick(0.5), "p99_ms": pick(0.99), "max_ms": samples[-1] * 1000}
+
+
+def fill_virtual(root, view, n, rng, sample_every):
+    """Thêm n tin; cứ sample_every tin thì đo một lần thêm + vẽ lại hoàn chỉnh."""
+    samples = []
+    start = time.perf_counter()
+    for i in range(n):
+        item = ChatItem(f"user{i % 7}", i % 5 == 0, text=random_text(rng))
+        if i % sample_every == 0:
+            t0 = time.perf_counter()
+            view.append(item)
+            root.update()
+            samples.append(time.perf_counter() - t0)
+        else:
+            view.append(item)
+    root.update()
+    return time.perf_counter() - start, samples
+
+
+def fill_legacy(root, frame, n, rng, sample_every):
+    samples = []
+    start = time.perf_counter()
+    for i in range(n):
+        t0 = time.perf_counter()
+        msg_frame = ctk.CTkFrame(frame, fg_color="transparent")
+        msg_frame.pack(fill="x", pady=3, padx=5, anchor="w")
+        bubble = ctk.CTkFrame(msg_frame, fg_color="#D8CAB8", corner_radius=10)
+        bubble.pack(side="left", padx=10, pady=2)
+        ctk.CTkLabel(bubble, text=random_text(rng), wraplength=450, justify="left").pack(anchor="w", padx=6)
+        ctk.CTkLabel(bubble, text="2024-01-01 00:00:00", text_color="gray").pack(anchor="e", padx=6)
+        if i % sample_every == 0:
+            frame._parent_canvas.yview_moveto(1.0)
+            root.update()
+            samples.append(time.perf_counter() - t0)
+    root.update()
+    return time.perf_counter() - start, samples
+
+
+def scroll_samples(root, scroll, rng, count):
+    samples = []
+    for _ in range(count):
+        t0 = time.perf_counter()
+        scroll(rng.random())
+        root.update()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--legacy-messages", type=int, default=2000, help="0 = bỏ qua cách cũ")
+    parser.add_argument("--scrolls", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        root = ctk.CTk()
+    except tkinter.TclError as e:
+        print(f"Không mở được cửa sổ Tk (cần màn hình): {e}")
+        return
+    root.geometry("780x600")
+    rng = random.Random(0)
+    results = []
+
+    tab = ctk.CTkFrame(root)
+    tab.pack(fill="both", expand=True)
+    view = ChatView(tab, "ALL")
+    root.update()
+    total, appends = fill_virtual(root, view, args.messages, rng, max(1, args.messages // 500))
+    scrolls = scroll_samples(root, lambda f: view.scroll_to(f * view.heights.total), rng, args.scrolls)
+    results.append({"mode": "virtual", "messages": args.messages, "fill_s": total, "widget_rows": view.widget_rows,
+                    "append": percentiles(appends), "scroll": percentiles(scrolls)})
+    tab.destroy()
+
+    if args.legacy_messages:
+        frame = ctk.CTkScrollableFrame(root)
+        frame.pack(fill="both", expand=True)
+        root.update()
+        total, appends = fill_legacy(root, frame, args.legacy_messages, rng, max(1, args.legacy_messages // 200))
+        scrolls = scroll_samples(root, frame._parent_canvas.yview_moveto, rng, args.scrolls)
+        results.append({"mode": "legacy", "messages": args.legacy_messages, "fill_s": total,
+                        "widget_rows": args.legacy_messages, "append": percentiles(appends),
+                        "scroll": percentiles(scrolls)})
+    root.destroy()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'mode':>8} {'msgs':>7} {'fill s':>7} {'rows':>6} {'add p50':>8} {'add p99':>8} "
+          f"{'scr p50':>8} {'scr p99':>8}")
+    for r in results:
+        print(f"{r['mode']:>8} {r['messages']:>7} {r['fill_s']:>7.1f} {r['widget_rows']:>6} "
+              f"{r['append']['p50_ms']:>8.2f} {r['append']['p99_ms']:>8.2f} "
+              f"{r['scroll']['p50_ms']:>8.2f} {r['scroll']['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
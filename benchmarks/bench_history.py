@@ -0,0 +1,102 @@
+"""
+Benchmark lưu lịch sử trên đường chuyển tiếp:
+  - sync  : mỗi tin mã hóa + ghi + flush ngay khi chuyển tiếp (cách làm đơn giản)
+  - batched: MessageLog.append() (chỉ cấp seq, ghi theo lô ở luồng riêng - message_log.py)
+Đo độ trễ thêm một tin (p50 / p99, đây là thời gian luồng chuyển tiếp bị giữ lại),
+thông lượng, rồi thời gian đọc một trang lịch sử và lấy hộp thư offline.
+
+Chạy:  python benchmarks/bench_history.py --messages 100000 --payload 200
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_log import MessageLog, encode_record  # noqa: E402
+from protocol import Message  # noqa: E402
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1e6  # noqa: E731
+    return {"p50_us": pick(0.5), "p99_us": pick(0.99), "max_us": samples[-1] * 1e6}
+
+
+def make_messages(n, payload):
+    body = b"x" * payload
+    users = [f"user{i}" for i in range(20)]
+    return [Message("TEXTMSG", users[i % 20], "ALL" if i % 4 else users[(i + 1) % 20], body) for i in range(n)]
+
+
+def run_sync(directory, messages):
+    samples = []
+    start = time.perf_counter()
+    with open(os.path.join(directory, "sync.log"), "ab") as f:
+        for seq, msg in enumerate(messages, 1):
+            t0 = time.perf_counter()
+            f.writelines(encode_record(seq, time.time(), msg.kind, msg.sender, msg.receiver, msg.body))
+            f.flush()
+            samples.append(time.perf_counter() - t0)
+    return time.perf_counter() - start, samples
+
+
+def run_batched(directory, messages):
+    log = MessageLog(directory)
+    samples = []
+    start = time.perf_counter()
+    for msg in messages:
+        t0 = time.perf_counter()
+        log.append(msg, offline=msg.receiver != "ALL")
+        samples.append(time.perf_counter() - t0)
+    relay = time.perf_counter() - start
+    log.sync(timeout=60)
+    return log, relay, time.perf_counter() - start, samples
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--payload", type=int, default=200, help="số byte body mỗi tin")
+    parser.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    args = parser.parse_args(argv)
+
+    messages = make_messages(args.messages, args.payload)
+    with tempfile.TemporaryDirectory() as directory:
+        sync_total, sync_samples = run_sync(directory, messages)
+        log, relay, total, samples = run_batched(os.path.join(directory, "log"), messages)
+        t0 = time.perf_counter()
+        page, _ = log.history("ALL", limit=50)
+        page_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        offline = log.take_offline("user1")
+        offline_s = time.perf_counter() - t0
+        stats = log.stats()
+        log.close()
+
+    results = {
+        "messages": args.messages,
+        "payload": args.payload,
+        "sync": {"total_s": sync_total, "msgs_per_s": args.messages / sync_total, **percentiles(sync_samples)},
+        "batched": {"relay_s": relay, "durable_s": total, "msgs_per_s": args.messages / relay,
+                    "batches": stats["batches_written"], **percentiles(samples)},
+        "page_ms": page_s * 1000, "page_size": len(page),
+        "offline_ms": offline_s * 1000, "offline_size": len(offline),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'mode':>8} {'msg/s':>10} {'p50 us':>8} {'p99 us':>8} {'max us':>9}")
+    for mode in ("sync", "batched"):
+        r = results[mode]
+        print(f"{mode:>8} {r['msgs_per_s']:>10.0f} {r['p50_us']:>8.1f} {r['p99_us']:>8.1f} {r['max_us']:>9.1f}")
+    print(f"batched: {results['batched']['batches']} lô ghi, trên đĩa sau {results['batched']['durable_s']:.2f}s")
+    print(f"trang 50 tin ALL: {results['page_ms']:.2f} ms; hộp thư offline "
+          f"{results['offline_size']} tin: {results['offline_ms']:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
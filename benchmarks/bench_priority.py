@@ -0,0 +1,160 @@
+"""
+Benchmark ưu tiên gửi: độ trễ tin chữ tới một người nhận trong khi người đó đang nhận tệp lớn
+(FILE) từ nhiều người gửi khác, trên server.py thật. Người nhận là client v2, có ('sliced') hoặc
+không ('whole') đề nghị nhận lát (HELLO slices=1): không có lát, tin chữ vẫn vượt được các tệp
+đang CHỜ nhưng phải đợi tệp đang gửi dở; có lát, tin chữ chỉ đợi tối đa một lát.
+Kèm thông lượng tệp và phần chia giữa các người gửi (công bằng theo người gửi).
+
+Chạy:  python benchmarks/bench_priority.py --engines thread asyncio --modes whole sliced --bulk-senders 2 \\
+           --file-bytes 8000000 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import loadgen  # noqa: E402
+from bench_server_e2e import free_port, wait_for_port  # noqa: E402
+from protocol import PROTO_LATEST, SliceJoiner, encode_frame, split_file_body  # noqa: E402
+
+RECEIVER = "rx"
+CHAT_INTERVAL = 0.02  # giây giữa hai tin chữ
+CONNECT_TIMEOUT = 10
+
+
+class PriorityBench:
+    """Một người nhận, 'bulk_senders' người gửi tệp liên tục và một người gửi tin chữ đều đặn."""
+
+    def __init__(self, args, sliced):
+        self.args = args
+        self.sliced = sliced
+        self.joiner = SliceJoiner()
+        self.ready = asyncio.Event()
+        self.chat_latency = []
+        self.file_bytes = {}   # người gửi -> số byte tệp đã nhận
+        self.corrupt = 0
+        self.measuring = False
+
+    def on_message(self, msg):
+        msg = self.joiner.feed(msg)
+        if msg is None:
+            return
+        if msg.kind == "HELLO":
+            self.ready.set()
+        elif not self.measuring:
+            return
+        elif msg.kind == "TEXTMSG":
+            self.chat_latency.append(time.perf_counter() - float(msg.text()))
+        elif msg.kind == "FILE":
+            parts = split_file_body(msg.body)
+            data = parts[1] if parts else b""
+            if len(data) != self.args.file_bytes or data[:1] != data[-1:]:
+                self.corrupt += 1
+            name = parts[0] if parts else "?"
+            self.file_bytes[name] = self.file_bytes.get(name, 0) + len(data)
+
+    async def open(self, port, name, hello=None, on_message=lambda msg: None):
+        loop = asyncio.get_running_loop()
+        _, conn = await loop.create_connection(lambda: loadgen.LoadConnection(on_message), "127.0.0.1", port)
+        if hello:
+            conn.write(encode_frame(hello.encode()))
+        conn.write(encode_frame(f"USERNAME::{name}".encode()))
+        return conn
+
+    async def send_files(self, conn, index, stop):
+        """Gửi tệp liên tục (byte đầu = byte cuối để kiểm tra tệp ghép lại đúng)."""
+        name = f"bulk{index}"
+        fill = bytes([65 + index]) * self.args.file_bytes
+        frame = encode_frame(f"FILE::{name}::{RECEIVER}::{name}::".encode() + fill)
+        while not stop.is_set():
+            conn.write(frame)
+            await conn.drain()
+            await asyncio.sleep(0)
+
+    async def send_chat(self, conn, stop):
+        while not stop.is_set():
+            conn.write(encode_frame(f"TEXTMSG::chat::{RECEIVER}::{time.perf_counter()!r}".encode()))
+            await asyncio.sleep(CHAT_INTERVAL)
+
+    async def run(self, port):
+        hello = f"HELLO::proto={PROTO_LATEST}" + (";slices=1" if self.sliced else "")
+        receiver = await self.open(port, RECEIVER, hello, self.on_message)
+        await asyncio.wait_for(self.ready.wait(), CONNECT_TIMEOUT)
+        chat = await self.open(port, "chat")
+        bulk = [await self.open(port, f"bulk{i}") for i in range(self.args.bulk_senders)]
+        await asyncio.sleep(0.3)
+        stop = asyncio.Event()
+        tasks = [asyncio.create_task(self.send_files(conn, i, stop)) for i, conn in enumerate(bulk)]
+        tasks.append(asyncio.create_task(self.send_chat(chat, stop)))
+        await asyncio.sleep(1)  # để hàng đợi của người nhận đầy tệp trước khi đo
+        self.measuring = True
+        await asyncio.sleep(self.args.duration)
+        self.measuring = False
+        stop.set()
+        for conn in [receiver, chat] + bulk:
+            conn.transport.abort()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+
+def run_case(engine, mode, args):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "server.py"), "--engine", engine,
+                               "--host", "127.0.0.1", "--port", str(port), "--no-history"] + args.server_args,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_for_port(port):
+            raise RuntimeError(f"server ({engine}) không mở cổng {port}")
+        bench = PriorityBench(args, mode == "sliced")
+        asyncio.run(bench.run(port))
+    finally:
+        server.terminate()
+        server.wait(10)
+    latency = [x * 1000 for x in bench.chat_latency]
+    shares = sorted(bench.file_bytes.values())
+    return {
+        "engine": engine, "mode": mode, "bulk_senders": args.bulk_senders, "file_bytes": args.file_bytes,
+        "chat_msgs": len(latency), "chat_p50_ms": percentile(latency, 0.5),
+        "chat_p99_ms": percentile(latency, 0.99), "chat_max_ms": max(latency, default=float("nan")),
+        "file_mb_s": sum(shares) / args.duration / 1e6,
+        "fair_ratio": shares[0] / shares[-1] if len(shares) > 1 and shares[-1] else 1.0,
+        "corrupt_files": bench.corrupt,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engines", nargs="+", default=["thread", "asyncio"])
+    parser.add_argument("--modes", nargs="+", choices=["whole", "sliced"], default=["whole", "sliced"])
+    parser.add_argument("--bulk-senders", type=int, default=2)
+    parser.add_argument("--file-bytes", type=int, default=8_000_000)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--server-args", nargs=argparse.REMAINDER, default=[],
+                        help="tham số thêm cho server.py (đặt cuối cùng)")
+    parser.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    args = parser.parse_args(argv)
+
+    rows = [run_case(engine, mode, args) for engine in args.engines for mode in args.modes]
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    print(f"{'engine':>8} {'mode':>7} {'tin chữ':>8} {'p50':>9} {'p99':>9} {'max':>9} {'tệp MB/s':>9} "
+          f"{'chia đều':>8} {'tệp hỏng':>8}")
+    for r in rows:
+        print(f"{r['engine']:>8} {r['mode']:>7} {r['chat_msgs']:>8} {r['chat_p50_ms']:>7.2f}ms "
+              f"{r['chat_p99_ms']:>7.2f}ms {r['chat_max_ms']:>7.1f}ms {r['file_mb_s']:>9.1f} "
+              f"{r['fair_ratio']:>8.2f} {r['corrupt_files']:>8}")
+
+
+if __name__ == "__main__":
+    main()
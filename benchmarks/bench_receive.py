@@ -0,0 +1,97 @@
+"""
+Benchmark đường nhận: recv() + bytearray.extend + bytes() (cách cũ, recv_all)
+so với recv_into thẳng vào buffer lấy từ BufferPool (protocol.FrameAssembler).
+
+Gửi liên tiếp nhiều frame FILE qua socketpair, đo bộ nhớ cấp phát đỉnh (tracemalloc),
+tổng số byte được cấp phát cho payload và thông lượng.
+
+Chạy:  python benchmarks/bench_receive.py --payload-kb 64 1024 8192 --frames 50
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocol import (HEADER_SIZE, BufferPool, FrameAssembler, encode_frame, parse_v1,  # noqa: E402
+                      recv_message, send_frame)
+
+
+def old_recv_all(sock, n):
+    # Cách cũ: mỗi lần recv tạo bytes mới, nối vào bytearray rồi sao chép lần nữa sang bytes
+    data = bytearray()
+    while len(data) < n:
+        packet = sock.recv(n - len(data))
+        if not packet:
+            return None
+        data.extend(packet)
+    return bytes(data)
+
+
+def old_receive(sock, count):
+    for _ in range(count):
+        head = old_recv_all(sock, HEADER_SIZE)
+        msg = parse_v1(old_recv_all(sock, int(head.decode().strip())))
+        del msg
+
+
+def new_receive(sock, count):
+    assembler = FrameAssembler(BufferPool())
+    for _ in range(count):
+        msg = recv_message(sock, assembler)
+        msg.release()
+
+
+def run_case(receive, payload, count):
+    tx, rx = socket.socketpair()
+    frame = encode_frame(b"FILE::alice::bob::f.bin::" + payload)
+
+    def produce():
+        for _ in range(count):
+            send_frame(tx, frame)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    producer.start()
+    receive(rx, count)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    producer.join()
+    tx.close()
+    rx.close()
+    return {"peak_alloc": peak, "seconds": elapsed, "mb_per_s": count * len(frame) / elapsed / 1e6}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--payload-kb", type=int, nargs="+", default=[64, 1024, 8192])
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    args = parser.parse_args(argv)
+
+    results = []
+    for kb in args.payload_kb:
+        payload = os.urandom(kb * 1024)
+        for name, receive in (("recv_all", old_receive), ("recv_into", new_receive)):
+            r = run_case(receive, payload, args.frames)
+            r.update(payload_bytes=len(payload), frames=args.frames, method=name)
+            results.append(r)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'payload KB':>10} {'method':>10} {'peak alloc MB':>14} {'MB/s':>9}")
+    for r in results:
+        print(f"{r['payload_bytes'] // 1024:>10} {r['method']:>10} {r['peak_alloc'] / 1e6:>14.2f} "
+              f"{r['mb_per_s']:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
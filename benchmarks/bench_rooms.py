@@ -0,0 +1,167 @@
+"""
+Benchmark phòng chat: độ trễ fan-out của một tin tới phòng "#bench" (K thành viên) so với cùng tin
+gửi "ALL" (N người), trên server.py thật. Mỗi vòng gửi MỘT tin rồi chờ người nhận cuối cùng nhận đủ,
+nên độ trễ đo được là thời gian fan-out của riêng tin đó. Kèm CPU của server cho mỗi tin và số lần
+giao mỗi tin (người ngoài phòng không được nhận tin nào của phòng).
+
+Chạy:  python benchmarks/bench_rooms.py --engines thread asyncio --users 100 500 --room-size 10 --rounds 300
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import loadgen  # noqa: E402
+from bench_server_e2e import free_port, wait_for_port  # noqa: E402
+from protocol import ALL_ID, PROTO_LATEST, encode_frame, parse_options  # noqa: E402
+
+ROOM = "#bench"
+WARMUP_ROUNDS = 20
+ROUND_TIMEOUT = 10  # giây chờ một tin tới đủ người nhận
+
+
+class RoomBench:
+    """N kết nối (v2), K kết nối đầu vào ROOM; kết nối 0 gửi, các kết nối khác đếm tin nhận."""
+
+    def __init__(self, users, room_size):
+        self.users = users
+        self.room_size = room_size
+        self.hellos = 0
+        self.registered = asyncio.Event()
+        self.room_ready = asyncio.Event()
+        self.pending = None   # [seq, số người nhận mong đợi, thời điểm gửi, future, độ trễ từng người]
+        self.stray = 0        # tin của phòng tới người không phải thành viên
+
+    def on_message(self, index, msg):
+        if msg.kind == "HELLO":
+            self.hellos += 1
+            if self.hellos == self.users:
+                self.registered.set()
+        elif msg.kind == "ROOM" and index == 0:
+            members = parse_options(msg.text()).get("members", "")
+            if len(members.split(",")) >= self.room_size:
+                self.room_ready.set()
+        elif msg.kind == "TEXTMSG":
+            if msg.receiver_id != ALL_ID and index >= self.room_size:
+                self.stray += 1
+            pending = self.pending
+            if pending is not None and int(msg.body) == pending[0]:
+                pending[4].append(time.perf_counter() - pending[2])
+                if len(pending[4]) == pending[1] and not pending[3].done():
+                    pending[3].set_result(None)
+
+    async def connect(self, port):
+        loop = asyncio.get_running_loop()
+        self.conns = []
+        for index in range(self.users):
+            _, conn = await loop.create_connection(
+                lambda i=index: loadgen.LoadConnection(lambda msg: self.on_message(i, msg)), "127.0.0.1", port)
+            conn.write(encode_frame(f"HELLO::proto={PROTO_LATEST}".encode()))
+            conn.write(encode_frame(f"USERNAME::bench{index}".encode()))
+            self.conns.append(conn)
+        await asyncio.wait_for(self.registered.wait(), ROUND_TIMEOUT * 3)
+        for conn in self.conns[:self.room_size]:
+            conn.write(encode_frame(f"JOIN::{ROOM}".encode()))
+        await asyncio.wait_for(self.room_ready.wait(), ROUND_TIMEOUT)
+
+    async def send_rounds(self, target, rounds, first_seq):
+        """Gửi 'rounds' tin tới 'target', mỗi lần chờ đủ người nhận; trả về [(người cuối, trung vị)]."""
+        expected = (self.room_size if target == ROOM else self.users) - 1
+        results = []
+        loop = asyncio.get_running_loop()
+        for seq in range(first_seq, first_seq + rounds):
+            future = loop.create_future()
+            self.pending = [seq, expected, time.perf_counter(), future, []]
+            self.conns[0].write(encode_frame(f"TEXTMSG::bench0::{target}::{seq}".encode()))
+            await asyncio.wait_for(future, ROUND_TIMEOUT)
+            latencies = self.pending[4]
+            results.append((max(latencies), statistics.median(latencies)))
+        self.pending = None
+        return results
+
+    def close(self):
+        for conn in self.conns:
+            conn.transport.close()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def measure(engine, users, args, port, sampler):
+    bench = RoomBench(users, args.room_size)
+    await bench.connect(port)
+    rows = []
+    seq = 0
+    try:
+        for target in (ROOM, "ALL"):
+            await bench.send_rounds(target, WARMUP_ROUNDS, seq)
+            seq += WARMUP_ROUNDS
+            cpu_before = sampler.cpu_seconds()
+            results = await bench.send_rounds(target, args.rounds, seq)
+            cpu = sampler.cpu_seconds() - cpu_before
+            seq += args.rounds
+            last = [r[0] * 1000 for r in results]
+            rows.append({
+                "engine": engine, "users": users, "room_size": args.room_size, "target": target,
+                "recipients": (args.room_size if target == ROOM else users) - 1,
+                "last_p50_ms": percentile(last, 0.5), "last_p99_ms": percentile(last, 0.99),
+                "median_recipient_ms": statistics.median(r[1] * 1000 for r in results),
+                "server_cpu_ms_per_msg": cpu / args.rounds * 1000,
+            })
+    finally:
+        bench.close()
+    rows[0]["stray_deliveries"] = bench.stray
+    return rows
+
+
+def run_case(engine, users, args):
+    port, stats_port = free_port(), free_port()
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "server.py"), "--engine", engine,
+                               "--host", "127.0.0.1", "--port", str(port), "--stats-port", str(stats_port),
+                               "--no-history"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_for_port(port):
+            raise RuntimeError(f"server ({engine}) không mở cổng {port}")
+        return asyncio.run(measure(engine, users, args, port, loadgen.ProcessSampler(server.pid)))
+    finally:
+        server.terminate()
+        server.wait(10)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engines", nargs="+", default=["thread", "asyncio"])
+    parser.add_argument("--users", type=int, nargs="+", default=[100, 500])
+    parser.add_argument("--room-size", type=int, default=10, help="số thành viên phòng (kể cả người gửi)")
+    parser.add_argument("--rounds", type=int, default=300)
+    parser.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    args = parser.parse_args(argv)
+    loadgen.raise_fd_limit()
+
+    rows = []
+    for engine in args.engines:
+        for users in args.users:
+            rows += run_case(engine, users, args)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    print(f"{'engine':>8} {'users':>6} {'tới':>7} {'nhận':>6} {'cuối p50':>9} {'cuối p99':>9} "
+          f"{'trung vị':>9} {'CPU/tin':>8}")
+    for r in rows:
+        print(f"{r['engine']:>8} {r['users']:>6} {r['target']:>7} {r['recipients']:>6} {r['last_p50_ms']:>7.2f}ms "
+              f"{r['last_p99_ms']:>7.2f}ms {r['median_recipient_ms']:>7.2f}ms {r['server_cpu_ms_per_msg']:>6.2f}ms")
+    stray = sum(r.get("stray_deliveries", 0) for r in rows)
+    print(f"Tin của phòng tới người ngoài phòng: {stray}")
+
+
+if __name__ == "__main__":
+    main()
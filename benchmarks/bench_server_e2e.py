@@ -0,0 +1,148 @@
+"""
+Benchmark đầu-cuối của server.py: với mỗi tổ hợp engine x số user x loại tải, khởi động một server
+mới (thư mục lịch sử tạm, cổng số liệu --stats-port) rồi chạy bộ tạo tải loadgen.py lên nó.
+Báo cáo độ trễ giao tin p50 / p99, thông lượng, CPU và RSS đỉnh của server; toàn bộ kết quả
+(kể cả số liệu của server) được ghi ra JSON để so sánh giữa các lần chạy bằng --compare.
+
+Chạy:  python benchmarks/bench_server_e2e.py --engines thread asyncio --users 50 200 --workloads text mixed \\
+           --duration 10 --output e2e.json
+       python benchmarks/bench_server_e2e.py ... --compare e2e.json   # so với lần chạy trước
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import loadgen  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def run_case(engine, users, workload, args, history_dir):
+    port, stats_port = free_port(), free_port()
+    command = [sys.executable, os.path.join(ROOT, "server.py"), "--engine", engine, "--host", "127.0.0.1",
+               "--port", str(port), "--stats-port", str(stats_port), "--history-dir", history_dir]
+    if args.no_history:
+        command.append("--no-history")
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_for_port(port):
+            raise RuntimeError(f"server ({engine}) không mở cổng {port}")
+        load_args = loadgen.parse_args([
+            "--port", str(port), "--users", str(users), "--workers", str(args.workers),
+            "--duration", str(args.duration), "--rate", str(args.rate), "--workload", workload,
+            "--private-ratio", str(args.private_ratio), "--file-bytes", str(args.file_bytes),
+            "--server-pid", str(server.pid), "--stats-port", str(stats_port),
+        ])
+        results = loadgen.run(load_args)
+    finally:
+        server.terminate()
+        server.wait(10)
+    results.update(engine=engine, workload=workload)
+    return results
+
+
+def case_key(r):
+    return r["engine"], r["users"], r["workload"]
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {case_key(r): r for r in json.load(f)["runs"]}
+    print(f"\nSo với {baseline_path} (thay đổi tương đối, âm = nhỏ hơn):")
+    print(f"{'engine':>8} {'users':>6} {'workload':>8} {'p50':>8} {'p99':>8} {'giao/s':>8} {'CPU':>8} {'RSS':>8}")
+
+    def delta(new, old):
+        return f"{(new - old) / old * 100:+.0f}%" if old else "-"
+
+    for r in results:
+        old = baseline.get(case_key(r))
+        if old is None:
+            continue
+        server, old_server = r["server"] or {}, old["server"] or {}
+        print(f"{r['engine']:>8} {r['users']:>6} {r['workload']:>8} "
+              f"{delta(r['latency'].get('p50_ms', 0), old['latency'].get('p50_ms', 0)):>8} "
+              f"{delta(r['latency'].get('p99_ms', 0), old['latency'].get('p99_ms', 0)):>8} "
+              f"{delta(r['throughput']['delivered_msgs_per_s'], old['throughput']['delivered_msgs_per_s']):>8} "
+              f"{delta(server.get('cpu_percent', 0), old_server.get('cpu_percent', 0)):>8} "
+              f"{delta(server.get('rss_peak_kb', 0), old_server.get('rss_peak_kb', 0)):>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engines", nargs="+", default=["thread", "asyncio"])
+    parser.add_argument("--users", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--workloads", nargs="+", choices=sorted(loadgen.WORKLOADS), default=["text", "mixed"])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--rate", type=float, default=1.0, help="số hành động / giây của mỗi user")
+    parser.add_argument("--private-ratio", type=float, default=0.3)
+    parser.add_argument("--file-bytes", type=int, default=64 * 1024)
+    parser.add_argument("--workers", type=int, default=max(1, min(4, (os.cpu_count() or 2) // 2)),
+                        help="số tiến trình tạo tải")
+    parser.add_argument("--no-history", action="store_true", help="chạy server với --no-history")
+    parser.add_argument("--output", help="ghi toàn bộ kết quả JSON ra tệp")
+    parser.add_argument("--compare", help="tệp JSON của lần chạy trước để so sánh")
+    parser.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    args = parser.parse_args(argv)
+    loadgen.raise_fd_limit()  # server con thừa hưởng giới hạn này
+
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        for engine in args.engines:
+            for users in args.users:
+                for workload in args.workloads:
+                    history_dir = os.path.join(directory, f"{engine}-{users}-{workload}")
+                    runs.append(run_case(engine, users, workload, args, history_dir))
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "runs": runs,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{'engine':>8} {'users':>6} {'workload':>8} {'giao %':>7} {'giao/s':>8} {'MB/s':>7} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'CPU %':>6} {'RSS MB':>7} {'tạo tải %':>9}")
+    for r in runs:
+        server = r["server"] or {}
+        print(f"{r['engine']:>8} {r['users']:>6} {r['workload']:>8} {r['delivery_ratio'] * 100:>7.1f} "
+              f"{r['throughput']['delivered_msgs_per_s']:>8.0f} {r['throughput']['delivered_mb_per_s']:>7.2f} "
+              f"{r['latency'].get('p50_ms', 0):>8.2f} {r['latency'].get('p99_ms', 0):>8.2f} "
+              f"{server.get('cpu_percent', 0):>6.0f} {server.get('rss_peak_kb', 0) / 1024:>7.1f} "
+              f"{r['loadgen']['cpu_percent_max']:>9.0f}")
+    if args.output:
+        print(f"Đã ghi kết quả: {args.output}")
+    if args.compare:
+        compare(runs, args.compare)
+
+
+if __name__ == "__main__":
+    main()
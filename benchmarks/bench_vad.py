@@ -0,0 +1,111 @@
+"""
+Benchmark cắt khoảng lặng khi ghi âm (vad.py): bản ghi tổng hợp gồm các câu nói (giọng tổng hợp như
+bench_voice_codec.py) xen khoảng ngừng dài, có lặng ở đầu / cuối và nhiễu nền. So sánh số giây và số
+byte gửi đi (sau codec) khi không cắt và khi cắt, phần năng lượng tiếng nói còn giữ (100% = không mất
+tiếng), và tốc độ xử lý (lần thời gian thực) khi đẩy từng block CHUNK mẫu như luồng ghi âm của client
+và khi đẩy cả bản ghi một lần. Cần NumPy.
+
+Chạy:  python benchmarks/bench_vad.py --noise-db -60 -50 --pause 1 4
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_voice_codec import synthetic_speech  # noqa: E402
+from vad import FRAME_MS, SilenceTrimmer  # noqa: E402
+from voice_codec import CODEC_ULAW, encode_voice  # noqa: E402
+
+SAMPLE_RATE = 44100
+CHUNK = 1024          # block mỗi lần callback ghi âm của client
+SENTENCES = 6
+SENTENCE_SECONDS = 2.0
+EDGE_SECONDS = 2.0    # lặng ở đầu và cuối bản ghi
+
+
+def recording(noise_db, pause, seed=0):
+    """Bản ghi thử -> (mẫu int16, mẫu chỉ có tiếng nói để đo năng lượng giữ lại)."""
+    rng = np.random.default_rng(seed)
+    amplitude = 32768 * 10 ** (noise_db / 20)
+    parts = []
+    for i in range(SENTENCES):
+        gap = EDGE_SECONDS if i == 0 else pause
+        parts.append(np.zeros(int(gap * SAMPLE_RATE), dtype=np.float64))
+        parts.append(synthetic_speech(SENTENCE_SECONDS, SAMPLE_RATE, seed + i).astype(np.float64))
+    parts.append(np.zeros(int(EDGE_SECONDS * SAMPLE_RATE), dtype=np.float64))
+    clean = np.concatenate(parts)
+    noisy = clean + amplitude * rng.standard_normal(len(clean))
+    speech = np.clip(clean, -32768, 32767).astype(np.int16)
+    return np.clip(noisy, -32768, 32767).astype(np.int16), speech
+
+
+def trim(samples, block=CHUNK):
+    """Đẩy từng block mẫu qua SilenceTrimmer như client -> (mẫu giữ lại, bộ cắt, giây xử lý)."""
+    trimmer = SilenceTrimmer(SAMPLE_RATE)
+    blocks = samples.reshape(-1, 1)
+    kept = []
+    start = time.perf_counter()
+    for i in range(0, len(blocks), block):
+        kept += trimmer.push(blocks[i:i + block])
+    kept += trimmer.flush()
+    elapsed = time.perf_counter() - start
+    return (np.concatenate(kept).reshape(-1) if kept else np.zeros(0, dtype=np.int16)), trimmer, elapsed
+
+
+def speech_kept(samples, speech, kept):
+    """
+    Phần năng lượng tiếng nói (bản sạch) nằm trong các khung được giữ. Khung được giữ là khung nguyên
+    của bản ghi (nhiễu làm mỗi khung khác nhau), nên tìm lại được vị trí gốc của nó theo nội dung.
+    """
+    frame = SAMPLE_RATE * FRAME_MS // 1000
+    n = len(samples) // frame
+    index = {samples[i * frame:(i + 1) * frame].tobytes(): i for i in range(n)}
+    energy = np.sum(speech[:n * frame].reshape(n, frame).astype(np.float64) ** 2, axis=1)
+    kept_frames = {index.get(kept[i:i + frame].tobytes()) for i in range(0, len(kept) - frame + 1, frame)}
+    kept_frames.discard(None)
+    total = energy.sum()
+    return float(energy[sorted(kept_frames)].sum() / total) if total else 1.0
+
+
+def run_case(noise_db, pause):
+    samples, speech = recording(noise_db, pause)
+    kept, trimmer, elapsed = trim(samples)
+    seconds = len(samples) / SAMPLE_RATE
+    before = len(encode_voice(samples, SAMPLE_RATE, CODEC_ULAW))
+    after = len(encode_voice(kept, SAMPLE_RATE, CODEC_ULAW)) if len(kept) else 0
+    return {
+        "noise_db": noise_db, "pause_s": pause,
+        "seconds": seconds, "kept_seconds": trimmer.output_frames / SAMPLE_RATE,
+        "bytes": before, "kept_bytes": after, "saved_bytes": before - after,
+        "speech_energy_kept": speech_kept(samples, speech, kept),
+        "x_realtime": seconds / elapsed,
+        "whole_x_realtime": seconds / trim(samples, len(samples))[2],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--noise-db", type=float, nargs="+", default=[-60, -50], help="mức nhiễu nền (dBFS)")
+    parser.add_argument("--pause", type=float, nargs="+", default=[1, 4], help="giây ngừng giữa các câu")
+    parser.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    args = parser.parse_args(argv)
+
+    rows = [run_case(noise_db, pause) for noise_db in args.noise_db for pause in args.pause]
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    print(f"{'nhiễu':>6} {'ngừng':>6} {'giây':>6} {'giữ':>6} {'KB':>7} {'KB giữ':>7} {'tiết kiệm':>9} "
+          f"{'tiếng':>6} {'x block':>8} {'x cả bản':>8}")
+    for r in rows:
+        print(f"{r['noise_db']:>4.0f}dB {r['pause_s']:>5.1f}s {r['seconds']:>6.1f} {r['kept_seconds']:>6.1f} "
+              f"{r['bytes'] / 1000:>7.1f} {r['kept_bytes'] / 1000:>7.1f} {r['saved_bytes'] / 1000:>7.1f}KB "
+              f"{r['speech_energy_kept']:>6.1%} {r['x_realtime']:>8.0f} {r['whole_x_realtime']:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
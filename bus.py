@@ -0,0 +1,326 @@
+import os
+import socket
+import threading
+import time
+
+import outbound
+from protocol import (BufferPool, Frame, FrameAssembler, ProtocolError, encode_frame, encode_header, encode_v1, parse_v1,
+                      priority_for, recv_message, send_frame)
+from rooms import is_room
+
+# === KÊNH ĐỊNH TUYẾN GIỮA CÁC WORKER (chế độ nhiều tiến trình) ===
+#
+# Một tiến trình Python chỉ dùng được một nhân (GIL). Với --workers N, tiến trình chính mở một
+# RoutingHub trên Unix socket rồi chạy N worker; các worker cùng accept trên một cổng (SO_REUSEPORT,
+# kernel chia kết nối mới cho các worker) và mỗi worker nối một BusLink tới hub.
+#
+# Trên bus, tin nhắn đi ở framing v1 ("KIND::gui::nhan::body"), tức là mang TÊN chứ không mang ID:
+# mỗi worker tự cấp ID v2 cho client của mình (ClientRegistry), nên không cần bảng ID chung.
+#   worker -> hub : WORKER::<id>              (mở đầu)
+#                   ONLINE::<ten> / OFFLINE::<ten>   (kết nối đầu tiên / cuối cùng của tên ở worker đó)
+#                   tin chuyển tiếp (TEXTMSG, VOICEMSG, FILE..., nhận "ALL" hoặc một tên)
+#   hub -> worker : ONLINE::<worker>::<ten> / OFFLINE::<worker>::<ten>   (danh bạ của các worker khác)
+#                   tin chuyển tiếp từ worker khác
+#                   UNDELIVERED::<payload v1 gốc>   (tin riêng worker này gửi mà không worker nào còn
+#                                                    giữ người nhận: họ vừa offline, trả lại nơi gửi)
+# Hub giữ danh bạ tên -> worker: tin "ALL" đi tới mọi worker khác đang có user, tin riêng chỉ tới
+# worker đang giữ người nhận. Mỗi worker gộp danh bạ đó với client của mình để ra danh sách online,
+# nên USERLIST / PRESENCE giống nhau ở mọi worker. Frame được chuyển tiếp nguyên vẹn (buffer nhận
+# dùng chung, retain / release như hàng đợi gửi của client), hub không đóng gói lại.
+
+BUS_QUEUE_BYTES = 64 * 1024 * 1024   # hàng đợi gửi của mỗi đầu bus
+CONNECT_TIMEOUT = 10                 # giây worker chờ hub sẵn sàng
+UNDELIVERED = "UNDELIVERED"
+
+
+def default_address():
+    """Đường dẫn Unix socket của hub cho tiến trình hiện tại."""
+    return os.path.join("/tmp", f"voicechat-bus-{os.getpid()}.sock")
+
+
+def control(kind, *fields):
+    return encode_frame("::".join((kind,) + tuple(str(f) for f in fields)).encode('utf-8'))
+
+
+def _writer(sock, queue, name):
+    """Writer của một đầu bus (giống writer_thread của server): lấy frame từ hàng đợi và gửi."""
+    try:
+        while True:
+            frame = queue.get()
+            if frame is None:
+                break
+            try:
+                send_frame(sock, frame)
+            finally:
+                frame.release()
+    except OSError as e:
+        print(f"[BUS] Lỗi gửi ({name}): {e}")
+    finally:
+        queue.close()
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class _HubLink:
+    """Một worker đã nối vào hub."""
+
+    def __init__(self, sock, worker):
+        self.sock = sock
+        self.worker = worker
+        self.names = set()       # tên đang online ở worker này
+        self.queue = outbound.OutboundQueue(BUS_QUEUE_BYTES, outbound.POLICY_BACKPRESSURE)
+
+
+class RoutingHub:
+    """Hub của bus (chạy trong tiến trình chính): danh bạ tên -> worker và chuyển tiếp frame."""
+
+    def __init__(self, address=None):
+        self.address = address or default_address()
+        self.pool = BufferPool()
+        self._lock = threading.Lock()
+        self.links = {}          # worker -> _HubLink
+        self.forwarded = 0
+        self.unroutable = 0
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.address)
+        self._server.listen()
+
+    def start(self):
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        print(f"[BUS] Hub tại {self.address}")
+
+    def close(self):
+        self._server.close()
+        with self._lock:
+            links = list(self.links.values())
+        for link in links:
+            link.queue.close()
+        try:
+            os.remove(self.address)
+        except OSError:
+            pass
+
+    def _accept_loop(self):
+        while True:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serve, args=(sock,), daemon=True).start()
+
+    def _serve(self, sock):
+        assembler = FrameAssembler(self.pool)
+        link = None
+        try:
+            hello = recv_message(sock, assembler)
+            if hello is None or hello.kind != "WORKER":
+                return
+            link = _HubLink(sock, hello.text())
+            hello.release()
+            threading.Thread(target=_writer, args=(sock, link.queue, f"worker {link.worker}"), daemon=True).start()
+            with self._lock:
+                old = self.links.get(link.worker)
+                self.links[link.worker] = link
+                # Danh bạ hiện tại của các worker khác cho worker mới vào
+                for other in self.links.values():
+                    if other is not link:
+                        for name in other.names:
+                            link.queue.force_put(control("ONLINE", other.worker, name))
+            if old is not None:
+                self._drop(old)  # worker khởi động lại với cùng số hiệu
+            print(f"[BUS] Worker {link.worker} đã nối.")
+            while True:
+                msg = recv_message(sock, assembler)
+                if msg is None:
+                    break
+                try:
+                    self._handle(link, msg)
+                finally:
+                    msg.release()
+        except (OSError, ProtocolError) as e:
+            print(f"[BUS] Lỗi ({link.worker if link else '?'}): {e}")
+        finally:
+            if link is not None:
+                with self._lock:
+                    if self.links.get(link.worker) is link:
+                        del self.links[link.worker]
+                self._drop(link)
+                print(f"[BUS] Worker {link.worker} đã ngắt.")
+            sock.close()
+
+    def _drop(self, link):
+        """Worker ngắt: các worker còn lại xóa mọi tên của nó khỏi danh bạ."""
+        link.queue.close()
+        with self._lock:
+            others = list(self.links.values())
+            names, link.names = link.names, set()
+        for name in names:
+            frame = control("OFFLINE", link.worker, name)
+            for other in others:
+                other.queue.force_put(frame)
+
+    def _handle(self, link, msg):
+        if msg.kind in ("ONLINE", "OFFLINE"):
+            name = msg.text()
+            online = msg.kind == "ONLINE"
+            with self._lock:
+                if online:
+                    link.names.add(name)
+                else:
+                    link.names.discard(name)
+                frame = control(msg.kind, link.worker, name)
+                for other in self.links.values():
+                    if other is not link:
+                        other.queue.force_put(frame)
+            return
+        with self._lock:
+            if msg.receiver == "ALL":
+                targets = [other for other in self.links.values() if other is not link and other.names]
+            else:
+                targets = [other for other in self.links.values() if other is not link and msg.receiver in other.names]
+        if not targets:
+            self.unroutable += 1
+            if msg.receiver != "ALL" and not is_room(msg.receiver):
+                self._return(link, msg)
+            return
+        frame = encode_v1(msg)
+        frame.owner = msg.buffer
+        for other in targets:
+            # Worker nhận chậm: hub chờ (ngừng đọc từ worker gửi), backpressure lan ngược về người gửi
+            if not other.queue.offer(frame):
+                other.queue.put_wait(frame, outbound.DEFAULT_BACKPRESSURE_TIMEOUT)
+        self.forwarded += 1
+
+
+    def _return(self, link, msg):
+        """
+        Tin riêng tới người không còn ở worker nào (offline giữa lúc worker gửi tra danh bạ và lúc hub
+        nhận): trả nguyên payload về worker gửi để nó xử lý như tin tới người offline.
+        """
+        print(f"[BUS] '{msg.receiver}' không còn ở worker nào, trả {msg.kind} về worker {link.worker}.")
+        prefix = f"{UNDELIVERED}::".encode('utf-8')
+        frame = Frame(encode_header(len(prefix) + len(msg.raw)), prefix, msg.raw, owner=msg.buffer)
+        frame.priority = priority_for(msg.kind, frame.size)
+        link.queue.force_put(frame)
+
+
+class BusLink:
+    """
+    Đầu bus của một worker. on_message(msg) được gọi trên luồng đọc của bus cho mỗi tin từ worker khác
+    (msg mang tên người gửi / nhận; on_message chịu trách nhiệm msg.release()); on_directory() khi danh bạ
+    của các worker khác thay đổi; on_undelivered(msg) (như on_message) cho tin riêng của chính worker này
+    mà hub không giao được (mặc định: bỏ).
+    """
+
+    def __init__(self, worker, on_message, on_directory, address=None, on_undelivered=None):
+        self.worker = worker
+        self.on_message = on_message
+        self.on_directory = on_directory
+        self.on_undelivered = on_undelivered or (lambda msg: msg.release())
+        self.address = address or default_address()
+        self.pool = BufferPool()
+        self.queue = outbound.OutboundQueue(BUS_QUEUE_BYTES, outbound.POLICY_BACKPRESSURE)
+        self._lock = threading.Lock()
+        self.remote = {}         # tên -> tập worker đang giữ tên đó
+        self.received = 0
+        self.undelivered = 0
+        self.sock = self._connect()
+        self.queue.force_put(control("WORKER", worker))
+        threading.Thread(target=_writer, args=(self.sock, self.queue, "hub"), daemon=True).start()
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def _connect(self):
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.address)
+                return sock
+            except OSError:
+                sock.close()
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def _read_loop(self):
+        assembler = FrameAssembler(self.pool)
+        try:
+            while True:
+                msg = recv_message(self.sock, assembler)
+                if msg is None:
+                    break
+                if msg.kind in ("ONLINE", "OFFLINE"):
+                    worker, _, name = msg.text().partition("::")
+                    msg.release()
+                    self._update(msg.kind == "ONLINE", worker, name)
+                    continue
+                handler = self.on_message
+                if msg.kind == UNDELIVERED:
+                    msg = self._unwrap(msg)
+                    handler = self.on_undelivered
+                    self.undelivered += 1
+                else:
+                    self.received += 1
+                try:
+                    handler(msg)
+                except Exception as e:
+                    print(f"[BUS] Lỗi xử lý tin từ bus: {e}")
+        except (OSError, ProtocolError) as e:
+            print(f"[BUS] Mất kết nối tới hub: {e}")
+        finally:
+            self.queue.close()
+            print("[BUS] Đã ngắt khỏi hub.")
+
+    @staticmethod
+    def _unwrap(msg):
+        """UNDELIVERED::<payload v1> -> Message gốc, dùng chung buffer nhận (không sao chép)."""
+        inner = parse_v1(msg.body)
+        inner.buffer, msg.buffer = msg.buffer, None
+        return inner
+
+    def _update(self, online, worker, name):
+        with self._lock:
+            workers = self.remote.setdefault(name, set())
+            if online:
+                workers.add(worker)
+            else:
+                workers.discard(worker)
+                if not workers:
+                    del self.remote[name]
+        self.on_directory()
+
+    # --- Dùng từ server (có thể khi đang giữ 'clients_lock') ---
+    def announce(self, online, name):
+        """Báo hub: 'name' vừa có kết nối đầu tiên (online) / vừa hết kết nối ở worker này."""
+        self.queue.force_put(control("ONLINE" if online else "OFFLINE", name))
+
+    def publish(self, frame, receiver, blocked):
+        """
+        Gửi frame lên hub (hub tự chọn worker nhận theo 'receiver'); hàng đợi đầy -> thêm vào 'blocked'.
+        Trả về số hàng đợi đã nhận frame.
+        """
+        if not self.queue.offer(frame):
+            blocked.append((self.queue, frame))
+        return 1
+
+    def hosts(self, name):
+        """Có worker khác đang giữ 'name' không."""
+        with self._lock:
+            return name in self.remote
+
+    def remote_names(self):
+        with self._lock:
+            return list(self.remote)
+
+    def stats(self):
+        with self._lock:
+            remote_users = len(self.remote)
+        return {"worker": self.worker, "remote_users": remote_users, "received": self.received,
+                "undelivered": self.undelivered, "queue_frames": len(self.queue), "queue_bytes": self.queue.nbytes}
+
+    def close(self):
+        self.queue.close()
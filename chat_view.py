@@ -0,0 +1,418 @@
+import math
+import sys
+import weakref
+from datetime import datetime
+
+import customtkinter as ctk
+
+# === KHUNG CHAT ẢO HÓA (VIRTUALIZED) ===
+#
+# CTkScrollableFrame cũ tạo ≥ 3 widget cho MỖI tin nhắn và không bao giờ xóa: tab ALL đông người
+# càng lúc càng chậm (cuộn / thêm tin trễ hàng giây). ChatView giữ tin nhắn trong một model nhẹ
+# (ChatItem, không có widget) và chỉ dựng widget cho các tin đang nhìn thấy + một khoảng đệm
+# (OVERSCAN_PX) trên/dưới. Khi cuộn, các dòng ra khỏi vùng nhìn được tái sử dụng cho tin mới vào,
+# nên số widget của mỗi tab bị chặn theo chiều cao cửa sổ, không theo số tin nhắn.
+#
+# Chiều cao từng tin nằm trong HeightIndex (cây Fenwick): ban đầu là ước lượng, được thay bằng
+# chiều cao đo thật khi tin được dựng lần đầu. Tìm tin ở một vị trí cuộn / tính tọa độ một tin
+# đều O(log n), kể cả với hàng chục nghìn tin.
+
+OVERSCAN_PX = 300        # dựng thêm bao nhiêu pixel phía trên / dưới vùng nhìn thấy
+WHEEL_STEP_PX = 60       # một nấc con lăn chuột
+WRAP_LENGTH = 450        # độ rộng ngắt dòng của nội dung tin nhắn
+MAX_BUTTONS = 2          # số nút tối đa của một tin (tệp: Lưu / Mở)
+
+SELF_COLOR = "#6DF32F"
+OTHER_COLOR = "#D8CAB8"
+
+
+class HeightIndex:
+    """
+    Cây Fenwick trên chiều cao các dòng: tổng tiền tố (tọa độ y của dòng i), cập nhật một dòng
+    và tìm dòng chứa tọa độ y đều O(log n). Thêm dòng là O(log n) (dựng lại cây khi nới dung lượng).
+    """
+
+    def __init__(self):
+        self._heights = []
+        self._tree = [0]
+        self.total = 0
+
+    def __len__(self):
+        return len(self._heights)
+
+    def append(self, height):
+        self._heights.append(height)
+        n = len(self._heights)
+        if n >= len(self._tree):
+            self._rebuild(max(16, 2 * len(self._tree)))
+        else:
+            self._add(n - 1, height)
+        self.total += height
+
+    def prepend(self, heights):
+        """Chèn các dòng vào đầu (tải tin cũ hơn): dựng lại cây, O(n)."""
+        self._heights[:0] = heights
+        size = len(self._tree)
+        while size <= len(self._heights):
+            size *= 2
+        self._rebuild(max(16, size))
+        self.total += sum(heights)
+
+    def get(self, index):
+        return self._heights[index]
+
+    def set(self, index, height):
+        delta = height - self._heights[index]
+        if delta:
+            self._heights[index] = height
+            self._add(index, delta)
+            self.total += delta
+
+    def offset(self, index):
+        """Tọa độ y (tổng chiều cao các dòng trước 'index')."""
+        total = 0
+        i = index
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def find(self, y):
+        """Chỉ số dòng chứa tọa độ 'y' (kẹp vào [0, n-1])."""
+        n = len(self._heights)
+        if n == 0:
+            return 0
+        pos = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            nxt = pos + step
+            if nxt < len(self._tree) and nxt <= n and self._tree[nxt] <= y:
+                pos = nxt
+                y -= self._tree[nxt]
+            step >>= 1
+        return min(pos, n - 1)
+
+    def _add(self, index, delta):
+        i = index + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _rebuild(self, size):
+        # mọi nút (kể cả nút > n, phủ các dòng sau này) phải nhận tổng của nút con: _add() và find()
+        # dùng tới chúng
+        n = len(self._heights)
+        tree = [0] * size
+        for i in range(1, size):
+            if i <= n:
+                tree[i] += self._heights[i - 1]
+            parent = i + (i & -i)
+            if parent < size:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+
+class ChatItem:
+    """
+    Một tin nhắn trong model (không giữ widget nào).
+    - text: nội dung / tên tệp (None nếu không có)
+    - buttons: list (nhãn, hàm) - nút phát voice, Lưu / Mở tệp...
+    - progress: 0..1 cho thanh tiến độ (None = không có), status: dòng trạng thái nhỏ
+    - timestamp: thời điểm gửi (tin trong lịch sử), mặc định là lúc tạo
+    """
+
+    __slots__ = ("sender", "is_self", "text", "buttons", "progress", "status", "time", "index")
+
+    def __init__(self, sender, is_self, text=None, buttons=(), progress=None, status=None, timestamp=None):
+        self.sender = sender
+        self.is_self = is_self
+        self.text = text
+        self.buttons = list(buttons)
+        self.progress = progress
+        self.status = status
+        when = datetime.fromtimestamp(timestamp) if timestamp is not None else datetime.now()
+        self.time = when.strftime("%Y-%m-%d %H:%M:%S")
+        self.index = -1
+
+    def estimate_height(self):
+        """Chiều cao ước lượng (pixel) trước khi được dựng và đo thật."""
+        height = 34  # dòng thời gian + lề
+        if not self.is_self:
+            height += 22
+        if self.text:
+            lines = sum(max(1, math.ceil(len(line) / 60)) for line in self.text.split("\n"))
+            height += 18 * lines + 4
+        if self.buttons:
+            height += 34
+        if self.progress is not None:
+            height += 12
+        if self.status is not None:
+            height += 16
+        return height
+
+
+class _Row:
+    """Một dòng widget tái sử dụng được: bind() đổ một ChatItem bất kỳ vào."""
+
+    def __init__(self, parent):
+        self.frame = ctk.CTkFrame(parent, fg_color="transparent")
+        self.bubble = ctk.CTkFrame(self.frame, corner_radius=10)
+        self.sender_label = ctk.CTkLabel(self.bubble, text="", font=ctk.CTkFont(weight="bold"))
+        self.text_label = ctk.CTkLabel(self.bubble, text="", wraplength=WRAP_LENGTH, justify="left")
+        self.progress_bar = ctk.CTkProgressBar(self.bubble, width=240)
+        self.status_label = ctk.CTkLabel(self.bubble, text="", font=ctk.CTkFont(size=10), text_color="gray")
+        self.button_frame = ctk.CTkFrame(self.bubble, fg_color="transparent")
+        self.buttons = [ctk.CTkButton(self.button_frame, text="", width=120 if i == 0 else 80)
+                        for i in range(MAX_BUTTONS)]
+        self.time_label = ctk.CTkLabel(self.bubble, text="", font=ctk.CTkFont(size=10, slant="italic"),
+                                       text_color="gray")
+        self.item = None
+
+    def bind(self, item):
+        self.item = item
+        for widget in (self.sender_label, self.text_label, self.progress_bar, self.status_label,
+                       self.button_frame, self.time_label):
+            widget.pack_forget()
+        self.bubble.pack_forget()
+        self.bubble.configure(fg_color=SELF_COLOR if item.is_self else OTHER_COLOR)
+        self.bubble.pack(side="right" if item.is_self else "left", padx=10, pady=2)
+        if not item.is_self:
+            self.sender_label.configure(text=item.sender)
+            self.sender_label.pack(anchor="w", padx=6, pady=(4, 0))
+        if item.text is not None:
+            self.text_label.configure(text=item.text)
+            self.text_label.pack(anchor="w", padx=6, pady=(4, 0))
+        if item.progress is not None:
+            self.progress_bar.set(item.progress)
+            self.progress_bar.pack(anchor="w", padx=6, pady=(4, 0))
+        if item.status is not None:
+            self.status_label.configure(text=item.status)
+            self.status_label.pack(anchor="w", padx=6, pady=(0, 4))
+        if item.buttons:
+            for button in self.buttons:
+                button.pack_forget()
+            for button, (label, command) in zip(self.buttons, item.buttons):
+                button.configure(text=label, command=command)
+                button.pack(side="left", padx=(0, 6))
+            self.button_frame.pack(anchor="w", padx=6, pady=(0, 6))
+        suffix = " ✓" if item.is_self else ""
+        self.time_label.configure(text=f"{item.time}{suffix}")
+        self.time_label.pack(anchor="e", padx=6, pady=(0, 4))
+
+    def update_progress(self, item):
+        """Chỉ cập nhật thanh tiến độ / trạng thái (không đổi bố cục, không phải đo lại)."""
+        self.progress_bar.set(item.progress)
+        self.status_label.configure(text=item.status)
+
+    def height(self):
+        return self.frame.winfo_reqheight()
+
+
+class _WheelDispatcher:
+    """
+    Con lăn chuột của mọi ChatView trong một cửa sổ: MỘT handler bind_all cho mỗi cửa sổ gốc
+    (widget CTk không cho bind_all, nên bind trên cửa sổ gốc), chuyển sự kiện tới khung chat có
+    con trỏ nằm trên đó. Khung chat bị đóng thì chỉ gỡ khỏi danh sách, không để lại handler nào.
+    """
+
+    _by_root = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def for_root(cls, root):
+        dispatcher = cls._by_root.get(root)
+        if dispatcher is None:
+            dispatcher = cls._by_root[root] = cls(root)
+        return dispatcher
+
+    def __init__(self, root):
+        self.views = []
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            root.bind_all(sequence, self.dispatch, add="+")
+
+    def add(self, view):
+        self.views.append(view)
+
+    def remove(self, view):
+        if view in self.views:
+            self.views.remove(view)
+
+    def dispatch(self, event):
+        for view in list(self.views):
+            if view._on_wheel(event):
+                return
+
+
+class ChatView:
+    """
+    Khung chat của một tab: append() thêm tin (O(log n), không tạo widget nếu tin nằm ngoài
+    vùng nhìn thấy), prepend() chèn tin cũ hơn lên đầu (lịch sử), update_item() sửa một tin
+    (tiến độ tệp, voice đã nhận xong...). Nhiều thay đổi liên tiếp chỉ vẽ lại một lần (after_idle).
+    'on_reach_top': hàm gọi khi người dùng cuộn lên tới đầu (tải trang lịch sử cũ hơn).
+    """
+
+    def __init__(self, parent, title):
+        self.container = ctk.CTkFrame(parent)
+        self.container.pack(fill="both", expand=True, padx=10, pady=10)
+        ctk.CTkLabel(self.container, text=f"Cuộc trò chuyện: {title}").pack(fill="x")
+        self.scrollbar = ctk.CTkScrollbar(self.container, command=self._on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+        self.viewport = ctk.CTkFrame(self.container, fg_color="transparent")
+        self.viewport.pack(side="left", fill="both", expand=True)
+        self.viewport.bind("<Configure>", lambda e: self.refresh())
+        # con lăn chuột: một handler chung cho cả cửa sổ, chỉ xử lý khi con trỏ nằm trên khung chat này
+        self._wheel = _WheelDispatcher.for_root(self.viewport.winfo_toplevel())
+        self._wheel.add(self)
+
+        self.items = []
+        self.heights = HeightIndex()
+        self.measured = []       # đã đo chiều cao thật của tin i chưa
+        self.offset = 0          # vị trí cuộn (pixel từ đầu danh sách)
+        self.follow = True       # đang ở cuối: tin mới tới thì tự cuộn theo
+        self._rows = {}          # chỉ số tin -> _Row đang hiển thị
+        self._pool = []          # _Row rảnh để tái sử dụng
+        self._pending = None     # after_idle đang chờ vẽ lại
+        self.on_reach_top = None
+
+    # ---------- model ----------
+    def append(self, item):
+        item.index = len(self.items)
+        self.items.append(item)
+        self.heights.append(item.estimate_height())
+        self.measured.append(False)
+        self.refresh()
+        return item
+
+    def prepend(self, items):
+        """Chèn 'items' (cũ -> mới) lên trước mọi tin hiện có, giữ nguyên vị trí đang xem."""
+        if not items:
+            return
+        k = len(items)
+        heights = [item.estimate_height() for item in items]
+        self.items[:0] = items
+        for index, item in enumerate(self.items):
+            item.index = index
+        self.heights.prepend(heights)
+        self.measured[:0] = [False] * k
+        self._rows = {index + k: row for index, row in self._rows.items()}
+        if not self.follow:
+            self.offset += sum(heights)
+        self.refresh()
+
+    def update_item(self, item, **changes):
+        """Đổi thuộc tính của 'item'; nếu đang hiển thị thì dựng lại dòng đó."""
+        # tiến độ tệp thay đổi liên tục: chỉ sửa 2 widget nếu dòng đã có sẵn thanh tiến độ / trạng thái
+        progress_only = set(changes) <= {"progress", "status"} and item.progress is not None \
+            and item.status is not None and None not in changes.values()
+        for name, value in changes.items():
+            setattr(item, name, value)
+        if progress_only:
+            if item.index in self._rows:
+                self._rows[item.index].update_progress(item)
+            return
+        self.measured[item.index] = False
+        if item.index in self._rows:
+            self._rows[item.index].bind(item)
+            self.refresh()
+        else:
+            # đo lại khi được dựng; trong lúc chờ dùng ước lượng theo nội dung mới
+            self.heights.set(item.index, item.estimate_height())
+
+    def scroll_to_end(self):
+        self.follow = True
+        self.refresh()
+
+    def destroy(self):
+        """Đóng khung chat (đóng tab): gỡ khỏi bộ phân phối con lăn chuột và hủy widget."""
+        self._wheel.remove(self)
+        if self._pending is not None:
+            self.viewport.after_cancel(self._pending)
+            self._pending = None
+        self.container.destroy()
+
+    # ---------- cuộn ----------
+    def _viewport_height(self):
+        return max(1, self.viewport.winfo_height())
+
+    def _max_offset(self):
+        return max(0, self.heights.total - self._viewport_height())
+
+    def scroll_to(self, offset):
+        self.offset = min(max(0, int(offset)), self._max_offset())
+        self.follow = self.offset >= self._max_offset()
+        self.refresh()
+        if self.offset == 0 and self.on_reach_top is not None:
+            self.on_reach_top()
+
+    def _on_scrollbar(self, action, value, unit=None):
+        if action == "moveto":
+            self.scroll_to(float(value) * self.heights.total)
+        elif action == "scroll":
+            step = self._viewport_height() if unit == "pages" else WHEEL_STEP_PX
+            self.scroll_to(self.offset + int(value) * step)
+
+    def _on_wheel(self, event):
+        """Sự kiện con lăn chuột (từ _WheelDispatcher); True nếu con trỏ nằm trên khung chat này."""
+        if not str(event.widget).startswith(str(self.viewport)) or not self.viewport.winfo_ismapped():
+            return False
+        if event.num == 4:
+            steps = -1
+        elif event.num == 5:
+            steps = 1
+        else:
+            # Windows: bội số của 120; macOS: số nhỏ
+            steps = -event.delta // 120 if sys.platform.startswith("win") else -event.delta
+        self.scroll_to(self.offset + steps * WHEEL_STEP_PX)
+        return True
+
+    # ---------- vẽ ----------
+    def refresh(self):
+        """Hẹn vẽ lại (gộp nhiều thay đổi trong cùng một vòng sự kiện thành một lần vẽ)."""
+        if self._pending is None:
+            self._pending = self.viewport.after_idle(self._render)
+
+    def visible_range(self):
+        """[first, last] các tin cần có widget: vùng nhìn thấy + OVERSCAN_PX hai phía."""
+        if not self.items:
+            return 0, -1
+        first = self.heights.find(max(0, self.offset - OVERSCAN_PX))
+        last = self.heights.find(self.offset + self._viewport_height() + OVERSCAN_PX)
+        return first, last
+
+    def _render(self):
+        self._pending = None
+        for _ in range(3):  # đo thật có thể đổi chiều cao -> vùng nhìn thấy -> đo thêm vài dòng
+            if self.follow:
+                self.offset = self._max_offset()
+            first, last = self.visible_range()
+            for index in [i for i in self._rows if i < first or i > last]:
+                row = self._rows.pop(index)
+                row.frame.place_forget()
+                row.item = None
+                self._pool.append(row)
+            fresh = []
+            for index in range(first, last + 1):
+                if index not in self._rows:
+                    row = self._pool.pop() if self._pool else _Row(self.viewport)
+                    row.bind(self.items[index])
+                    self._rows[index] = row
+                if not self.measured[index]:
+                    fresh.append(index)
+            if not fresh:
+                break
+            # đo chiều cao thật của các dòng vừa dựng
+            self.viewport.update_idletasks()
+            for index in fresh:
+                self.heights.set(index, self._rows[index].height())
+                self.measured[index] = True
+        self.offset = min(self.offset, self._max_offset())
+        # chiều cao đo được là pixel thật, còn place() của CTk nhân tọa độ với hệ số scaling (HiDPI)
+        scaling = ctk.ScalingTracker.get_widget_scaling(self.viewport)
+        for index, row in self._rows.items():
+            row.frame.place(x=0, y=(self.heights.offset(index) - self.offset) / scaling, relwidth=1.0)
+        total = max(1, self.heights.total)
+        self.scrollbar.set(self.offset / total, min(1.0, (self.offset + self._viewport_height()) / total))
+
+    @property
+    def widget_rows(self):
+        """Số dòng widget đã tạo (đang hiển thị + rảnh trong pool)."""
+        return len(self._rows) + len(self._pool)
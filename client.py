@@ -9,15 +9,53 @@ import tkinter as tk
 from tkinter import filedialog, messagebox
 import os
 import sys
+import shutil
 import subprocess
 import tempfile
+import queue
+
+from protocol import (ALL_ID, CALL_KINDS, FILE_STREAM_KINDS, PROTO_LATEST, PROTO_V1, PROTO_V2, FrameAssembler, ProtocolError,
+                      SliceJoiner, encode_frame, encode_parts, format_options, parse_options, recv_message,
+                      safe_filename, send_frame, split_file_body)
+from attachments import AttachmentMissing, AttachmentStore
+from chat_view import ChatItem, ChatView
+from compression import (ALL_METHODS, COMPRESSIBLE_KINDS, COMPRESSION_FLAGS, METHODS, CompressionError,
+                         CompressionStats, compress, format_methods, inflate, parse_methods)
+from message_log import iter_records
+from presence import SNAPSHOT, parse_presence
+from recorder import RingRecorder
+from rooms import ROOM_PREFIX, is_room, valid_room
+from transfer import (STREAM_THRESHOLD, IncomingTransfer, OutgoingTransfer, chunk_parts, encode_cancel,
+                      encode_offset, parse_cancel, parse_chunk, parse_offer, parse_offset)
+from ui_inbox import UI_TICK_MS, UiInbox
+from vad import SilenceTrimmer
+from voice_call import (CALL_RATE, FRAME_SAMPLES, CallSession, NetworkSimulator, encode_signal, new_call_id,
+                        parse_signal)
+from voice_codec import (CODEC_ULAW, IncomingVoice, StreamResampler, VoiceStreamEncoder, decode_voice, join_voice,
+                         new_voice_id, parse_voice_chunk, voice_chunk_parts, voice_duration)
 
 # ================== CẤU HÌNH AUDIO / NETWORK ==================
 SAMPLE_RATE = 44100
 CHANNELS = 1
 DTYPE = np.int16
 CHUNK = 1024
-HEADER_SIZE = 10
+# Codec nén tin nhắn thoại (voice_codec.py): CODEC_ULAW = 16 kHz μ-law (~5.5 lần nhỏ hơn PCM 44.1 kHz),
+# CODEC_ADPCM = 16 kHz IMA-ADPCM (~11 lần), CODEC_PCM16 = không nén
+VOICE_CODEC = CODEC_ULAW
+MAX_RECORD_SECONDS = 300  # Thời lượng tối đa của một tin nhắn thoại
+# Cắt khoảng lặng trước khi mã hóa tin nhắn thoại (vad.py): tham số của SilenceTrimmer, ví dụ
+# {"start_db": -30, "stop_db": -40, "hangover": 0.5} cho phòng ồn; {} = mặc định, None = tắt
+VOICE_VAD = {}
+# Dung lượng tối đa của cache tệp đính kèm trên đĩa (attachments.py), vượt quá thì xóa tệp lâu không dùng
+ATTACHMENT_CACHE_BYTES = 1024 * 1024 * 1024
+HISTORY_PAGE = 50  # số tin mỗi lần tải lịch sử (khi kết nối / mở tab / cuộn lên đầu)
+# In số liệu hộp thư giao diện (ui_inbox.py: độ sâu hàng đợi, thời gian mỗi lần rút) mỗi N giây, 0 = tắt
+UI_STATS_INTERVAL = 0
+# Nén tin chữ / file gửi đi (compression.py) khi server đồng ý: "zlib", "lzma" (nén mạnh hơn, chậm hơn)
+# hoặc None = không nén. Tin nhỏ hay dữ liệu đã nén sẵn (zip, ảnh, video...) luôn được gửi nguyên.
+COMPRESSION = "zlib"
+# Giả lập mạng xấu cho cuộc gọi UDP khi thử qua loopback, ví dụ {"loss": 0.05, "jitter": 0.03}
+CALL_SIMULATION = None
 
 # ================== LỚP GIAO DIỆN CHÍNH ==================
 class VoiceChatClient(ctk.CTk):
@@ -34,12 +72,51 @@ class VoiceChatClient(ctk.CTk):
         # trạng thái
         self.is_connected = False
         self.is_recording = False
-        self.recorded_frames = []
         self.username = ""
         self.socket = None
         self.receive_thread = None
-        self.private_chats = {}  # chứa các khung chat riêng {username/group: Frame}
+        self.assembler = None  # bộ ghép frame (recv_into) của kết nối hiện tại
+        self.slices = None     # ghép lát (FLAG_MORE) của tin lớn server cắt nhỏ để tin chữ chen vào
+        # nhiều luồng cùng gửi (giao diện, ghi âm, gửi file): mỗi frame phải đi liền một khối
+        self.send_lock = threading.Lock()
+        # giao thức: v1 cho tới khi server xác nhận v2 bằng HELLO
+        self.proto = PROTO_V1
+        self.user_id = ALL_ID
+        self.user_ids = {"ALL": ALL_ID}   # tên -> ID số (giao thức v2)
+        self.user_names = {ALL_ID: "ALL"}  # ID số -> tên (giữ cả user đã rời để tin đến trễ vẫn hiển thị tên)
+        self.compress = 0  # kiểu nén server đã đồng ý (bitmask cờ nén), 0 = gửi nguyên
+        self.compression_stats = CompressionStats()  # kích thước trước / sau nén của các tin đã gửi
+        self.private_chats = {}  # chứa các khung chat riêng {username/group/#phòng: ChatView}
         self.current_chat = "ALL"
+        # phòng chat có tên (rooms.py): thành viên của các phòng đã vào {#phòng: [tên]}, phòng đang chờ server xác nhận
+        self.room_members = {}
+        self.rooms_joining = set()
+        self.online_users = set()  # để biết ai vừa (vào lại) online -> tiếp tục gửi file dở
+        self.presence_version = 0  # version danh sách online (PRESENCE snapshot / delta, xem presence.py)
+        # lịch sử trên server (message_log.py): seq đầu tiên nhận trực tiếp (từ HELLO), và với mỗi tab:
+        # seq cũ nhất đã hiển thị, còn tin cũ hơn không, đang chờ trang nào
+        self.history_enabled = False
+        self.history_head = 0
+        self.history_before = {}
+        self.history_more = {}
+        self.history_loading = set()
+        # truyền file dạng luồng (transfer.py): {tid: OutgoingTransfer / IncomingTransfer}
+        self.outgoing_transfers = {}
+        self.incoming_transfers = {}
+        self.transfer_widgets = {}  # {tid: (ChatView, ChatItem)}
+        self.transfer_percent = {}  # {tid: % đã hiển thị}: chỉ vẽ lại khi % thay đổi, không phải mỗi chunk
+        # (tid, peer) cần gửi thêm chunk: luồng gửi file đọc đĩa + gửi, luồng nhận không bị chặn
+        self.transfer_jobs = queue.Queue()
+        threading.Thread(target=self._transfer_sender_thread, daemon=True).start()
+        # tin nhắn thoại đang nhận dần (VOICECHUNK): {vid: IncomingVoice}, {vid: (ChatView, ChatItem)}
+        self.incoming_voices = {}
+        self.voice_items = {}
+        # payload voice / file nhận được nằm trên đĩa, giao diện chỉ giữ Attachment (mã băm + kích thước)
+        self.attachments = AttachmentStore(max_bytes=ATTACHMENT_CACHE_BYTES)
+        # cuộc gọi trực tiếp (voice_call.py): CallSession, người/nhóm đang gọi, stream sounddevice
+        self.call = None
+        self.call_target = None
+        self.call_streams = []
 
         # Layout chính (2 cột: trái controls, phải chat)
         self.grid_columnconfigure(0, weight=1, minsize=300)
@@ -72,6 +149,18 @@ class VoiceChatClient(ctk.CTk):
         self.send_file_button = ctk.CTkButton(self.left_frame, text="Gửi tệp...", command=self.choose_and_send_file, state="disabled")
         self.send_file_button.pack(pady=(0,8), padx=10, fill="x")
 
+        # Phòng chat có tên: nhập "#ten" rồi vào phòng, tab của phòng nằm cạnh các tab chat riêng
+        self.room_frame = ctk.CTkFrame(self.left_frame)
+        self.room_frame.pack(pady=(0,8), padx=10, fill="x")
+        self.room_entry = ctk.CTkEntry(self.room_frame, placeholder_text="#phong", state="disabled")
+        self.room_entry.grid(row=0, column=0, padx=5, pady=5, sticky="ew")
+        self.room_entry.bind("<Return>", self.join_room)
+        self.join_room_button = ctk.CTkButton(self.room_frame, text="Vào phòng", width=90, state="disabled", command=self.join_room)
+        self.join_room_button.grid(row=0, column=1, padx=5, pady=5)
+        self.leave_room_button = ctk.CTkButton(self.room_frame, text="Rời phòng đang mở", state="disabled", command=self.leave_room)
+        self.leave_room_button.grid(row=1, column=0, columnspan=2, padx=5, pady=(0,5), sticky="ew")
+        self.room_frame.grid_columnconfigure(0, weight=1)
+
         # Toggle chế độ sáng/tối (mới)
         self.theme_button = ctk.CTkButton(self.left_frame, text="Chuyển chế độ Sáng/Tối", command=self.toggle_theme)
         self.theme_button.pack(pady=(0,8), padx=10, fill="x")
@@ -88,7 +177,7 @@ class VoiceChatClient(ctk.CTk):
         self.user_list_label.pack(pady=(10,0), padx=10, fill="x")
         self.user_list_frame = ctk.CTkScrollableFrame(self.left_frame)
         self.user_list_frame.pack(fill="both", expand=True, pady=5, padx=10)
-        self.user_widgets = []
+        self.user_widgets = {}  # {username: nút}: chỉ thêm / xóa dòng thay đổi
 
         # === KHUNG CHAT CHÍNH (PHẢI) ===
         self.right_frame = ctk.CTkFrame(self)
@@ -115,8 +204,16 @@ class VoiceChatClient(ctk.CTk):
         self.record_button = ctk.CTkButton(self.right_frame, text="🎤", width=60, state="disabled", command=self.toggle_recording)
         self.record_button.grid(row=1, column=3, padx=6, pady=(0,10))
 
+        self.call_button = ctk.CTkButton(self.right_frame, text="📞", width=60, state="disabled", command=self.toggle_call)
+        self.call_button.grid(row=1, column=4, padx=6, pady=(0,10))
+
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
 
+        # cập nhật giao diện từ các luồng nền đi qua hộp thư, rút theo nhịp (ui_inbox.py)
+        self.inbox = UiInbox()
+        self.inbox_stats_at = time.monotonic()
+        self.after(UI_TICK_MS, self._drain_inbox)
+
         # Khởi tạo sounddevice để tránh lỗi khi lần đầu dùng
         try:
             sd.play(np.zeros(100, dtype=DTYPE), samplerate=SAMPLE_RATE)
@@ -142,86 +239,109 @@ class VoiceChatClient(ctk.CTk):
         # gọi lại sau 1s
         self.after(1000, self.update_datetime)
 
+    # ================== HỘP THƯ GIAO DIỆN ==================
+    def _drain_inbox(self):
+        """(Luồng giao diện) chạy các cập nhật từ luồng nền theo lô có giới hạn thời gian, rồi hẹn nhịp sau"""
+        try:
+            self.inbox.drain()
+            if UI_STATS_INTERVAL and time.monotonic() - self.inbox_stats_at >= UI_STATS_INTERVAL:
+                self.inbox_stats_at = time.monotonic()
+                stats = self.inbox.stats()
+                print(f"📊 UI inbox: depth={stats['depth']} peak={stats['peak_depth']} "
+                      f"batch={stats['last_batch']} drain avg={stats['avg_drain_ms']:.2f}ms "
+                      f"max={stats['max_drain_ms']:.2f}ms coalesced={stats['coalesced']}")
+        finally:
+            self.after(UI_TICK_MS, self._drain_inbox)
+
     # ================== TẠO KHUNG CHAT MỚI ==================
     def _create_chat_area(self, parent, title):
-        chat_frame = ctk.CTkScrollableFrame(parent, label_text=f"Cuộc trò chuyện: {title}")
-        chat_frame.pack(fill="both", expand=True, padx=10, pady=10)
-        return chat_frame
+        # ChatView (chat_view.py): chỉ dựng widget cho các tin đang nhìn thấy, tái sử dụng khi cuộn
+        view = ChatView(parent, title)
+        # cuộn lên tới đầu: tải trang lịch sử cũ hơn
+        view.on_reach_top = lambda: self._request_history(title)
+        return view
 
     def _ensure_chat_tab(self, username):
-        """Tạo tab riêng nếu chưa có"""
+        """Tạo tab riêng nếu chưa có (kèm trang lịch sử gần nhất của cuộc trò chuyện)"""
         if username not in self.private_chats:
             tab = self.chat_tabs.add(username)
             self.private_chats[username] = self._create_chat_area(tab, username)
+            self._request_history(username)
         self.chat_tabs.set(username)
         self.current_chat = username
 
     # ================== HIỂN THỊ TIN NHẮN / VOICE / FILE ==================
+    def _chat_view(self, chat_name):
+        view = self.private_chats.get(chat_name)
+        if not view:
+            # ensure tab exists and return the view
+            self._ensure_chat_tab(chat_name)
+            view = self.private_chats[chat_name]
+        return view
+
     def add_message_widget(self, sender, content, chat_name="ALL", is_voice=False, is_file=False):
         """
-        Thêm tin nhắn vào chat.
-        - is_voice: content = (audio_bytes, duration)
-        - is_file: content = (filename, file_bytes)
+        Thêm tin nhắn vào chat (model của ChatView, widget chỉ được dựng khi tin nằm trong vùng nhìn thấy).
+        - is_voice: content = (Attachment, duration); vid (str) thay cho Attachment nếu tin nhắn thoại còn đang tới
+        - is_file: content = (filename, Attachment)
         - text: content = str
         """
-        frame = self.private_chats.get(chat_name)
-        if not frame:
-            # ensure tab exists and return the frame
-            self._ensure_chat_tab(chat_name)
-            frame = self.private_chats[chat_name]
-
-        msg_frame = ctk.CTkFrame(frame, fg_color="transparent")
+        view = self._chat_view(chat_name)
+        item = self._message_item(sender, content, is_voice, is_file)
+        if is_voice and isinstance(content[0], str):
+            self.voice_items[content[0]] = (view, item)
+        return view.append(item)
+
+    def _message_item(self, sender, content, is_voice=False, is_file=False, timestamp=None):
+        """ChatItem của một tin (content như add_message_widget), chưa gắn vào khung chat nào"""
         is_self = (sender == self.username)
-        msg_frame.pack(fill="x", pady=3, padx=5, anchor="e" if is_self else "w")
-
-        bubble_color = "#6DF32F" if is_self else "#D8CAB8"
-        bubble = ctk.CTkFrame(msg_frame, fg_color=bubble_color, corner_radius=10)
-        bubble.pack(side="right" if is_self else "left", padx=10, pady=2)
-
-        # Hiển thị tên nếu không phải mình
-        if not is_self:
-            ctk.CTkLabel(bubble, text=sender, font=ctk.CTkFont(weight="bold")).pack(anchor="w", padx=6, pady=(4,0))
-
-        # Nội dung tin nhắn
         if is_voice:
             audio_data, duration = content
-            play_btn = ctk.CTkButton(bubble,
-                                     text=f"▶ ({duration:.1f}s)",
-                                     width=120,
-                                     command=lambda d=audio_data: self.play_voice_message(d))
-            play_btn.pack(padx=6, pady=(0,6))
-        elif is_file:
-            filename, file_bytes = content
+            if isinstance(audio_data, str):
+                # đang nhận dần: nghe trực tiếp các đoạn đã tới, tin trở thành tin bình thường khi đủ
+                return ChatItem(sender, is_self, buttons=[("▶ Nghe trực tiếp...",
+                                                          lambda v=audio_data: self.play_live_voice(v))])
+            return ChatItem(sender, is_self, buttons=[(f"▶ ({duration:.1f}s)",
+                                                      lambda d=audio_data: self.play_voice_message(d))],
+                            timestamp=timestamp)
+        if is_file:
+            filename, attachment = content
             # nút Lưu / Mở file
-            file_label = ctk.CTkLabel(bubble, text=f"[Tệp] {filename}", wraplength=450, justify="left")
-            file_label.pack(anchor="w", padx=6, pady=(4,0))
-
-            action_frame = ctk.CTkFrame(bubble, fg_color="transparent")
-            action_frame.pack(anchor="w", padx=6, pady=(0,4))
-
-            save_btn = ctk.CTkButton(action_frame, text="Lưu...", width=80,
-                                     command=lambda fn=filename, b=file_bytes: self.save_received_file(fn, b))
-            save_btn.pack(side="left", padx=(0,6))
-            open_btn = ctk.CTkButton(action_frame, text="Mở", width=80,
-                                     command=lambda fn=filename, b=file_bytes: self.open_received_file(fn, b))
-            open_btn.pack(side="left")
-        else:
-            ctk.CTkLabel(bubble, text=content,
-                         wraplength=450,
-                         justify="left").pack(anchor="w", padx=6, pady=(0,4))
-
-        # Thời gian gửi + dấu ✓ cho tin mình
-        time_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        suffix = " ✓" if is_self else ""
-        ctk.CTkLabel(bubble,
-                     text=f"{time_str}{suffix}",
-                     font=ctk.CTkFont(size=10, slant="italic"),
-                     text_color="gray").pack(anchor="e", padx=6, pady=(0,4))
-
-        # cuộn xuống cuối
-        self.after(100, lambda: frame._parent_canvas.yview_moveto(1.0))
-
-
+            return ChatItem(sender, is_self, text=f"[Tệp] {filename}", buttons=[
+                ("Lưu...", lambda fn=filename, a=attachment: self.save_received_file(fn, a)),
+                ("Mở", lambda fn=filename, a=attachment: self.open_received_file(fn, a)),
+            ], timestamp=timestamp)
+        return ChatItem(sender, is_self, text=content, timestamp=timestamp)
+
+    def add_transfer_widget(self, tid, sender, filename, size, chat_name):
+        """Tin tệp đang truyền dạng luồng: tên tệp + thanh tiến độ cập nhật theo từng chunk"""
+        view = self._chat_view(chat_name)
+        item = ChatItem(sender, sender == self.username, text=f"[Tệp] {filename} ({self._format_size(size)})",
+                        progress=0.0, status="")
+        self.transfer_widgets[tid] = (view, view.append(item))
+
+    def update_transfer_widget(self, tid, progress, text=None):
+        widgets = self.transfer_widgets.get(tid)
+        if not widgets:
+            return
+        view, item = widgets
+        changes = {}
+        if progress is not None:
+            changes["progress"] = progress
+        if text is not None:
+            changes["status"] = text
+        view.update_item(item, **changes)
+
+    def finish_transfer_widget(self, tid, filename, path):
+        """Nhận xong: thêm nút Lưu / Mở (file nằm trên đĩa, không nạp vào RAM)"""
+        widgets = self.transfer_widgets.get(tid)
+        if not widgets:
+            return
+        view, item = widgets
+        view.update_item(item, progress=1.0, status="✓ Đã nhận xong", buttons=[
+            ("Lưu...", lambda: self.save_received_path(filename, path)),
+            ("Mở", lambda: self._open_path(path)),
+        ])
 
     # ================== GỬI TIN VĂN BẢN ==================
     def send_text_message(self, event=None):
@@ -232,8 +352,7 @@ class VoiceChatClient(ctk.CTk):
         current_tab = self.chat_tabs.get()
         receiver = "ALL" if current_tab.startswith("ALL") else current_tab
 
-        full = f"TEXTMSG::{self.username}::{receiver}::{msg}"
-        self._send_message(full.encode('utf-8'))
+        self._send("TEXTMSG", receiver, msg.encode('utf-8'))
 
         # Hiển thị local CHỈ khi là private (tránh duplicate ở group)
         self.add_message_widget(self.username, msg, chat_name=receiver)
@@ -252,114 +371,497 @@ class VoiceChatClient(ctk.CTk):
                                                filetypes=[("All files", "*.*")])
         if not file_path:
             return
+        current_tab = self.chat_tabs.get()
+        receiver = "ALL" if current_tab.startswith("ALL") else current_tab
         try:
+            if os.path.getsize(file_path) > STREAM_THRESHOLD:
+                # File lớn: đề nghị gửi dạng luồng, chỉ đọc từng chunk khi người nhận chấp nhận
+                self.start_file_transfer(file_path, receiver)
+                return
             with open(file_path, "rb") as f:
                 data = f.read()
-            filename = os.path.basename(file_path)
-            current_tab = self.chat_tabs.get()
-            receiver = "ALL" if current_tab.startswith("ALL") else current_tab
-            # Lưu ý: đơn giản dùng separator "::" cho metadata; tránh tên file chứa "::"
-            payload = b"FILE::" + self.username.encode('utf-8') + b"::" + receiver.encode('utf-8') + b"::" + filename.encode('utf-8') + b"::" + data
-            self._send_message(payload)
-
-            self.add_message_widget(self.username, (filename, data), chat_name=receiver, is_file=True)
+            # "::" ngăn cách tên file và dữ liệu nên không được có trong tên file
+            filename = safe_filename(os.path.basename(file_path))
+            # body = ten_file::du_lieu (gửi thành nhiều phần, không nối lại)
+            self._send("FILE", receiver, filename.encode('utf-8'), b"::", data)
+
+            content = (filename, self.attachments.put(data))
+            self.add_message_widget(self.username, content, chat_name=receiver, is_file=True)
             # Hiển thị local CHỈ khi gửi private (tránh trùng group)
             # if receiver != "ALL":
             #     self.add_message_widget(self.username, (filename, data), chat_name=receiver, is_file=True)
         except Exception as e:
             messagebox.showerror("Lỗi gửi tệp", str(e))
 
-    # ================== NHẬN DỮ LIỆU TỪ SOCKET ==================
-    def _recv_all(self, n):
-        """Đọc chính xác n bytes từ socket (nếu socket đóng trả về None)"""
-        data = bytearray()
-        while len(data) < n:
-            packet = self.socket.recv(n - len(data))
-            if not packet:
-                return None
-            data.extend(packet)
-        return bytes(data)
+    # ================== GỬI / NHẬN FILE DẠNG LUỒNG ==================
+    def start_file_transfer(self, file_path, receiver):
+        """Đề nghị gửi file lớn (FILEOFFER); chunk chỉ được gửi sau khi người nhận FILEACCEPT"""
+        transfer = OutgoingTransfer(file_path, receiver)
+        self.outgoing_transfers[transfer.tid] = transfer
+        self._send("FILEOFFER", receiver, transfer.offer_body())
+        self.add_transfer_widget(transfer.tid, self.username, transfer.filename, transfer.size, receiver)
+        self.update_transfer_widget(transfer.tid, 0, "Đang chờ người nhận chấp nhận...")
+
+    def _resume_transfers(self, peers):
+        """Những người trong 'peers' vừa online (hoặc mình vừa kết nối lại): đề nghị lại file gửi dở"""
+        for transfer in list(self.outgoing_transfers.values()):
+            targets = transfer.unfinished_peers()
+            if not self._is_group(transfer.receiver) and not transfer.peers:
+                targets = [transfer.receiver]  # chưa ai trả lời đề nghị
+            for peer in targets:
+                if peer in peers:
+                    self._send("FILEOFFER", peer, transfer.offer_body())
+
+    def _transfer_sender_thread(self):
+        """Luồng gửi file: đọc chunk từ đĩa và gửi trong giới hạn cửa sổ chưa ACK"""
+        while True:
+            tid, peer = self.transfer_jobs.get()
+            transfer = self.outgoing_transfers.get(tid)
+            if transfer is None or not self.is_connected:
+                continue
+            try:
+                for offset, data in transfer.next_chunks(peer):
+                    self._send("FILECHUNK", peer, *chunk_parts(tid, offset, data))
+            except OSError as e:
+                print(f"⚠️ Lỗi đọc tệp {transfer.path}: {e}")
+                self._send("FILECANCEL", peer, encode_cancel(tid, "lỗi đọc tệp"))
+                transfer.remove(peer)
+
+    def _handle_file_stream(self, data):
+        """FILEOFFER / FILEACCEPT / FILECHUNK / FILEACK / FILECANCEL (xem transfer.py)"""
+        sender, receiver = data.sender, data.receiver
+        if data.kind == "FILECHUNK":
+            chunk = parse_chunk(data.body)
+            transfer = self.incoming_transfers.get(chunk[0]) if chunk else None
+            if transfer is None:
+                return
+            tid, offset, payload = chunk
+            if transfer.write(offset, payload):
+                # ACK từng chunk: người gửi dịch cửa sổ, và biết offset để tiếp tục nếu mất kết nối
+                self._send("FILEACK", sender, encode_offset(tid, transfer.received))
+                self._report_incoming_progress(transfer)
+
+        elif data.kind == "FILEOFFER":
+            offer = parse_offer(data.body)
+            if offer is None:
+                return
+            tid, size, filename = offer
+            filename = os.path.basename(filename) or "file"
+            if tid in self.incoming_transfers or IncomingTransfer.resumable(tid):
+                # Đã nhận dở: tự tiếp tục từ phần đã có, không hỏi lại
+                self._accept_file_offer(sender, receiver, tid, size, filename)
+            else:
+                # hộp thoại modal: đi thẳng qua after, không chặn việc rút hộp thư
+                self.after(0, lambda: self._prompt_file_offer(sender, receiver, tid, size, filename))
+
+        elif data.kind in ("FILEACCEPT", "FILEACK"):
+            parsed = parse_offset(data.body)
+            transfer = self.outgoing_transfers.get(parsed[0]) if parsed else None
+            if transfer is None:
+                return
+            tid, offset = parsed
+            if data.kind == "FILEACCEPT":
+                transfer.accept(sender, offset)
+                progress = transfer.ack(sender, offset)
+            else:
+                progress = transfer.ack(sender, offset)
+                if progress is None:
+                    return
+            if transfer.done(sender):
+                self.inbox.post(self.update_transfer_widget, tid, 1.0, f"✓ {sender} đã nhận đủ")
+                if not self._is_group(transfer.receiver):
+                    transfer.close()
+                    self.outgoing_transfers.pop(tid, None)
+            else:
+                self._report_outgoing_progress(tid, sender, progress)
+                self.transfer_jobs.put((tid, sender))
+
+        elif data.kind == "FILECANCEL":
+            tid, reason = parse_cancel(data.body)
+            outgoing = self.outgoing_transfers.get(tid)
+            if outgoing is not None:
+                outgoing.remove(sender)
+                if not self._is_group(outgoing.receiver):
+                    outgoing.close()
+                    self.outgoing_transfers.pop(tid, None)
+            incoming = self.incoming_transfers.pop(tid, None)
+            if incoming is not None:
+                incoming.discard()
+            self.inbox.post(self.update_transfer_widget, tid, None, f"✗ {sender}: {reason}")
+
+    def _prompt_file_offer(self, sender, receiver, tid, size, filename):
+        """(Luồng giao diện) hỏi người dùng có nhận file lớn không"""
+        if messagebox.askyesno("Nhận tệp", f"{sender} muốn gửi '{filename}' ({self._format_size(size)}). Nhận?"):
+            self._accept_file_offer(sender, receiver, tid, size, filename)
+        else:
+            self._send("FILECANCEL", sender, encode_cancel(tid, "từ chối"))
 
+    def _accept_file_offer(self, sender, receiver, tid, size, filename):
+        transfer = self.incoming_transfers.get(tid)
+        if transfer is None:
+            try:
+                transfer = IncomingTransfer(tid, sender, filename, size)
+            except OSError as e:
+                print(f"⚠️ Không tạo được tệp tạm: {e}")
+                self._send("FILECANCEL", sender, encode_cancel(tid, "lỗi ghi tệp"))
+                return
+            self.incoming_transfers[tid] = transfer
+        if tid not in self.transfer_widgets:
+            chat_name = self._chat_name(sender, receiver)
+            self.inbox.post(self.add_transfer_widget, tid, sender, filename, size, chat_name)
+        self._report_incoming_progress(transfer)
+        self._send("FILEACCEPT", sender, encode_offset(tid, transfer.received))
+
+    def _report_incoming_progress(self, transfer):
+        tid = transfer.tid
+        if transfer.complete:
+            self.incoming_transfers.pop(tid, None)
+            self.inbox.post(self.finish_transfer_widget, tid, transfer.filename, transfer.path)
+            return
+        progress = transfer.progress()
+        if self._percent_changed(tid, progress):
+            text = f"{self._format_size(transfer.received)} / {self._format_size(transfer.size)}"
+            self.inbox.post_latest(("progress", tid), self.update_transfer_widget, tid, progress, text)
+
+    def _report_outgoing_progress(self, tid, peer, progress):
+        if self._percent_changed(tid, progress):
+            self.inbox.post_latest(("progress", tid), self.update_transfer_widget, tid, progress,
+                                   f"{peer}: {progress:.0%}")
+
+    def _percent_changed(self, tid, progress):
+        percent = int(progress * 100)
+        if self.transfer_percent.get(tid) == percent:
+            return False
+        self.transfer_percent[tid] = percent
+        return True
+
+    @staticmethod
+    def _format_size(n):
+        for unit in ("B", "KB", "MB"):
+            if n < 1024:
+                return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+            n /= 1024
+        return f"{n:.1f} GB"
+
+    # ================== NHẬN DỮ LIỆU TỪ SOCKET ==================
     def _send_message(self, message_bytes):
-        """Gửi message với header cố định HEADER_SIZE biểu diễn độ dài payload"""
+        """Gửi payload v1 thô (dùng cho bắt tay HELLO/USERNAME, luôn ở framing v1)"""
+        sock = self.socket
         try:
-            msg_len = f"{len(message_bytes):<{HEADER_SIZE}}".encode('utf-8')
-            # Gửi header + payload
-            self.socket.sendall(msg_len + message_bytes)
+            with self.send_lock:
+                send_frame(sock, encode_frame(message_bytes))
         except Exception:
-            # Nếu lỗi khi gửi, ngắt kết nối an toàn
-            self.disconnect()
+            # Nếu lỗi khi gửi, ngắt kết nối an toàn (trên luồng giao diện)
+            self.inbox.post(self.disconnect, sock)
+
+    def _send(self, kind, receiver, *parts):
+        """
+        Gửi tin nhắn 'kind' tới 'receiver' ("ALL", username hoặc "#phòng"), body gồm các phần 'parts'.
+        Dùng header nhị phân v2 nếu server đã xác nhận, ngược lại dùng v1 "KIND::sender::receiver::".
+        TEXTMSG / FILE / FILECHUNK được nén nếu server đồng ý kiểu nén COMPRESSION (và nén có lợi).
+        """
+        if self.proto >= PROTO_V2:
+            receiver_id = self.user_ids.get(receiver)
+            if receiver_id is None:
+                print(f"Không biết ID của '{receiver}', không gửi được.")
+                return
+            flags = 0
+            if kind in COMPRESSIBLE_KINDS and self.compress & METHODS.get(COMPRESSION, 0):
+                parts, flags = self._compress(kind, parts)
+            frame = encode_parts(PROTO_V2, kind, parts, sender_id=self.user_id, receiver_id=receiver_id,
+                                 flags=flags)
+        else:
+            frame = encode_parts(PROTO_V1, kind, parts, self.username, receiver)
+        sock = self.socket
+        try:
+            with self.send_lock:
+                send_frame(sock, frame)
+        except Exception:
+            # Nếu lỗi khi gửi, ngắt kết nối an toàn. _send chạy cả trên luồng ghi âm, luồng gửi tệp,
+            # luồng nhận: việc ngắt (đụng tới widget) phải chạy trên luồng giao diện
+            self.inbox.post(self.disconnect, sock)
+
+    def _compress(self, kind, parts):
+        """Nén body (phần cuối = dữ liệu người dùng, dùng để nhận biết dữ liệu đã nén sẵn) -> (parts, cờ)"""
+        size = sum(len(part) for part in parts)
+        body, flags = compress(parts, COMPRESSION)
+        if body is None:
+            return parts, 0
+        self.compression_stats.add(kind, len(body), size)
+        if kind == "FILE":
+            print(f"[NÉN] FILE {self._format_size(size)} -> {self._format_size(len(body))} ({COMPRESSION})")
+        return (body,), flags
+
+    def _report_compression(self):
+        """In tổng kích thước trước / sau nén của các tin đã gửi trong kết nối vừa đóng"""
+        for kind, values in sorted(self.compression_stats.snapshot()["kinds"].items()):
+            print(f"[NÉN] {kind}: {values['frames']} tin, {self._format_size(values['original_bytes'])} -> "
+                  f"{self._format_size(values['bytes'])} (x{values['ratio']})")
+        self.compression_stats = CompressionStats()
 
     def _receive_message(self):
-        header = self._recv_all(HEADER_SIZE)
-        if not header:
-            return None
+        """Đọc 1 tin nhắn (v1 hoặc v2, tự nhận biết). Trả về Message hoặc None nếu mất kết nối."""
         try:
-            msg_len = int(header.decode('utf-8').strip())
-        except:
+            # Payload nhận thẳng vào buffer riêng của từng tin (không pool: widget giữ body rất lâu)
+            msg = recv_message(self.socket, self.assembler)
+            # Lát của tin lớn: đọc tiếp cho tới lát cuối (tin khác có thể xen giữa các lát)
+            # Tin nén được giải nén ngay trong SliceJoiner (từng lát khi tới)
+            while msg is not None and msg.version >= PROTO_V2:
+                try:
+                    joined = self.slices.feed(msg)
+                except CompressionError as e:
+                    print(f"⚠️ Bỏ tin nén hỏng: {e}")
+                    joined = None
+                if joined is not None:
+                    msg = joined
+                    break
+                msg = recv_message(self.socket, self.assembler)
+        except ProtocolError as e:
+            print(f"⚠️ Frame không hợp lệ: {e}")
             return None
-        return self._recv_all(msg_len)
+        if msg is not None and msg.version >= PROTO_V2:
+            # v2 chỉ mang ID số: đổi sang tên để phần còn lại của client dùng chung logic
+            msg.sender = self.user_names.get(msg.sender_id, f"#{msg.sender_id}")
+            msg.receiver = self.user_names.get(msg.receiver_id, f"#{msg.receiver_id}")
+        return msg
+
+    def _chat_name(self, sender, receiver):
+        """nếu receiver là ALL -> chat nhóm; là phòng -> tab phòng; nếu receiver là mình -> private tab sender"""
+        return "ALL" if receiver == "ALL" else (sender if receiver == self.username else receiver)
+
+    @staticmethod
+    def _is_group(name):
+        """ALL hoặc phòng: nhiều người nhận (file gửi cho từng người chấp nhận, gọi nhóm)"""
+        return name == "ALL" or is_room(name)
+
+    def _handle_hello(self, msg):
+        """Server xác nhận phiên bản giao thức (và ID của mình) -> chuyển sang gửi v2"""
+        options = parse_options(msg.text())
+        try:
+            proto = int(options.get("proto", PROTO_V1))
+            self.user_id = int(options.get("id", ALL_ID))
+        except ValueError:
+            return
+        self.proto = min(proto, PROTO_LATEST)
+        self.compress = parse_methods(options.get("compress")) if self.proto >= PROTO_V2 else 0
+        # server có lưu lịch sử: tin có seq < history_head là lịch sử, tải trang gần nhất của tab ALL
+        self.history_enabled = "history" in options and self.proto >= PROTO_V2
+        if self.history_enabled:
+            try:
+                self.history_head = int(options["history"])
+            except ValueError:
+                self.history_enabled = False
+                return
+            for chat_name in list(self.private_chats):
+                if chat_name not in self.history_more:  # tab chưa từng tải lịch sử
+                    self._request_history(chat_name)
+
+    # ================== LỊCH SỬ / TIN OFFLINE ==================
+    def _request_history(self, chat_name):
+        """Xin trang lịch sử cũ hơn tin cũ nhất đang hiển thị của 'chat_name' (mỗi tab một yêu cầu một lúc)"""
+        if not self.history_enabled or not self.is_connected or chat_name in self.history_loading \
+                or not self.history_more.get(chat_name, True):
+            return
+        self.history_loading.add(chat_name)
+        before = self.history_before.get(chat_name, self.history_head)
+        options = format_options({"conv": chat_name, "before": before, "limit": HISTORY_PAGE})
+        self._send("HISTORY", "ALL", options.encode('utf-8'))
+
+    def _handle_history(self, msg):
+        """
+        HISTORY (luồng nhận): mode=page là một trang của một tab (chèn lên đầu), mode=offline là
+        các tin riêng gửi tới mình lúc offline (thêm vào cuối các tab tương ứng)
+        """
+        view = memoryview(msg.body)
+        sep = bytes(view[:1024]).find(b"::")
+        if sep < 0:
+            return
+        options = parse_options(bytes(view[:sep]).decode('utf-8', errors='ignore'))
+        mode = options.get("mode", "page")
+        chats = {}  # tab -> [seq cũ nhất, [ChatItem]]
+        voices = {}  # vid -> các đoạn VOICECHUNK
+        for _, _, record in iter_records(view[sep + 2:]):
+            chat_name = self._chat_name(record.sender, record.receiver)
+            content = self._history_content(record, voices)
+            entry = chats.setdefault(chat_name, [record.seq, []])
+            entry[0] = min(entry[0], record.seq)
+            if content is not None:
+                kind, content = content
+                entry[1].append(self._message_item(record.sender, content, kind == "voice", kind == "file",
+                                                   timestamp=record.ts))
+        if mode == "page":
+            conv = options.get("conv", "ALL")
+            oldest, items = chats.get(conv, [None, []])
+            self.inbox.post(self._show_history, conv, items, oldest, options.get("more") == "1", True)
+        else:
+            for chat_name, (oldest, items) in chats.items():
+                self.inbox.post(self._show_history, chat_name, items, oldest, True, False)
+
+    def _history_content(self, record, voices):
+        """Bản ghi lịch sử -> ("text" / "voice" / "file", content của add_message_widget), None nếu bỏ qua"""
+        if record.flags & COMPRESSION_FLAGS:
+            # server lưu nguyên tin nén như khi nhận
+            try:
+                record.body = inflate(record.body, record.flags)
+            except CompressionError as e:
+                print(f"⚠️ Bỏ bản ghi lịch sử nén hỏng #{record.seq}: {e}")
+                return None
+        if record.kind == "TEXTMSG":
+            return "text", str(record.body, 'utf-8', errors='ignore')
+        if record.kind == "VOICEMSG":
+            return "voice", (self.attachments.put(record.body), voice_duration(record.body, SAMPLE_RATE, CHANNELS))
+        if record.kind == "FILE":
+            parts = split_file_body(record.body)
+            return ("file", (parts[0], self.attachments.put(parts[1]))) if parts else None
+        if record.kind == "VOICECHUNK":
+            # ghép các đoạn của một tin nhắn thoại, hiển thị ở vị trí đoạn cuối
+            chunk = parse_voice_chunk(record.body)
+            if chunk is None:
+                return None
+            vid, seq, final, body = chunk
+            bodies = voices.setdefault(vid, [])
+            if seq != len(bodies):
+                voices.pop(vid)  # thiếu đoạn đầu (nằm ở trang trước) hoặc lệch thứ tự
+                return None
+            bodies.append(bytes(body))
+            if not final:
+                return None
+            audio_bytes = join_voice(voices.pop(vid))
+            return "voice", (self.attachments.put(audio_bytes), voice_duration(audio_bytes, SAMPLE_RATE, CHANNELS))
+        return None
+
+    def _show_history(self, chat_name, items, oldest, more, prepend):
+        """(Luồng giao diện) đưa các tin lịch sử vào tab 'chat_name'"""
+        if oldest is not None:
+            self.history_before[chat_name] = min(oldest, self.history_before.get(chat_name, self.history_head))
+        self.history_more[chat_name] = more
+        self.history_loading.discard(chat_name)
+        view = self._chat_view(chat_name)
+        if prepend:
+            view.prepend(items)
+        else:
+            for item in items:
+                view.append(item)
+
+    def _parse_user_list(self, msg):
+        """USERLIST v1: "a,b,c"; v2: "id:a,id:b" (cập nhật bảng ID <-> tên)"""
+        entries = [e for e in msg.text().split(',') if e]
+        if msg.version < PROTO_V2:
+            return entries
+        users = []
+        for entry in entries:
+            user_id, _, name = entry.partition(":")
+            try:
+                user_id = int(user_id)
+            except ValueError:
+                continue
+            self.user_ids[name] = user_id
+            self.user_names[user_id] = name
+            users.append(name)
+        return users
+
+    def _handle_presence(self, msg):
+        """PRESENCE snapshot (thay cả danh sách) / delta (chỉ người vào / ra), xem presence.py"""
+        parsed = parse_presence(msg.body)
+        if parsed is None:
+            return
+        kind, version, joined, left = parsed
+        if kind != SNAPSHOT:
+            if version <= self.presence_version:
+                return  # delta cũ hơn snapshot đã có
+            if version != self.presence_version + 1:
+                # mất delta ở giữa: xin lại snapshot
+                self._send("PRESENCE", "ALL")
+                return
+        self.presence_version = version
+        for user_id, name in joined:
+            self.user_ids[name] = user_id
+            self.user_names[user_id] = name
+        joined_names = [name for _, name in joined]
+        left_names = [name for _, name in left]
+        if kind == SNAPSHOT:
+            self._set_online(set(joined_names), set(joined_names) - self.online_users)
+            self.inbox.post(self.update_user_list_display, joined_names)
+        else:
+            self._set_online((self.online_users | set(joined_names)) - set(left_names), set(joined_names))
+            self.inbox.post(self.apply_user_list_delta, joined_names, left_names)
+
+    def _set_online(self, users, joined):
+        """Cập nhật tập user online (luồng nhận): tiếp tục gửi file dở cho người vừa vào lại,
+        chốt tin nhắn thoại đang nhận của người đã rời đi"""
+        self.online_users = users
+        if joined:
+            self._resume_transfers(joined)
+        for voice in list(self.incoming_voices.values()):
+            if voice.sender not in self.online_users:
+                self._finish_incoming_voice(voice)
 
     def receive_data(self):
         """Luồng nhận dữ liệu: xử lý USERLIST, TEXTMSG, VOICEMSG, FILE"""
         while self.is_connected:
             try:
                 data = self._receive_message()
-                if not data:
+                if data is None:
                     print("🔌 Mất kết nối với server.")
                     break
 
                 # --- xử lý các loại tin nhắn ---
-                if data.startswith(b"USERLIST::"):
-                    text = data.decode('utf-8', errors='ignore')
-                    users = text.split("::", 1)[1].split(',') if "::" in text else []
-                    self.after(0, lambda u=users: self.update_user_list_display(u))
-
-                elif data.startswith(b"TEXTMSG::"):
-                    parts = data.split(b"::", 3)
-                    if len(parts) == 4:
-                        sender = parts[1].decode(errors='ignore')
-                        receiver = parts[2].decode(errors='ignore')
-                        msg = parts[3].decode(errors='ignore')
-                        # nếu receiver là ALL -> chat nhóm; nếu receiver là mình -> private tab sender
-                        chat_name = "ALL" if receiver == "ALL" else (sender if receiver == self.username else receiver)
-                        self.after(0, lambda s=sender, m=msg, c=chat_name: self.add_message_widget(s, m, c))
-                        if receiver == self.username and chat_name not in self.private_chats:
-                            self.after(0, lambda: self._ensure_chat_tab(sender))
-
-                elif data.startswith(b"VOICEMSG::"):
-                    parts = data.split(b"::", 3)
-                    if len(parts) == 4:
-                        sender = parts[1].decode(errors='ignore')
-                        receiver = parts[2].decode(errors='ignore')
-                        audio_bytes = parts[3]
-                        # duration tính từ số bytes
-                        duration = len(audio_bytes) / (SAMPLE_RATE * np.dtype(DTYPE).itemsize * CHANNELS)
-                        chat_name = "ALL" if receiver == "ALL" else (sender if receiver == self.username else receiver)
-                        content = (audio_bytes, duration)
-                        self.after(0, lambda s=sender, c=content, cn=chat_name: self.add_message_widget(s, c, cn, True))
-                        if receiver == self.username and chat_name not in self.private_chats:
-                            self.after(0, lambda: self._ensure_chat_tab(sender))
-
-                elif data.startswith(b"FILE::"):
-                    # Định dạng payload: FILE::sender::receiver::filename::file_bytes
-                    # Lưu ý: đơn giản hóa - không hỗ trợ filename chứa "::"
-                    parts = data.split(b"::", 4)
-                    if len(parts) == 5:
-                        sender = parts[1].decode(errors='ignore')
-                        receiver = parts[2].decode(errors='ignore')
-                        filename = parts[3].decode(errors='ignore')
-                        file_bytes = parts[4]
-                        chat_name = "ALL" if receiver == "ALL" else (sender if receiver == self.username else receiver)
-                        content = (filename, file_bytes)
-                        self.after(0, lambda s=sender, c=content, cn=chat_name: self.add_message_widget(s, c, cn, False, True))
-                        if receiver == self.username and chat_name not in self.private_chats:
-                            self.after(0, lambda: self._ensure_chat_tab(sender))
+                if data.kind == "HELLO":
+                    self._handle_hello(data)
+
+                elif data.kind == "USERLIST":
+                    # server cũ / client v1: cả danh sách mỗi lần thay đổi
+                    users = self._parse_user_list(data)
+                    joined = set(users) - self.online_users
+                    self._set_online(set(users), joined)
+                    self.inbox.post(self.update_user_list_display, users)
+
+                elif data.kind == "PRESENCE":
+                    self._handle_presence(data)
+
+                elif data.kind == "HISTORY":
+                    self._handle_history(data)
+
+                elif data.kind == "ROOM":
+                    self._handle_room(data)
+
+                elif data.kind in FILE_STREAM_KINDS and data.receiver is not None:
+                    self._handle_file_stream(data)
+
+                elif data.kind in CALL_KINDS and data.receiver is not None:
+                    self._handle_call_signal(data)
+
+                elif data.kind == "TEXTMSG" and data.receiver is not None:
+                    sender, receiver = data.sender, data.receiver
+                    msg = data.text()
+                    chat_name = self._chat_name(sender, receiver)
+                    self.inbox.post(self.add_message_widget, sender, msg, chat_name)
+
+                elif data.kind == "VOICEMSG" and data.receiver is not None:
+                    sender, receiver = data.sender, data.receiver
+                    audio_bytes = data.body
+                    # duration lấy từ sub-header codec (tin cũ không có: tính từ số bytes PCM)
+                    duration = voice_duration(audio_bytes, SAMPLE_RATE, CHANNELS)
+                    chat_name = self._chat_name(sender, receiver)
+                    content = (self.attachments.put(audio_bytes), duration)
+                    self.inbox.post(self.add_message_widget, sender, content, chat_name, True)
+
+                elif data.kind == "VOICECHUNK" and data.receiver is not None:
+                    self._handle_voice_chunk(data)
+
+                elif data.kind == "FILE" and data.receiver is not None:
+                    # Định dạng body: filename::file_bytes (tên file không chứa "::")
+                    parts = split_file_body(data.body)
+                    if parts:
+                        sender, receiver = data.sender, data.receiver
+                        filename, file_bytes = parts
+                        chat_name = self._chat_name(sender, receiver)
+                        content = (filename, self.attachments.put(file_bytes))
+                        self.inbox.post(self.add_message_widget, sender, content, chat_name, False, True)
 
                 else:
                     # Không rõ định dạng - in debug
-                    text = data.decode(errors='ignore')
-                    print("Unknown payload:", text[:200])
+                    print("Unknown payload:", data)
 
             except OSError as e:
                 print(f"⚠️ Socket đã đóng hoặc bị lỗi: {e}")
@@ -371,69 +873,333 @@ class VoiceChatClient(ctk.CTk):
         print("🛑 Dừng luồng nhận dữ liệu.")
         self.is_connected = False
         # cập nhật giao diện khi bị ngắt
-        self.after(0, lambda: self.update_status("Đã ngắt kết nối", "gray"))
+        self.inbox.post(self.update_status, "Đã ngắt kết nối", "gray")
 
     # ================== AUDIO ==================
-    def play_voice_message(self, audio_data):
-        threading.Thread(target=self._play_audio_thread, args=(audio_data,), daemon=True).start()
-
-    def _play_audio_thread(self, audio_data):
-        arr = np.frombuffer(audio_data, dtype=DTYPE)
-        # nếu mono recorded dạng (n,1), flatten về (n,)
-        if arr.ndim > 1 and arr.shape[1] == 1:
-            arr = arr.reshape(-1)
-        sd.play(arr, samplerate=SAMPLE_RATE)
+    def play_voice_message(self, attachment):
+        threading.Thread(target=self._play_audio_thread, args=(attachment,), daemon=True).start()
+
+    def _play_audio_thread(self, attachment):
+        # đọc payload bằng mmap từ cache, giải mã theo codec ghi trong payload,
+        # đổi về tần số thiết bị (nhiều card không phát được 16 kHz)
+        try:
+            with self.attachments.open(attachment) as audio_data:
+                arr, rate = decode_voice(audio_data, output_rate=SAMPLE_RATE, default_rate=SAMPLE_RATE)
+        except AttachmentMissing:
+            self.after(0, lambda: messagebox.showerror("Tin nhắn thoại", "Tin nhắn đã bị xóa khỏi bộ nhớ đệm."))
+            return
+        sd.play(arr, samplerate=rate)
         sd.wait()
+
+    def play_live_voice(self, vid):
+        voice = self.incoming_voices.get(vid)
+        if voice is not None:
+            threading.Thread(target=self._play_live_voice_thread, args=(voice,), daemon=True).start()
+
+    def _play_live_voice_thread(self, voice):
+        """Phát tin nhắn thoại đang tới: phát từng đoạn ngay khi có, chờ đoạn kế tiếp tới khi hết"""
+        resampler = None
+        try:
+            with sd.OutputStream(samplerate=SAMPLE_RATE, channels=CHANNELS, dtype=DTYPE) as stream:
+                index = 0
+                while True:
+                    body = voice.wait_chunk(index)
+                    if body is None:
+                        break
+                    index += 1
+                    samples, rate = decode_voice(body, default_rate=SAMPLE_RATE)
+                    # đổi tần số liên tục qua các đoạn (không có tiếng tách ở biên đoạn)
+                    resampler = resampler or StreamResampler(rate, SAMPLE_RATE, chunk_seconds=0.1)
+                    for out in resampler.push(samples):
+                        stream.write(out.reshape(-1, 1))
+                if resampler is not None:
+                    stream.write(resampler.flush().reshape(-1, 1))
+        except Exception as e:
+            print("Playback error:", e)
+
+    def _handle_voice_chunk(self, data):
+        """VOICECHUNK (luồng nhận): đoạn đầu tạo bong bóng nghe trực tiếp, đoạn cuối ghép thành một tin"""
+        chunk = parse_voice_chunk(data.body)
+        if chunk is None:
+            return
+        vid, seq, final, body = chunk
+        voice = self.incoming_voices.get(vid)
+        if voice is None:
+            if seq != 0:
+                return  # đoạn lạc của tin nhắn đã xong / bị bỏ
+            sender, receiver = data.sender, data.receiver
+            chat_name = self._chat_name(sender, receiver)
+            voice = self.incoming_voices[vid] = IncomingVoice(vid, sender, chat_name)
+            self.inbox.post(self.add_message_widget, sender, (vid, 0.0), chat_name, True)
+        if voice.add(seq, body, final):
+            self._finish_incoming_voice(voice)
+
+    def _finish_incoming_voice(self, voice):
+        """Đã đủ đoạn (hoặc người gửi rời đi): bong bóng trở thành tin nhắn thoại bình thường phát lại được"""
+        voice.finish()
+        self.incoming_voices.pop(voice.vid, None)
+        if not voice.bodies:
+            return
+        audio_bytes = join_voice(voice.bodies)
+        duration = voice_duration(audio_bytes, SAMPLE_RATE, CHANNELS)
+        attachment = self.attachments.put(audio_bytes)
+        self.inbox.post(self._finish_voice_widget, voice.vid, attachment, duration)
+
+    def _finish_voice_widget(self, vid, attachment, duration):
+        widgets = self.voice_items.pop(vid, None)
+        if widgets is not None:
+            view, item = widgets
+            view.update_item(item, buttons=[(f"▶ ({duration:.1f}s)", lambda: self.play_voice_message(attachment))])
+
     # ================== GHI ÂM ==================
     def toggle_recording(self):
-        """Bắt đầu / dừng ghi âm"""
+        """Bắt đầu / dừng ghi âm (các đoạn được gửi dần ngay trong lúc ghi)"""
         if self.is_recording:
-            # dừng ghi
+            # dừng ghi: luồng ghi âm gửi nốt đoạn cuối rồi hiển thị tin nhắn
             self.is_recording = False
             self.record_button.configure(text="🎤", fg_color="#3B8ED0")
-            if self.recorded_frames:
-                # nối các frame lại thành 1 mảng numpy
-                audio_np = np.concatenate(self.recorded_frames, axis=0).astype(DTYPE)
-                # flatten nếu (n,1)
-                if audio_np.ndim > 1 and audio_np.shape[1] == 1:
-                    audio_flat = audio_np.reshape(-1)
-                else:
-                    audio_flat = audio_np
-                receiver_tab = self.chat_tabs.get()
-                receiver = "ALL" if receiver_tab.startswith("ALL") else receiver_tab
-                audio_bytes = audio_flat.tobytes()
-                payload = b"VOICEMSG::" + self.username.encode('utf-8') + b"::" + receiver.encode('utf-8') + b"::" + audio_bytes
-                # send voice payload
-                self._send_message(payload)
-
-                # Hiển thị local CHỈ khi là private (tránh trùng ở group)
-                duration = len(audio_bytes) / (SAMPLE_RATE * np.dtype(DTYPE).itemsize * CHANNELS)
-                self.add_message_widget(self.username, (audio_bytes, duration), chat_name=receiver, is_voice=True)
-                # if receiver != "ALL":
-                #     self.add_message_widget(self.username, (audio_bytes, duration), chat_name=receiver, is_voice=True)
-
-                self.recorded_frames.clear()
         else:
             # bắt đầu ghi
+            receiver_tab = self.chat_tabs.get()
+            receiver = "ALL" if receiver_tab.startswith("ALL") else receiver_tab
             self.is_recording = True
             self.record_button.configure(text="■", fg_color="red")
-            self.recorded_frames.clear()
-            threading.Thread(target=self._record_audio_thread, daemon=True).start()
+            threading.Thread(target=self._record_audio_thread, args=(receiver,), daemon=True).start()
+
+    def _record_audio_thread(self, receiver):
+        """
+        Ghi âm và gửi dần: callback của sounddevice chép mẫu vào ring buffer (recorder.py), luồng này
+        lấy ra (view, không sao chép) và cứ đủ ~0.5 s là mã hóa (VOICE_CODEC) rồi gửi một VOICECHUNK,
+        người nhận nghe được trước khi ghi xong. Dừng ghi (hoặc quá MAX_RECORD_SECONDS): gửi đoạn cuối
+        (final) và hiển thị tin nhắn của mình là một bong bóng duy nhất.
+        Nếu bật VOICE_VAD, khoảng lặng đầu / cuối và khoảng ngừng dài bị cắt trước khi mã hóa.
+        """
+        vid = new_voice_id()
+        encoder = VoiceStreamEncoder(SAMPLE_RATE, VOICE_CODEC, CHANNELS)
+        recorder = RingRecorder(SAMPLE_RATE, CHANNELS, MAX_RECORD_SECONDS, DTYPE)
+        trimmer = SilenceTrimmer(SAMPLE_RATE, CHANNELS, **VOICE_VAD) if VOICE_VAD is not None else None
+        bodies = []
+
+        def send_chunk(body, final=False):
+            self._send("VOICECHUNK", receiver, *voice_chunk_parts(vid, len(bodies), final, body))
+            bodies.append(body)
+
+        def encode(block):
+            for piece in trimmer.push(block) if trimmer is not None else (block,):
+                for body in encoder.push(piece):
+                    send_chunk(body)
 
-    def _record_audio_thread(self):
         try:
-            with sd.InputStream(samplerate=SAMPLE_RATE, channels=CHANNELS, dtype=DTYPE, blocksize=CHUNK) as stream:
-                while self.is_recording:
-                    data, _ = stream.read(CHUNK)
-                    arr = np.asarray(data, dtype=DTYPE)
-                    # normalize shape to (n,1) for mono, to keep consistent
-                    if CHANNELS == 1 and arr.ndim == 1:
-                        arr = arr.reshape(-1, 1)
-                    self.recorded_frames.append(arr)
+            recorder.start(blocksize=CHUNK)
+            while True:
+                recording = self.is_recording and not recorder.limit_reached
+                if recording:
+                    recorder.wait(timeout=0.1)
+                else:
+                    recorder.stop()
+                block = recorder.peek()
+                while len(block):
+                    encode(block)
+                    recorder.consume(len(block))
+                    block = recorder.peek()
+                if not recording:
+                    break
         except Exception as e:
             print("Recording error:", e)
+            recorder.stop()
+        if self.is_recording:
+            # lỗi thiết bị hoặc đã ghi tới giới hạn: tự dừng
             self.is_recording = False
-            self.after(0, lambda: self.record_button.configure(text="🎤", fg_color=("#3B8ED0")))
+            self.inbox.post(lambda: self.record_button.configure(text="🎤", fg_color=("#3B8ED0")))
+        if recorder.limit_reached:
+            self.inbox.post(self.update_status, f"Đã đạt thời lượng ghi tối đa ({MAX_RECORD_SECONDS}s)", "orange")
+        if recorder.overruns:
+            print(f"⚠️ Ghi âm bị tràn {recorder.overruns} lần (mất mẫu ở thiết bị)")
+        if trimmer is not None:
+            for piece in trimmer.flush():
+                for body in encoder.push(piece):
+                    send_chunk(body)
+        last = encoder.flush()
+        if not self.is_connected or (not bodies and voice_duration(last) == 0):
+            if trimmer is not None and trimmer.input_frames:
+                print("[VAD] Không phát hiện tiếng nói, tin nhắn thoại không được gửi.")
+            return
+        send_chunk(last, final=True)
+        if trimmer is not None:
+            self._report_trimmed(trimmer, bodies)
+        audio_bytes = join_voice(bodies)
+        duration = voice_duration(audio_bytes, SAMPLE_RATE, CHANNELS)
+        content = (self.attachments.put(audio_bytes), duration)
+        self.inbox.post(self.add_message_widget, self.username, content, receiver, True)
+
+    def _report_trimmed(self, trimmer, bodies):
+        """In số giây im lặng đã cắt và số byte tiết kiệm được (ước lượng theo tỉ lệ mẫu, codec có bitrate cố định)"""
+        sent = sum(len(body) for body in bodies)
+        if not trimmer.removed_seconds or not trimmer.output_frames:
+            return
+        saved = int(sent * (trimmer.input_frames / trimmer.output_frames - 1))
+        print(f"[VAD] {trimmer.input_frames / SAMPLE_RATE:.1f}s -> {trimmer.output_frames / SAMPLE_RATE:.1f}s, "
+              f"bỏ {trimmer.removed_seconds:.1f}s im lặng, tiết kiệm ~{self._format_size(saved)} "
+              f"(đã gửi {self._format_size(sent)})")
+
+    # ================== GỌI TRỰC TIẾP (UDP) ==================
+    def toggle_call(self):
+        """Gọi người / nhóm ở tab hiện tại, hoặc kết thúc cuộc gọi đang diễn ra"""
+        if self.call is not None:
+            self.end_call()
+            return
+        current_tab = self.chat_tabs.get()
+        target = "ALL" if current_tab.startswith("ALL") else current_tab
+        self._open_call(new_call_id(), target)
+        self._send("CALLINVITE", target, self._call_signal())
+        self.update_status(f"Đang gọi {target}...", "green")
+
+    def _call_signal(self):
+        """body báo hiệu: call_id + địa chỉ UDP của mình (IP của card mạng đang nối tới server)"""
+        return encode_signal(self.call.call_id, self.socket.getsockname()[0], self.call.port)
+
+    def _open_call(self, call_id, target):
+        simulator = NetworkSimulator(**CALL_SIMULATION) if CALL_SIMULATION else None
+        self.call = CallSession(call_id, simulator=simulator)
+        self.call_target = target
+        self._start_call_audio(self.call)
+        self.call_button.configure(text="■📞", fg_color="red")
+
+    def _start_call_audio(self, session):
+        """Ghi / phát theo khung 20 ms: callback ghi gửi từng khung, callback phát lấy khung từ jitter buffer"""
+        def on_input(indata, frames, time_info, status):
+            session.send_frame(indata[:, 0])
+
+        def on_output(outdata, frames, time_info, status):
+            frame = session.mix_frame()
+            if frames != len(frame):
+                frame = np.resize(frame, frames)
+            outdata[:, 0] = frame
+
+        try:
+            self.call_streams = [
+                sd.InputStream(samplerate=CALL_RATE, channels=1, dtype=DTYPE, blocksize=FRAME_SAMPLES, callback=on_input),
+                sd.OutputStream(samplerate=CALL_RATE, channels=1, dtype=DTYPE, blocksize=FRAME_SAMPLES, callback=on_output),
+            ]
+            for stream in self.call_streams:
+                stream.start()
+        except Exception as e:
+            print("Call audio error:", e)
+
+    def end_call(self, notify=True):
+        if self.call is None:
+            return
+        if notify and self.is_connected:
+            self._send("CALLEND", self.call_target, self._call_signal())
+        for stream in self.call_streams:
+            try:
+                stream.stop()
+                stream.close()
+            except Exception:
+                pass
+        self.call_streams = []
+        print("Call stats:", self.call.stats())
+        self.call.close()
+        self.call = None
+        self.call_target = None
+        self.call_button.configure(text="📞", fg_color="#3B8ED0")
+        self.update_status("Đã kết thúc cuộc gọi", "gray")
+
+    def _handle_call_signal(self, data):
+        """CALLINVITE / CALLACCEPT / CALLEND (luồng nhận)"""
+        signal = parse_signal(data.body)
+        if signal is None:
+            return
+        call_id, addr = signal
+        sender, receiver = data.sender, data.receiver
+        if data.kind == "CALLINVITE":
+            if self.call is None:
+                # hộp thoại modal: đi thẳng qua after, không chặn việc rút hộp thư
+                self.after(0, lambda: self._prompt_call(sender, receiver, call_id, addr))
+            return
+        if self.call is None or self.call.call_id != call_id:
+            return
+        if data.kind == "CALLACCEPT":
+            self.call.add_peer(addr)
+            if self._is_group(receiver):
+                # Người mới vào cuộc gọi nhóm thông báo cho cả nhóm: trả lời riêng địa chỉ của mình
+                self._send("CALLACCEPT", sender, self._call_signal())
+            self.inbox.post(self.update_status, f"{sender} đã vào cuộc gọi", "green")
+        elif data.kind == "CALLEND":
+            self.call.remove_peer(addr)
+            if not self._is_group(self.call_target):
+                self.inbox.post(self.end_call, False)
+            else:
+                self.inbox.post(self.update_status, f"{sender} đã rời cuộc gọi", "gray")
+
+    def _prompt_call(self, sender, receiver, call_id, addr):
+        """(Luồng giao diện) hỏi có nhận cuộc gọi không"""
+        target = receiver if self._is_group(receiver) else sender
+        where = "nhóm" if receiver == "ALL" else (f"phòng {receiver}" if is_room(receiver) else "riêng")
+        if self.call is not None or not messagebox.askyesno("Cuộc gọi", f"{sender} đang gọi ({where}). Nghe máy?"):
+            return
+        self._open_call(call_id, target)
+        self.call.add_peer(addr)
+        # Gọi nhóm: báo cho cả nhóm để mọi người đang trong cuộc gọi gửi tiếng cho mình
+        self._send("CALLACCEPT", target, self._call_signal())
+        self.update_status(f"Đang gọi với {target}", "green")
+
+    # ================== PHÒNG CHAT ==================
+    def join_room(self, event=None):
+        """Vào phòng có tên (tab của phòng được mở khi server xác nhận bằng ROOM)"""
+        name = self.room_entry.get().strip()
+        if not name or not self.is_connected:
+            return
+        room = name if is_room(name) else ROOM_PREFIX + name
+        if not valid_room(room):
+            messagebox.showwarning("Tên phòng", "Tên phòng không được chứa khoảng trắng hoặc các ký tự : ; , =")
+            return
+        self.rooms_joining.add(room)
+        self._send("JOIN", "ALL", room.encode('utf-8'))
+        self.room_entry.delete(0, "end")
+
+    def leave_room(self):
+        """Rời phòng của tab đang mở và đóng tab đó"""
+        room = self.chat_tabs.get()
+        if not is_room(room):
+            return
+        if self.is_connected:
+            self._send("LEAVE", "ALL", room.encode('utf-8'))
+        self.room_members.pop(room, None)
+        self.rooms_joining.discard(room)
+        view = self.private_chats.pop(room, None)
+        if view is not None:
+            view.destroy()
+        self.history_before.pop(room, None)
+        self.history_more.pop(room, None)
+        self.history_loading.discard(room)
+        self.chat_tabs.delete(room)
+        self.chat_tabs.set("ALL (Nhóm)")
+        self.current_chat = "ALL"
+
+    def _handle_room(self, msg):
+        """ROOM (luồng nhận): ID của phòng (giao thức v2) và danh sách thành viên mới -> dòng thông báo trong tab"""
+        options = parse_options(msg.text())
+        room = options.get("room", "")
+        if room not in self.room_members and room not in self.rooms_joining:
+            return  # phòng vừa rời (ROOM đến trễ)
+        try:
+            room_id = int(options.get("id", ""))
+        except ValueError:
+            return
+        self.user_ids[room] = room_id
+        self.user_names[room_id] = room
+        self.rooms_joining.discard(room)
+        members = [m for m in options.get("members", "").split(",") if m]
+        previous = self.room_members.get(room)
+        self.room_members[room] = members
+        if previous is None:
+            note = f"Thành viên: {', '.join(members)}"
+        else:
+            note = "; ".join([f"{m} đã vào phòng" for m in members if m not in previous] +
+                             [f"{m} đã rời phòng" for m in previous if m not in members])
+        if note:
+            self.inbox.post(self.add_message_widget, "🔔", note, room)
 
     # ================== KẾT NỐI / NGẮT KẾT NỐI ==================
     def toggle_connection(self):
@@ -451,22 +1217,58 @@ class VoiceChatClient(ctk.CTk):
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((host, 12345))
+            self.assembler = FrameAssembler()
+            self.slices = SliceJoiner(inflate=True)
             self.is_connected = True
-            # gửi USERNAME để server biết
+            # đề nghị giao thức mới nhất (server cũ sẽ bỏ qua), rồi gửi USERNAME để server biết
+            self.proto = PROTO_V1
+            self.compress = 0
+            hello = f"HELLO::proto={PROTO_LATEST};history=1;slices=1;compress={format_methods(ALL_METHODS)}"
+            self._send_message(hello.encode())
             self._send_message(f"USERNAME::{self.username}".encode())
+            # vào lại các phòng còn mở tab (server quên thành viên của kết nối cũ)
+            for room in self.private_chats:
+                if is_room(room):
+                    self.rooms_joining.add(room)
+                    self._send_message(f"JOIN::{room}".encode('utf-8'))
             self.update_status(f"Đã kết nối tới {host}", "green")
             self.connect_button.configure(text="Ngắt kết nối")
             self.message_entry.configure(state="normal")
             self.send_button.configure(state="normal")
             self.record_button.configure(state="normal")
+            self.call_button.configure(state="normal")
             self.send_file_button.configure(state="normal")  # kích hoạt nút gửi file
+            for widget in (self.room_entry, self.join_room_button, self.leave_room_button):
+                widget.configure(state="normal")
             # bắt đầu luồng nhận
             threading.Thread(target=self.receive_data, daemon=True).start()
         except Exception as e:
             self.update_status(f"Lỗi: {e}", "red")
 
-    def disconnect(self):
+    def disconnect(self, sock=None):
+        """
+        (Luồng giao diện) đóng kết nối và khóa các nút. Gọi nhiều lần được: nhiều luồng có thể cùng
+        gặp lỗi gửi trên 'sock'; bỏ qua nếu socket đã đóng hoặc 'sock' là kết nối cũ (đã kết nối lại).
+        """
+        if sock is not None and sock is not self.socket:
+            return
+        if self.socket is not None and self.socket.fileno() < 0:
+            return
+        if self.call is not None:
+            self.end_call()
         self.is_connected = False
+        self.online_users = set()
+        self.presence_version = 0
+        self.room_members.clear()
+        self.rooms_joining.clear()
+        self.history_loading.clear()
+        # file đang nhận dở giữ lại .part, kết nối lại sẽ tiếp tục từ đó
+        for transfer in self.incoming_transfers.values():
+            transfer.close()
+        self.incoming_transfers.clear()
+        for voice in list(self.incoming_voices.values()):
+            self._finish_incoming_voice(voice)
+        self._report_compression()
         try:
             if self.socket:
                 try:
@@ -482,42 +1284,64 @@ class VoiceChatClient(ctk.CTk):
             self.message_entry.configure(state="disabled")
             self.send_button.configure(state="disabled")
             self.record_button.configure(state="disabled")
+            self.call_button.configure(state="disabled")
             self.send_file_button.configure(state="disabled")
+            for widget in (self.room_entry, self.join_room_button, self.leave_room_button):
+                widget.configure(state="disabled")
             print("✅ Socket đã được đóng hoàn toàn.\n")
 
     # ================== HELPER: SAVE & OPEN FILE NHẬN ĐƯỢC ==================
-    def save_received_file(self, filename, file_bytes):
-        """Mở hộp thoại lưu file cho file nhận được"""
+    def save_received_file(self, filename, attachment):
+        """Mở hộp thoại lưu file cho file nhận được (chép từ cache tệp đính kèm)"""
+        try:
+            save_path = filedialog.asksaveasfilename(initialfile=filename, title="Lưu tệp", defaultextension=os.path.splitext(filename)[1])
+            if not save_path:
+                return
+            self.attachments.save_to(attachment, save_path)
+            messagebox.showinfo("Lưu tệp", f"Đã lưu: {save_path}")
+        except AttachmentMissing:
+            messagebox.showerror("Lỗi lưu tệp", "Tệp đã bị xóa khỏi bộ nhớ đệm.")
+        except Exception as e:
+            messagebox.showerror("Lỗi lưu tệp", str(e))
+
+    def save_received_path(self, filename, path):
+        """Như save_received_file nhưng sao chép từ file trên đĩa (tệp nhận dạng luồng)"""
         try:
             save_path = filedialog.asksaveasfilename(initialfile=filename, title="Lưu tệp", defaultextension=os.path.splitext(filename)[1])
             if not save_path:
                 return
-            with open(save_path, "wb") as f:
-                f.write(file_bytes)
+            shutil.copyfile(path, save_path)
             messagebox.showinfo("Lưu tệp", f"Đã lưu: {save_path}")
         except Exception as e:
             messagebox.showerror("Lỗi lưu tệp", str(e))
 
-    def open_received_file(self, filename, file_bytes):
+    def open_received_file(self, filename, attachment):
         """
-        Lưu tạm file vào thư mục temp rồi mở bằng chương trình mặc định của hệ điều hành.
+        Lưu tạm file vào thư mục temp (giữ phần mở rộng) rồi mở bằng chương trình mặc định của hệ điều hành.
         Hành vi khác nhau trên Windows/Linux/Mac được xử lý.
         """
         try:
             # tạo file tạm
             suffix = os.path.splitext(filename)[1]
             with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-                tmp.write(file_bytes)
                 tmp_path = tmp.name
+            self.attachments.save_to(attachment, tmp_path)
+            self._open_path(tmp_path)
+        except AttachmentMissing:
+            messagebox.showerror("Lỗi mở tệp", "Tệp đã bị xóa khỏi bộ nhớ đệm.")
+        except Exception as e:
+            messagebox.showerror("Lỗi mở tệp", str(e))
 
-            # mở file tuỳ OS
+    def _open_path(self, path):
+        """Mở file bằng chương trình mặc định, tuỳ OS"""
+        try:
             if sys.platform.startswith("win"):
-                os.startfile(tmp_path)
+                os.startfile(path)
             elif sys.platform.startswith("darwin"):
-                subprocess.call(["open", tmp_path])
+                subprocess.call(["open", path])
             else:
                 # Linux / *nix
-                subprocess.call(["xdg-open", tmp_path])
+                subprocess.call(["xdg-open", path])
         except Exception as e:
             messagebox.showerror("Lỗi mở tệp", str(e))
 
@@ -526,18 +1350,23 @@ class VoiceChatClient(ctk.CTk):
         self.status_label.configure(text=f"Trạng thái: {text}", text_color=color)
 
     def update_user_list_display(self, users):
-        # xóa widgets cũ
-        for w in self.user_widgets:
-            w.destroy()
-        self.user_widgets.clear()
-        # lọc bỏ tên mình và rỗng
-        users = [u for u in users if u and u != self.username]
-        self.user_list_label.configure(text=f"Đang hoạt động ({len(users)}):")
-        for u in users:
-            b = ctk.CTkButton(self.user_list_frame, text=f"👤 {u}",
-                               command=lambda name=u: self._ensure_chat_tab(name))
-            b.pack(fill="x", pady=2, padx=5)
-            self.user_widgets.append(b)
+        """Đồng bộ với cả danh sách 'users' (snapshot / USERLIST), chỉ đụng tới các dòng thay đổi"""
+        wanted = set(users)
+        self.apply_user_list_delta(users, [u for u in self.user_widgets if u not in wanted])
+
+    def apply_user_list_delta(self, joined, left):
+        """Xóa dòng của người đã rời, thêm dòng cho người mới vào (bỏ qua tên mình và rỗng)"""
+        for u in left:
+            w = self.user_widgets.pop(u, None)
+            if w is not None:
+                w.destroy()
+        for u in joined:
+            if u and u != self.username and u not in self.user_widgets:
+                b = ctk.CTkButton(self.user_list_frame, text=f"👤 {u}",
+                                   command=lambda name=u: self._ensure_chat_tab(name))
+                b.pack(fill="x", pady=2, padx=5)
+                self.user_widgets[u] = b
+        self.user_list_label.configure(text=f"Đang hoạt động ({len(self.user_widgets)}):")
 
     def on_closing(self):
         self.disconnect()
@@ -0,0 +1,231 @@
+import socket
+import threading
+import time
+
+import outbound
+from bus import BUS_QUEUE_BYTES, _writer, control
+from protocol import BufferPool, FrameAssembler, ProtocolError, recv_message, send_frame
+
+# === CỤM NHIỀU NODE SERVER (--cluster-port / --peers) ===
+#
+# Mỗi node là một server.py độc lập (client nối vào node nào cũng được). Các node nối với nhau thành
+# lưới đầy đủ bằng TCP: node mở --cluster-port để nhận, và chủ động nối tới các địa chỉ trong --peers
+# (tự nối lại khi mất kết nối). Một cặp node chỉ cần MỘT bên liệt kê bên kia; nếu cả hai cùng nối,
+# cả hai giữ lại kết nối do node có ID nhỏ hơn mở, kết nối còn lại bị đóng.
+#
+# Trên một kết nối giữa hai node (framing v1, như bus.py):
+#   NODE::<id>                          mở đầu, hai chiều
+#   ONLINE::<ten> / OFFLINE::<ten>      tên vừa có kết nối đầu tiên / vừa hết kết nối ở node gửi
+#                                       (ngay sau NODE là toàn bộ danh sách tên hiện có, dạng ONLINE)
+#   tin chuyển tiếp                     TEXTMSG, VOICEMSG, FILE... tới "ALL" hoặc một tên
+# Mỗi node biết tên nào đang ở node nào: tin riêng chỉ đi tới node giữ người nhận, tin "ALL" tới các
+# node đang có user. Tin nhận từ node khác chỉ giao cho client cục bộ, không chuyển tiếp tiếp
+# (lưới đầy đủ, nên không cần đi qua node trung gian và không có vòng lặp).
+
+RECONNECT_INTERVAL = 2   # giây giữa các lần nối lại tới một peer
+HANDSHAKE_TIMEOUT = 5    # giây chờ NODE của bên kia
+
+
+def parse_address(text, default_host="127.0.0.1"):
+    """'host:port' hoặc 'port' -> (host, port)."""
+    host, _, port = text.rpartition(":")
+    return host or default_host, int(port)
+
+
+class _PeerLink:
+    """Kết nối tới một node khác."""
+
+    def __init__(self, sock, node, addr, dialed):
+        self.sock = sock
+        self.node = node
+        self.addr = addr
+        self.dialed = dialed     # True nếu node này chủ động nối
+        self.names = set()       # tên đang online ở node kia
+        self.queue = outbound.OutboundQueue(BUS_QUEUE_BYTES, outbound.POLICY_BACKPRESSURE)
+
+
+class ClusterNode:
+    """
+    Đầu bus của một node trong cụm, cùng giao diện với bus.BusLink (announce / publish / hosts /
+    remote_names / stats): on_message(msg) cho mỗi tin từ node khác (on_message chịu trách nhiệm
+    msg.release()), on_directory() khi danh sách tên ở các node khác thay đổi.
+    """
+
+    def __init__(self, node, on_message, on_directory, host="0.0.0.0", port=0, peers=()):
+        self.node = node
+        self.on_message = on_message
+        self.on_directory = on_directory
+        self.pool = BufferPool()
+        self._lock = threading.Lock()
+        self.links = {}          # node -> _PeerLink đang dùng
+        self.local = set()       # tên đang online ở node này (theo announce)
+        self.received = 0
+        self._closed = False
+        self._server = None
+        if port:
+            self._server = socket.create_server((host, port))
+            threading.Thread(target=self._accept_loop, daemon=True).start()
+            print(f"[CỤM] Node '{node}' nhận kết nối từ node khác tại {host}:{port}")
+        for peer in peers:
+            threading.Thread(target=self._dial_loop, args=(parse_address(peer),), daemon=True).start()
+
+    # --- Kết nối giữa các node ---
+    def _accept_loop(self):
+        while True:
+            try:
+                sock, addr = self._server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._run_link, args=(sock, f"{addr[0]}:{addr[1]}", False),
+                             daemon=True).start()
+
+    def _dial_loop(self, address):
+        """Nối (và nối lại) tới một peer; không nối khi đã có kết nối tới node đó (do bên kia mở)."""
+        node = None
+        while not self._closed:
+            if node is None or node not in self.links:
+                try:
+                    sock = socket.create_connection(address, timeout=HANDSHAKE_TIMEOUT)
+                except OSError:
+                    pass
+                else:
+                    node = self._run_link(sock, f"{address[0]}:{address[1]}", True) or node
+            time.sleep(RECONNECT_INTERVAL)
+
+    def _preferred(self, link):
+        """Giữa hai kết nối tới cùng một node: giữ kết nối do node có ID nhỏ hơn mở (hai bên cùng chọn)."""
+        return link.dialed == (self.node < link.node)
+
+    def _run_link(self, sock, addr, dialed):
+        """Bắt tay, gắn kết nối vào cụm rồi đọc tới khi đóng. Trả về ID node bên kia (None nếu bắt tay lỗi)."""
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        assembler = FrameAssembler(self.pool)
+        link = None
+        try:
+            sock.settimeout(HANDSHAKE_TIMEOUT)
+            send_frame(sock, control("NODE", self.node))
+            hello = recv_message(sock, assembler)
+            if hello is None or hello.kind != "NODE":
+                return None
+            node = hello.text()
+            hello.release()
+            sock.settimeout(None)
+            if node == self.node:
+                print(f"[CỤM] Bỏ qua kết nối tới chính mình ({addr}).")
+                return node
+            link = _PeerLink(sock, node, addr, dialed)
+            if not self._attach(link):
+                return node
+            self._read_loop(link, assembler)
+            return node
+        except (OSError, ProtocolError) as e:
+            print(f"[CỤM] Lỗi kết nối {addr}: {e}")
+            return link.node if link is not None else None
+        finally:
+            if link is not None:
+                self._detach(link)
+            sock.close()
+
+    def _attach(self, link):
+        with self._lock:
+            old = self.links.get(link.node)
+            if old is not None and not self._preferred(link):
+                return False
+            self.links[link.node] = link
+            # Danh sách tên hiện có, trong cùng lock với announce() nên không lẫn thứ tự với các delta sau
+            for name in self.local:
+                link.queue.force_put(control("ONLINE", name))
+        threading.Thread(target=_writer, args=(link.sock, link.queue, f"node {link.node}"), daemon=True).start()
+        if old is not None:
+            self._detach(old)
+        print(f"[CỤM] Đã nối node '{link.node}' ({link.addr}).")
+        return True
+
+    def _detach(self, link):
+        link.queue.close()
+        with self._lock:
+            current = self.links.get(link.node) is link
+            if current:
+                del self.links[link.node]
+            had_names, link.names = bool(link.names), set()
+        if current:
+            print(f"[CỤM] Mất kết nối node '{link.node}'.")
+        if had_names:
+            self.on_directory()
+
+    def _read_loop(self, link, assembler):
+        while True:
+            msg = recv_message(link.sock, assembler)
+            if msg is None:
+                break
+            if msg.kind in ("ONLINE", "OFFLINE"):
+                name = msg.text()
+                msg.release()
+                with self._lock:
+                    if msg.kind == "ONLINE":
+                        link.names.add(name)
+                    else:
+                        link.names.discard(name)
+                self.on_directory()
+                continue
+            self.received += 1
+            try:
+                self.on_message(msg)
+            except Exception as e:
+                print(f"[CỤM] Lỗi xử lý tin từ node '{link.node}': {e}")
+
+    # --- Dùng từ server (có thể khi đang giữ 'clients_lock') ---
+    def announce(self, online, name):
+        """Báo mọi node khác: 'name' vừa có kết nối đầu tiên (online) / vừa hết kết nối ở node này."""
+        frame = control("ONLINE" if online else "OFFLINE", name)
+        with self._lock:
+            if online:
+                self.local.add(name)
+            else:
+                self.local.discard(name)
+            for link in self.links.values():
+                link.queue.force_put(frame)
+
+    def publish(self, frame, receiver, blocked):
+        """
+        Gửi frame tới các node liên quan: node giữ 'receiver', hoặc mọi node đang có user nếu "ALL".
+        Hàng đợi đầy -> thêm vào 'blocked'. Trả về số node đã nhận frame.
+        """
+        with self._lock:
+            if receiver == "ALL":
+                targets = [link for link in self.links.values() if link.names]
+            else:
+                targets = [link for link in self.links.values() if receiver in link.names]
+        for link in targets:
+            if not link.queue.offer(frame):
+                blocked.append((link.queue, frame))
+        return len(targets)
+
+    def hosts(self, name):
+        """Có node khác đang giữ 'name' không."""
+        with self._lock:
+            return any(name in link.names for link in self.links.values())
+
+    def remote_names(self):
+        with self._lock:
+            names = {}
+            for link in self.links.values():
+                names.update(dict.fromkeys(link.names))
+            return list(names)
+
+    def stats(self):
+        with self._lock:
+            peers = [{"node": link.node, "addr": link.addr, "users": len(link.names),
+                      "queue_frames": len(link.queue), "queue_bytes": link.queue.nbytes}
+                     for link in self.links.values()]
+        return {"node": self.node, "peers": peers, "remote_users": len(self.remote_names()),
+                "received": self.received}
+
+    def close(self):
+        self._closed = True
+        if self._server is not None:
+            self._server.close()
+        with self._lock:
+            links = list(self.links.values())
+        for link in links:
+            link.queue.close()
@@ -0,0 +1,221 @@
+import lzma
+import math
+import struct
+import threading
+import zlib
+from collections import Counter
+
+# === NÉN PAYLOAD (TEXTMSG / FILE / FILECHUNK) ===
+#
+# Thương lượng trong HELLO (như "slices=1"):
+#   client: "HELLO::proto=2;...;compress=zlib,lzma"   các kiểu client giải nén được
+#   server: "HELLO::proto=2;...;compress=zlib,lzma"   các kiểu server chấp nhận (giao của hai bên)
+# Sau đó client có thể gửi body đã nén; cờ trong header v2 cho biết kiểu nén:
+#   FLAG_ZLIB (0x01) / FLAG_LZMA (0x02), body = [kích thước gốc 4B, network byte order][dữ liệu nén]
+# Server KHÔNG giải nén để chuyển tiếp: người nhận đã thương lượng nhận nguyên frame nén; người nhận
+# không hiểu (client v1, client cũ, bus giữa các worker / node) nhận bản đã giải nén MỘT lần cho cả
+# fan-out. Kích thước gốc khai trong body được kiểm tra với giới hạn frame của loại tin trước khi giải
+# nén, và dữ liệu giải nén không được vượt kích thước đó (chặn "bom nén").
+# Người gửi bỏ qua nén khi payload nhỏ, đã là định dạng nén (nhận biết qua magic bytes hoặc entropy
+# của một mẫu) hoặc nén xong không nhỏ đi đáng kể.
+
+FLAG_ZLIB = 0x01
+FLAG_LZMA = 0x02
+COMPRESSION_FLAGS = FLAG_ZLIB | FLAG_LZMA
+
+METHODS = {"zlib": FLAG_ZLIB, "lzma": FLAG_LZMA}
+ALL_METHODS = FLAG_ZLIB | FLAG_LZMA
+
+# Loại tin có body là dữ liệu người dùng, đáng nén (VOICEMSG / VOICECHUNK đã nén bằng voice_codec)
+COMPRESSIBLE_KINDS = {"TEXTMSG", "FILE", "FILECHUNK"}
+
+SIZE_HEADER = struct.Struct("!I")
+MIN_COMPRESS_BYTES = 512        # payload nhỏ hơn: header + từ điển nén ăn hết phần tiết kiệm
+MAX_RATIO = 0.9                 # nén xong phải còn <= 90% kích thước gốc, không thì gửi nguyên
+ENTROPY_SAMPLE = 4096           # số byte lấy mẫu để ước lượng entropy
+ENTROPY_LIMIT = 7.5             # bit/byte; dữ liệu đã nén / mã hóa ~8, văn bản ~4-5
+MAX_INFLATE_BYTES = 64 * 1024 * 1024  # kích thước gốc tối đa client chấp nhận giải nén
+ZLIB_LEVEL = 6
+LZMA_PRESET = 6
+
+# Magic bytes của các định dạng đã nén sẵn (nén lại chỉ tốn CPU)
+COMPRESSED_MAGIC = (
+    b"\x1f\x8b",              # gzip
+    b"PK\x03\x04",            # zip, docx / xlsx / pptx, jar, apk
+    b"\x89PNG",
+    b"\xff\xd8\xff",          # jpeg
+    b"GIF8",
+    b"BZh",                   # bzip2
+    b"\xfd7zXZ\x00",          # xz
+    b"7z\xbc\xaf\x27\x1c",
+    b"Rar!",
+    b"\x28\xb5\x2f\xfd",      # zstd
+    b"OggS",
+    b"fLaC",
+    b"ID3",                   # mp3
+    b"%PDF",                  # pdf: các stream bên trong thường đã nén
+)
+
+
+class CompressionError(ValueError):
+    """Body nén hỏng, sai kiểu nén hoặc giải nén vượt kích thước khai báo / cho phép."""
+
+
+def parse_methods(text):
+    """"zlib,lzma" -> bitmask cờ nén (kiểu không biết bị bỏ qua)."""
+    mask = 0
+    for name in (text or "").split(","):
+        mask |= METHODS.get(name.strip().lower(), 0)
+    return mask
+
+
+def format_methods(mask):
+    """Bitmask cờ nén -> "zlib,lzma" (rỗng nếu không có kiểu nào)."""
+    return ",".join(name for name, flag in METHODS.items() if mask & flag)
+
+
+def byte_entropy(sample):
+    """Entropy Shannon (bit/byte) của 'sample'."""
+    total = len(sample)
+    if not total:
+        return 0.0
+    return -sum(n / total * math.log2(n / total) for n in Counter(sample).values())
+
+
+def looks_compressed(data):
+    """Dữ liệu đã nén sẵn? Xét magic bytes ở đầu, rồi entropy của một mẫu ở giữa dữ liệu."""
+    view = memoryview(data).cast('B')
+    head = bytes(view[:8])
+    if head.startswith(COMPRESSED_MAGIC) or head[4:8] == b"ftyp":  # ftyp: mp4 / mov / m4a
+        return True
+    start = max(0, len(view) // 2 - ENTROPY_SAMPLE // 2)
+    return byte_entropy(bytes(view[start:start + ENTROPY_SAMPLE])) > ENTROPY_LIMIT
+
+
+def compress(parts, method, sample=None):
+    """
+    Nén body gồm các phần 'parts' bằng 'method' ("zlib" / "lzma").
+    'sample': phần dữ liệu người dùng dùng để nhận biết dữ liệu đã nén (mặc định cả body),
+    ví dụ chỉ nội dung file, không tính tên file ở đầu body FILE.
+    Trả về (body_nén, cờ), hoặc (None, 0) nếu nên gửi nguyên.
+    """
+    size = sum(len(part) for part in parts)
+    flag = METHODS.get(method, 0)
+    if not flag or size < MIN_COMPRESS_BYTES:
+        return None, 0
+    if looks_compressed(sample if sample is not None else parts[-1]):
+        return None, 0
+    if flag == FLAG_ZLIB:
+        compressor = zlib.compressobj(ZLIB_LEVEL)
+    else:
+        compressor = lzma.LZMACompressor(preset=LZMA_PRESET)
+    chunks = [SIZE_HEADER.pack(size)]
+    chunks += [compressor.compress(part) for part in parts]
+    chunks.append(compressor.flush())
+    body = b"".join(chunks)
+    if len(body) > size * MAX_RATIO:
+        return None, 0
+    return body, flag
+
+
+def original_size(body):
+    """Kích thước gốc khai trong body nén, hoặc None nếu body quá ngắn."""
+    if len(body) < SIZE_HEADER.size:
+        return None
+    return SIZE_HEADER.unpack(bytes(memoryview(body)[:SIZE_HEADER.size]))[0]
+
+
+class Inflater:
+    """
+    Giải nén dạng luồng MỘT body nén: feed() từng đoạn (ví dụ từng lát FLAG_MORE) ngay khi tới,
+    bản nén đầy đủ không cần nằm trong bộ nhớ. finish() trả về dữ liệu gốc (bytearray).
+    """
+
+    __slots__ = ("flags", "max_size", "size", "out", "_head", "_decoder")
+
+    def __init__(self, flags, max_size=MAX_INFLATE_BYTES):
+        if flags & COMPRESSION_FLAGS == FLAG_ZLIB:
+            self._decoder = zlib.decompressobj()
+        elif flags & COMPRESSION_FLAGS == FLAG_LZMA:
+            self._decoder = lzma.LZMADecompressor()
+        else:
+            raise CompressionError(f"cờ nén không hợp lệ: {flags:#x}")
+        self.flags = flags
+        self.max_size = max_size
+        self.size = None
+        self.out = bytearray()
+        self._head = b""
+
+    def feed(self, data):
+        if self.size is None:
+            # chỉ chép các byte của header kích thước, phần nén còn lại đưa thẳng cho bộ giải nén
+            data = memoryview(data)
+            needed = SIZE_HEADER.size - len(self._head)
+            self._head += bytes(data[:needed])
+            if len(self._head) < SIZE_HEADER.size:
+                return
+            self.size = SIZE_HEADER.unpack(self._head)[0]
+            if self.size > self.max_size:
+                raise CompressionError(f"kích thước gốc {self.size} bytes vượt giới hạn {self.max_size} bytes")
+            data, self._head = data[needed:], None
+        self._inflate(data)
+
+    def _inflate(self, data):
+        # chỉ xin tối đa phần còn thiếu + 1 byte: dữ liệu dài hơn khai báo bị phát hiện mà không bung ra hết
+        try:
+            self.out += self._decoder.decompress(data, self.size - len(self.out) + 1)
+        except (zlib.error, lzma.LZMAError) as e:
+            raise CompressionError(f"dữ liệu nén hỏng: {e}") from None
+        if len(self.out) > self.size:
+            raise CompressionError(f"dữ liệu giải nén dài hơn kích thước khai báo {self.size} bytes")
+
+    def finish(self):
+        if self.size is None:
+            raise CompressionError("body nén thiếu header kích thước")
+        if not self._decoder.eof:
+            self._inflate(b"")
+        if not self._decoder.eof or len(self.out) != self.size or self._decoder.unused_data:
+            raise CompressionError(f"dữ liệu nén không khớp kích thước khai báo {self.size} bytes")
+        return self.out
+
+
+def inflate(body, flags, max_size=MAX_INFLATE_BYTES):
+    """Giải nén cả một body nén -> bytearray (CompressionError nếu hỏng / quá lớn)."""
+    inflater = Inflater(flags, max_size)
+    inflater.feed(body)
+    return inflater.finish()
+
+
+class CompressionStats:
+    """Số frame nén theo loại tin: byte trên dây (đã nén) và byte gốc, cùng số lần phải giải nén."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.kinds = {}          # kind -> [frames, bytes nén, bytes gốc]
+        self.inflated = 0        # số lần giải nén cho người nhận không hiểu frame nén
+        self.inflated_bytes = 0
+        self.errors = 0          # body nén hỏng / vượt giới hạn (tin bị bỏ)
+
+    def add(self, kind, wire_bytes, original_bytes):
+        with self._lock:
+            total = self.kinds.setdefault(kind, [0, 0, 0])
+            total[0] += 1
+            total[1] += wire_bytes
+            total[2] += original_bytes
+
+    def add_inflated(self, nbytes):
+        with self._lock:
+            self.inflated += 1
+            self.inflated_bytes += nbytes
+
+    def add_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            kinds = {kind: {"frames": frames, "bytes": wire, "original_bytes": original,
+                            "ratio": round(original / wire, 2) if wire else 0.0}
+                     for kind, (frames, wire, original) in self.kinds.items()}
+            return {"kinds": kinds, "inflated": self.inflated, "inflated_bytes": self.inflated_bytes,
+                    "errors": self.errors}
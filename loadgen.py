@@ -0,0 +1,625 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+
+from presence import parse_presence
+from protocol import (ALL_ID, HEADER_SIZE, PROTO_V1, PROTO_V2, V2_HEADER, V2_MAGIC, ProtocolError, build_message_v2,
+                      decode_v2_header, encode_frame, encode_parts, parse_options, parse_v1, split_file_body)
+from voice_codec import new_voice_id, parse_voice_chunk, voice_chunk_parts
+
+# === BỘ TẠO TẢI KHÔNG GIAO DIỆN (client giả lập cho server.py) ===
+#
+# client.py là client CustomTkinter duy nhất nên không đo được sức chịu tải của server. Module này
+# giả lập hàng nghìn user ảo (VU), chia cho --workers tiến trình (mỗi tiến trình một event loop),
+# nói đúng giao thức của client thật (HELLO / USERNAME, v2 mặc định hoặc v1) và phát tải trộn:
+#   text  : TEXTMSG ngắn                                    (chat thường)
+#   voice : một đợt VOICECHUNK, mỗi đoạn 0.5 s μ-law 16 kHz (ghi âm gửi dần)
+#   file  : một frame FILE --file-bytes                    (gửi tệp nhỏ)
+# tới "ALL" hoặc một VU khác (--private-ratio). Đầu mỗi nội dung có một tem STAMP (VU gửi, số thứ tự,
+# thời điểm gửi theo time.monotonic_ns, đồng hồ chung của cả máy), người nhận đọc tem để tính
+# độ trễ giao tin. Các tiến trình chờ nhau (Barrier) tới khi mọi VU đã online rồi mới phát tải.
+# Kết quả (JSON, để so sánh giữa các lần chạy): số tin gửi / giao theo loại, tỉ lệ giao, thông lượng,
+# độ trễ p50 / p90 / p99 / max, CPU và RSS của server (đọc /proc, cần --server-pid), số liệu của chính
+# server nếu có --stats-port (xem metrics.py) và CPU của bộ tạo tải: gần 100% nghĩa là chính bộ tạo tải
+# đang là nút thắt, hãy tăng --workers.
+#
+# Chạy:  python loadgen.py --port 12345 --users 1000 --workers 4 --duration 30 --output run.json
+
+STAMP = struct.Struct("!4sIIQ")  # magic | vu | seq | thời điểm gửi (ns, time.monotonic_ns)
+STAMP_MAGIC = b"LGv1"
+
+VOICE_CHUNK_BYTES = 8000       # 0.5 s μ-law 16 kHz
+VOICE_CHUNK_INTERVAL = 0.5     # giây giữa hai đoạn của một đợt (như ghi âm thật)
+MAX_SAMPLES = 200_000          # số mẫu độ trễ giữ lại cho mỗi loại tin (reservoir sampling)
+SAMPLE_INTERVAL = 0.5          # chu kỳ đo RSS của server
+READY_TIMEOUT = 60             # giây chờ mọi VU xuất hiện trong danh sách online
+
+# Tỉ lệ các hành động của từng loại tải
+WORKLOADS = {
+    "text": {"text": 1.0},
+    "voice": {"voice": 1.0},
+    "file": {"file": 1.0},
+    "mixed": {"text": 0.85, "voice": 0.1, "file": 0.05},
+}
+STAMPED_KINDS = {"TEXTMSG", "VOICECHUNK", "FILE"}
+
+
+def raise_fd_limit():
+    """Nâng giới hạn số file mở (soft -> hard): mỗi VU là một socket. Không có 'resource' (Windows) thì bỏ qua."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass
+    return soft
+
+
+class LatencyRecorder:
+    """Độ trễ (giây) của một loại tin: đếm tất cả, giữ tối đa 'cap' mẫu ngẫu nhiên để tính phân vị."""
+
+    def __init__(self, rng, cap=MAX_SAMPLES):
+        self.rng = rng
+        self.cap = cap
+        self.samples = []
+        self.count = 0
+        self.nbytes = 0
+        self.max = 0.0
+
+    def add(self, seconds, nbytes):
+        self.count += 1
+        self.nbytes += nbytes
+        if seconds > self.max:
+            self.max = seconds
+        if len(self.samples) < self.cap:
+            self.samples.append(seconds)
+        else:
+            j = self.rng.randrange(self.count)
+            if j < self.cap:
+                self.samples[j] = seconds
+
+    def merge(self, count, nbytes, peak, samples):
+        """Gộp kết quả của một tiến trình khác (mẫu được nối lại, không lấy mẫu lại)."""
+        self.count += count
+        self.nbytes += nbytes
+        self.max = max(self.max, peak)
+        self.samples += samples
+
+    def state(self):
+        return self.count, self.nbytes, self.max, self.samples
+
+    def summary(self):
+        if not self.samples:
+            return {"messages": self.count, "bytes": self.nbytes}
+        samples = sorted(self.samples)
+        pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000  # noqa: E731
+        return {"messages": self.count, "bytes": self.nbytes, "p50_ms": pick(0.5), "p90_ms": pick(0.9),
+                "p99_ms": pick(0.99), "max_ms": self.max * 1000}
+
+
+class ProcessSampler:
+    """CPU và RSS của một tiến trình (server) đọc từ /proc; hệ điều hành khác: available = False."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.available = pid is not None and os.path.exists(f"/proc/{pid}/stat")
+        self.tick = os.sysconf("SC_CLK_TCK") if self.available else 100
+        self.peak_rss_kb = 0
+
+    def cpu_seconds(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rpartition(")")[2].split()
+        return (int(fields[11]) + int(fields[12])) / self.tick  # utime + stime
+
+    def memory_kb(self):
+        """(RSS hiện tại, RSS đỉnh từ lúc tiến trình chạy) theo kB."""
+        values = {}
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    values[key] = int(value.split()[0])
+        return values.get("VmRSS", 0), values.get("VmHWM", 0)
+
+    def sample(self):
+        try:
+            rss, _ = self.memory_kb()
+        except OSError:
+            return
+        self.peak_rss_kb = max(self.peak_rss_kb, rss)
+
+
+class LoadConnection(asyncio.Protocol):
+    """
+    Kết nối của một VU. Khác FrameConnection của server (vùng đọc trước nhỏ, payload lớn nhận thẳng
+    vào BufferPool), ở đây mỗi data_received (tới 256 KB) được tách thành nhiều frame ngay trong bộ đệm:
+    VU chỉ cần body dạng bytes và nhận hàng nghìn tin nhỏ mỗi giây.
+    on_message(msg) được gọi trực tiếp trong data_received, body là bytes riêng của tin đó.
+    """
+
+    def __init__(self, on_message):
+        self.on_message = on_message
+        self.transport = None
+        self._buf = bytearray()
+        self._can_write = asyncio.Event()
+        self._can_write.set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        buf = self._buf
+        buf += data
+        pos = 0
+        try:
+            while len(buf) - pos >= HEADER_SIZE:
+                if buf[pos] == V2_MAGIC:
+                    start = pos + V2_HEADER.size
+                    if len(buf) < start:
+                        break
+                    kind, flags, length, sender_id, receiver_id = decode_v2_header(buf[pos:start])
+                    if len(buf) < start + length:
+                        break
+                    msg = build_message_v2(kind, flags, sender_id, receiver_id, bytes(buf[start:start + length]))
+                else:
+                    start = pos + HEADER_SIZE
+                    try:
+                        length = int(buf[pos:start].decode('utf-8').strip())
+                    except ValueError:
+                        raise ProtocolError(f"header v1 không hợp lệ: {bytes(buf[pos:start])!r}")
+                    if len(buf) < start + length:
+                        break
+                    msg = parse_v1(bytes(buf[start:start + length]))
+                pos = start + length
+                self.on_message(msg)
+        except ProtocolError as e:
+            print(f"[LOADGEN] Lỗi giao thức: {e}")
+            self.transport.abort()
+        del buf[:pos]
+
+    def connection_lost(self, exc):
+        self._can_write.set()  # Không để drain() chờ mãi
+
+    def pause_writing(self):
+        self._can_write.clear()
+
+    def resume_writing(self):
+        self._can_write.set()
+
+    def write(self, frame):
+        for buf in frame.buffers():
+            self.transport.write(buf)
+
+    async def drain(self):
+        if self.transport.is_closing():
+            raise ConnectionResetError("kết nối đã đóng")
+        await self._can_write.wait()
+
+
+class VirtualUser:
+    """Một client giả lập: một kết nối, chỉ phát tải; việc nhận do LoadGenerator.on_message xử lý."""
+
+    def __init__(self, gen, index):
+        self.gen = gen
+        self.index = index
+        self.name = gen.name_of(index)
+        self.proto = gen.args.proto
+        self.user_id = ALL_ID
+        self.conn = None
+        self.seq = 0
+        self.hello = asyncio.Event()
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        _, self.conn = await loop.create_connection(
+            lambda: LoadConnection(lambda msg: self.gen.on_message(self, msg)), self.gen.args.host, self.gen.args.port)
+        if self.proto >= PROTO_V2:
+            self.conn.write(encode_frame(f"HELLO::proto={self.proto}".encode('utf-8')))
+        else:
+            self.hello.set()
+        self.conn.write(encode_frame(f"USERNAME::{self.name}".encode('utf-8')))
+        await self.conn.drain()
+
+    def stamp(self):
+        self.seq += 1
+        return STAMP.pack(STAMP_MAGIC, self.index, self.seq, time.monotonic_ns())
+
+    def frame(self, kind, target, *parts):
+        if self.proto >= PROTO_V2:
+            receiver_id = ALL_ID if target == "ALL" else self.gen.ids[target]
+            return encode_parts(PROTO_V2, kind, parts, sender_id=self.user_id, receiver_id=receiver_id)
+        return encode_parts(PROTO_V1, kind, parts, self.name, target)
+
+    async def send(self, kind, target, *parts):
+        frame = self.frame(kind, target, *parts)
+        self.conn.write(frame)
+        self.gen.on_sent(kind, target, len(frame))
+        await self.conn.drain()
+
+    async def run(self, deadline):
+        """Phát tải tới 'deadline' (loop.time()): khoảng cách giữa hai hành động theo phân phối mũ."""
+        gen, args = self.gen, self.gen.args
+        loop = asyncio.get_running_loop()
+        rng = gen.rng
+        bursts = set()
+        while True:
+            delay = rng.expovariate(args.rate)
+            if loop.time() + delay >= deadline:
+                break
+            await asyncio.sleep(delay)
+            if self.conn.transport.is_closing():
+                break
+            action = rng.choices(gen.actions, gen.weights)[0]
+            target = "ALL"
+            if rng.random() < args.private_ratio and args.users > 1:
+                other = rng.randrange(args.users)
+                if other != self.index:
+                    target = gen.name_of(other)
+            if target != "ALL" and target not in gen.online:
+                gen.unresolved += 1
+                continue
+            if action == "text":
+                size = rng.randint(STAMP.size, max(STAMP.size, args.text_bytes))
+                await self.send("TEXTMSG", target, self.stamp(), gen.padding[:size - STAMP.size])
+            elif action == "file":
+                await self.send("FILE", target, b"loadgen.bin::", self.stamp(), gen.padding[:args.file_bytes])
+            else:
+                task = asyncio.create_task(self.voice_burst(target))
+                bursts.add(task)
+                task.add_done_callback(bursts.discard)
+        if bursts:
+            await asyncio.gather(*bursts, return_exceptions=True)
+
+    async def voice_burst(self, target):
+        vid = new_voice_id()
+        chunks = self.gen.args.voice_chunks
+        chunk = self.gen.padding[:VOICE_CHUNK_BYTES - STAMP.size]
+        for seq in range(chunks):
+            head, _ = voice_chunk_parts(vid, seq, seq == chunks - 1, b"")
+            await self.send("VOICECHUNK", target, head, self.stamp(), chunk)
+            if seq < chunks - 1:
+                await asyncio.sleep(VOICE_CHUNK_INTERVAL)
+
+    def close(self):
+        if self.conn is not None and self.conn.transport is not None:
+            self.conn.transport.close()
+
+
+class LoadGenerator:
+    """Các VU của MỘT tiến trình worker: chỉ số từ 'first' tới trước 'last' trong tổng số --users."""
+
+    def __init__(self, args, first, last, barrier=None):
+        self.args = args
+        self.first = first
+        self.last = last
+        self.barrier = barrier
+        self.rng = random.Random(args.seed * 1000 + first)
+        mix = WORKLOADS[args.workload]
+        self.actions, self.weights = list(mix), list(mix.values())
+        self.padding = memoryview(bytes(max(args.file_bytes, VOICE_CHUNK_BYTES, args.text_bytes)))
+        self.users = []
+        self.observer = None       # VU đầu tiên: theo dõi danh sách online thay cho cả tiến trình
+        self.online = set()        # tên đang online (từ PRESENCE / USERLIST)
+        self.ids = {}              # tên -> ID số (v2)
+        self.sent = {}             # loại -> [số tin, số byte]
+        self.delivered = {}        # loại -> LatencyRecorder
+        self.expected = 0          # số lượt giao mong đợi (ALL: mọi người online khác, riêng: 1)
+        self.unresolved = 0        # tin riêng bị bỏ vì người nhận chưa online
+        self.connect_failed = 0
+        self.foreign = 0           # tin không mang tem (từ client khác ngoài bộ tạo tải)
+
+    def name_of(self, index):
+        return f"{self.args.name_prefix}{index}"
+
+    # --- Nhận ---
+    def on_message(self, vu, msg):
+        kind = msg.kind
+        if kind in STAMPED_KINDS:
+            now = time.monotonic_ns()
+            content = msg.body
+            if kind == "VOICECHUNK":
+                parsed = parse_voice_chunk(content)
+                content = parsed[3] if parsed else b""
+            elif kind == "FILE":
+                parsed = split_file_body(content)
+                content = parsed[1] if parsed else b""
+            if len(content) < STAMP.size or content[:4] != STAMP_MAGIC:
+                self.foreign += 1
+                return
+            sent_at = STAMP.unpack_from(content)[3]
+            recorder = self.delivered.get(kind)
+            if recorder is None:
+                recorder = self.delivered[kind] = LatencyRecorder(self.rng, self.args.max_samples)
+            recorder.add((now - sent_at) / 1e9, len(msg.body))
+        elif kind == "HELLO":
+            vu.user_id = int(parse_options(msg.text()).get("id", ALL_ID))
+            vu.hello.set()
+        elif kind in ("PRESENCE", "USERLIST"):
+            # Mọi VU nhận cùng một danh sách online: chỉ VU nhận được danh sách đầu tiên (luôn là
+            # snapshot / USERLIST đầy đủ) cập nhật cho cả tiến trình
+            if self.observer is None:
+                self.observer = vu
+            if vu is not self.observer:
+                return
+            if kind == "PRESENCE":
+                parsed = parse_presence(msg.body)
+                if parsed is not None:
+                    mode, _, joined, left = parsed
+                    if mode == "snapshot":
+                        self.online.clear()
+                        self.ids.clear()
+                    for user_id, name in joined:
+                        self.online.add(name)
+                        self.ids[name] = user_id
+                    for _, name in left:
+                        self.online.discard(name)
+                        self.ids.pop(name, None)
+            else:
+                self.online = {name for name in msg.text().split(",") if name}
+
+    def on_sent(self, kind, target, nbytes):
+        total = self.sent.setdefault(kind, [0, 0])
+        total[0] += 1
+        total[1] += nbytes
+        self.expected += len(self.online) - 1 if target == "ALL" else 1
+
+    def delivered_count(self):
+        return sum(r.count for r in self.delivered.values())
+
+    # --- Chạy ---
+    async def connect_all(self):
+        """Kết nối lần lượt từng nhóm --connect-batch VU (tránh tràn hàng đợi accept của server)."""
+        batch_size = self.args.connect_batch
+        users = [VirtualUser(self, i) for i in range(self.first, self.last)]
+        for start in range(0, len(users), batch_size):
+            batch = users[start:start + batch_size]
+            results = await asyncio.gather(*(vu.connect() for vu in batch), return_exceptions=True)
+            for vu, result in zip(batch, results):
+                if isinstance(result, BaseException):
+                    self.connect_failed += 1
+                else:
+                    self.users.append(vu)
+
+    async def wait_ready(self):
+        """Chờ mọi VU của tiến trình nhận HELLO và mọi VU (của mọi tiến trình) có trong danh sách online."""
+        deadline = time.monotonic() + READY_TIMEOUT
+        names = {self.name_of(i) for i in range(self.args.users)}
+        while time.monotonic() < deadline:
+            if all(vu.hello.is_set() for vu in self.users) and names <= self.online:
+                return True
+            await asyncio.sleep(0.05)
+        return False
+
+    async def run(self):
+        args = self.args
+        loop = asyncio.get_running_loop()
+        t0 = time.perf_counter()
+        await self.connect_all()
+        ready = await self.wait_ready() if self.users else False
+        connect_s = time.perf_counter() - t0
+        if self.barrier is not None:
+            # Mọi tiến trình (và tiến trình chính, nơi đo server) bắt đầu phát tải cùng lúc
+            try:
+                await loop.run_in_executor(None, self.barrier.wait, READY_TIMEOUT)
+            except threading.BrokenBarrierError:
+                ready = False
+
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        deadline = loop.time() + args.duration
+        await asyncio.gather(*(vu.run(deadline) for vu in self.users), return_exceptions=True)
+        send_s = time.perf_counter() - start
+        # Chờ các tin còn trên đường đi (tối đa --drain giây)
+        drain_deadline = time.perf_counter() + args.drain
+        while self.delivered_count() < self.expected and time.perf_counter() < drain_deadline:
+            await asyncio.sleep(0.05)
+        total_s = time.perf_counter() - start
+        cpu_s = time.process_time() - cpu_start
+        for vu in self.users:
+            vu.close()
+        return {
+            "users": len(self.users), "connect_failed": self.connect_failed, "ready": ready,
+            "connect_s": connect_s, "send_s": send_s, "total_s": total_s, "cpu_s": cpu_s,
+            "sent": self.sent, "expected": self.expected, "unresolved": self.unresolved, "foreign": self.foreign,
+            "delivered": {kind: r.state() for kind, r in self.delivered.items()},
+        }
+
+
+def _worker(args, first, last, barrier, results):
+    raise_fd_limit()
+    try:
+        part = asyncio.run(LoadGenerator(args, first, last, barrier).run())
+    except Exception as e:
+        part = {"error": f"{type(e).__name__}: {e}"}
+        barrier.abort()
+    results.put(part)
+
+
+def fetch_server_stats(host, port, timeout=5):
+    """JSON số liệu của server từ cổng --stats-port (xem server.start_stats_server), None nếu lỗi."""
+    host = "127.0.0.1" if host in ("0.0.0.0", "") else host
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as s:
+            s.sendall(b"json\n")
+            chunks = []
+            while chunk := s.recv(65536):
+                chunks.append(chunk)
+        return json.loads(b"".join(chunks))
+    except (OSError, ValueError) as e:
+        print(f"[LOADGEN] Không đọc được số liệu server: {e}")
+        return None
+
+
+def run(args):
+    """
+    Chạy một lần đo với cấu hình 'args' (xem parse_args), trả về dict kết quả.
+    VU được chia cho args.workers tiến trình; tiến trình gọi hàm này đo CPU / RSS của server
+    trong lúc phát tải rồi gộp kết quả.
+    """
+    raise_fd_limit()
+    workers = max(1, min(args.workers, args.users))
+    barrier = multiprocessing.Barrier(workers + 1)
+    results = multiprocessing.Queue()
+    processes = []
+    for w in range(workers):
+        first, last = args.users * w // workers, args.users * (w + 1) // workers
+        p = multiprocessing.Process(target=_worker, args=(args, first, last, barrier, results), daemon=True)
+        p.start()
+        processes.append(p)
+
+    try:
+        barrier.wait(READY_TIMEOUT * 2)
+    except threading.BrokenBarrierError:
+        pass
+    sampler = ProcessSampler(args.server_pid)
+    cpu_start = sampler.cpu_seconds() if sampler.available else 0.0
+    start = time.perf_counter()
+    parts = []
+    while len(parts) < workers:
+        try:
+            parts.append(results.get(timeout=SAMPLE_INTERVAL))
+        except queue.Empty:
+            if not any(p.is_alive() for p in processes) and results.empty():
+                break
+        sampler.sample()
+    elapsed = time.perf_counter() - start
+    server = None
+    if sampler.available:
+        cpu = sampler.cpu_seconds() - cpu_start
+        _, hwm = sampler.memory_kb()
+        server = {"pid": args.server_pid, "cpu_s": cpu, "cpu_percent": cpu / elapsed * 100,
+                  "rss_peak_kb": sampler.peak_rss_kb, "rss_hwm_kb": hwm}
+    for p in processes:
+        p.join(5)
+    server_stats = fetch_server_stats(args.host, args.stats_port) if args.stats_port else None
+    return merge_results(args, workers, parts, server, server_stats)
+
+
+def merge_results(args, workers, parts, server, server_stats):
+    errors = [p["error"] for p in parts if "error" in p]
+    parts = [p for p in parts if "error" not in p]
+    if not parts:
+        raise ConnectionError(f"không worker nào chạy được: {errors}")
+    rng = random.Random(args.seed)
+    delivered, sent = {}, {}
+    for part in parts:
+        for kind, state in part["delivered"].items():
+            delivered.setdefault(kind, LatencyRecorder(rng)).merge(*state)
+        for kind, (n, b) in part["sent"].items():
+            total = sent.setdefault(kind, [0, 0])
+            total[0] += n
+            total[1] += b
+    overall = LatencyRecorder(rng)
+    for r in delivered.values():
+        overall.merge(*r.state())
+    expected = sum(p["expected"] for p in parts)
+    send_s = max(p["send_s"] for p in parts)
+    total_s = max(p["total_s"] for p in parts)
+    sent_count = sum(n for n, _ in sent.values())
+    cpu = [p["cpu_s"] / p["total_s"] * 100 for p in parts if p["total_s"]]
+    return {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "users": sum(p["users"] for p in parts),
+        "connect_failed": sum(p["connect_failed"] for p in parts),
+        "worker_errors": errors,
+        "ready": all(p["ready"] for p in parts),
+        "connect_s": max(p["connect_s"] for p in parts),
+        "send_s": send_s,
+        "total_s": total_s,
+        "sent": {kind: {"messages": n, "bytes": b} for kind, (n, b) in sorted(sent.items())},
+        "delivered": {kind: r.summary() for kind, r in sorted(delivered.items())},
+        "expected_deliveries": expected,
+        "delivery_ratio": overall.count / expected if expected else 1.0,
+        "unresolved": sum(p["unresolved"] for p in parts),
+        "foreign": sum(p["foreign"] for p in parts),
+        "throughput": {
+            "sent_msgs_per_s": sent_count / send_s if send_s else 0.0,
+            "delivered_msgs_per_s": overall.count / total_s if total_s else 0.0,
+            "delivered_mb_per_s": overall.nbytes / total_s / 1e6 if total_s else 0.0,
+        },
+        "latency": overall.summary(),
+        "loadgen": {"workers": workers, "cpu_percent_max": max(cpu, default=0.0)},
+        "server": server,
+        "server_stats": server_stats,
+    }
+
+
+def print_summary(results):
+    lat = results["latency"]
+    tp = results["throughput"]
+    print(f"{results['users']} VU (lỗi kết nối {results['connect_failed']}), kết nối {results['connect_s']:.2f}s, "
+          f"gửi {results['send_s']:.1f}s")
+    print(f"{'loại':>10} {'gửi':>8} {'giao':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for kind, d in results["delivered"].items():
+        sent = results["sent"].get(kind, {}).get("messages", 0)
+        print(f"{kind:>10} {sent:>8} {d['messages']:>9} {d.get('p50_ms', 0):>8.2f} "
+              f"{d.get('p99_ms', 0):>8.2f} {d.get('max_ms', 0):>8.2f}")
+    print(f"giao {results['delivery_ratio'] * 100:.1f}% số lượt mong đợi; "
+          f"{tp['sent_msgs_per_s']:.0f} tin gửi/s, {tp['delivered_msgs_per_s']:.0f} tin giao/s, "
+          f"{tp['delivered_mb_per_s']:.2f} MB/s; p50 {lat.get('p50_ms', 0):.2f} ms, p99 {lat.get('p99_ms', 0):.2f} ms")
+    if results["server"]:
+        s = results["server"]
+        print(f"server: CPU {s['cpu_percent']:.0f}% ({s['cpu_s']:.2f}s), RSS đỉnh {s['rss_peak_kb'] / 1024:.1f} MB")
+    loadgen = results["loadgen"]
+    print(f"bộ tạo tải: {loadgen['workers']} tiến trình, CPU cao nhất {loadgen['cpu_percent_max']:.0f}%")
+    if loadgen["cpu_percent_max"] > 90:
+        print("⚠️ Bộ tạo tải gần hết CPU: độ trễ đo được gồm cả thời gian chờ ở phía tạo tải, hãy tăng --workers.")
+    for error in results["worker_errors"]:
+        print(f"❌ Worker lỗi: {error}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bộ tạo tải không giao diện cho server.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--users", type=int, default=100, help="số user ảo (mỗi user một kết nối)")
+    parser.add_argument("--workers", type=int, default=1, help="số tiến trình tạo tải (chia đều user ảo)")
+    parser.add_argument("--duration", type=float, default=10, help="số giây phát tải")
+    parser.add_argument("--rate", type=float, default=1.0, help="số hành động / giây của mỗi user")
+    parser.add_argument("--workload", choices=sorted(WORKLOADS), default="mixed")
+    parser.add_argument("--private-ratio", type=float, default=0.3, help="tỉ lệ tin gửi riêng (còn lại gửi ALL)")
+    parser.add_argument("--proto", type=int, choices=(PROTO_V1, PROTO_V2), default=PROTO_V2)
+    parser.add_argument("--text-bytes", type=int, default=200, help="độ dài tối đa của TEXTMSG")
+    parser.add_argument("--voice-chunks", type=int, default=4, help="số đoạn 0.5 s của một đợt thoại")
+    parser.add_argument("--file-bytes", type=int, default=64 * 1024, help="kích thước tệp của tin FILE")
+    parser.add_argument("--connect-batch", type=int, default=100, help="số kết nối mở đồng thời")
+    parser.add_argument("--drain", type=float, default=5, help="số giây chờ tin còn trên đường đi sau khi dừng")
+    parser.add_argument("--name-prefix", default="vu")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--max-samples", type=int, default=MAX_SAMPLES)
+    parser.add_argument("--server-pid", type=int, help="PID của server để đo CPU / RSS (Linux)")
+    parser.add_argument("--stats-port", type=int, default=0, help="cổng số liệu của server (--stats-port)")
+    parser.add_argument("--output", help="ghi kết quả JSON ra tệp ('-' = stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(args)
+    if args.output == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    print_summary(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Đã ghi kết quả: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,514 @@
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+
+from protocol import Message
+from rooms import is_room
+from voice_codec import parse_voice_chunk
+
+# === LỊCH SỬ TIN NHẮN: LOG GHI NỐI TIẾP CHIA ĐOẠN (phía server) ===
+#
+# Mọi TEXTMSG / VOICEMSG / VOICECHUNK / FILE được ghi nối tiếp vào các tệp đoạn (segment)
+# trong thư mục lịch sử: "<seq đầu>.log", đầy SEGMENT_BYTES thì mở đoạn mới, quá MAX_SEGMENTS
+# thì xóa đoạn cũ nhất. Mỗi bản ghi:
+#   header RECORD (crc32, seq, thời gian, flags, offline, độ dài các trường) + kind + sender + receiver + body
+# crc32 phủ mọi thứ sau nó: khi khởi động, phần đuôi ghi dở (server tắt giữa chừng) bị cắt bỏ.
+#
+# Đường chuyển tiếp tin KHÔNG ghi đĩa: append() chỉ cấp seq, tính vị trí trong đoạn và giữ tham
+# chiếu tới buffer nhận (retain, không sao chép). Một luồng ghi riêng gom các bản ghi chờ và
+# ghi theo lô mỗi FLUSH_INTERVAL giây (hoặc khi đủ FLUSH_BYTES, hoặc ngay khi read() cần một bản ghi
+# chưa được ghi).
+#
+# Chỉ mục trong RAM (dựng lại từ các đoạn khi khởi động):
+#   - theo cuộc trò chuyện ("ALL" hoặc cặp tên): mảng seq + mảng thời gian, tìm trang bằng bisect,
+#     và seq bản ghi đầu của tin chứa từng bản ghi (các đoạn VOICECHUNK của một tin thoại trỏ về
+#     đoạn đầu), để một trang lịch sử không bao giờ cắt đôi một tin thoại gửi dần
+#   - vị trí: seq -> (đoạn, offset) qua mảng offset của từng đoạn (seq trong một đoạn liên tiếp)
+#   - hộp thư offline: tin riêng gửi lúc người nhận không online, con trỏ "đã giao" của từng
+#     người được luồng ghi lưu trong cursors.json
+
+SEGMENT_BYTES = 16 * 1024 * 1024
+MAX_SEGMENTS = 64             # ~1 GB lịch sử
+FLUSH_INTERVAL = 0.05         # giây
+FLUSH_BYTES = 1024 * 1024
+CURSORS_FILE = "cursors.json"
+MAX_OPEN_VOICES = 10000       # tin thoại gửi dần chưa thấy đoạn cuối (người gửi mất kết nối giữa chừng)
+
+RECORD = struct.Struct("!IQdBBHHHI")  # crc32, seq, ts, flags, offline, len kind/sender/receiver, len body
+CRC_SIZE = 4
+
+
+def conversation_key(sender, receiver):
+    """"ALL" cho chat nhóm, tên phòng cho phòng ("#ten"), cặp tên (sắp xếp) cho chat riêng."""
+    if receiver == "ALL" or is_room(receiver):
+        return receiver
+    return (sender, receiver) if sender <= receiver else (receiver, sender)
+
+
+class LogRecord:
+    """Một tin nhắn đã lưu (body là memoryview / bytes)."""
+
+    __slots__ = ("seq", "ts", "kind", "sender", "receiver", "body", "flags", "offline")
+
+    def __init__(self, seq, ts, kind, sender, receiver, body, flags=0, offline=False):
+        self.seq = seq
+        self.ts = ts
+        self.kind = kind
+        self.sender = sender
+        self.receiver = receiver
+        self.body = body
+        self.flags = flags
+        self.offline = offline
+
+    def to_message(self):
+        return Message(self.kind, self.sender, self.receiver, self.body, flags=self.flags)
+
+    def __repr__(self):
+        return f"LogRecord(#{self.seq} {self.kind}, {self.sender!r} -> {self.receiver!r}, {len(self.body)} bytes)"
+
+
+def encode_record(seq, ts, kind, sender, receiver, body, flags=0, offline=False):
+    """Bản ghi -> (header + các trường tên, body); body không bị sao chép."""
+    names = kind.encode('utf-8') + sender.encode('utf-8') + receiver.encode('utf-8')
+    header = RECORD.pack(0, seq, ts, flags, int(offline), len(kind.encode('utf-8')), len(sender.encode('utf-8')),
+                         len(receiver.encode('utf-8')), len(body))
+    head = bytearray(header + names)
+    crc = zlib.crc32(body, zlib.crc32(memoryview(head)[CRC_SIZE:]))
+    struct.pack_into("!I", head, 0, crc)
+    return bytes(head), body
+
+
+def voice_chunk_key(kind, sender, body):
+    """Bản ghi VOICECHUNK -> ((người gửi, vid), số thứ tự đoạn, đoạn cuối?, body đoạn), ngược lại None."""
+    if kind != "VOICECHUNK":
+        return None
+    chunk = parse_voice_chunk(body)
+    if chunk is None:
+        return None
+    vid, index, final, chunk_body = chunk
+    return (sender, vid), index, final, chunk_body
+
+
+def record_size(kind, sender, receiver, body):
+    return RECORD.size + len(kind.encode('utf-8')) + len(sender.encode('utf-8')) + \
+        len(receiver.encode('utf-8')) + len(body)
+
+
+def iter_records(view, verify=True):
+    """
+    Duyệt các bản ghi liên tiếp trong 'view' (nội dung một đoạn, hoặc body HISTORY gửi cho client).
+    Body là memoryview cắt từ 'view'. Dừng ở bản ghi hỏng / thiếu (đuôi ghi dở).
+    """
+    view = memoryview(view)
+    pos = 0
+    while pos + RECORD.size <= len(view):
+        crc, seq, ts, flags, offline, klen, slen, rlen, blen = RECORD.unpack_from(view, pos)
+        start = pos + RECORD.size
+        end = start + klen + slen + rlen + blen
+        if end > len(view):
+            return
+        if verify and zlib.crc32(view[pos + CRC_SIZE:end]) != crc:
+            return
+        names = bytes(view[start:start + klen + slen + rlen])
+        kind = names[:klen].decode('utf-8', errors='ignore')
+        sender = names[klen:klen + slen].decode('utf-8', errors='ignore')
+        receiver = names[klen + slen:].decode('utf-8', errors='ignore')
+        yield pos, end - pos, LogRecord(seq, ts, kind, sender, receiver, view[end - blen:end], flags, bool(offline))
+        pos = end
+
+
+class _Segment:
+    """Một tệp đoạn: seq đầu tiên và offset của từng bản ghi (seq liên tiếp)."""
+
+    __slots__ = ("base", "path", "size", "offsets", "sizes", "dropped")
+
+    def __init__(self, base, path, size=0):
+        self.base = base
+        self.path = path
+        self.size = size
+        self.offsets = array('Q')
+        self.sizes = array('I')
+        self.dropped = False  # đã bị xóa theo MAX_SEGMENTS (bản ghi còn chờ ghi thì bỏ)
+
+    @property
+    def end(self):
+        """seq kế tiếp sau đoạn này."""
+        return self.base + len(self.offsets)
+
+
+class MessageLog:
+    """
+    Kho tin nhắn bền vững của server. append() gọi được khi đang giữ 'clients_lock' (không I/O);
+    history() / take_offline() đọc đĩa (chặn), gọi ngoài lock và ngoài event loop.
+    """
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, max_segments=MAX_SEGMENTS,
+                 flush_interval=FLUSH_INTERVAL, fsync=False):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self._cond = threading.Condition()
+        self.segments = []
+        self.conversations = {}   # key -> (array seq, array ts, array seq đầu của tin)
+        self.offline = {}         # username -> array seq chưa giao
+        self.cursors = {}         # username -> seq offline cuối cùng đã giao
+        self._cursors_dirty = False
+        self._voices = {}         # (người gửi, vid) -> seq đoạn đầu của tin thoại chưa có đoạn cuối
+        self.next_seq = 1
+        self._pending = []        # (đoạn, seq, ts, flags, offline, kind, sender, receiver, body, PooledBuffer)
+        self._pending_bytes = 0
+        self.flushed_seq = 0      # mọi seq < flushed_seq đã nằm trên đĩa
+        self._flush_now = False   # có người đang chờ đọc: luồng ghi ghi ngay, không đợi hết flush_interval
+        self._closed = False
+        # thống kê
+        self.records_written = 0
+        self.batches_written = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+        self._writer = threading.Thread(target=self._writer_loop, name="message-log", daemon=True)
+        self._writer.start()
+
+    # ---------- khởi động ----------
+    def _load(self):
+        path = os.path.join(self.directory, CURSORS_FILE)
+        try:
+            with open(path, encoding='utf-8') as f:
+                self.cursors = {name: int(seq) for name, seq in json.load(f).items()}
+        except (OSError, ValueError):
+            self.cursors = {}
+        names = sorted((n for n in os.listdir(self.directory) if n.endswith(".log")),
+                       key=lambda n: int(n[:-4]) if n[:-4].isdigit() else -1)
+        for name in names:
+            if not name[:-4].isdigit():
+                continue
+            segment = _Segment(int(name[:-4]), os.path.join(self.directory, name))
+            if self.segments and segment.base != self.segments[-1].end:
+                print(f"[HISTORY] Bỏ qua đoạn {name}: không liên tiếp với đoạn trước")
+                continue
+            with open(segment.path, "rb") as f:
+                data = f.read()
+            for offset, size, record in iter_records(data):
+                if record.seq != segment.end:
+                    break
+                segment.offsets.append(offset)
+                segment.sizes.append(size)
+                segment.size = offset + size
+                self._index(record.seq, record.ts, record.kind, record.sender, record.receiver, record.body,
+                            record.offline)
+            if segment.size < len(data):
+                # đuôi ghi dở / hỏng: cắt bỏ để ghi tiếp nối đúng chỗ
+                print(f"[HISTORY] Cắt {len(data) - segment.size} byte hỏng ở cuối {name}")
+                with open(segment.path, "r+b") as f:
+                    f.truncate(segment.size)
+            self.segments.append(segment)
+            self.next_seq = segment.end
+        self.flushed_seq = self.next_seq
+        if self.segments:
+            total = sum(len(s.offsets) for s in self.segments)
+            print(f"[HISTORY] {total} tin trong {len(self.segments)} đoạn, seq kế tiếp {self.next_seq}")
+
+    def _index(self, seq, ts, kind, sender, receiver, body, offline):
+        seqs, times, starts = self.conversations.setdefault(conversation_key(sender, receiver),
+                                                            (array('Q'), array('d'), array('Q')))
+        seqs.append(seq)
+        times.append(ts)
+        starts.append(self._message_start(seq, kind, sender, body))
+        if offline and seq > self.cursors.get(receiver, 0):
+            self.offline.setdefault(receiver, array('Q')).append(seq)
+
+    def _message_start(self, seq, kind, sender, body):
+        """seq bản ghi đầu của tin chứa bản ghi 'seq' (khác 'seq' chỉ với đoạn sau của tin thoại gửi dần)."""
+        chunk = voice_chunk_key(kind, sender, body)
+        if chunk is None:
+            return seq
+        key, index, final, _ = chunk
+        start = seq if index == 0 else self._voices.pop(key, seq)
+        if not final:
+            self._voices[key] = start
+            if len(self._voices) > MAX_OPEN_VOICES:
+                del self._voices[next(iter(self._voices))]
+        return start
+
+    # ---------- ghi ----------
+    def append(self, msg, offline=False):
+        """
+        Thêm tin nhắn (Message đã có sender / receiver là tên) vào log, trả về seq.
+        Không sao chép body, không I/O: buffer nhận được giữ lại tới khi luồng ghi xong.
+        'offline': tin riêng mà người nhận không online (giao khi họ kết nối lại).
+        """
+        kind, sender, receiver, body = msg.kind, msg.sender, msg.receiver, msg.body
+        size = record_size(kind, sender, receiver, body)
+        with self._cond:
+            if self._closed:
+                return None
+            seq = self.next_seq
+            self.next_seq += 1
+            ts = time.time()
+            segment = self.segments[-1] if self.segments else None
+            if segment is None or (segment.offsets and segment.size + size > self.segment_bytes):
+                segment = self._roll_locked(seq)
+            segment.offsets.append(segment.size)
+            segment.sizes.append(size)
+            segment.size += size
+            self._index(seq, ts, kind, sender, receiver, body, offline)
+            if msg.buffer is not None:
+                msg.buffer.retain()
+            self._pending.append((segment, seq, ts, msg.flags, offline, kind, sender, receiver, body, msg.buffer))
+            self._pending_bytes += size
+            if self._pending_bytes >= FLUSH_BYTES:
+                self._cond.notify_all()
+        return seq
+
+    def _roll_locked(self, seq):
+        segment = _Segment(seq, os.path.join(self.directory, f"{seq:020d}.log"))
+        self.segments.append(segment)
+        while len(self.segments) > self.max_segments:
+            old = self.segments.pop(0)
+            old.dropped = True
+            try:
+                os.remove(old.path)
+            except OSError:
+                pass
+            print(f"[HISTORY] Xóa đoạn cũ {os.path.basename(old.path)}")
+            # bỏ các seq đã bị xóa khỏi chỉ mục
+            first = self.segments[0].base
+            for key, (seqs, times, starts) in list(self.conversations.items()):
+                cut = bisect_left(seqs, first)
+                if cut == len(seqs):
+                    del self.conversations[key]
+                elif cut:
+                    del seqs[:cut]
+                    del times[:cut]
+                    del starts[:cut]
+        return segment
+
+    def _writer_loop(self):
+        files = {}  # đường dẫn -> tệp đang mở (ghi nối tiếp)
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending_bytes >= FLUSH_BYTES or self._flush_now or self._closed,
+                                    self.flush_interval)
+                batch, self._pending = self._pending, []
+                self._pending_bytes = 0
+                self._flush_now = False
+                closed = self._closed
+                cursors = None
+                if self._cursors_dirty:
+                    cursors, self._cursors_dirty = dict(self.cursors), False
+            if batch:
+                self._write_batch(batch, files)
+                with self._cond:
+                    self.flushed_seq = batch[-1][1] + 1
+                    self.records_written += len(batch)
+                    self.batches_written += 1
+                    self._cond.notify_all()
+            if cursors is not None:
+                self._save_cursors(cursors)
+            if closed and not batch:
+                break
+        for f in files.values():
+            f.close()
+
+    def _write_batch(self, batch, files):
+        try:
+            for segment, seq, ts, flags, offline, kind, sender, receiver, body, buffer in batch:
+                if segment.dropped:
+                    continue
+                f = files.get(segment.path)
+                if f is None:
+                    # chỉ giữ mở tệp của đoạn mới nhất
+                    for path in list(files):
+                        self._flush_file(files.pop(path))
+                    f = files[segment.path] = open(segment.path, "ab")
+                f.writelines(encode_record(seq, ts, kind, sender, receiver, body, flags, offline))
+            for f in files.values():
+                self._flush_file(f, close=False)
+        except OSError as e:
+            print(f"[HISTORY] Lỗi ghi log: {e}")
+        finally:
+            for item in batch:
+                if item[-1] is not None:
+                    item[-1].release()
+
+    def _save_cursors(self, cursors):
+        path = os.path.join(self.directory, CURSORS_FILE)
+        try:
+            with open(path + ".tmp", "w", encoding='utf-8') as f:
+                json.dump(cursors, f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"[HISTORY] Không lưu được con trỏ offline: {e}")
+
+    def _flush_file(self, f, close=True):
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+        if close:
+            f.close()
+
+    def sync(self, timeout=5.0, target=None):
+        """
+        Chờ tới khi mọi bản ghi có seq < 'target' (mặc định: mọi bản ghi đã append()) nằm trên đĩa.
+        Luồng ghi được đánh thức để ghi ngay lô đang chờ.
+        """
+        with self._cond:
+            if target is None:
+                target = self.next_seq
+            if self.flushed_seq >= target:
+                return True
+            self._flush_now = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self.flushed_seq >= target or self._closed, timeout)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.join()
+
+    # ---------- đọc ----------
+    def _locate_locked(self, seq):
+        bases = [s.base for s in self.segments]
+        i = bisect_right(bases, seq) - 1
+        if i < 0 or seq >= self.segments[i].end:
+            return None
+        segment = self.segments[i]
+        return segment.path, segment.offsets[seq - segment.base], segment.sizes[seq - segment.base]
+
+    def read(self, seqs):
+        """Đọc các bản ghi theo seq (tăng dần), bỏ qua seq đã bị xóa theo MAX_SEGMENTS."""
+        if not len(seqs):
+            return []
+        # chỉ chờ khi chính các bản ghi cần đọc chưa được ghi (thường đã nằm trên đĩa từ lâu)
+        self.sync(target=seqs[-1] + 1)
+        with self._cond:
+            locations = [loc for loc in map(self._locate_locked, seqs) if loc is not None]
+        records = []
+        files = {}
+        try:
+            for path, offset, size in locations:
+                f = files.get(path)
+                if f is None:
+                    try:
+                        f = files[path] = open(path, "rb")
+                    except FileNotFoundError:
+                        continue  # đoạn vừa bị xóa
+                f.seek(offset)
+                data = f.read(size)
+                for _, _, record in iter_records(data):
+                    records.append(record)
+        finally:
+            for f in files.values():
+                f.close()
+        return records
+
+    def _bounds_locked(self, key, since):
+        """(seq, ts, seq đầu tin) của cuộc trò chuyện 'key' và chỉ số bản ghi cũ nhất còn đọc được."""
+        seqs, times, starts = self.conversations.get(key, (array('Q'), array('d'), array('Q')))
+        first = self.segments[0].base if self.segments else self.next_seq
+        low = bisect_left(seqs, first)
+        if since is not None:
+            low = max(low, bisect_left(times, since))
+        return seqs, starts, low
+
+    def history(self, key, before=None, limit=50, since=None, max_bytes=None):
+        """
+        Một trang lịch sử của cuộc trò chuyện 'key' (conversation_key): tối đa 'limit' tin có
+        seq < 'before' (None = mới nhất), thời gian >= 'since', tổng body <= 'max_bytes'.
+        Trang luôn bắt đầu ở đầu một tin: không cắt đôi các đoạn VOICECHUNK của một tin thoại
+        (xem _whole_messages). Trả về (bản ghi theo thứ tự cũ -> mới, còn tin cũ hơn không).
+        """
+        with self._cond:
+            seqs, _, low = self._bounds_locked(key, since)
+            high = len(seqs) if before is None else bisect_left(seqs, before)
+            wanted = seqs[max(low, high - limit):high]
+        records = self.read(wanted)
+        if max_bytes is not None:
+            total = 0
+            for i in range(len(records) - 1, -1, -1):
+                total += len(records[i].body)
+                if total > max_bytes and i < len(records) - 1:
+                    records = records[i + 1:]
+                    break
+        records = self._whole_messages(key, since, records)
+        if not records:
+            return records, False
+        with self._cond:
+            seqs, _, low = self._bounds_locked(key, since)
+            return records, bisect_left(seqs, records[0].seq) > low
+
+    def _whole_messages(self, key, since, records):
+        """
+        Bỏ phần đầu trang thuộc các tin thoại đã bắt đầu ở trang cũ hơn (cùng các tin xen giữa):
+        chúng nằm trọn trong trang đó. Nếu cả trang là phần sau của một tin thoại dài thì ngược lại,
+        lùi đầu trang về đoạn đầu của tin (trang dài hơn 'limit' / 'max_bytes').
+        """
+        if not records:
+            return records
+        with self._cond:
+            seqs, starts, low = self._bounds_locked(key, since)
+            start_of = {r.seq: starts[i] for r in records
+                        if (i := bisect_left(seqs, r.seq)) < len(seqs) and seqs[i] == r.seq}
+            cut = 0
+            while cut < len(records):
+                page_first = records[cut].seq
+                open_until = [i for i in range(cut, len(records)) if start_of.get(records[i].seq, page_first) < page_first]
+                if not open_until:
+                    return records[cut:]
+                cut = open_until[-1] + 1
+            # Lùi về đoạn đầu của các tin còn dở (có thể kéo theo tin khác bắt đầu còn sớm hơn)
+            begin = end = bisect_left(seqs, records[0].seq)
+            target = min(start_of.get(r.seq, r.seq) for r in records)
+            while True:
+                new_begin = max(low, bisect_left(seqs, target))
+                if new_begin >= begin:
+                    break
+                target = min(target, min(starts[new_begin:begin]))
+                begin = new_begin
+            older = seqs[begin:end]
+        return self.read(older) + records
+
+    def take_offline(self, username):
+        """Các tin riêng gửi tới 'username' khi họ offline (chưa giao), theo thứ tự."""
+        with self._cond:
+            seqs = self.offline.get(username)
+            if not seqs:
+                return []
+            seqs = array('Q', seqs)
+        return self.read(seqs)
+
+    def mark_delivered(self, username, seq):
+        """
+        Đã giao các tin offline tới 'seq': bỏ khỏi hộp thư. Không I/O (gọi được từ writer của kết nối /
+        event loop): luồng ghi lưu con trỏ xuống đĩa ở lần ghi kế tiếp.
+        """
+        with self._cond:
+            seqs = self.offline.get(username)
+            if seqs is not None:
+                remaining = seqs[bisect_right(seqs, seq):]
+                if remaining:
+                    self.offline[username] = remaining
+                else:
+                    del self.offline[username]
+            if seq > self.cursors.get(username, 0):
+                self.cursors[username] = seq
+                self._cursors_dirty = True
+
+    def stats(self):
+        with self._cond:
+            return {
+                "segments": len(self.segments),
+                "bytes": sum(s.size for s in self.segments),
+                "next_seq": self.next_seq,
+                "pending": len(self._pending),
+                "records_written": self.records_written,
+                "batches_written": self.batches_written,
+                "offline_users": len(self.offline),
+            }
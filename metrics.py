@@ -0,0 +1,216 @@
+import threading
+import time
+from collections import deque
+
+# === SỐ LIỆU ĐO CỦA SERVER (counter / histogram) ===
+#
+# Thay cho việc đọc các dòng print(): server đếm frame / byte theo loại tin (vào và ra, kèm tốc độ
+# trong RATE_WINDOW giây gần nhất), đo độ trễ chuyển tiếp (từ lúc bắt đầu định tuyến tới lần gửi
+# cuối cùng), thời gian chờ 'clients_lock' và độ sâu hàng đợi gửi của từng kết nối.
+# Ảnh chụp (snapshot) lấy qua tin quản trị STATS (JSON) hoặc cổng thống kê cục bộ (--stats-port):
+# gửi "json" để nhận JSON, còn lại là dạng text "ten{nhan} gia_tri" mỗi dòng một số (dễ scrape).
+#
+# Histogram chia bucket theo lũy thừa 2 của micro giây: observe() O(1), không giữ từng mẫu,
+# phân vị tính từ bucket (sai số tối đa 2 lần ở bucket chứa phân vị, đủ để theo dõi).
+
+RATE_WINDOW = 10   # giây
+HISTOGRAM_BUCKETS = 32
+
+
+class Histogram:
+    """Histogram độ trễ (giây), bucket i chứa các giá trị < 2**i micro giây."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        index = min(int(seconds * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)
+        with self._lock:
+            self.buckets[index] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, q, buckets=None, count=None):
+        """Cận trên (giây) của bucket chứa phân vị 'q'."""
+        buckets = self.buckets if buckets is None else buckets
+        count = self.count if count is None else count
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for index, n in enumerate(buckets):
+            seen += n
+            if seen >= rank:
+                return (1 << index) / 1e6
+        return self.max
+
+    def snapshot(self):
+        with self._lock:
+            buckets, count, total, peak = list(self.buckets), self.count, self.total, self.max
+        return {
+            "count": count,
+            "avg_ms": total / count * 1000 if count else 0.0,
+            "p50_ms": min(self.percentile(0.5, buckets, count), peak) * 1000,
+            "p90_ms": min(self.percentile(0.9, buckets, count), peak) * 1000,
+            "p99_ms": min(self.percentile(0.99, buckets, count), peak) * 1000,
+            "max_ms": peak * 1000,
+        }
+
+
+class KindCounters:
+    """Số frame / byte theo loại tin: tổng từ lúc chạy và tốc độ trong RATE_WINDOW giây gần nhất."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = {}    # kind -> [frames, bytes]
+        self._recent = {}   # kind -> deque [giây, frames, bytes]
+
+    def add(self, kind, nbytes, frames=1):
+        now = int(time.monotonic())
+        with self._lock:
+            total = self.totals.get(kind)
+            if total is None:
+                total = self.totals[kind] = [0, 0]
+                self._recent[kind] = deque()
+            total[0] += frames
+            total[1] += nbytes
+            recent = self._recent[kind]
+            if recent and recent[-1][0] == now:
+                recent[-1][1] += frames
+                recent[-1][2] += nbytes
+            else:
+                recent.append([now, frames, nbytes])
+                while recent[0][0] <= now - RATE_WINDOW:
+                    recent.popleft()
+
+    def snapshot(self):
+        # chỉ tính các giây đã trọn vẹn: [now - RATE_WINDOW, now)
+        now = int(time.monotonic())
+        result = {}
+        with self._lock:
+            for kind, (frames, nbytes) in self.totals.items():
+                window = [r for r in self._recent[kind] if now - RATE_WINDOW <= r[0] < now]
+                result[kind] = {
+                    "frames": frames,
+                    "bytes": nbytes,
+                    "frames_per_s": sum(r[1] for r in window) / RATE_WINDOW,
+                    "bytes_per_s": sum(r[2] for r in window) / RATE_WINDOW,
+                }
+        return result
+
+
+class TimedLock:
+    """
+    threading.Lock đo thời gian chờ: lần lấy lock không phải chờ chỉ tốn một acquire(False);
+    lần phải chờ được đếm vào 'contended' và ghi thời gian chờ vào histogram.
+    """
+
+    def __init__(self, histogram):
+        self._lock = threading.Lock()
+        self.histogram = histogram
+        self.acquired = 0
+        self.contended = 0
+
+    def acquire(self):
+        if not self._lock.acquire(False):
+            start = time.perf_counter()
+            self._lock.acquire()
+            self.histogram.observe(time.perf_counter() - start)
+            self.contended += 1
+        self.acquired += 1
+        return True
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+    def snapshot(self):
+        return {"acquired": self.acquired, "contended": self.contended, "wait": self.histogram.snapshot()}
+
+
+_trace_lock = threading.Lock()
+
+
+class RelayTrace:
+    """
+    Đo độ trễ chuyển tiếp của MỘT tin nhắn: Message giữ một tham chiếu (tới khi định tuyến xong),
+    mỗi hàng đợi gửi giữ thêm một tham chiếu qua frame (retain / release như buffer nhận).
+    Tham chiếu cuối cùng được trả (người nhận cuối cùng đã gửi xong) -> ghi vào histogram.
+    """
+
+    __slots__ = ("histogram", "start", "refs")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = time.perf_counter()
+        self.refs = 1
+
+    def retain(self):
+        with _trace_lock:
+            self.refs += 1
+
+    def release(self):
+        with _trace_lock:
+            self.refs -= 1
+            done = self.refs == 0
+        if done:
+            self.histogram.observe(time.perf_counter() - self.start)
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def format_text(snapshot, prefix="voicechat"):
+    """Snapshot (dict lồng nhau) -> text, mỗi dòng "ten{nhan="..."} gia_tri"."""
+    lines = []
+    for key in ("uptime_s", "connections", "users", "rooms"):
+        lines.append(f"{prefix}_{key} {snapshot[key]}")
+    for direction in ("in", "out"):
+        for kind, values in sorted(snapshot["frames"][direction].items()):
+            for name, value in values.items():
+                lines.append(f'{prefix}_{direction}_{name}{{kind="{_label(kind)}"}} {value:g}')
+    for name, hist in (("relay_latency", snapshot["relay_latency"]), ("lock_wait", snapshot["lock"]["wait"])):
+        for stat, value in hist.items():
+            lines.append(f"{prefix}_{name}_{stat} {value:g}")
+    lines.append(f"{prefix}_lock_acquired {snapshot['lock']['acquired']}")
+    lines.append(f"{prefix}_lock_contended {snapshot['lock']['contended']}")
+    queues = snapshot["queues"]
+    for key in ("frames", "bytes", "largest_bytes", "dropped"):
+        lines.append(f"{prefix}_queue_{key} {queues[key]}")
+    for conn in queues["connections"]:
+        labels = f'user="{_label(conn["user"])}",addr="{_label(conn["addr"])}"'
+        for key in ("frames", "bytes", "dropped"):
+            lines.append(f"{prefix}_conn_queue_{key}{{{labels}}} {conn[key]}")
+    for key, value in (snapshot.get("history") or {}).items():
+        lines.append(f"{prefix}_history_{key} {value}")
+    for key, value in (snapshot.get("admission") or {}).items():
+        lines.append(f"{prefix}_admission_{key} {value}")
+    compression = snapshot.get("compression") or {}
+    for kind, values in sorted(compression.get("kinds", {}).items()):
+        for name, value in values.items():
+            lines.append(f'{prefix}_compressed_{name}{{kind="{_label(kind)}"}} {value:g}')
+    for key in ("inflated", "inflated_bytes", "errors"):
+        if key in compression:
+            lines.append(f"{prefix}_compression_{key} {compression[key]}")
+    bus = snapshot.get("bus") or {}
+    labels = ",".join(f'{key}="{_label(value)}"' for key, value in bus.items() if isinstance(value, str))
+    for key, value in bus.items():
+        if isinstance(value, (int, float)):
+            lines.append(f"{prefix}_bus_{key}{{{labels}}} {value}")
+    for peer in bus.get("peers", ()):
+        labels = f'node="{_label(peer["node"])}",addr="{_label(peer["addr"])}"'
+        for key in ("users", "queue_frames", "queue_bytes"):
+            lines.append(f"{prefix}_peer_{key}{{{labels}}} {peer[key]}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,256 @@
+import threading
+from collections import OrderedDict, deque
+
+from protocol import PRIORITIES, can_slice, slice_frame
+
+# === CHÍNH SÁCH KHI HÀNG ĐỢI GỬI BỊ ĐẦY ===
+POLICY_DROP = "drop"                  # Bỏ frame mới, đếm vào 'dropped'
+POLICY_DISCONNECT = "disconnect"      # Ngắt kết nối client nhận quá chậm
+POLICY_BACKPRESSURE = "backpressure"  # Bắt NGƯỜI GỬI chờ (ngoài lock) cho tới khi có chỗ
+POLICIES = (POLICY_DROP, POLICY_DISCONNECT, POLICY_BACKPRESSURE)
+
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024   # 8 MB đang chờ gửi cho mỗi kết nối
+DEFAULT_BACKPRESSURE_TIMEOUT = 10.0   # Chờ tối đa bao lâu trước khi coi người nhận là "chết"
+
+# === THỨ TỰ GỬI ===
+# Frame được xếp theo lớp ưu tiên (protocol.PRIORITY_*): lớp cao hơn luôn được gửi trước, trừ khi lớp
+# thấp hơn đã chờ quá STARVATION_LIMIT lượt liên tiếp (khi đó được gửi một lượt). Trong một lớp, mỗi
+# người gửi (frame.flow) có hàng riêng, các hàng được phục vụ xoay vòng theo số byte (deficit round
+# robin, FAIR_QUANTUM mỗi lượt): người gửi tệp lớn không chiếm hết đường truyền của người khác.
+# Thứ tự các frame của CÙNG một người gửi trong cùng lớp được giữ nguyên.
+# Với slice_bytes > 0 (client hiểu FLAG_MORE), frame v2 lớn được gửi thành từng lát slice_bytes, nên
+# tin chữ chỉ phải chờ tối đa một lát chứ không phải cả tệp.
+DEFAULT_SLICE_BYTES = 64 * 1024
+FAIR_QUANTUM = 64 * 1024
+STARVATION_LIMIT = 32
+
+
+class _Flow:
+    """Hàng frame của một người gửi trong một lớp ưu tiên."""
+
+    __slots__ = ("items", "deficit", "offset")
+
+    def __init__(self):
+        self.items = deque()
+        self.deficit = FAIR_QUANTUM
+        self.offset = 0           # số byte body của frame đầu hàng đã gửi (đang gửi theo lát)
+
+
+class OutboundQueue:
+    """
+    Hàng đợi gửi đi có giới hạn (theo số byte) của MỘT kết nối.
+
+    Các hàm fan-out (broadcast_message, send_to_user_only...) chỉ gọi offer(),
+    không bao giờ chặn, nên có thể gọi khi đang giữ 'clients_lock'.
+    Một writer riêng (luồng hoặc task asyncio) lấy frame ra bằng get()/get_nowait()
+    và thực hiện việc gửi chậm chạp qua socket.
+
+    Frame nằm trong hàng đợi được giữ bằng frame.retain() (buffer nhận dùng chung không bị
+    trả về pool); writer gọi frame.release() sau khi gửi xong, còn frame bị hủy khi đóng
+    hàng đợi thì được release() tại đây. Lát của frame lớn (slice_bytes) cũng được writer
+    release() như frame thường.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, policy=POLICY_BACKPRESSURE, slice_bytes=0):
+        if policy not in POLICIES:
+            raise ValueError(f"policy không hợp lệ: {policy!r}")
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.slice_bytes = slice_bytes  # 0 = không cắt lát
+        self.nbytes = 0       # Tổng số byte đang chờ gửi
+        self.dropped = 0      # Số frame bị bỏ (policy drop)
+        self.closed = False
+        self.close_reason = None
+        self._count = 0
+        self._classes = [OrderedDict() for _ in PRIORITIES]  # lớp -> {flow: _Flow}
+        self._streak = 0      # số lượt liên tiếp lớp cao được gửi trong khi lớp thấp hơn đang chờ
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        # Callback (không tham số) cho engine asyncio: gọi sau khi có dữ liệu mới / có thêm chỗ trống.
+        # Được gọi NGOÀI lock nội bộ, có thể từ bất kỳ luồng nào.
+        self.on_data = None
+        self.on_space = None
+        # Callback on_close(reason): engine dùng để cắt socket, kể cả khi writer đang kẹt trong lệnh gửi
+        self.on_close = None
+
+    def __len__(self):
+        return self._count
+
+    def _has_space(self, n):
+        # Luôn nhận frame nếu hàng đợi rỗng, để frame lớn hơn max_bytes vẫn đi được
+        return self.nbytes == 0 or self.nbytes + n <= self.max_bytes
+
+    def has_space(self, n):
+        with self._lock:
+            return self.closed or self._has_space(n)
+
+    def _append(self, frame):
+        frame.retain()
+        flows = self._classes[frame.priority]
+        flow = flows.get(frame.flow)
+        if flow is None:
+            flow = flows[frame.flow] = _Flow()
+        flow.items.append(frame)
+        self._count += 1
+        self.nbytes += len(frame)
+        self._not_empty.notify()
+
+    def offer(self, frame):
+        """
+        Thử đưa frame vào hàng đợi mà KHÔNG chặn.
+        Trả về False chỉ khi policy là backpressure và hàng đợi đầy:
+        khi đó người gọi phải chờ bằng put_wait() (hoặc bản asyncio) sau khi nhả lock.
+        """
+        with self._lock:
+            if self.closed:
+                return True
+            if self._has_space(len(frame)):
+                self._append(frame)
+                queued = True
+            elif self.policy == POLICY_DROP:
+                self.dropped += 1
+                return True
+            elif self.policy == POLICY_DISCONNECT:
+                self._close_locked("overflow")
+                queued = False
+            else:
+                return False
+        self._notify(queued)
+        if not queued:
+            self._fire_close()
+        return True
+
+    def put_wait(self, frame, timeout=DEFAULT_BACKPRESSURE_TIMEOUT):
+        """
+        Đưa frame vào hàng đợi, chặn tối đa 'timeout' giây chờ chỗ trống (backpressure).
+        Hết thời gian mà vẫn đầy: người nhận bị coi là chết và hàng đợi bị đóng.
+        """
+        with self._lock:
+            if not self._not_full.wait_for(lambda: self.closed or self._has_space(len(frame)), timeout):
+                self._close_locked("backpressure timeout")
+                queued = False
+            elif self.closed:
+                return False
+            else:
+                self._append(frame)
+                queued = True
+        self._notify(queued)
+        if not queued:
+            self._fire_close()
+        return queued
+
+    def force_put(self, frame):
+        """Đưa frame vào bất kể giới hạn (dùng sau khi đã chờ chỗ trống ở engine asyncio)."""
+        with self._lock:
+            if self.closed:
+                return False
+            self._append(frame)
+        self._notify(True)
+        return True
+
+    def get(self, timeout=None):
+        """Lấy frame tiếp theo (chặn). Trả về None nếu hàng đợi đã đóng hoặc hết thời gian."""
+        with self._lock:
+            self._not_empty.wait_for(lambda: self.closed or self._count, timeout)
+            if self.closed or not self._count:
+                return None
+            frame = self._pop_locked()
+        self._notify_space()
+        return frame
+
+    def get_nowait(self):
+        """Lấy frame tiếp theo nếu có, ngược lại trả về None (không chặn)."""
+        with self._lock:
+            if self.closed or not self._count:
+                return None
+            frame = self._pop_locked()
+        self._notify_space()
+        return frame
+
+    def _pick_class_locked(self):
+        waiting = [flows for flows in self._classes if flows]
+        if len(waiting) == 1:
+            self._streak = 0
+            return waiting[0]
+        self._streak += 1
+        if self._streak > STARVATION_LIMIT:
+            self._streak = 0
+            return waiting[-1]
+        return waiting[0]
+
+    def _pop_locked(self):
+        """Frame (hoặc lát) tiếp theo theo lớp ưu tiên, rồi xoay vòng giữa các người gửi."""
+        flows = self._pick_class_locked()
+        key, flow = next(iter(flows.items()))
+        while flow.deficit <= 0:
+            flow.deficit += FAIR_QUANTUM
+            flows.move_to_end(key)
+            key, flow = next(iter(flows.items()))
+        frame = flow.items[0]
+        if self.slice_bytes and (flow.offset or len(frame) > self.slice_bytes + len(frame.header)) \
+                and can_slice(frame):
+            piece, last = slice_frame(frame, flow.offset, self.slice_bytes)
+            body = len(piece) - len(piece.header)
+            flow.offset += body
+            self.nbytes -= body
+            if last:
+                piece.trace = frame.trace  # độ trễ chuyển tiếp tính tới lát cuối
+                piece.on_sent = frame.on_sent
+            piece.retain()
+            if not last:
+                flow.deficit -= len(piece)
+                self._not_full.notify_all()
+                return piece
+            # Lát cuối: trả tham chiếu của hàng đợi tới frame gốc (các lát giữ tham chiếu riêng)
+            self.nbytes -= len(frame.header)
+            frame.release()
+            frame, flow.offset = piece, 0
+        else:
+            self.nbytes -= len(frame)
+        flow.items.popleft()
+        self._count -= 1
+        flow.deficit -= len(frame)
+        if not flow.items:
+            del flows[key]
+        self._not_full.notify_all()
+        return frame
+
+    def close(self, reason="closed"):
+        with self._lock:
+            if self.closed:
+                return
+            self._close_locked(reason)
+        self._notify(False)
+        self._fire_close()
+
+    def _close_locked(self, reason):
+        self.closed = True
+        self.close_reason = reason
+        for flows in self._classes:
+            for flow in flows.values():
+                for frame in flow.items:
+                    frame.release()
+            flows.clear()
+        self._count = 0
+        self.nbytes = 0
+        self._not_empty.notify_all()
+        self._not_full.notify_all()
+
+    def _notify(self, queued):
+        # queued=False nghĩa là trạng thái đóng thay đổi: đánh thức cả writer lẫn người đang chờ chỗ
+        if self.on_data:
+            self.on_data()
+        if not queued and self.on_space:
+            self.on_space()
+
+    def _fire_close(self):
+        if self.on_close:
+            try:
+                self.on_close(self.close_reason)
+            except Exception:
+                pass
+
+    def _notify_space(self):
+        if self.on_space:
+            self.on_space()
@@ -0,0 +1,89 @@
+# === DANH SÁCH ONLINE DẠNG DELTA (PRESENCE) ===
+#
+# Thay vì gửi lại cả USERLIST cho mọi người mỗi khi có người vào / ra (O(N) mỗi lần, O(N²) khi
+# cả phòng kết nối lại), server gửi cho client v2:
+#   PRESENCE::snapshot::<version>::id:ten,id:ten,...     một lần khi client vừa vào (hoặc khi yêu cầu)
+#   PRESENCE::delta::<version>::+id:ten,-id:ten,...      sau đó chỉ gửi phần thay đổi
+# Các thay đổi trong PRESENCE_COALESCE giây được gộp lại thành một delta (300 người vào cùng lúc
+# = một tin), người vào rồi ra ngay trong khoảng đó không tạo ra thay đổi nào.
+# 'version' tăng 1 sau mỗi delta: client thấy nhảy version (mất delta) thì gửi "PRESENCE" rỗng
+# để xin snapshot mới. Client v1 vẫn nhận USERLIST đầy đủ (cũng đã được gộp).
+
+PRESENCE_COALESCE = 0.05
+
+SNAPSHOT = "snapshot"
+DELTA = "delta"
+
+
+def _entry(user_id, name):
+    return f"{user_id}:{name.replace(',', '')}"
+
+
+def encode_snapshot(version, users):
+    """users: list (id, ten)."""
+    entries = ",".join(_entry(user_id, name) for user_id, name in users)
+    return f"{SNAPSHOT}::{version}::{entries}".encode('utf-8')
+
+
+def encode_delta(version, joined, left):
+    """joined / left: list (id, ten)."""
+    entries = [f"+{_entry(user_id, name)}" for user_id, name in joined]
+    entries += [f"-{_entry(user_id, name)}" for user_id, name in left]
+    return f"{DELTA}::{version}::{','.join(entries)}".encode('utf-8')
+
+
+def parse_presence(body):
+    """
+    body PRESENCE -> (loai, version, joined, left) với joined / left là list (id, ten)
+    (snapshot: joined = cả danh sách), hoặc None nếu sai định dạng.
+    """
+    kind, _, rest = str(body, 'utf-8', errors='ignore').partition("::")
+    version, _, entries = rest.partition("::")
+    if kind not in (SNAPSHOT, DELTA):
+        return None
+    try:
+        version = int(version)
+    except ValueError:
+        return None
+    joined, left = [], []
+    for entry in entries.split(","):
+        target = joined
+        if kind == DELTA:
+            if entry[:1] not in ("+", "-"):
+                continue
+            target = joined if entry[0] == "+" else left
+            entry = entry[1:]
+        user_id, _, name = entry.partition(":")
+        try:
+            target.append((int(user_id), name))
+        except ValueError:
+            continue
+    return kind, version, joined, left
+
+
+class PresenceTracker:
+    """
+    Trạng thái đã thông báo cho client (phía server): tập tên online ở 'version' hiện tại.
+    diff() so với tập online thật để ra delta, nên các thay đổi xảy ra giữa hai lần diff()
+    tự được gộp lại. Lớp này KHÔNG tự khóa: người gọi phải giữ 'clients_lock' của server.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.announced = {}  # ten -> id, theo thứ tự vào
+
+    def diff(self, online):
+        """
+        online: list (id, ten) đang online. Trả về (joined, left) và chuyển sang version mới
+        nếu có thay đổi.
+        """
+        current = {name: user_id for user_id, name in online}
+        joined = [(user_id, name) for name, user_id in current.items() if name not in self.announced]
+        left = [(user_id, name) for name, user_id in self.announced.items() if name not in current]
+        if joined or left:
+            self.version += 1
+            self.announced = current
+        return joined, left
+
+    def snapshot(self):
+        return [(user_id, name) for name, user_id in self.announced.items()]
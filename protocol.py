@@ -0,0 +1,887 @@
+import socket
+import struct
+import threading
+import time
+
+from compression import COMPRESSION_FLAGS, MAX_INFLATE_BYTES, CompressionError, Inflater, inflate
+
+# === GIAO THỨC TRUYỀN TIN ===
+#
+# --- v1 (giao thức gốc, vẫn được hỗ trợ) ---
+# Mỗi tin nhắn: [HEADER][PAYLOAD]
+# - HEADER: 10 bytes, chứa độ dài của PAYLOAD (dạng text), căn trái.
+# - PAYLOAD: dữ liệu thực tế, các trường ngăn cách bởi "::".
+#   Ví dụ: TEXTMSG::nguoi_gui::nguoi_nhan::noi_dung
+#
+# --- v2 (nhị phân) ---
+# Mỗi tin nhắn: [HEADER 16 bytes][BODY]
+#   magic (1B, 0xA5) | version (1B) | type (1B) | flags (1B)
+#   length (4B) | sender_id (4B) | receiver_id (4B)       -- network byte order
+# Người gửi / người nhận là ID số do server cấp (0 = "ALL" / server),
+# nên định tuyến chỉ cần đọc header, không phải quét payload tìm "::".
+# BODY giống hệt phần nội dung sau "KIND::sender::receiver::" của v1,
+# nhờ vậy server chuyển đổi v1 <-> v2 chỉ bằng cách thay header, không sao chép body.
+# flags: FLAG_MORE (0x80) = frame này chỉ là một LÁT của body, các lát tiếp theo cùng loại / người gửi /
+# người nhận nối tiếp phía sau (lát cuối không có cờ). Server cắt tin lớn (FILE, VOICEMSG...) thành
+# lát để tin nhỏ chen vào giữa trên cùng kết nối (xem outbound.py); chỉ dùng với client đã đề nghị
+# "slices=1" trong HELLO, client ghép lại bằng SliceJoiner.
+# FLAG_ZLIB (0x01) / FLAG_LZMA (0x02) = body đã nén (thương lượng "compress=..." trong HELLO,
+# xem compression.py); lát của một body nén mang cùng cờ nén, ghép lại mới giải nén được.
+#
+# --- Thương lượng phiên bản ---
+# Client mới gửi "HELLO::proto=2" (framing v1) TRƯỚC "USERNAME::ten".
+# Server hỗ trợ v2 trả lời "HELLO::proto=2;id=<id_cua_ban>" trước USERLIST;
+# từ đó server gửi v2 cho client này, và client cũng chuyển sang gửi v2.
+# Server cũ không trả lời HELLO (chỉ in "payload không hợp lệ"), client giữ v1.
+# Byte đầu tiên của header cho biết phiên bản (v1 luôn bắt đầu bằng chữ số),
+# nên hai bên luôn đọc được cả hai loại frame.
+HEADER_SIZE = 10
+
+PROTO_V1 = 1
+PROTO_V2 = 2
+PROTO_LATEST = PROTO_V2
+
+V2_MAGIC = 0xA5
+V2_HEADER = struct.Struct("!BBBBIII")
+
+ALL_ID = 0  # receiver_id của tin nhắn nhóm "ALL" (và sender_id của tin từ server)
+
+# Mã loại tin nhắn trong header v2
+TYPE_CODES = {
+    "HELLO": 1,
+    "USERNAME": 2,
+    "USERLIST": 3,
+    "TEXTMSG": 4,
+    "VOICEMSG": 5,
+    "FILE": 6,
+    "OPENPRIVATE": 7,
+    "QUEUEDEPTH": 8,
+    "FILEOFFER": 9,
+    "FILEACCEPT": 10,
+    "FILECHUNK": 11,
+    "FILEACK": 12,
+    "FILECANCEL": 13,
+    "CALLINVITE": 14,
+    "CALLACCEPT": 15,
+    "CALLEND": 16,
+    "VOICECHUNK": 17,
+    "PRESENCE": 18,
+    "HISTORY": 19,
+    "STATS": 20,
+    "JOIN": 21,
+    "LEAVE": 22,
+    "ROOM": 23,
+}
+TYPE_NAMES = {code: kind for kind, code in TYPE_CODES.items()}
+
+# Bố cục payload v1 theo loại: số trường định tuyến (sender, receiver) và có body hay không
+#   TEXTMSG::sender::receiver::body     OPENPRIVATE::sender::receiver     USERLIST::body
+# Truyền file dạng luồng (xem transfer.py): định tuyến như TEXTMSG, body do client tự hiểu
+FILE_STREAM_KINDS = {"FILEOFFER", "FILEACCEPT", "FILECHUNK", "FILEACK", "FILECANCEL"}
+# Báo hiệu cuộc gọi UDP (xem voice_call.py): body "call_id::ip::port"
+CALL_KINDS = {"CALLINVITE", "CALLACCEPT", "CALLEND"}
+# Tin nhắn thoại gửi dần trong lúc ghi âm (xem voice_codec.py): body "vid::seq::final::" + đoạn thoại
+ROUTED_KINDS = {"TEXTMSG", "VOICEMSG", "VOICECHUNK", "FILE", "OPENPRIVATE"} | FILE_STREAM_KINDS | CALL_KINDS
+NO_BODY_KINDS = {"OPENPRIVATE"}
+# Số byte đầu payload v1 cần đọc để biết KIND (loại dài nhất + "::"), xem FrameAssembler
+KIND_PEEK = max(len(kind) for kind in TYPE_CODES) + 2
+
+FLAG_MORE = 0x80
+
+# Lớp ưu tiên khi gửi (xem outbound.OutboundQueue): lớp nhỏ hơn được gửi trước
+PRIORITY_INTERACTIVE = 0   # điều khiển, danh sách online, tin chữ, báo hiệu cuộc gọi / truyền file
+PRIORITY_STREAM = 1        # đoạn thoại gửi dần trong lúc ghi âm
+PRIORITY_BULK = 2          # tệp, tin thoại trọn gói, lịch sử
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_STREAM, PRIORITY_BULK)
+STREAM_KINDS = {"VOICECHUNK"}
+BULK_KINDS = {"FILE", "VOICEMSG", "FILECHUNK", "HISTORY"}
+INTERACTIVE_MAX_BYTES = 64 * 1024  # frame lớn hơn luôn vào lớp bulk, bất kể loại tin
+
+
+def priority_for(kind, size):
+    if kind in BULK_KINDS or size > INTERACTIVE_MAX_BYTES:
+        return PRIORITY_BULK
+    if kind in STREAM_KINDS:
+        return PRIORITY_STREAM
+    return PRIORITY_INTERACTIVE
+
+
+# Windows không có socket.sendmsg: khi đó gửi lần lượt từng buffer
+HAS_SENDMSG = hasattr(socket.socket, "sendmsg")
+
+
+class ProtocolError(Exception):
+    """Frame không hợp lệ (header hỏng, loại không xác định...)."""
+
+
+class Frame:
+    """
+    Một tin nhắn đã đóng gói, dùng chung cho MỌI người nhận.
+
+    Header và các phần payload được giữ riêng (không nối lại), nên broadcast 1 tin 5 MB
+    tới 100 người chỉ tạo đúng 1 header; payload không bị sao chép thêm lần nào.
+    len(frame) là tổng số byte sẽ đi trên dây (dùng cho việc đếm byte của hàng đợi gửi).
+
+    Nếu body trỏ vào buffer nhận lấy từ BufferPool, 'owner' là PooledBuffer đó:
+    hàng đợi gửi gọi retain() khi nhận frame và release() khi đã gửi xong / bỏ frame,
+    để buffer chỉ quay lại pool khi không còn người nhận nào cần nó.
+    'trace' (metrics.RelayTrace, nếu có) được retain / release cùng lúc để đo độ trễ chuyển tiếp.
+
+    'priority' (PRIORITY_*) và 'flow' (người gửi) quyết định thứ tự gửi trong hàng đợi của người nhận.
+    Frame tạo bằng encode_parts / encode_v1 lấy lớp ưu tiên theo loại tin, còn lại theo kích thước.
+
+    'on_sent' (hàm không tham số, tùy chọn) được writer gọi qua sent() khi frame đã thực sự lên socket
+    (frame bị bỏ / kết nối đóng trước đó thì không), ví dụ để đánh dấu tin offline đã giao.
+    """
+
+    __slots__ = ("parts", "size", "owner", "trace", "priority", "flow", "on_sent")
+
+    def __init__(self, *parts, owner=None):
+        self.parts = parts
+        self.size = sum(len(p) for p in parts)
+        self.owner = owner
+        self.trace = None
+        self.priority = PRIORITY_BULK if self.size > INTERACTIVE_MAX_BYTES else PRIORITY_INTERACTIVE
+        self.flow = None
+        self.on_sent = None
+
+    def sent(self):
+        if self.on_sent is not None:
+            self.on_sent()
+
+    def retain(self):
+        if self.owner is not None:
+            self.owner.retain()
+        if self.trace is not None:
+            self.trace.retain()
+
+    def release(self):
+        if self.owner is not None:
+            self.owner.release()
+        if self.trace is not None:
+            self.trace.release()
+
+    @property
+    def header(self):
+        return self.parts[0]
+
+    def __len__(self):
+        return self.size
+
+    def buffers(self):
+        """Các buffer cần gửi theo thứ tự (dùng cho sendmsg / writer.write)."""
+        return self.parts
+
+
+class Message:
+    """
+    Tin nhắn đã giải mã, độc lập với phiên bản giao thức.
+
+    - kind:     "TEXTMSG", "VOICEMSG", "FILE", "USERLIST"...
+    - sender / receiver: tên (v1), hoặc None nếu đến từ v2 và chưa được phân giải từ ID
+    - body:     nội dung (memoryview/bytes, không sao chép từ buffer nhận)
+    - raw:      payload v1 gốc (nếu có), để gửi lại cho client v1 mà không đóng gói lại
+    - buffer:   PooledBuffer chứa payload (nếu đọc bằng FrameAssembler), trả lại bằng release()
+    - trace:    metrics.RelayTrace do server gắn khi định tuyến, trả lại bằng release()
+    - plain:    bản đã giải nén của tin có body nén (cho người nhận không hiểu frame nén), xem MessageFrames
+    """
+
+    __slots__ = ("kind", "sender", "receiver", "body", "raw", "version", "flags", "sender_id", "receiver_id",
+                 "buffer", "trace", "plain")
+
+    def __init__(self, kind, sender="", receiver="", body=b"", raw=None, version=PROTO_V1,
+                 flags=0, sender_id=ALL_ID, receiver_id=ALL_ID):
+        self.kind = kind
+        self.sender = sender
+        self.receiver = receiver
+        self.body = body
+        self.raw = raw
+        self.version = version
+        self.flags = flags
+        self.sender_id = sender_id
+        self.receiver_id = receiver_id
+        self.buffer = None
+        self.trace = None
+        self.plain = None
+
+    def release(self):
+        """
+        Người đọc đã xử lý xong tin nhắn: trả tham chiếu của mình tới buffer nhận.
+        body/raw cũng được bỏ, để buffer lớn (ngoài pool) được giải phóng ngay
+        thay vì sống tới lần nhận kế tiếp.
+        """
+        if self.buffer is not None:
+            self.buffer.release()
+            self.buffer = None
+            self.body = self.raw = None
+        if self.trace is not None:
+            self.trace.release()
+            self.trace = None
+        self.plain = None
+
+    def text(self):
+        """Body dưới dạng chuỗi UTF-8."""
+        return str(self.body, 'utf-8', errors='ignore')
+
+    def __repr__(self):
+        return f"Message({self.kind}, {self.sender!r} -> {self.receiver!r}, {len(self.body)} bytes, v{self.version})"
+
+
+# ================== OPTIONS (HELLO) ==================
+
+def format_options(options):
+    """{"proto": 2, "id": 5} -> "proto=2;id=5" """
+    return ";".join(f"{k}={v}" for k, v in options.items())
+
+
+def parse_options(text):
+    """ "proto=2;id=5" -> {"proto": "2", "id": "5"} """
+    options = {}
+    for item in text.split(";"):
+        key, sep, value = item.partition("=")
+        if key.strip():
+            options[key.strip()] = value.strip()
+    return options
+
+
+# ================== v1 ==================
+
+def encode_header(length):
+    """Header 10 bytes: độ dài payload dạng text, căn trái (ví dụ: "123       ")."""
+    return f"{length:<{HEADER_SIZE}}".encode('utf-8')
+
+
+def encode_frame(message_bytes):
+    """Đóng gói payload v1 thành Frame (không sao chép payload)."""
+    return Frame(encode_header(len(message_bytes)), message_bytes)
+
+
+MAX_FIELD_BYTES = 1024  # Độ dài tối đa của KIND / sender / receiver trong payload v1
+
+
+def _find_sep(view, start):
+    """Vị trí "::" đầu tiên từ 'start', chỉ quét tối đa MAX_FIELD_BYTES (không quét body)."""
+    sep = bytes(view[start:start + MAX_FIELD_BYTES + 2]).find(b"::")
+    return -1 if sep < 0 else start + sep
+
+
+def _field(view, start, end):
+    return str(view[start:end], 'utf-8', errors='ignore')
+
+
+def parse_v1(payload):
+    """
+    Phân tích payload v1 thành Message.
+    Chỉ tìm "::" trong phần KIND/sender/receiver ở đầu payload, body được cắt bằng
+    memoryview nên không bị quét hay sao chép (kể cả khi body chứa "::").
+    Nếu payload thiếu trường bắt buộc, sender/receiver là None (người nhận tự báo lỗi format).
+    """
+    view = memoryview(payload)
+    kind_end = _find_sep(view, 0)
+    if kind_end < 0:
+        return Message(_field(view, 0, MAX_FIELD_BYTES), raw=payload)
+    kind = _field(view, 0, kind_end)
+    pos = kind_end + 2
+    sender = receiver = ""
+    if kind in ROUTED_KINDS:
+        sep = _find_sep(view, pos)
+        if sep < 0:
+            return Message(kind, None, None, view[pos:], raw=payload)
+        sender = _field(view, pos, sep)
+        pos = sep + 2
+        if kind in NO_BODY_KINDS:
+            receiver = _field(view, pos, len(view))
+            pos = len(view)
+        else:
+            sep = _find_sep(view, pos)
+            if sep < 0:
+                return Message(kind, None, None, view[pos:], raw=payload)
+            receiver = _field(view, pos, sep)
+            pos = sep + 2
+    return Message(kind, sender, receiver, view[pos:], raw=payload)
+
+
+def v1_prefix(kind, sender="", receiver=""):
+    """Phần đầu payload v1 đứng trước body: "KIND::sender::receiver::" hoặc "KIND::"."""
+    if kind in ROUTED_KINDS:
+        prefix = f"{kind}::{sender}::{receiver}"
+        if kind not in NO_BODY_KINDS:
+            prefix += "::"
+    else:
+        prefix = f"{kind}::"
+    return prefix.encode('utf-8')
+
+
+def encode_parts(proto, kind, parts, sender="", receiver="", sender_id=ALL_ID, receiver_id=ALL_ID, flags=0):
+    """
+    Đóng gói body gồm nhiều phần (ví dụ: tên file + dữ liệu file) thành Frame
+    theo phiên bản 'proto', mà không nối các phần lại với nhau.
+    v1 dùng tên (sender/receiver), v2 dùng ID số (sender_id/receiver_id).
+    """
+    length = sum(len(p) for p in parts)
+    if proto >= PROTO_V2:
+        header = V2_HEADER.pack(V2_MAGIC, PROTO_V2, TYPE_CODES[kind], flags, length, sender_id, receiver_id)
+        frame = Frame(header, *parts)
+    else:
+        prefix = v1_prefix(kind, sender, receiver)
+        frame = Frame(encode_header(len(prefix) + length), prefix, *parts)
+    frame.priority = priority_for(kind, frame.size)
+    return frame
+
+
+def encode_v1(msg):
+    """Đóng gói Message thành frame v1. Dùng lại payload gốc nếu có."""
+    if msg.raw is not None:
+        frame = encode_frame(msg.raw)
+        frame.priority = priority_for(msg.kind, frame.size)
+        return frame
+    return encode_parts(PROTO_V1, msg.kind, (msg.body,), msg.sender, msg.receiver)
+
+
+# ================== v2 ==================
+
+def encode_v2(kind, body=b"", sender_id=ALL_ID, receiver_id=ALL_ID, flags=0):
+    """Đóng gói body thành frame v2 (header nhị phân 16 bytes + body, không sao chép body)."""
+    return encode_parts(PROTO_V2, kind, (body,), sender_id=sender_id, receiver_id=receiver_id, flags=flags)
+
+
+def decode_v2_header(header):
+    """Giải mã header v2 -> (kind, flags, length, sender_id, receiver_id)."""
+    magic, version, type_code, flags, length, sender_id, receiver_id = V2_HEADER.unpack(header)
+    if magic != V2_MAGIC or version != PROTO_V2:
+        raise ProtocolError(f"header v2 không hợp lệ: magic={magic:#x} version={version}")
+    kind = TYPE_NAMES.get(type_code)
+    if kind is None:
+        raise ProtocolError(f"loại tin nhắn v2 không xác định: {type_code}")
+    return kind, flags, length, sender_id, receiver_id
+
+
+def can_slice(frame):
+    """Frame v2 (một header 16 bytes + body) mới cắt được thành lát."""
+    header = frame.parts[0]
+    return len(header) == V2_HEADER.size and header[0] == V2_MAGIC
+
+
+def slice_frame(frame, offset, max_bytes):
+    """
+    Lát body[offset:offset + max_bytes] của frame v2 -> (Frame, là lát cuối?).
+    Lát không phải cuối mang FLAG_MORE. Body được cắt bằng memoryview, không sao chép.
+    """
+    _, _, type_code, flags, length, sender_id, receiver_id = V2_HEADER.unpack(frame.parts[0])
+    end = min(offset + max_bytes, length)
+    last = end == length
+    parts = []
+    pos = 0
+    for part in frame.parts[1:]:
+        n = len(part)
+        if pos < end and pos + n > offset:
+            parts.append(memoryview(part).cast('B')[max(offset - pos, 0):end - pos])
+        pos += n
+    header = V2_HEADER.pack(V2_MAGIC, PROTO_V2, type_code, flags if last else flags | FLAG_MORE,
+                            end - offset, sender_id, receiver_id)
+    piece = Frame(header, *parts)
+    piece.priority, piece.flow = frame.priority, frame.flow
+    return piece, last
+
+
+_DROPPED = object()  # SliceJoiner: lát của tin nén đã hỏng, bỏ tới lát cuối
+
+
+class SliceJoiner:
+    """
+    Ghép các lát (FLAG_MORE) của frame v2 bị server cắt nhỏ lại thành một Message.
+    Lát của các tin khác nhau có thể xen kẽ: mỗi (loại, người gửi, người nhận) được ghép riêng.
+    'inflate': giải nén luôn body nén (FLAG_ZLIB / FLAG_LZMA); tin bị cắt lát được giải nén dần từng
+    lát khi tới (compression.Inflater), nên không phải giữ bản nén đầy đủ. Body nén hỏng / quá
+    'max_inflate' bytes gây compression.CompressionError (chỉ tin đó bị bỏ, kết nối vẫn dùng được).
+    """
+
+    def __init__(self, inflate=False, max_inflate=MAX_INFLATE_BYTES):
+        self.inflate = inflate
+        self.max_inflate = max_inflate
+        self._pending = {}
+
+    def feed(self, msg):
+        """Trả về Message hoàn chỉnh, hoặc None nếu 'msg' là một lát chưa phải cuối."""
+        if not msg.flags & FLAG_MORE and not self._pending:
+            return self._complete(msg)
+        key = (msg.kind, msg.sender_id, msg.receiver_id)
+        sink = self._pending.pop(key, None)
+        if sink is None:
+            if not msg.flags & FLAG_MORE:
+                return self._complete(msg)
+            sink = Inflater(msg.flags, self.max_inflate) if self._inflates(msg) else bytearray()
+        more = msg.flags & FLAG_MORE
+        try:
+            if isinstance(sink, Inflater):
+                sink.feed(msg.body)
+            elif sink is not _DROPPED:
+                sink += msg.body
+        except CompressionError:
+            # các lát còn lại của tin hỏng bị bỏ im lặng, lỗi chỉ báo một lần
+            if more:
+                self._pending[key] = _DROPPED
+            raise
+        finally:
+            msg.release()
+        if more:
+            self._pending[key] = sink
+            return None
+        if sink is _DROPPED:
+            return None
+        if isinstance(sink, Inflater):
+            return build_message_v2(msg.kind, msg.flags & ~COMPRESSION_FLAGS, msg.sender_id, msg.receiver_id,
+                                    memoryview(sink.finish()))
+        return build_message_v2(msg.kind, msg.flags, msg.sender_id, msg.receiver_id, memoryview(sink))
+
+    def _inflates(self, msg):
+        return self.inflate and msg.flags & COMPRESSION_FLAGS
+
+    def _complete(self, msg):
+        if not self._inflates(msg):
+            return msg
+        try:
+            return inflate_message(msg, self.max_inflate)
+        finally:
+            msg.release()
+
+
+def is_v2_header(first_bytes):
+    return len(first_bytes) > 0 and first_bytes[0] == V2_MAGIC
+
+
+def build_message_v2(kind, flags, sender_id, receiver_id, body):
+    return Message(kind, None, None, body, version=PROTO_V2, flags=flags,
+                   sender_id=sender_id, receiver_id=receiver_id)
+
+
+def inflate_message(msg, max_size=MAX_INFLATE_BYTES):
+    """Bản sao đã giải nén của Message có body nén (CompressionError nếu hỏng / quá 'max_size' bytes)."""
+    body = inflate(msg.body, msg.flags, max_size)
+    return Message(msg.kind, msg.sender, msg.receiver, memoryview(body), version=msg.version,
+                   flags=msg.flags & ~COMPRESSION_FLAGS, sender_id=msg.sender_id, receiver_id=msg.receiver_id)
+
+
+def encode_message(msg, proto, id_for=None):
+    """
+    Đóng gói Message theo phiên bản 'proto' của người nhận.
+    'id_for(name)' trả về ID số của một tên (bắt buộc với v2 khi có sender/receiver).
+    """
+    if proto < PROTO_V2:
+        return encode_v1(msg)
+    sender_id = receiver_id = ALL_ID
+    if msg.kind in ROUTED_KINDS:
+        sender_id = id_for(msg.sender)
+        receiver_id = ALL_ID if msg.receiver == "ALL" else id_for(msg.receiver)
+    return encode_v2(msg.kind, msg.body, sender_id, receiver_id, msg.flags)
+
+
+MAX_FILENAME_BYTES = 1024
+
+
+def split_file_body(body):
+    """
+    Tách body FILE "ten_file::du_lieu" -> (ten_file, memoryview(du_lieu)).
+    Chỉ quét phần tên file ở đầu, dữ liệu file không bị quét hay sao chép.
+    Trả về None nếu thiếu dấu phân cách.
+    """
+    view = memoryview(body)
+    sep = bytes(view[:MAX_FILENAME_BYTES + 2]).find(b"::")
+    if sep < 0:
+        return None
+    return bytes(view[:sep]).decode('utf-8', errors='ignore'), view[sep + 2:]
+
+
+def safe_filename(filename):
+    """Tên file không được chứa "::" (dấu phân cách giữa tên file và dữ liệu)."""
+    return filename.replace("::", "_")
+
+
+class MessageFrames:
+    """
+    Bộ nhớ đệm frame của MỘT tin nhắn theo từng phiên bản giao thức.
+    Khi fan-out tới cả client v1 lẫn v2, mỗi phiên bản chỉ được đóng gói một lần.
+    Tin có body nén chỉ giữ nguyên frame nén cho người nhận v2 chấp nhận kiểu nén đó ('accept');
+    người nhận khác nhận msg.plain (bản giải nén, người gọi nên chuẩn bị sẵn NGOÀI lock).
+    """
+
+    __slots__ = ("msg", "id_for", "_frames")
+
+    def __init__(self, msg, id_for=None):
+        self.msg = msg
+        self.id_for = id_for
+        self._frames = {}
+
+    def frame_for(self, proto, accept=0):
+        """Frame cho người nhận 'proto' / 'accept' (bitmask cờ nén), None nếu không giải nén được."""
+        msg, key = self.msg, proto
+        if msg.flags & COMPRESSION_FLAGS and not (proto >= PROTO_V2 and msg.flags & accept):
+            key = -proto  # frame đã giải nén
+        frame = self._frames.get(key)
+        if frame is None:
+            source = msg
+            if key < 0:
+                if msg.plain is None:
+                    try:
+                        msg.plain = inflate_message(msg)
+                    except CompressionError:
+                        return None
+                source = msg.plain
+            frame = self._frames[key] = encode_message(source, proto, self.id_for)
+            frame.owner = source.buffer
+            frame.trace = msg.trace
+            frame.flow = msg.sender
+        return frame
+
+
+class VersionedFrames:
+    """Các frame đã đóng gói sẵn cho từng phiên bản (khi body khác nhau theo phiên bản, ví dụ USERLIST)."""
+
+    __slots__ = ("_frames",)
+
+    def __init__(self, v1_frame, v2_frame):
+        self._frames = {PROTO_V1: v1_frame, PROTO_V2: v2_frame}
+
+    def frame_for(self, proto, accept=0):
+        return self._frames[PROTO_V2 if proto >= PROTO_V2 else PROTO_V1]
+
+
+# ================== BỘ ĐỆM NHẬN ==================
+
+class PooledBuffer:
+    """
+    Buffer nhận của MỘT tin nhắn, có đếm tham chiếu.
+    'view' là memoryview đúng bằng độ dài payload (body/raw của Message cắt từ đây).
+    Người đọc giữ 1 tham chiếu; mỗi hàng đợi gửi đang giữ frame trỏ vào buffer giữ thêm 1.
+    Khi về 0, buffer quay lại pool (nếu có) để tin nhắn sau nhận thẳng vào đó.
+    """
+
+    __slots__ = ("pool", "data", "view", "refs")
+
+    def __init__(self, pool, data, length):
+        self.pool = pool
+        self.data = data
+        self.view = memoryview(data)[:length]
+        self.refs = 1
+
+    def retain(self):
+        if self.pool is not None:
+            with self.pool.lock:
+                self.refs += 1
+
+    def release(self):
+        if self.pool is not None:
+            with self.pool.lock:
+                self.refs -= 1
+                if self.refs:
+                    return
+            self.pool.give_back(self)
+
+
+class BufferPool:
+    """
+    Pool các bytearray nhận, chia theo lớp kích thước lũy thừa 2 (min_size .. max_size).
+    Tin nhắn lớn hơn max_size nhận vào bytearray riêng (vẫn bằng recv_into, không nối/sao chép),
+    tránh giữ lại bộ nhớ lớn trong pool sau một lần truyền file.
+
+    'in_use' là tổng payload của các buffer đang được cấp (chưa trả); 'budget' > 0 là trần của nó
+    cho try_acquire (xem admission.py).
+    """
+
+    def __init__(self, min_size=4096, max_size=1024 * 1024, per_class=32, budget=0):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.per_class = per_class
+        self.budget = budget
+        self.in_use = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+        self._free = {}   # kích thước lớp -> [bytearray]
+
+    def _class_size(self, n):
+        size = self.min_size
+        while size < n:
+            size *= 2
+        return size
+
+    def _reserve_locked(self, n):
+        self.in_use += n
+        if self.in_use > self.peak:
+            self.peak = self.in_use
+
+    def acquire(self, n):
+        with self.lock:
+            self._reserve_locked(n)
+        return self._allocate(n)
+
+    def try_acquire(self, n):
+        """Như acquire(), nhưng trả về None nếu cấp thêm n bytes sẽ vượt 'budget' (luôn cấp khi không còn buffer nào)."""
+        with self.lock:
+            if self.budget and self.in_use and self.in_use + n > self.budget:
+                return None
+            self._reserve_locked(n)
+        return self._allocate(n)
+
+    def _allocate(self, n):
+        if n > self.max_size:
+            return PooledBuffer(self, bytearray(n), n)
+        size = self._class_size(n)
+        with self.lock:
+            free = self._free.get(size)
+            data = free.pop() if free else None
+        if data is None:
+            data = bytearray(size)
+        return PooledBuffer(self, data, n)
+
+    def give_back(self, buf):
+        size = len(buf.data)
+        n = len(buf.view)
+        buf.view.release()
+        with self.lock:
+            self.in_use -= n
+            if size > self.max_size:
+                return
+            free = self._free.setdefault(size, [])
+            if len(free) < self.per_class:
+                free.append(buf.data)
+
+    def stats(self):
+        with self.lock:
+            return {size: len(free) for size, free in self._free.items()}
+
+
+def alloc_buffer(pool, n):
+    """Buffer nhận n bytes: lấy từ pool nếu có, ngược lại bytearray riêng (không đếm tham chiếu)."""
+    if pool is not None:
+        return pool.acquire(n)
+    return PooledBuffer(None, bytearray(n), n)
+
+
+# ================== ĐỌC FRAME ==================
+
+# Vùng đọc trước của FrameAssembler: một lần recv_into lấy được nhiều frame nhỏ cùng lúc
+READ_AHEAD = 8 * 1024
+# Phần payload còn thiếu từ mức này trở lên được recv_into thẳng vào buffer đích (không qua vùng đọc trước)
+DIRECT_PAYLOAD_BYTES = READ_AHEAD // 2
+
+
+class FrameAssembler:
+    """
+    Bộ ghép frame (v1 hoặc v2, tự nhận biết qua byte đầu tiên) theo kiểu recv_into:
+    buffer() cho biết vùng nhớ cần ghi tiếp, advance(n) báo đã ghi n bytes vào đó.
+
+    Dữ liệu được đọc trước vào một bytearray dùng lại (READ_AHEAD bytes), nên một lần nhận
+    có thể chứa nhiều frame nhỏ: advance() trả về tin đầu tiên ghép xong, pop() lấy các tin
+    còn lại từ phần đã đọc (không đọc socket). Payload nhỏ được chép một lần sang buffer đích;
+    phần payload còn thiếu từ DIRECT_PAYLOAD_BYTES trở lên được nhận thẳng vào buffer đích.
+
+    Dùng chung cho socket chặn (recv_message) và asyncio.BufferedProtocol.
+    Header hỏng gây ProtocolError.
+
+    'admission' (admission.Admission, tùy chọn) được hỏi TRƯỚC khi cấp buffer payload, với loại tin
+    (v2: trong header; v1: xem tối đa KIND_PEEK byte đầu payload) và độ dài đã khai báo.
+    Khi phải chờ (vượt tốc độ / ngân sách byte chung đầy), advance()/pop() trả về None với 'wait' > 0:
+    người gọi KHÔNG đọc tiếp mà chờ 'wait' giây rồi gọi resume().
+    """
+
+    def __init__(self, pool=None, admission=None, read_ahead=READ_AHEAD):
+        self.pool = pool
+        self.admission = admission
+        self.wait = 0.0
+        self._data = bytearray(read_ahead)
+        self._view = memoryview(self._data)
+        self._start = self._end = 0   # phần đã đọc mà chưa xử lý: _data[_start:_end]
+        self._direct = False          # buffer() vừa trả về vùng nhớ của payload
+        self._reset()
+
+    def _reset(self):
+        self._pos = 0
+        self._stage = "header"
+        self._buf = None
+        self._v2_fields = None
+        self._length = 0
+        self._budget_waited = False
+
+    def buffer(self):
+        """Vùng nhớ (memoryview, luôn khác rỗng) mà lần nhận tiếp theo phải ghi vào."""
+        if self._start == self._end:
+            self._start = self._end = 0
+            if self._stage == "payload" and self._length - self._pos >= DIRECT_PAYLOAD_BYTES:
+                self._direct = True
+                return self._buf.view[self._pos:]
+        elif self._end == len(self._data):
+            # Dồn phần chưa xử lý (một header / phần đầu payload dở) về đầu vùng đọc trước
+            pending = self._end - self._start
+            self._data[:pending] = self._view[self._start:self._end]
+            self._start, self._end = 0, pending
+        self._direct = False
+        return self._view[self._end:]
+
+    def advance(self, n):
+        """Đã ghi thêm n bytes. Trả về Message đầu tiên ghép xong, ngược lại None (các tin còn lại: pop())."""
+        if self._direct:
+            self._direct = False
+            self._pos += n
+            if self._pos < self._length:
+                return None
+            return self._finish()
+        self._end += n
+        return self.pop()
+
+    def pop(self):
+        """Tin nhắn tiếp theo ghép được từ phần đã đọc trước (không đọc thêm), hoặc None."""
+        while not self.wait:
+            available = self._end - self._start
+            if self._stage == "header":
+                if not available:
+                    return None
+                size = V2_HEADER.size if self._data[self._start] == V2_MAGIC else HEADER_SIZE
+                if available < size:
+                    return None
+                header = self._view[self._start:self._start + size]
+                self._start += size
+                if size == HEADER_SIZE:
+                    msg = self._header_v1(header)
+                else:
+                    kind, flags, length, sender_id, receiver_id = decode_v2_header(header)
+                    self._v2_fields = (kind, flags, sender_id, receiver_id)
+                    msg = self._admit(kind, length)
+            elif self._stage == "kind":
+                # Loại tin v1 nằm ở đầu payload: chỉ xem, các byte này vẫn được chép vào payload sau đó
+                peek = min(self._length, KIND_PEEK)
+                if available < peek:
+                    return None
+                prefix = bytes(self._view[self._start:self._start + peek])
+                msg = self._admit(prefix.partition(b"::")[0].decode('utf-8', errors='ignore'), self._length)
+            elif self._stage == "payload":
+                take = min(available, self._length - self._pos)
+                self._buf.view[self._pos:self._pos + take] = self._view[self._start:self._start + take]
+                self._start += take
+                self._pos += take
+                if self._pos < self._length:
+                    return None
+                msg = self._finish()
+            else:
+                return None
+            if msg is not None:
+                return msg
+        return None
+
+    def _header_v1(self, header):
+        try:
+            length = int(bytes(header).decode('utf-8').strip())
+        except ValueError:
+            raise ProtocolError(f"header v1 không hợp lệ: {bytes(header)!r}")
+        if length < 0:
+            raise ProtocolError(f"độ dài payload không hợp lệ: {length}")
+        if self.admission is None or length == 0:
+            return self._admit("", length)
+        self._length = length
+        self._stage = "kind"
+        return None
+
+    def _admit(self, kind, length):
+        self._length = length
+        if self.admission is None:
+            return self._start_payload(alloc_buffer(self.pool, length))
+        self._stage = "admit"
+        self.wait = self.admission.admit(kind, length)
+        if self.wait:
+            return None
+        return self._acquire()
+
+    def resume(self):
+        """Hết thời gian chờ: thử cấp buffer cho payload (theo ngân sách chung). Trả về như advance()."""
+        msg = self._acquire()
+        if msg is None and not self.wait:
+            msg = self.pop()
+        return msg
+
+    def _acquire(self):
+        if self.pool is None:
+            buf = alloc_buffer(None, self._length)
+        else:
+            buf = self.pool.try_acquire(self._length)
+        if buf is None:
+            self.wait = self.admission.budget_full(not self._budget_waited)
+            self._budget_waited = True
+            return None
+        self.wait = 0.0
+        return self._start_payload(buf)
+
+    def _start_payload(self, buf):
+        self._buf = buf
+        self._stage = "payload"
+        self._pos = 0
+        if not self._length:
+            return self._finish()
+        return None
+
+    def _finish(self):
+        buf, v2_fields = self._buf, self._v2_fields
+        self._reset()
+        if v2_fields is None:
+            msg = parse_v1(buf.view)
+        else:
+            msg = build_message_v2(*v2_fields, buf.view)
+        msg.buffer = buf
+        return msg
+
+    def discard(self):
+        """Kết nối đóng giữa chừng: trả buffer của payload đang nhận dở (nếu có), bỏ phần đã đọc trước."""
+        if self._buf is not None:
+            self._buf.release()
+        self._start = self._end = 0
+        self._direct = False
+        self._reset()
+
+
+def recv_message(sock, assembler):
+    """
+    Đọc MỘT tin nhắn từ socket chặn bằng recv_into (không sao chép qua bytes trung gian).
+    Các tin đã nằm sẵn trong vùng đọc trước được trả về trước, không gọi recv.
+    Trả về Message, hoặc None nếu kết nối đóng. Header hỏng gây ProtocolError.
+    Khi kiểm soát tiếp nhận bắt chờ, luồng đọc ngủ (không đọc socket) rồi thử lại.
+    """
+    msg = assembler.pop()
+    while msg is None:
+        if assembler.wait:
+            time.sleep(assembler.wait)
+            msg = assembler.resume()
+        else:
+            n = sock.recv_into(assembler.buffer())
+            if not n:
+                return None
+            msg = assembler.advance(n)
+    return msg
+
+
+# ================== GỬI FRAME ==================
+
+def sendmsg_all(sock, buffers):
+    """
+    Gửi HẾT các buffer bằng vectored I/O (socket.sendmsg), tương tự sendall
+    nhưng không cần nối header + payload thành một bytes mới.
+    Phần đã gửi một nửa được cắt bằng memoryview (không sao chép).
+    """
+    views = [memoryview(b).cast('B') for b in buffers if len(b)]
+    if not HAS_SENDMSG:
+        for view in views:
+            sock.sendall(view)
+        return
+    while views:
+        sent = sock.sendmsg(views)
+        # Bỏ các buffer đã gửi xong, cắt buffer đang gửi dở
+        while sent:
+            first = len(views[0])
+            if sent >= first:
+                sent -= first
+                views.pop(0)
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
+
+
+def send_frame(sock, frame):
+    """Gửi (chặn) một Frame qua socket."""
+    sendmsg_all(sock, frame.buffers())
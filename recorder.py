@@ -0,0 +1,117 @@
+import threading
+
+import numpy as np
+import sounddevice as sd
+
+# === GHI ÂM BẰNG CALLBACK VÀO RING BUFFER ===
+#
+# Callback của sounddevice (luồng âm thanh của PortAudio) chép từng block vào một ring buffer
+# NumPy cấp sẵn; luồng gửi đọc ra bằng peek() (view, không sao chép) rồi consume().
+# Không có vòng lặp stream.read() bằng Python, không tạo mảng / list mới cho mỗi block.
+# Ring buffer bắt đầu nhỏ và chỉ nới rộng (gấp đôi) khi luồng đọc bị chậm (ví dụ gửi bị chặn
+# do server áp dụng backpressure), tối đa bằng thời lượng ghi tối đa, nên dữ liệu đã ghi không bao giờ bị
+# ghi đè; chỉ còn tràn ở phía thiết bị (PortAudio báo input overflow khi callback không kịp chạy).
+
+INITIAL_SECONDS = 2
+
+
+class RingRecorder:
+    """
+    Bộ ghi âm một người ghi (callback) - một người đọc (luồng gửi).
+    - Tối đa 'max_seconds' giây: vượt quá thì ngừng nhận, 'limit_reached' = True.
+    - 'overruns': số lần PortAudio báo input overflow (mất mẫu ở phía thiết bị).
+    """
+
+    def __init__(self, sample_rate, channels=1, max_seconds=300, dtype=np.int16):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.max_frames = int(max_seconds * sample_rate)
+        self._ring = np.empty((min(INITIAL_SECONDS * sample_rate, self.max_frames), channels), dtype=dtype)
+        self._read = 0       # tổng số frame đã đọc (vị trí trong ring = _read % capacity)
+        self._written = 0    # tổng số frame đã ghi (đếm lại từ phần chưa đọc khi nới ring)
+        self.total_frames = 0  # số frame đã nhận từ đầu bản ghi
+        self._cond = threading.Condition()
+        self._stream = None
+        self.limit_reached = False
+        self.overruns = 0
+
+    @property
+    def capacity(self):
+        return len(self._ring)
+
+    @property
+    def duration(self):
+        return self.total_frames / self.sample_rate
+
+    def start(self, blocksize=0):
+        self._stream = sd.InputStream(samplerate=self.sample_rate, channels=self.channels, dtype=self._ring.dtype,
+                                      blocksize=blocksize, callback=self._callback)
+        self._stream.start()
+
+    def stop(self):
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+        with self._cond:
+            self._cond.notify_all()
+
+    def _callback(self, indata, frames, time_info, status):
+        if status and status.input_overflow:
+            self.overruns += 1
+        self.write(indata)
+
+    def write(self, block):
+        """Chép một block (frames, channels) vào ring buffer (gọi từ callback)."""
+        with self._cond:
+            n = len(block)
+            if self.total_frames + n > self.max_frames:
+                n = self.max_frames - self.total_frames
+                self.limit_reached = True
+            unread = self._written - self._read
+            if unread + n > self.capacity:
+                self._grow(unread + n)  # luôn đủ: unread + n <= max_frames
+            if n > 0:
+                start = self._written % self.capacity
+                first = min(n, self.capacity - start)
+                self._ring[start:start + first] = block[:first]
+                self._ring[:n - first] = block[first:n]
+                self._written += n
+                self.total_frames += n
+            self._cond.notify_all()
+
+    def _grow(self, needed):
+        """Nới ring buffer (gấp đôi, tối đa max_frames), giữ nguyên thứ tự phần chưa đọc."""
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        capacity = min(capacity, self.max_frames)
+        unread = self._written - self._read
+        ring = np.empty((capacity, self.channels), dtype=self._ring.dtype)
+        start = self._read % self.capacity
+        first = min(unread, self.capacity - start)
+        ring[:first] = self._ring[start:start + first]
+        ring[first:unread] = self._ring[:unread - first]
+        self._ring = ring
+        # phần chưa đọc giờ nằm ở đầu ring mới
+        self._read, self._written = 0, unread
+
+    def wait(self, timeout=None):
+        """Chờ tới khi có dữ liệu chưa đọc (hoặc hết giờ / đã dừng)."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._written > self._read or self._stream is None or self.limit_reached,
+                                timeout)
+
+    def peek(self):
+        """
+        View (không sao chép) của đoạn chưa đọc liền nhau dài nhất trong ring buffer;
+        phần quay vòng về đầu ring được trả ở lần peek() sau. Hợp lệ tới khi consume().
+        """
+        with self._cond:
+            start = self._read % self.capacity
+            n = min(self._written - self._read, self.capacity - start)
+            return self._ring[start:start + n]
+
+    def consume(self, n):
+        with self._cond:
+            self._read += n
@@ -0,0 +1,137 @@
+import time
+from collections import OrderedDict
+
+from protocol import ALL_ID, PROTO_V1
+
+ID_REUSE_DELAY = 600  # giây: ID của tên đã rời chưa được cấp cho tên khác (tin đến trễ, client chưa cập nhật)
+
+
+class Session:
+    """
+    Metadata của MỘT kết nối đã đăng ký.
+    'conn' là socket (engine luồng) hoặc FrameConnection (engine asyncio).
+    """
+
+    __slots__ = ("conn", "username", "addr", "queue", "joined_at", "proto", "user_id", "accept")
+
+    def __init__(self, conn, username, addr, queue, proto=PROTO_V1, accept=0):
+        self.conn = conn
+        self.username = username
+        self.addr = addr
+        self.queue = queue          # OutboundQueue của kết nối này
+        self.joined_at = time.time()
+        self.proto = proto          # Phiên bản giao thức server dùng khi GỬI cho kết nối này
+        self.user_id = ALL_ID       # ID số của username (giao thức v2), do registry cấp
+        self.accept = accept        # bitmask cờ nén client giải nén được (xem compression.py), 0 = không nén
+
+    def __repr__(self):
+        return f"Session({self.username!r}, {self.addr})"
+
+
+class ClientRegistry:
+    """
+    Sổ đăng ký hai chiều các client đang kết nối:
+    - conn -> Session     (tra cứu metadata của 1 kết nối)
+    - username -> {conn: Session}  (định tuyến tin riêng O(1), không cần duyệt hết)
+
+    Một username có thể đăng nhập từ nhiều nơi cùng lúc (trùng tên):
+    tin riêng gửi tới username đó sẽ tới TẤT CẢ các kết nối của nó,
+    còn USERLIST chỉ hiển thị tên đó một lần.
+
+    Registry cũng cấp ID số cho mỗi username / phòng (dùng trong header giao thức v2). ID 0 dành cho "ALL".
+    Khi một tên không còn dùng nữa (release_id: user rời hẳn, phòng hết thành viên), ID của nó vẫn
+    phân giải về tên cũ (tin nhắn đến trễ) và chỉ được cấp cho tên khác sau 'reuse_delay' giây;
+    tên cũ quay lại trước đó lấy lại đúng ID cũ. Số ID vì thế bị chặn theo số tên dùng cùng lúc.
+
+    Lớp này KHÔNG tự khóa: người gọi phải giữ 'clients_lock' của server.
+    """
+
+    def __init__(self, reuse_delay=ID_REUSE_DELAY):
+        self.reuse_delay = reuse_delay
+        self._by_conn = {}
+        self._by_name = {}
+        self._ids = {"ALL": ALL_ID}
+        self._names_by_id = {ALL_ID: "ALL"}
+        self._released = OrderedDict()  # tên -> (ID, lúc nhả), cũ nhất trước
+        self._next_id = ALL_ID + 1
+        self._accepts = {}  # bitmask cờ nén -> số kết nối (người nhận nào cần bản giải nén)
+
+    def __len__(self):
+        return len(self._by_conn)
+
+    def __contains__(self, conn):
+        return conn in self._by_conn
+
+    def __iter__(self):
+        """Duyệt các Session theo thứ tự tham gia."""
+        return iter(self._by_conn.values())
+
+    def id_for(self, username):
+        """ID số của 'username' (cấp mới nếu chưa có)."""
+        user_id = self._ids.get(username)
+        if user_id is None:
+            released = self._released.pop(username, None)
+            user_id = released[0] if released is not None else self._new_id()
+            self._ids[username] = user_id
+            self._names_by_id[user_id] = username
+        return user_id
+
+    def _new_id(self):
+        if self._released:
+            name, (user_id, since) = next(iter(self._released.items()))
+            if time.monotonic() - since >= self.reuse_delay:
+                del self._released[name]
+                return user_id
+        user_id = self._next_id
+        self._next_id += 1
+        return user_id
+
+    def release_id(self, name):
+        """'name' không còn online / phòng không còn thành viên: ID của nó được cấp lại sau reuse_delay giây."""
+        if name == "ALL" or name in self._by_name:
+            return
+        user_id = self._ids.pop(name, None)
+        if user_id is not None:
+            self._released[name] = (user_id, time.monotonic())
+
+    def name_for(self, user_id):
+        """Tên ứng với ID số, hoặc None nếu ID không tồn tại."""
+        return self._names_by_id.get(user_id)
+
+    def add(self, session):
+        session.user_id = self.id_for(session.username)
+        self._by_conn[session.conn] = session
+        self._by_name.setdefault(session.username, {})[session.conn] = session
+        self._accepts[session.accept] = self._accepts.get(session.accept, 0) + 1
+
+    def remove(self, conn):
+        """Xóa kết nối 'conn', trả về Session của nó (hoặc None nếu không có)."""
+        session = self._by_conn.pop(conn, None)
+        if session is not None:
+            same_name = self._by_name.get(session.username)
+            if same_name is not None:
+                same_name.pop(conn, None)
+                if not same_name:
+                    del self._by_name[session.username]
+            self._accepts[session.accept] -= 1
+            if not self._accepts[session.accept]:
+                del self._accepts[session.accept]
+        return session
+
+    def needs_plain(self, flags):
+        """Có kết nối nào không giải nén được kiểu nén trong 'flags' (phải gửi bản đã giải nén)?"""
+        return any(not accept & flags for accept in self._accepts)
+
+    def get(self, conn):
+        return self._by_conn.get(conn)
+
+    def sessions_for(self, username):
+        """Tất cả Session đang đăng nhập với 'username' (rỗng nếu user không online)."""
+        return list(self._by_name.get(username, {}).values())
+
+    def is_online(self, username):
+        return username in self._by_name
+
+    def names(self):
+        """Danh sách username (không trùng lặp) theo thứ tự lần đầu xuất hiện."""
+        return list(self._by_name)
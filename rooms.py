@@ -0,0 +1,87 @@
+import re
+
+# === PHÒNG CHAT CÓ TÊN ("#ten_phong") ===
+#
+# Ngoài "ALL" và một username, người nhận của tin định tuyến có thể là một phòng: tên bắt đầu bằng "#".
+#   JOIN::#dev / LEAVE::#dev                     client vào / rời phòng (v2: body là tên phòng)
+#   ROOM::room=#dev;id=7;members=alice,bob       server báo thành viên phòng (cho người vừa vào và
+#                                                 mọi thành viên khác mỗi khi có người vào / ra)
+#   TEXTMSG::alice::#dev::noi_dung               tin tới phòng (v2: receiver_id = id của phòng)
+# Server giữ chỉ mục phòng -> kết nối thành viên, nên tin tới phòng chỉ được đưa vào hàng đợi của
+# các thành viên (không duyệt mọi client như "ALL"). ID của phòng dùng chung không gian ID với
+# username (ClientRegistry.id_for), nên định tuyến v2 vẫn chỉ cần đọc header.
+
+ROOM_PREFIX = "#"
+MAX_ROOM_NAME = 64
+_ROOM_NAME = re.compile(r"#[^\s:;,=]{1,%d}" % MAX_ROOM_NAME)
+
+
+def is_room(name):
+    return bool(name) and name.startswith(ROOM_PREFIX)
+
+
+def valid_room(name):
+    """Tên phòng hợp lệ: "#" + tối đa MAX_ROOM_NAME ký tự, không có khoảng trắng / ':' / ';' / ',' / '='."""
+    return _ROOM_NAME.fullmatch(name) is not None
+
+
+class RoomIndex:
+    """
+    Chỉ mục thành viên phòng:
+    - room -> {conn: Session}   (fan-out tin tới phòng chỉ chạm các thành viên)
+    - conn -> [room]            (kết nối ngắt thì rời mọi phòng của nó)
+
+    Thành viên tính theo kết nối: một user đăng nhập từ hai nơi có thể ở phòng khác nhau.
+    Lớp này KHÔNG tự khóa: người gọi phải giữ 'clients_lock' của server.
+    """
+
+    def __init__(self):
+        self._members = {}
+        self._rooms_of = {}
+
+    def __len__(self):
+        return len(self._members)
+
+    def join(self, room, session):
+        """Thêm 'session' vào 'room'; False nếu đã là thành viên."""
+        members = self._members.setdefault(room, {})
+        if session.conn in members:
+            return False
+        members[session.conn] = session
+        self._rooms_of.setdefault(session.conn, {})[room] = None
+        return True
+
+    def leave(self, room, conn):
+        """Xóa 'conn' khỏi 'room'; False nếu không phải thành viên."""
+        members = self._members.get(room)
+        if members is None or members.pop(conn, None) is None:
+            return False
+        if not members:
+            del self._members[room]
+        rooms = self._rooms_of.get(conn)
+        if rooms is not None:
+            rooms.pop(room, None)
+            if not rooms:
+                del self._rooms_of[conn]
+        return True
+
+    def leave_all(self, conn):
+        """Kết nối ngắt: rời mọi phòng, trả về danh sách phòng đã rời."""
+        rooms = list(self._rooms_of.get(conn, ()))
+        for room in rooms:
+            self.leave(room, conn)
+        return rooms
+
+    def is_member(self, room, conn):
+        return conn in self._members.get(room, ())
+
+    def sessions_for(self, room):
+        """Các Session thành viên của 'room' (rỗng nếu phòng không có ai)."""
+        return list(self._members.get(room, {}).values())
+
+    def members(self, room):
+        """Username thành viên (không trùng lặp) theo thứ tự vào phòng."""
+        return list(dict.fromkeys(session.username for session in self._members.get(room, {}).values()))
+
+    def rooms_of(self, conn):
+        return list(self._rooms_of.get(conn, ()))
@@ -1,147 +1,972 @@
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing
+import signal
 import socket
+import sys
 import threading
 import time
 
+import bus as bus_module
+import metrics
+import outbound
+from admission import DEFAULT_INFLIGHT_BYTES, AdmissionPolicy, parse_frame_limits
+from async_conn import FrameConnection
+from cluster import ClusterNode
+from compression import (ALL_METHODS, COMPRESSIBLE_KINDS, COMPRESSION_FLAGS, METHODS, CompressionError,
+                         CompressionStats, format_methods, original_size, parse_methods)
+from message_log import MessageLog, conversation_key, encode_record, voice_chunk_key
+from protocol import (CALL_KINDS, FILE_STREAM_KINDS, FLAG_MORE, HEADER_SIZE, PROTO_LATEST, PROTO_V1, PROTO_V2, ROUTED_KINDS,
+                      TYPE_CODES, V2_HEADER, BufferPool, FrameAssembler, Message, MessageFrames, ProtocolError, encode_frame,
+                      encode_parts, encode_v2, format_options, inflate_message, parse_options, recv_message,
+                      send_frame)
+from presence import PRESENCE_COALESCE, PresenceTracker, encode_delta, encode_snapshot
+from registry import ClientRegistry, Session
+from rooms import ROOM_PREFIX, RoomIndex, is_room, valid_room
+from voice_codec import join_voice
+
 # === CẤU HÌNH SERVER ===
 HOST = '0.0.0.0'  # Lắng nghe trên tất cả các giao diện mạng
 PORT = 12345        # Cổng mà server sẽ lắng nghe
-HEADER_SIZE = 10    # Kích thước cố định của header (chứa độ dài tin nhắn)
 
 # === BIẾN TOÀN CỤC ===
-# Dictionary lưu trữ các client đang kết nối
-# Cấu trúc: {socket_connection: username}
+# Sổ đăng ký hai chiều các client đang kết nối (xem registry.py):
+#   conn -> Session(username, addr, hàng đợi gửi...)  và  username -> các kết nối của user đó.
 # Dùng socket_connection làm key là an toàn nhất vì nó là duy nhất.
-clients = {}
-# Lock (khóa) để bảo vệ quyền truy cập vào dictionary 'clients'
+clients = ClientRegistry()
+# Lock (khóa) để bảo vệ quyền truy cập vào 'clients'
 # vì nhiều luồng (mỗi client 1 luồng) sẽ cùng lúc đọc/ghi vào nó.
-clients_lock = threading.Lock()
+# Fan-out CHỈ enqueue khi giữ lock, còn việc gửi thật qua socket
+# do writer riêng của từng kết nối đảm nhận.
+# TimedLock đo thời gian các luồng phải chờ lock này (xem metrics.py).
+clients_lock = metrics.TimedLock(metrics.Histogram())
+# Chỉ mục phòng -> kết nối thành viên (xem rooms.py), cũng được bảo vệ bởi 'clients_lock'
+rooms = RoomIndex()
+
+# Danh sách online đã thông báo (version + delta, xem presence.py), các kết nối đang chờ snapshot
+# và timer gộp thay đổi; tất cả được bảo vệ bởi 'clients_lock'
+presence = PresenceTracker()
+presence_pending = set()
+presence_timer = None
+
+# Event loop của engine asyncio (None với engine luồng). Khi có, event loop là luồng DUY NHẤT đụng
+# tới 'clients' / 'clients_lock': timer gộp presence chạy bằng call_later, luồng đọc bus và cổng
+# thống kê chuyển việc sang event loop (call_in_loop), nên không luồng nào giữ lock làm nghẽn loop.
+event_loop = None
+
+# Cấu hình hàng đợi gửi (có thể đổi bằng tham số dòng lệnh)
+OUTBOUND_MAX_BYTES = outbound.DEFAULT_MAX_BYTES
+OVERFLOW_POLICY = outbound.POLICY_BACKPRESSURE
+BACKPRESSURE_TIMEOUT = outbound.DEFAULT_BACKPRESSURE_TIMEOUT
+# Tin lớn gửi tới client hiểu FLAG_MORE được cắt thành lát cỡ này (0 = không cắt, xem outbound.py)
+SLICE_BYTES = outbound.DEFAULT_SLICE_BYTES
+# Kiểu nén payload server chấp nhận khi client đề nghị "compress=..." trong HELLO (xem compression.py)
+COMPRESSION_METHODS = ALL_METHODS
+
+# Lịch sử tin nhắn + hộp thư offline (xem message_log.py), tạo trong configure(); None = tắt
+HISTORY_DIR = "history"
+history = None
+
+# Số liệu đo (xem metrics.py): frame / byte vào, ra theo loại tin và độ trễ chuyển tiếp.
+# Lấy bằng tin quản trị STATS hoặc cổng thống kê cục bộ (--stats-port).
+STATS_HOST = "127.0.0.1"  # cổng thống kê chỉ nghe trên máy này
+STATS_REQUEST_TIMEOUT = 1  # giây chờ dòng yêu cầu trên cổng thống kê
+frames_in = metrics.KindCounters()
+frames_out = metrics.KindCounters()
+relay_latency = metrics.Histogram()
+compression_stats = CompressionStats()
+started_at = time.time()
+
+# Chế độ nhiều tiến trình (--workers, xem bus.py): số hiệu worker này; None = 1 tiến trình
+worker_index = None
+# Đầu bus: BusLink tới hub (--workers) hoặc ClusterNode nối các node khác (--peers, xem cluster.py); None = tắt
+bus = None
+
+# Pool buffer nhận dùng chung cho mọi kết nối: payload được recv_into thẳng vào đây,
+# chuyển tiếp tới người nhận bằng memoryview, rồi quay lại pool khi mọi writer đã gửi xong.
+# Tổng payload đang được giữ trong pool bị chặn bởi INFLIGHT_MAX_BYTES (xem admission.py).
+INFLIGHT_MAX_BYTES = DEFAULT_INFLIGHT_BYTES
+receive_pool = BufferPool(budget=INFLIGHT_MAX_BYTES)
+# Giới hạn tiếp nhận (kích thước frame theo loại, tốc độ mỗi kết nối), tạo lại trong configure()
+admission = AdmissionPolicy(receive_pool)
 
 # ==================================
 # === CÁC HÀM TIỆN ÍCH (NETWORK) ===
 # ==================================
 
-def recv_all(sock, n):
+def send_message(sock, message_bytes):
     """
-    Hàm tiện ích để đảm bảo nhận ĐỦ 'n' bytes từ socket.
-    Hàm sock.recv() mặc định không đảm bảo nhận đủ 'n' bytes trong 1 lần gọi.
+    Gửi trực tiếp (chặn) một tin nhắn qua socket.
+    Các hàm fan-out KHÔNG dùng hàm này mà đi qua hàng đợi (enqueue_message).
     """
-    data = bytearray()
     try:
-        while len(data) < n:
-            # Nhận phần dữ liệu còn thiếu
-            packet = sock.recv(n - len(data))
-            if not packet:
-                # Nếu không nhận được gì (socket đã đóng), trả về None
-                return None
-            data.extend(packet)
-        return bytes(data)
+        send_frame(sock, encode_frame(message_bytes))
+    except Exception as e:
+        print(f"[LỖI GỬI] {peer_name(sock)}: {e}")
+
+def peer_name(sock):
+    """Địa chỉ (ip, port) của đầu bên kia, dùng cho cả socket lẫn FrameConnection (asyncio)."""
+    try:
+        if isinstance(sock, FrameConnection):
+            return sock.get_extra_info('peername')
+        return sock.getpeername()
     except Exception:
-        # Nếu có lỗi (ví dụ: client ngắt kết nối đột ngột)
         return None
 
-def send_message(sock, message_bytes):
+def receive_message(sock, assembler):
     """
-    Hàm gửi tin nhắn (dạng bytes) theo giao thức: [HEADER][PAYLOAD]
-    - HEADER: 10 bytes, chứa độ dài của PAYLOAD, căn trái.
-    - PAYLOAD: Dữ liệu tin nhắn thực tế (dạng bytes).
+    Hàm nhận MỘT tin nhắn (giao thức v1 hoặc v2, tự nhận biết qua header).
+    Dữ liệu được recv_into thẳng vào buffer của 'assembler' (FrameAssembler của kết nối),
+    body của Message là memoryview vào buffer đó: gọi msg.release() khi xử lý xong.
+    Trả về Message, hoặc None nếu client ngắt kết nối / header không hợp lệ.
+    Hết hạn chờ (socket.timeout, chỉ khi người gọi đặt timeout) được ném tiếp cho người gọi.
     """
     try:
-        # 1. Tạo header: Lấy độ dài của tin nhắn, chuyển thành chuỗi,
-        #    và định dạng nó thành 10 bytes (ví dụ: "123      ")
-        msg_len = f"{len(message_bytes):<{HEADER_SIZE}}".encode('utf-8')
-        
-        # 2. Gửi header + payload
-        sock.sendall(msg_len + message_bytes)
-    except Exception as e:
-        print(f"[LỖI GỬI] {sock.getpeername()}: {e}")
+        return recv_message(sock, assembler)
+    except ProtocolError as e:
+        print(f"[LỖI GIAO THỨC] {peer_name(sock)}: {e}")
+        return None
+    except socket.timeout:
+        raise
+    except OSError:
+        # Ví dụ: client ngắt kết nối đột ngột
+        return None
+
+# =======================================
+# === CÁC HÀM LOGIC (QUẢN LÝ CLIENTS) ===
+# =======================================
 
-def receive_message(sock):
+def _enqueue_locked(session, frames, blocked):
     """
-    Hàm nhận tin nhắn theo giao thức: [HEADER][PAYLOAD]
+    Đưa frame (đã đóng gói theo phiên bản giao thức của 'session') vào hàng đợi của nó.
+    PHẢI gọi khi đang giữ 'clients_lock'.
+    Nếu hàng đợi đầy với policy backpressure, thêm (queue, frame) vào 'blocked'
+    để người gửi chờ SAU KHI nhả lock (xem wait_for_blocked).
+    Trả về số byte của frame (người gọi cộng dồn rồi ghi vào 'frames_out' sau khi nhả lock).
     """
-    # 1. Nhận header (10 bytes) trước
-    header = recv_all(sock, HEADER_SIZE)
-    if not header:
-        return None  # Client đã ngắt kết nối
-    
+    frame = frames.frame_for(session.proto, session.accept)
+    if frame is None:
+        return 0  # tin nén hỏng, không giải nén được cho người nhận này
+    if not session.queue.offer(frame):
+        blocked.append((session.queue, frame))
+    return len(frame)
+
+def on_event_loop():
+    """Đang chạy trên event loop của engine asyncio?"""
     try:
-        # 2. Decode header, loại bỏ khoảng trắng, chuyển thành số nguyên (độ dài payload)
-        msg_len = int(header.decode('utf-8').strip())
-    except Exception:
-        return None  # Header không hợp lệ
+        return asyncio.get_running_loop() is event_loop
+    except RuntimeError:
+        return False
 
-    # 3. Nhận payload với độ dài chính xác vừa đọc được
-    return recv_all(sock, msg_len)
+def call_in_loop(fn, *args):
+    """
+    Gọi fn(*args) trên event loop (engine asyncio) và chờ kết quả; dùng cho luồng nền cần đụng tới
+    'clients'. Engine luồng, hoặc đang ở trên event loop: gọi thẳng.
+    """
+    loop = event_loop
+    if loop is None or on_event_loop():
+        return fn(*args)
+    future = concurrent.futures.Future()
 
-# =======================================
-# === CÁC HÀM LOGIC (QUẢN LÝ CLIENTS) ===
-# =======================================
+    def run():
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    loop.call_soon_threadsafe(run)
+    return future.result()
 
-def broadcast_user_list():
+def schedule_presence_update(new_conn=None):
     """
-    Gửi danh sách tất cả user đang online cho MỌI client.
-    Được gọi mỗi khi có user tham gia hoặc rời đi.
+    Hẹn gửi thay đổi danh sách online sau PRESENCE_COALESCE giây (xem presence.py).
+    Mọi lần vào / ra trong khoảng đó được gộp thành MỘT delta, nên cả phòng kết nối lại
+    không còn là N lần gửi cả danh sách cho N người.
+    'new_conn': kết nối cần nhận snapshot đầy đủ (vừa vào, hoặc client xin lại).
     """
-    # Sử dụng lock để đảm bảo an toàn khi duyệt 'clients'
+    global presence_timer
+    loop = event_loop
+    if loop is not None and not on_event_loop():
+        # luồng đọc bus / cluster: hẹn trên event loop, không giữ lock ở luồng này
+        loop.call_soon_threadsafe(schedule_presence_update, new_conn)
+        return
     with clients_lock:
-        # Lấy danh sách tất cả username từ 'clients.values()'
-        # Lọc bỏ tên rỗng, không phải chuỗi và thay thế dấu ',' (nếu có)
-        safe_names = [name.replace(',', '') for name in clients.values() if isinstance(name, str) and name]
-        
-        # Tạo chuỗi user_list, ngăn cách bởi dấu ','
-        user_list = ",".join(safe_names)
-        
-        # Tạo payload theo định dạng "USERLIST::user1,user2,user3"
-        payload = f"USERLIST::{user_list}".encode('utf-8')
-        
-        print(f"[USERLIST] Cập nhật: {user_list}")
-
-        # Lặp qua tất cả socket connection (clients.keys())
-        # Dùng list() để tạo bản sao, phòng trường hợp 'clients' bị thay đổi khi đang lặp
-        for conn in list(clients.keys()):
-            try:
-                send_message(conn, payload)
-            except Exception as e:
-                print(f"Lỗi gửi userlist tới {clients[conn]}: {e}")
+        if new_conn is not None:
+            presence_pending.add(new_conn)
+        if presence_timer is None:
+            if loop is not None:
+                presence_timer = loop.call_later(PRESENCE_COALESCE, flush_presence)
+            else:
+                presence_timer = threading.Timer(PRESENCE_COALESCE, flush_presence)
+                presence_timer.daemon = True
+                presence_timer.start()
 
-def broadcast_message(message_bytes, exclude_conn=None):
+def flush_presence():
+    """
+    Gửi thay đổi đã gộp: delta cho client v2 đã có danh sách, snapshot cho client v2 mới vào,
+    USERLIST đầy đủ cho client v1. Mỗi loại frame chỉ đóng gói một lần.
     """
-    Gửi một tin nhắn (bytes) tới TẤT CẢ client.
+    global presence_timer, presence_pending
+    blocked = []
+    with clients_lock:
+        presence_timer = None
+        pending, presence_pending = presence_pending, set()
+        online = [(clients.id_for(name), name) for name in online_names() if name]
+        joined, left = presence.diff(online)
+        changed = bool(joined or left)
+        if not changed and not pending:
+            return
+        if changed:
+            changes = [f"+{name}" for _, name in joined] + [f"-{name}" for _, name in left]
+            print(f"[PRESENCE] v{presence.version}: {' '.join(changes)}")
+        for _, name in left:
+            clients.release_id(name)
+
+        frames = {}
+
+        def frame(kind):
+            # Đóng gói lười: chỉ khi có người cần loại frame đó
+            if kind not in frames:
+                if kind == "delta":
+                    frames[kind] = encode_v2("PRESENCE", encode_delta(presence.version, joined, left))
+                elif kind == "snapshot":
+                    frames[kind] = encode_v2("PRESENCE", encode_snapshot(presence.version, presence.snapshot()))
+                else:
+                    # v1: "USERLIST::user1,user2,user3"
+                    user_list = ",".join(name.replace(',', '') for _, name in online)
+                    frames[kind] = encode_frame(f"USERLIST::{user_list}".encode('utf-8'))
+            return frames[kind]
+
+        sent = {}  # loại tin -> [số frame, số byte]
+        for session in clients:
+            if session.proto < PROTO_V2:
+                if not (changed or session.conn in pending):
+                    continue
+                f = frame("userlist")
+            elif session.conn in pending:
+                f = frame("snapshot")
+            elif changed:
+                f = frame("delta")
+            else:
+                continue
+            if not session.queue.offer(f):
+                blocked.append((session.queue, f))
+            tally = sent.setdefault("USERLIST" if session.proto < PROTO_V2 else "PRESENCE", [0, 0])
+            tally[0] += 1
+            tally[1] += len(f)
+    # Danh sách online là tin điều khiển: không bắt ai chờ, hàng đợi đầy thì ép vào luôn
+    for q, f in blocked:
+        q.force_put(f)
+    for kind, (count, nbytes) in sent.items():
+        frames_out.add(kind, nbytes, count)
+
+def broadcast_message(msg, exclude_conn=None, record=False, publish=True):
+    """
+    Gửi một tin nhắn (Message) tới TẤT CẢ client.
+    Frame chỉ được đóng gói MỘT lần cho mỗi phiên bản giao thức rồi dùng chung cho mọi người nhận.
     Có thể tùy chọn 'exclude_conn' để không gửi lại cho chính người gửi.
-    (Lưu ý: trong code hiện tại, exclude_conn đang được set là None,
-     nghĩa là server gửi cho TẤT CẢ, bao gồm cả người gửi).
+    'record': lưu vào lịch sử (trong cùng lock với fan-out, nên seq khớp với việc ai đã nhận trực tiếp).
+    'publish': ở chế độ nhiều worker, gửi tiếp qua bus tới các worker khác (False với tin đến từ bus).
+    Trả về danh sách (queue, frame) đang bị backpressure, người gửi phải chờ.
     """
+    frames = MessageFrames(msg, clients.id_for)
+    blocked = []
+    count = nbytes = 0
     with clients_lock:
-        for conn in list(clients.keys()):
+        if record and history is not None:
+            history.append(msg)
+        for session in clients:
             # Bỏ qua client trong danh sách loại trừ
-            if conn is exclude_conn:
+            if session.conn is exclude_conn:
                 continue
-            try:
-                send_message(conn, message_bytes)
-            except Exception as e:
-                print(f"Lỗi broadcast tới {clients[conn]}: {e}")
+            nbytes += _enqueue_locked(session, frames, blocked)
+            count += 1
+        if publish and bus is not None:
+            _publish_locked(frames, "ALL", blocked)
+    if count:
+        frames_out.add(msg.kind, nbytes, count)
+    return blocked
 
-def send_to_user_only(username, message_bytes):
+def send_to_room(room, msg, exclude_conn=None, record=False, publish=True):
     """
-    Gửi tin nhắn (bytes) chỉ tới MỘT user cụ thể.
-    Hàm này duyệt 'clients' để tìm socket tương ứng với 'username'.
+    Gửi tin nhắn (Message) tới các thành viên của phòng 'room' (xem rooms.py).
+    Chỉ duyệt chỉ mục thành viên của phòng, không duyệt mọi client như broadcast_message.
+    Các tham số khác như broadcast_message. Trả về danh sách (queue, frame) đang bị backpressure.
     """
+    frames = MessageFrames(msg, clients.id_for)
+    blocked = []
+    nbytes = 0
     with clients_lock:
-        target_conn = None
-        # Duyệt qua (key, value) tức là (conn, name)
-        for c, name in clients.items():
-            if name == username:
-                target_conn = c
-                break  # Tìm thấy, thoát vòng lặp
-        
-        # Nếu tìm thấy socket của user
-        if target_conn:
-            try:
-                send_message(target_conn, message_bytes)
-            except Exception as e:
-                print(f"Lỗi gửi tới target {username}: {e}")
+        if record and history is not None:
+            history.append(msg)
+        targets = [session for session in rooms.sessions_for(room) if session.conn is not exclude_conn]
+        for session in targets:
+            nbytes += _enqueue_locked(session, frames, blocked)
+        if publish and bus is not None and bus.hosts(room):
+            _publish_locked(frames, room, blocked)
+    if targets:
+        frames_out.add(msg.kind, nbytes, len(targets))
+    return blocked
+
+def send_to_user_only(username, msg, record=False, publish=True):
+    """
+    Gửi tin nhắn (Message) chỉ tới MỘT user cụ thể.
+    Tra cứu O(1) trong registry; nếu user đăng nhập từ nhiều nơi (trùng tên),
+    TẤT CẢ các kết nối của user đó đều nhận được (kể cả kết nối ở worker khác, qua bus).
+    'record': lưu vào lịch sử; nếu user đang offline, tin được giao khi họ kết nối lại.
+    Trả về danh sách (queue, frame) đang bị backpressure, người gửi phải chờ.
+    """
+    frames = MessageFrames(msg, clients.id_for)
+    blocked = []
+    with clients_lock:
+        targets = clients.sessions_for(username)
+        remote = publish and bus is not None and bus.hosts(username)
+        recorded = record and history is not None
+        if recorded:
+            history.append(msg, offline=not targets and not remote)
+        nbytes = sum(_enqueue_locked(session, frames, blocked) for session in targets)
+        if remote:
+            _publish_locked(frames, username, blocked)
+    if targets:
+        frames_out.add(msg.kind, nbytes, len(targets))
+    elif not remote:
+        if recorded:
+            print(f"[OFFLINE] '{username}' không online, tin sẽ được giao khi kết nối lại.")
         else:
             print(f"Không tìm thấy user '{username}' để gửi tin.")
+    return blocked
+
+def _publish_locked(frames, receiver, blocked):
+    """Đưa frame v1 (mang tên người gửi / nhận) lên bus / cụm node. PHẢI gọi khi đang giữ 'clients_lock'."""
+    frame = frames.frame_for(PROTO_V1)
+    if frame is None:
+        return
+    count = bus.publish(frame, receiver, blocked)
+    if count:
+        frames_out.add("BUS", len(frame) * count, count)
+
+def online_names():
+    """Tên đang online: client của tiến trình này rồi tới client ở worker / node khác. PHẢI giữ 'clients_lock'."""
+    names = clients.names()
+    if bus is not None:
+        local = set(names)
+        # danh bạ của bus có cả phòng (node / worker có thành viên phòng đó), không phải user
+        names += [name for name in bus.remote_names() if name not in local and not is_room(name)]
+    return names
+
+def deliver_from_bus(msg):
+    """
+    Tin từ worker / node khác (luồng đọc của bus): fan-out tới client của tiến trình này, không gửi lại
+    lên bus (nên tin không bao giờ đi vòng). Mỗi node lưu lịch sử của riêng mình nên cũng ghi lại tin này.
+    Engine asyncio: fan-out chạy trên event loop, luồng bus chỉ chờ backpressure.
+    """
+    try:
+        wait_for_blocked(call_in_loop(_fan_out_from_bus, msg))
+    finally:
+        msg.release()
+
+def undelivered_from_bus(msg):
+    """
+    Tin riêng do tiến trình này gửi lên bus mà hub không giao được (người nhận vừa offline ở worker khác):
+    người nhận đã kết nối lại ở đây thì giao luôn, không thì xử lý như tin tới người offline.
+    """
+    try:
+        wait_for_blocked(call_in_loop(_deliver_undelivered, msg))
+    finally:
+        msg.release()
+
+def _deliver_undelivered(msg):
+    with clients_lock:
+        online = bool(clients.sessions_for(msg.receiver))
+        stored = not online and history is not None and msg.kind in HISTORY_KINDS
+        if stored:
+            history.append(msg, offline=True)
+    if online:
+        return send_to_user_only(msg.receiver, msg, publish=False)
+    if stored:
+        print(f"[OFFLINE] '{msg.receiver}' đã offline, tin sẽ được giao khi kết nối lại.")
+    else:
+        print(f"Không tìm thấy user '{msg.receiver}' để gửi tin (đã offline ở worker khác).")
+    return []
+
+def _fan_out_from_bus(msg):
+    record = msg.kind in HISTORY_KINDS
+    if msg.receiver == "ALL":
+        return broadcast_message(msg, record=record, publish=False)
+    if is_room(msg.receiver):
+        return send_to_room(msg.receiver, msg, record=record, publish=False)
+    return send_to_user_only(msg.receiver, msg, record=record, publish=False)
+
+def send_to_conn(conn, msg):
+    """Gửi tin nhắn (Message) tới đúng MỘT kết nối (ví dụ: trả lời yêu cầu của chính client đó)."""
+    blocked = []
+    with clients_lock:
+        session = clients.get(conn)
+        if session is not None:
+            nbytes = _enqueue_locked(session, MessageFrames(msg, clients.id_for), blocked)
+    if session is not None:
+        frames_out.add(msg.kind, nbytes)
+    return blocked
+
+def new_outbound_queue(slices=False):
+    """Tạo hàng đợi gửi theo cấu hình hiện tại của server ('slices': client ghép được lát FLAG_MORE)."""
+    return outbound.OutboundQueue(OUTBOUND_MAX_BYTES, OVERFLOW_POLICY, SLICE_BYTES if slices else 0)
+
+def wait_for_blocked(blocked):
+    """
+    Backpressure cho engine luồng: chờ (NGOÀI lock) tới khi các hàng đợi đầy có chỗ.
+    Chỉ luồng của người gửi bị chậm lại, mọi người khác vẫn hoạt động bình thường.
+    """
+    for q, frame in blocked:
+        if not q.put_wait(frame, BACKPRESSURE_TIMEOUT):
+            print(f"[BACKPRESSURE] Hàng đợi bị đóng ({q.close_reason}).")
+
+def wire_size(msg):
+    """Số byte trên dây của tin nhắn nhận được (header + payload)."""
+    if msg.version >= PROTO_V2:
+        return V2_HEADER.size + len(msg.body)
+    return HEADER_SIZE + len(msg.raw)
+
+def _room_frame(proto, room, user_id, members):
+    body = format_options({"room": room, "id": user_id, "members": ",".join(members)}).encode('utf-8')
+    return encode_parts(proto, "ROOM", (body,))
+
+def _notify_room_locked(room, blocked):
+    """
+    Gửi ROOM (danh sách thành viên mới) cho mọi thành viên của 'room'. PHẢI giữ 'clients_lock'.
+    Là tin điều khiển như danh sách online: hàng đợi đầy thì ép vào ('blocked' được force_put sau).
+    """
+    members = rooms.members(room)
+    frames = {}
+    for session in rooms.sessions_for(room):
+        frame = frames.get(session.proto)
+        if frame is None:
+            frame = frames[session.proto] = _room_frame(session.proto, room, clients.id_for(room), members)
+        if not session.queue.offer(frame):
+            blocked.append((session.queue, frame))
+        frames_out.add("ROOM", len(frame))
+
+def join_room(conn, username, room):
+    """JOIN::#ten: thêm kết nối vào phòng, báo thành viên mới cho cả phòng (kể cả người vừa vào)."""
+    if not valid_room(room):
+        print(f"Tên phòng không hợp lệ từ {username}: {room[:80]!r}")
+        return []
+    blocked = []
+    with clients_lock:
+        session = clients.get(conn)
+        if session is None or not rooms.join(room, session):
+            return []
+        if bus is not None and len(rooms.sessions_for(room)) == 1:
+            bus.announce(True, room)
+        _notify_room_locked(room, blocked)
+    print(f"[PHÒNG] '{username}' vào {room}")
+    for q, f in blocked:
+        q.force_put(f)
+    return []
+
+def leave_rooms(conn, username, names):
+    """Rời các phòng 'names' (LEAVE::#ten, hoặc mọi phòng khi ngắt kết nối), báo cho thành viên còn lại."""
+    blocked = []
+    with clients_lock:
+        for room in names:
+            if not rooms.leave(room, conn):
+                continue
+            if not rooms.sessions_for(room):
+                clients.release_id(room)
+                if bus is not None:
+                    bus.announce(False, room)
+            _notify_room_locked(room, blocked)
+            print(f"[PHÒNG] '{username}' rời {room}")
+    for q, f in blocked:
+        q.force_put(f)
+    return []
+
+def queue_depths():
+    """Độ sâu hàng đợi gửi của từng user: {username: {"frames": n, "bytes": b, "dropped": d}}"""
+    with clients_lock:
+        depths = {}
+        for session in clients:
+            q = session.queue
+            # Nhiều kết nối trùng tên: cộng dồn
+            d = depths.setdefault(session.username, {"frames": 0, "bytes": 0, "dropped": 0})
+            d["frames"] += len(q)
+            d["bytes"] += q.nbytes
+            d["dropped"] += q.dropped
+        return depths
+
+def stats_snapshot():
+    """
+    Ảnh chụp số liệu đo (dict, xem metrics.format_text): frame / byte vào, ra theo loại tin,
+    độ trễ chuyển tiếp, thời gian chờ 'clients_lock', hàng đợi gửi của từng kết nối và lịch sử.
+    """
+    with clients_lock:
+        connections = [{
+            "user": session.username,
+            "addr": f"{session.addr[0]}:{session.addr[1]}",
+            "proto": session.proto,
+            "frames": len(session.queue),
+            "bytes": session.queue.nbytes,
+            "dropped": session.queue.dropped,
+        } for session in clients]
+        users = len(clients.names())
+        room_count = len(rooms)
+    snapshot = {
+        "uptime_s": round(time.time() - started_at, 1),
+        "connections": len(connections),
+        "users": users,
+        "rooms": room_count,
+        "frames": {"in": frames_in.snapshot(), "out": frames_out.snapshot()},
+        "relay_latency": relay_latency.snapshot(),
+        "lock": clients_lock.snapshot(),
+        "queues": {
+            "frames": sum(c["frames"] for c in connections),
+            "bytes": sum(c["bytes"] for c in connections),
+            "largest_bytes": max((c["bytes"] for c in connections), default=0),
+            "dropped": sum(c["dropped"] for c in connections),
+            "limit_bytes": OUTBOUND_MAX_BYTES,
+            "connections": connections,
+        },
+        "history": history.stats() if history is not None else None,
+        "admission": admission.stats(),
+        "compression": compression_stats.snapshot(),
+    }
+    if bus is not None:
+        snapshot["bus"] = bus.stats()
+    return snapshot
+
+# =====================================
+# === ĐỊNH TUYẾN (DÙNG CHUNG 2 ENGINE) ===
+# =====================================
+
+HANDSHAKE_TIMEOUT = 5  # Số giây chờ client gửi USERNAME trước khi gán tên mặc định
+# Tin tới trước USERNAME được đệm lại, nhưng có giới hạn: vượt quá thì ngắt kết nối
+HANDSHAKE_MAX_MESSAGES = 32
+HANDSHAKE_MAX_BYTES = 1024 * 1024
+
+# Loại tin được chuyển tiếp (TEXTMSG::sender::receiver::... hoặc "ALL")
+RELAYED_KINDS = {"TEXTMSG", "VOICEMSG", "VOICECHUNK", "FILE"} | FILE_STREAM_KINDS | CALL_KINDS
+# Tin rất nhiều và nhỏ của truyền file / tin nhắn thoại dạng luồng: không in log cho từng tin
+QUIET_KINDS = {"FILECHUNK", "FILEACK", "VOICECHUNK"}
+# Tin được lưu vào lịch sử / hộp thư offline (báo hiệu cuộc gọi và chunk file dạng luồng thì không)
+HISTORY_KINDS = {"TEXTMSG", "VOICEMSG", "VOICECHUNK", "FILE"}
+HISTORY_PAGE_LIMIT = 200              # số tin tối đa của một trang HISTORY
+HISTORY_PAGE_BYTES = 4 * 1024 * 1024  # tổng body tối đa của một frame HISTORY
+
+def parse_username(msg, addr):
+    """
+    Lấy username từ tin nhắn "USERNAME::ten".
+    Nếu format lỗi hoặc tên rỗng, trả về tên mặc định "ip:port".
+    """
+    # Tên bắt đầu bằng "#" dành cho phòng (xem rooms.py)
+    username = msg.text().strip().lstrip(ROOM_PREFIX)
+    # Nếu tên rỗng, gán tên mặc định
+    return username or f"{addr[0]}:{addr[1]}"
+
+def negotiate_proto(msg):
+    """Phiên bản giao thức server sẽ dùng cho client đã gửi "HELLO::proto=N"."""
+    try:
+        offered = int(parse_options(msg.text()).get("proto", PROTO_V1))
+    except ValueError:
+        offered = PROTO_V1
+    return max(PROTO_V1, min(offered, PROTO_LATEST))
+
+def wants_bulk_history(msg):
+    """Client gửi "HELLO::proto=2;history=1" hiểu frame HISTORY (nhận tin offline theo lô)."""
+    return parse_options(msg.text()).get("history") == "1"
+
+def wants_slices(msg):
+    """Client gửi "HELLO::proto=2;slices=1" ghép được tin bị cắt lát (FLAG_MORE, xem protocol.SliceJoiner)."""
+    return parse_options(msg.text()).get("slices") == "1"
+
+def wants_compression(msg):
+    """Các kiểu nén (bitmask) dùng được với client gửi "HELLO::proto=2;compress=zlib,lzma"."""
+    return parse_methods(parse_options(msg.text()).get("compress")) & COMPRESSION_METHODS
+
+def check_compressed(msg, username):
+    """
+    Tin có body nén: kiểm tra kích thước gốc khai báo với giới hạn frame của loại tin, ghi số liệu
+    nén, và nếu có người nhận không hiểu frame nén thì giải nén sẵn MỘT lần (msg.plain), NGOÀI lock.
+    Trả về False nếu tin phải bỏ.
+    """
+    size = original_size(msg.body)
+    limit = admission.limit_for(msg.kind)
+    if msg.kind not in COMPRESSIBLE_KINDS or size is None or size > limit:
+        compression_stats.add_error()
+        print(f"Tin nén {msg.kind} không hợp lệ từ {username} (kích thước gốc {size}), tin bị bỏ.")
+        return False
+    compression_stats.add(msg.kind, len(msg.body), size)
+    with clients_lock:
+        needs_plain = bus is not None or clients.needs_plain(msg.flags)
+    if needs_plain:
+        try:
+            msg.plain = inflate_message(msg, limit)
+        except CompressionError as e:
+            compression_stats.add_error()
+            print(f"Tin nén {msg.kind} từ {username} bị hỏng ({e}), tin bị bỏ.")
+            return False
+        compression_stats.add_inflated(size)
+    return True
+
+def resolve_names(msg, username):
+    """
+    Điền sender/receiver cho tin nhắn v2 (chỉ mang ID số trong header).
+    Người gửi luôn là username của kết nối, không tin vào sender_id (v2) / tên người gửi (v1) do
+    client khai. Trả về False nếu receiver_id không tồn tại.
+    """
+    if msg.kind not in ROUTED_KINDS:
+        return True
+    if msg.version < PROTO_V2:
+        if msg.sender != username:
+            # payload gốc mang tên khai man: không chuyển tiếp nguyên, đóng gói lại với tên thật
+            msg.sender, msg.raw = username, None
+        return True
+    msg.sender = username
+    with clients_lock:
+        msg.receiver = clients.name_for(msg.receiver_id)
+    return msg.receiver is not None
+
+def route_message(conn, username, msg, echo=False):
+    """
+    Định tuyến MỘT tin nhắn (Message) nhận được từ client 'conn'.
+    Dùng chung cho cả engine luồng (handle_client) và engine asyncio (handle_client_async),
+    nên cả hai có cùng hành vi với USERNAME/TEXTMSG/VOICEMSG/FILE/OPENPRIVATE.
+    Định tuyến chỉ dựa vào kind/sender/receiver đã giải mã, không quét payload.
+    'echo': tin tới "ALL" được gửi cả cho người gửi (tin đệm trước USERNAME, như server gốc).
+    Trả về danh sách (queue, frame) bị backpressure mà engine phải chờ (xem wait_for_blocked).
+    """
+    frames_in.add(msg.kind, wire_size(msg))
+    # Chỉ server cắt lát (khi gửi); client không được gửi lát lên
+    msg.flags &= ~FLAG_MORE
+
+    # Client xin lại snapshot danh sách online (thấy nhảy version delta)
+    if msg.kind == "PRESENCE":
+        schedule_presence_update(conn)
+        return []
+
+    # Vào / rời phòng: "JOIN::#ten", "LEAVE::#ten"
+    if msg.kind == "JOIN":
+        return join_room(conn, username, msg.text().strip())
+    if msg.kind == "LEAVE":
+        return leave_rooms(conn, username, [msg.text().strip()])
+
+    # Client xin một trang lịch sử: "HISTORY::conv=ALL;before=123;limit=50"
+    if msg.kind == "HISTORY":
+        return send_history(conn, username, msg)
+
+    # Yêu cầu quản trị: xem độ sâu hàng đợi gửi của từng user
+    if msg.kind == "QUEUEDEPTH":
+        reply = Message("QUEUEDEPTH", body=json.dumps(queue_depths()).encode('utf-8'))
+        return send_to_conn(conn, reply)
+
+    # Yêu cầu quản trị: số liệu đo của server (JSON, như cổng --stats-port với "json")
+    if msg.kind == "STATS":
+        reply = Message("STATS", body=json.dumps(stats_snapshot()).encode('utf-8'))
+        return send_to_conn(conn, reply)
+
+    if msg.kind in ROUTED_KINDS and msg.version < PROTO_V2 and msg.receiver is None:
+        print(f"Format message không hợp lệ từ {username}")
+        return []
+
+    if not resolve_names(msg, username):
+        print(f"Người nhận (ID {msg.receiver_id}) không tồn tại, tin từ {username} bị bỏ.")
+        return []
+
+    if msg.flags & COMPRESSION_FLAGS and not check_compressed(msg, username):
+        return []
+
+    # Đo độ trễ chuyển tiếp: tới khi người nhận cuối cùng gửi xong (xem metrics.RelayTrace)
+    if msg.kind in ROUTED_KINDS:
+        msg.trace = metrics.RelayTrace(relay_latency)
+
+    # (Hiện tại code client không gửi OPENPRIVATE, nhưng logic server vẫn có)
+    if msg.kind == "OPENPRIVATE":
+        # Chỉ forward cho người nhận
+        return send_to_user_only(msg.receiver, msg)
+
+    # Xử lý tin nhắn TEXT hoặc VOICE (hoặc FILE, kể cả từng chunk của file dạng luồng)
+    if msg.kind in RELAYED_KINDS:
+        quiet = msg.kind in QUIET_KINDS
+        record = msg.kind in HISTORY_KINDS
+        # Nếu người nhận là "ALL"
+        if msg.receiver == "ALL":
+            # Gửi tin nhắn này cho TẤT CẢ MỌI NGƯỜI (loai tru người gửi)
+            if not quiet:
+                print(f"[BROADCAST] từ '{username}'")
+            # Truyền "conn" (socket của người gửi) vào để loại trừ
+            return broadcast_message(msg, exclude_conn=None if echo else conn, record=record)
+        elif is_room(msg.receiver):
+            # Tin tới phòng: chỉ thành viên mới được gửi, và chỉ thành viên nhận
+            with clients_lock:
+                member = rooms.is_member(msg.receiver, conn)
+            if not member:
+                print(f"'{username}' không ở phòng {msg.receiver}, tin bị bỏ.")
+                return []
+            if not quiet:
+                print(f"[PHÒNG] từ '{username}' tới {msg.receiver}")
+            return send_to_room(msg.receiver, msg, exclude_conn=conn, record=record)
+        else:
+            # Nếu là tin nhắn riêng, chỉ gửi cho người nhận
+            if not quiet:
+                print(f"[PRIVATE] từ '{username}' tới '{msg.receiver}'")
+            return send_to_user_only(msg.receiver, msg, record=record)
+    else:
+        # Nhận được một định dạng tin nhắn không xác định
+        print(f"Nhận payload không hợp lệ từ {username}, loại: {msg.kind[:30]!r}")
+    return []
+
+def buffer_early_message(buffered_messages, msg, addr):
+    """
+    Đệm một tin tới trước USERNAME. Trả về False nếu vượt HANDSHAKE_MAX_MESSAGES / HANDSHAKE_MAX_BYTES:
+    khi đó mọi tin đã đệm được trả buffer và người gọi ngắt kết nối.
+    """
+    buffered_messages.append(msg)
+    if (len(buffered_messages) <= HANDSHAKE_MAX_MESSAGES
+            and sum(wire_size(m) for m in buffered_messages) <= HANDSHAKE_MAX_BYTES):
+        return True
+    print(f"[TỪ CHỐI] {addr}: quá nhiều tin trước USERNAME, ngắt kết nối.")
+    release_messages(buffered_messages)
+    buffered_messages.clear()
+    return False
+
+def register_client(conn, username, addr, queue, buffered_messages, proto=PROTO_V1, history_bulk=False,
+                    compress=0, offline=True):
+    """
+    Thêm client (cùng hàng đợi gửi 'queue' của nó) vào 'clients',
+    thông báo user list, xử lý các tin nhắn đã bị đệm và giao tin nhắn offline.
+    'proto' là phiên bản giao thức đã thương lượng qua HELLO (v1 nếu client không gửi HELLO).
+    'history_bulk': client hiểu frame HISTORY (xem wants_bulk_history).
+    'compress': các kiểu nén đã thương lượng (xem wants_compression), chỉ dùng với v2.
+    'offline': giao luôn tin offline (đọc đĩa); engine asyncio tự gọi deliver_offline trong executor.
+    Trả về danh sách (queue, frame) bị backpressure từ các tin đã đệm / tin offline.
+    """
+    session = Session(conn, username, addr, queue, proto, compress if proto >= PROTO_V2 else 0)
+    with clients_lock:
+        # Thêm client vào registry toàn cục
+        clients.add(session)
+        same_name = len(clients.sessions_for(username))
+        if bus is not None and same_name == 1:
+            bus.announce(True, username)
+        # Tin có seq nhỏ hơn 'head' là lịch sử, từ 'head' trở đi client nhận trực tiếp
+        head = history.next_seq if history is not None else None
+    if same_name > 1:
+        print(f"[TRÙNG TÊN] '{username}' đang đăng nhập từ {same_name} nơi, tin riêng sẽ tới tất cả.")
+
+    if proto >= PROTO_V2:
+        # Xác nhận phiên bản (framing v1 để client nào cũng đọc được), TRƯỚC danh sách online
+        options = {"proto": proto, "id": session.user_id}
+        if head is not None:
+            options["history"] = head
+        if queue.slice_bytes:
+            options["slices"] = queue.slice_bytes
+        if session.accept:
+            options["compress"] = format_methods(session.accept)
+        hello = encode_frame(f"HELLO::{format_options(options)}".encode('utf-8'))
+        queue.force_put(hello)
+        frames_out.add("HELLO", len(hello))
+
+    print(f"Người dùng '{username}' ({addr}) đã tham gia (giao thức v{proto}).")
+
+    # User mới nhận snapshot, những người khác nhận delta (gộp với các lần vào / ra gần đó)
+    schedule_presence_update(conn)
+
+    # Xử lý các tin nhắn đã bị đệm (nếu có); tin tới "ALL" được gửi lại cả cho người gửi như trước
+    blocked = []
+    for msg in buffered_messages:
+        try:
+            blocked += route_message(conn, username, msg, echo=True)
+        except Exception:
+            pass  # Bỏ qua nếu tin nhắn trong buffer bị lỗi
+    buffered_messages.clear()  # Xóa buffer sau khi xử lý
+    if history is not None and offline:
+        blocked += deliver_offline(session, history_bulk)
+    return blocked
+
+def history_body(conv, mode, records, more, accept=0):
+    """
+    Body HISTORY: "conv=ALL;mode=page;more=1;count=N::" + các bản ghi theo định dạng của log
+    (message_log.iter_records đọc lại được, kể cả body nhị phân của voice / file).
+    Bản ghi nén (lưu nguyên như khi nhận) được giải nén nếu người nhận không hiểu kiểu nén đó ('accept').
+    """
+    options = format_options({"conv": conv, "mode": mode, "more": int(more), "count": len(records)})
+    parts = [options.encode('utf-8'), b"::"]
+    for r in records:
+        body, flags = r.body, r.flags
+        if flags & COMPRESSION_FLAGS and not flags & accept:
+            try:
+                plain = inflate_message(r.to_message())
+            except CompressionError:
+                continue
+            body, flags = plain.body, plain.flags
+        parts += encode_record(r.seq, r.ts, r.kind, r.sender, r.receiver, body, flags, r.offline)
+    return b"".join(parts)
+
+def _offline_batches(records):
+    """
+    Chia các tin offline thành lô cho frame HISTORY (mỗi lô tối đa HISTORY_PAGE_BYTES), chỉ cắt ở chỗ
+    không còn tin thoại gửi dần nào dở dang: client ghép VOICECHUNK trong phạm vi một body HISTORY.
+    Tin thoại mãi không có đoạn cuối thì vẫn cắt ở 4 * HISTORY_PAGE_BYTES.
+    """
+    batches, batch, size, open_voices = [], [], 0, set()
+    for r in records:
+        if batch and size + len(r.body) > HISTORY_PAGE_BYTES and \
+                (not open_voices or size + len(r.body) > 4 * HISTORY_PAGE_BYTES):
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(r)
+        size += len(r.body)
+        chunk = voice_chunk_key(r.kind, r.sender, r.body)
+        if chunk is not None:
+            key, _, final, _ = chunk
+            (open_voices.discard if final else open_voices.add)(key)
+    batches.append(batch)
+    return batches
+
+def _offline_messages(records):
+    """
+    Tin offline cho client cũ (v1, không hiểu VOICECHUNK): các đoạn của một tin thoại được ghép thành
+    một VOICEMSG ở vị trí đoạn cuối; tin thiếu đoạn cuối (người gửi mất kết nối) ghép phần đã có, để cuối.
+    Trả về [(Message, các seq nó thay mặt)].
+    """
+    out, voices = [], {}  # (người gửi, vid) -> (người nhận, các seq, các body đoạn)
+    for r in records:
+        chunk = voice_chunk_key(r.kind, r.sender, r.body)
+        if chunk is None:
+            out.append((r.to_message(), [r.seq]))
+            continue
+        key, _, final, body = chunk
+        _, seqs, bodies = voices.setdefault(key, (r.receiver, [], []))
+        seqs.append(r.seq)
+        bodies.append(body)
+        if final:
+            del voices[key]
+            out.append((Message("VOICEMSG", r.sender, r.receiver, join_voice(bodies)), seqs))
+    for (sender, _), (receiver, seqs, bodies) in voices.items():
+        out.append((Message("VOICEMSG", sender, receiver, join_voice(bodies)), seqs))
+    return out
+
+def _offline_cursor(username, seqs):
+    """
+    Hàm frame.on_sent cho tin offline: các frame có thể lên dây không theo thứ tự (lớp ưu tiên, lát),
+    nên con trỏ "đã giao" chỉ tiến tới hết đoạn seq liên tiếp từ đầu mà mọi frame chứa chúng đã gửi xong.
+    """
+    order = sorted(seqs)
+    done = set()
+    state = {"next": 0}
+    lock = threading.Lock()
+
+    def sent(covered):
+        with lock:
+            done.update(covered)
+            i = state["next"]
+            while i < len(order) and order[i] in done:
+                i += 1
+            if i == state["next"]:
+                return
+            state["next"] = i
+        history.mark_delivered(username, order[i - 1])
+
+    return sent
+
+def deliver_offline(session, bulk):
+    """
+    Giao các tin riêng gửi tới user khi họ offline, theo lô: client mới nhận vài frame HISTORY
+    (mode=offline, mỗi frame tối đa HISTORY_PAGE_BYTES), client cũ nhận lại từng tin như tin thường
+    ở framing v1 (mang tên người gửi: người gửi có thể đã offline, client chưa biết ID của họ).
+    Tin chỉ được đánh dấu đã giao khi frame chứa nó thực sự được gửi (Frame.on_sent): mất kết nối
+    giữa chừng thì lần đăng nhập sau giao lại.
+    """
+    records = history.take_offline(session.username)
+    if not records:
+        return []
+    if bulk:
+        batches = _offline_batches(records)
+        frames = [encode_parts(session.proto, "HISTORY", (history_body("", "offline", b, False, session.accept),))
+                  for b in batches]
+        kinds = ["HISTORY"] * len(frames)
+        covers = [[r.seq for r in b] for b in batches]
+    else:
+        messages = _offline_messages(records)
+        frames = [MessageFrames(m).frame_for(PROTO_V1) for m, _ in messages]
+        kinds = [m.kind for m, _ in messages]
+        covers = [seqs for _, seqs in messages]
+    sent = _offline_cursor(session.username, [r.seq for r in records])
+    blocked = []
+    for kind, frame, covered in zip(kinds, frames, covers):
+        if frame is None:
+            sent(covered)  # bản ghi nén hỏng: không bao giờ giao được
+            continue
+        frame.on_sent = lambda covered=covered: sent(covered)
+        if not session.queue.offer(frame):
+            blocked.append((session.queue, frame))
+        frames_out.add(kind, len(frame))
+    print(f"[OFFLINE] Giao {len(records)} tin cho '{session.username}'.")
+    return blocked
+
+def history_query(conn, username, msg):
+    """
+    Phần không đọc đĩa của một yêu cầu HISTORY (kiểm tra thành viên phòng, tham số, kiểu nén nhận được).
+    Trả về (conv, accept, các tham số của MessageLog.history), hoặc None nếu bỏ qua yêu cầu.
+    """
+    if history is None:
+        return None
+    options = parse_options(msg.text())
+    conv = options.get("conv", "ALL")
+    try:
+        before = int(options["before"]) if options.get("before") else None
+        since = float(options["since"]) if options.get("since") else None
+        limit = max(1, min(int(options.get("limit", 50)), HISTORY_PAGE_LIMIT))
+    except ValueError:
+        return None
+    with clients_lock:
+        if is_room(conv) and not rooms.is_member(conv, conn):
+            return None  # lịch sử phòng chỉ dành cho thành viên
+        session = clients.get(conn)
+    accept = session.accept if session is not None else 0
+    return conv, accept, (conversation_key(username, conv), before, limit, since, HISTORY_PAGE_BYTES)
+
+def read_history(query):
+    """Đọc trang lịch sử của history_query (đĩa, chặn) -> Message HISTORY."""
+    conv, accept, args = query
+    records, more = history.history(*args)
+    return Message("HISTORY", body=history_body(conv, "page", records, more, accept))
+
+def send_history(conn, username, msg):
+    """Trả một trang lịch sử của "ALL" hoặc cuộc trò chuyện riêng giữa 'username' và 'conv'."""
+    query = history_query(conn, username, msg)
+    if query is None:
+        return []
+    return send_to_conn(conn, read_history(query))
+
+def release_messages(messages):
+    """Trả buffer nhận của các tin đã xử lý xong (gọi SAU khi đã chờ xong backpressure)."""
+    for msg in messages:
+        msg.release()
+
+def unregister_client(conn, username, addr):
+    """Xóa client khỏi 'clients' và cập nhật user list cho những người còn lại."""
+    # Rời mọi phòng trước (thành viên còn lại nhận ROOM mới)
+    with clients_lock:
+        left_rooms = rooms.rooms_of(conn)
+    leave_rooms(conn, username, left_rooms)
+    with clients_lock:
+        # Xóa client khỏi registry
+        session = clients.remove(conn)
+        presence_pending.discard(conn)
+        if session is not None and not clients.is_online(username):
+            if bus is not None:
+                bus.announce(False, username)
+            if bus is None or not bus.hosts(username):
+                clients.release_id(username)
+    # Đóng hàng đợi để writer của kết nối này dừng lại
+    if session is not None:
+        session.queue.close()
+
+    print(f"Người dùng '{username}' ({addr}) đã rời khỏi.")
+
+    # Cập nhật danh sách online cho những người còn lại (delta, đã gộp)
+    schedule_presence_update()
 
 # ================================
 # === HÀM XỬ LÝ CLIENT (LUỒNG) ===
@@ -154,128 +979,85 @@ def handle_client(conn, addr):
     """
     print(f"[KẾT NỐI MỚI] {addr}")
     username = None
+    registered = False
+    proto = PROTO_V1  # Client cũ không gửi HELLO -> giữ giao thức v1
+    history_bulk = False
+    slices = False
+    compress = 0
     # Buffer: Lưu trữ các tin nhắn client gửi đến TRƯỚC KHI client gửi username
     buffered_messages = []
-    
+    # Bộ ghép frame của kết nối: header đọc vào buffer dùng lại, payload vào buffer từ pool
+    # (chỉ sau khi qua kiểm soát tiếp nhận)
+    assembler = FrameAssembler(receive_pool, admission.connection())
+
     try:
-        # --- Giai đoạn 1: Chờ xác thực USERNAME ---
-        start = time.time()
+        # --- Giai đoạn 1: Chờ xác thực USERNAME (tối đa HANDSHAKE_TIMEOUT giây) ---
+        deadline = time.monotonic() + HANDSHAKE_TIMEOUT
         while True:
-            # Nhận tin nhắn đầu tiên (hoặc các tin nhắn tiếp theo nếu chưa có username)
-            first_msg_bytes = receive_message(conn)
-            if not first_msg_bytes:
+            # Nhận tin nhắn đầu tiên (hoặc các tin nhắn tiếp theo nếu chưa có username).
+            # recv có hạn chờ: client im lặng không giữ luồng này mãi. Frame nhận dở (nếu có)
+            # vẫn nằm trong 'assembler' và được đọc tiếp ở giai đoạn 3.
+            conn.settimeout(max(deadline - time.monotonic(), 0.001))
+            try:
+                first_msg = receive_message(conn, assembler)
+            except socket.timeout:
+                # Sau HANDSHAKE_TIMEOUT giây không có USERNAME: tự gán tên mặc định và tiếp tục
+                username = f"{addr[0]}:{addr[1]}"
+                break
+            if first_msg is None:
                 # Client ngắt kết nối trước cả khi gửi username
                 conn.close()
                 return
 
+            # Client mới đề nghị phiên bản giao thức trước khi gửi USERNAME
+            if first_msg.kind == "HELLO":
+                proto = negotiate_proto(first_msg)
+                history_bulk = wants_bulk_history(first_msg)
+                slices = wants_slices(first_msg)
+                compress = wants_compression(first_msg)
+                first_msg.release()
             # Kiểm tra xem có phải tin nhắn USERNAME không
-            if first_msg_bytes.startswith(b"USERNAME::"):
-                try:
-                    # Tách chuỗi "USERNAME::" để lấy tên
-                    username = first_msg_bytes.decode('utf-8', errors='ignore').split("::",1)[1].strip()
-                    # Nếu tên rỗng, gán tên mặc định
-                    if not username:
-                        username = f"{addr[0]}:{addr[1]}"
-                except Exception:
-                    # Nếu format lỗi, gán tên mặc định
-                    username = f"{addr[0]}:{addr[1]}"
-                
+            elif first_msg.kind == "USERNAME":
+                username = parse_username(first_msg, addr)
+                first_msg.release()
                 # Đã có username, thoát khỏi vòng lặp chờ
                 break
             else:
                 # Nếu không phải tin USERNAME (ví dụ: client gửi TEXTMSG quá sớm),
                 # lưu vào buffer để xử lý sau khi có username.
-                buffered_messages.append(first_msg_bytes)
-            
-            # Đặt thời gian chờ 5s. Nếu sau 5s client không gửi USERNAME,
-            # tự gán tên mặc định và tiếp tục.
-            if time.time() - start > 5:
-                username = f"{addr[0]}:{addr[1]}"
-                break
+                if not buffer_early_message(buffered_messages, first_msg, addr):
+                    return
+        conn.settimeout(None)
 
-        # --- Giai đoạn 2: Đăng ký client và xử lý buffer ---
-        with clients_lock:
-            # Thêm client vào dictionary toàn cục
-            clients[conn] = username
-        
-        print(f"Người dùng '{username}' ({addr}) đã tham gia.")
-        
-        # Thông báo cho MỌI NGƯỜI (bao gồm cả user mới) danh sách user mới
-        broadcast_user_list()
-
-        # Xử lý các tin nhắn đã bị đệm (nếu có)
-        for msg in buffered_messages:
-            if msg is None:
-                continue
-            try:
-                # Phân tích và định tuyến các tin nhắn trong buffer
-                if msg.startswith(b"TEXTMSG::") or msg.startswith(b"VOICEMSG::"):
-                    parts = msg.split(b"::", 3)
-                    if len(parts) == 4:
-                        _, sender_b, receiver_b, content = parts
-                        receiver_name = receiver_b.decode('utf-8', errors='ignore')
-                        
-                        if receiver_name == "ALL":
-                            # Gửi cho tất cả (bao gồm cả người gửi)
-                            broadcast_message(msg, exclude_conn=None) 
-                        else:
-                            # Gửi riêng tư
-                            send_to_user_only(receiver_name, msg)
-                # (Logic cho OPENPRIVATE và FILE cũng nên được thêm vào đây nếu cần)
-            except Exception:
-                pass  # Bỏ qua nếu tin nhắn trong buffer bị lỗi
-        buffered_messages.clear() # Xóa buffer sau khi xử lý
+        # --- Giai đoạn 2: Đăng ký client, khởi động writer và xử lý buffer ---
+        queue = new_outbound_queue(slices)
+        queue.on_close = lambda reason: _shutdown_socket(conn)
+        threading.Thread(target=writer_thread, args=(conn, queue), daemon=True).start()
+        registered = True
+        pending = list(buffered_messages)
+        wait_for_blocked(register_client(conn, username, addr, queue, buffered_messages, proto, history_bulk,
+                                         compress))
+        release_messages(pending)
 
         # --- Giai đoạn 3: Vòng lặp chính (nhận và xử lý tin nhắn) ---
         while True:
             # Chờ nhận tin nhắn tiếp theo
-            data = receive_message(conn)
-            
+            data = receive_message(conn, assembler)
+
             # Nếu data là None, client đã ngắt kết nối
             if data is None:
                 break
-            
+
             try:
                 # --- LOGIC PHÂN TUYẾN (ROUTING) TIN NHẮN ---
-                
-                # (Hiện tại code client không gửi OPENPRIVATE, nhưng logic server vẫn có)
-                if data.startswith(b"OPENPRIVATE::"):
-                    parts = data.split(b"::", 2)
-                    if len(parts) == 3:
-                        _, sender_b, target_b = parts
-                        target_name = target_b.decode('utf-8', errors='ignore')
-                        # Chỉ forward cho người nhận
-                        send_to_user_only(target_name, data)
-                    continue # Xử lý xong, chờ tin tiếp theo
-
-                # Xử lý tin nhắn TEXT hoặc VOICE (hoặc FILE)
-                if data.startswith(b"TEXTMSG::") or data.startswith(b"VOICEMSG::") or data.startswith(b"FILE::"):
-                    # Tách payload: "PREFIX::SENDER::RECEIVER::CONTENT"
-                    parts = data.split(b"::", 3)
-                    if len(parts) != 4:
-                        print(f"Format message không hợp lệ từ {username}")
-                        continue
-
-                    _, sender_b, receiver_b, content = parts
-                    receiver_name = receiver_b.decode('utf-8', errors='ignore')
-                    
-                    # Nếu người nhận là "ALL"
-                    if receiver_name == "ALL":
-                        # Gửi tin nhắn này cho TẤT CẢ MỌI NGƯỜI (loai tru người gửi)
-                        print(f"[BROADCAST] từ '{username}'")
-                        # Truyền "conn" (socket của người gửi) vào để loại trừ
-                        broadcast_message(data, exclude_conn=conn)
-                    else:
-                        # Nếu là tin nhắn riêng, chỉ gửi cho người nhận
-                        print(f"[PRIVATE] từ '{username}' tới '{receiver_name}'")
-                        send_to_user_only(receiver_name, data)
-                else:
-                    # Nhận được một định dạng tin nhắn không xác định
-                    print(f"Nhận payload không hợp lệ từ {username}, loại: {data[:30]!r}")
-                    
+                # Nếu người nhận chậm và policy là backpressure, luồng này (người gửi) chờ tại đây
+                wait_for_blocked(route_message(conn, username, data))
             except Exception as e:
                 print(f"Lỗi xử lý message từ {username}: {e}")
                 break # Thoát vòng lặp nếu có lỗi nghiêm trọng
+            finally:
+                # Mọi hàng đợi đã giữ tham chiếu riêng tới buffer (nếu cần): trả phần của luồng đọc
+                data.release()
 
     except Exception as e:
         print(f"Lỗi client {addr}: {e}")
@@ -283,41 +1065,274 @@ def handle_client(conn, addr):
         # --- Giai đoạn 4: Dọn dẹp (Cleanup) ---
         # Khối finally này LUÔN LUÔN chạy,
         # dù client ngắt kết nối (break) hay bị lỗi (exception).
-        
-        with clients_lock:
-            # Xóa client khỏi dictionary
-            if conn in clients:
-                del clients[conn]
-        
-        print(f"Người dùng '{username}' ({addr}) đã rời khỏi.")
-        
-        # Cập nhật user list cho những người còn lại
-        broadcast_user_list()
-        
+        if registered:
+            unregister_client(conn, username, addr)
+        # Trả buffer nhận còn giữ (tin đệm chưa xử lý, payload nhận dở) về pool / ngân sách chung
+        release_messages(buffered_messages)
+        assembler.discard()
+
         # Đóng socket của client này
         try:
             conn.close()
         except Exception:
             pass # Bỏ qua nếu socket đã đóng
 
+def writer_thread(conn, queue):
+    """
+    Writer riêng của một kết nối (engine luồng): lấy frame từ hàng đợi và gửi (chặn) qua socket.
+    Client nhận chậm chỉ làm chậm luồng này, không giữ 'clients_lock'.
+    """
+    peer = peer_name(conn)
+    try:
+        while True:
+            frame = queue.get()
+            if frame is None:
+                break  # Hàng đợi đã đóng
+            # Header + payload gửi bằng vectored I/O, payload dùng chung giữa mọi người nhận
+            try:
+                send_frame(conn, frame)
+                frame.sent()
+            finally:
+                frame.release()
+    except Exception as e:
+        print(f"[LỖI GỬI] {peer}: {e}")
+    finally:
+        if queue.close_reason not in (None, "closed"):
+            print(f"[NGẮT KẾT NỐI] {peer}: {queue.close_reason}")
+        # Đóng hàng đợi cũng đánh thức luồng đọc (handle_client) qua on_close để nó dọn dẹp
+        queue.close()
+
+def _shutdown_socket(conn):
+    """Cắt socket: làm sendall/recv đang chặn ở writer và luồng đọc kết thúc ngay."""
+    try:
+        conn.shutdown(socket.SHUT_RDWR)
+    except Exception:
+        pass
+
+# =====================================
+# === HÀM XỬ LÝ CLIENT (ASYNCIO) ===
+# =====================================
+
+def new_outbound_queue_async(loop, writer, slices=False):
+    """Tạo hàng đợi gửi kèm 2 asyncio.Event (có dữ liệu / có chỗ trống) cho engine asyncio."""
+    queue = new_outbound_queue(slices)
+    data_event = asyncio.Event()
+    space_event = asyncio.Event()
+    queue.on_data = lambda: loop.call_soon_threadsafe(data_event.set)
+    queue.on_space = lambda: loop.call_soon_threadsafe(space_event.set)
+    # abort() làm 'await writer.drain()' đang kẹt với người nhận chậm kết thúc ngay
+    queue.on_close = lambda reason: loop.call_soon_threadsafe(writer.transport.abort)
+    return queue, data_event, space_event
+
+# Chu kỳ kiểm tra transport đã gửi hết chưa, khi writer rảnh nhưng còn frame chưa trả buffer
+FLUSH_POLL_INTERVAL = 0.05
+# Số giây chờ transport gửi nốt dữ liệu khi đóng kết nối, quá hạn thì cắt (abort)
+CLOSE_TIMEOUT = 5
+
+def _release_flushed(writer, written):
+    """
+    Trả buffer của các frame đã ghi, CHỈ khi transport không còn dữ liệu chờ gửi:
+    từ Python 3.12 transport giữ tham chiếu tới memoryview thay vì sao chép phần chưa gửi,
+    nên trả buffer về pool sớm hơn sẽ làm dữ liệu bị ghi đè trước khi lên dây.
+    Lúc đó các frame cũng mới thực sự được gửi (frame.sent()).
+    """
+    if written and writer.transport.get_write_buffer_size() == 0:
+        for frame in written:
+            frame.sent()
+            frame.release()
+        written.clear()
+
+async def writer_task(writer, queue, data_event):
+    """Writer riêng của một kết nối (engine asyncio): lấy frame từ hàng đợi và ghi + drain."""
+    peer = peer_name(writer)
+    written = []  # Frame đã ghi nhưng transport có thể vẫn đang giữ buffer của chúng
+    try:
+        while True:
+            frame = queue.get_nowait()
+            if frame is None:
+                if queue.closed:
+                    break
+                _release_flushed(writer, written)
+                data_event.clear()
+                # Kiểm tra lại sau khi clear để không lỡ tín hiệu
+                if not len(queue) and not queue.closed:
+                    if written:
+                        try:
+                            await asyncio.wait_for(data_event.wait(), FLUSH_POLL_INTERVAL)
+                        except asyncio.TimeoutError:
+                            pass
+                    else:
+                        await data_event.wait()
+                continue
+            for buf in frame.buffers():
+                writer.write(buf)
+            written.append(frame)
+            await writer.drain()
+            _release_flushed(writer, written)
+    except Exception as e:
+        print(f"[LỖI GỬI] {peer}: {e}")
+    finally:
+        if queue.close_reason not in (None, "closed"):
+            print(f"[NGẮT KẾT NỐI] {peer}: {queue.close_reason}")
+        queue.close()
+        writer.close()
+        # Frame đã ghi nhưng chưa chắc đã lên dây: chỉ trả buffer khi transport đóng hẳn
+        if written:
+            try:
+                await asyncio.wait_for(writer.wait_closed(), CLOSE_TIMEOUT)
+            except asyncio.TimeoutError:
+                writer.transport.abort()
+            for frame in written:
+                frame.release()
+
+async def wait_for_blocked_async(blocked, space_events):
+    """
+    Backpressure cho engine asyncio: coroutine của người gửi ngừng đọc
+    cho tới khi các hàng đợi đầy có chỗ (hoặc hết BACKPRESSURE_TIMEOUT thì ngắt người nhận).
+    """
+    for q, frame in blocked:
+        event = space_events.get(q)
+        deadline = time.monotonic() + BACKPRESSURE_TIMEOUT
+        while event is not None and not q.has_space(len(frame)):
+            event.clear()
+            if q.has_space(len(frame)):
+                break
+            remaining = deadline - time.monotonic()
+            try:
+                await asyncio.wait_for(event.wait(), max(remaining, 0))
+            except asyncio.TimeoutError:
+                q.close("backpressure timeout")
+                break
+        q.force_put(frame)
+
+# Sự kiện "có chỗ trống" của từng hàng đợi trong engine asyncio: {OutboundQueue: asyncio.Event}
+# Chỉ được truy cập từ luồng event loop.
+async_space_events = {}
+
+async def handle_client_async(writer):
+    """
+    Tương đương handle_client nhưng chạy như một coroutine trên event loop.
+    Một tiến trình có thể giữ hàng nghìn kết nối rảnh mà không cần 1 luồng/kết nối.
+    'writer' (FrameConnection) vừa nhận tin (read_message) vừa đóng vai trò 'conn' trong 'clients'.
+    """
+    addr = writer.get_extra_info('peername')
+    print(f"[KẾT NỐI MỚI] {addr}")
+    username = None
+    registered = False
+    proto = PROTO_V1
+    history_bulk = False
+    slices = False
+    compress = 0
+    buffered_messages = []
+
+    try:
+        # --- Giai đoạn 1: Chờ USERNAME (tối đa HANDSHAKE_TIMEOUT giây) ---
+        deadline = time.monotonic() + HANDSHAKE_TIMEOUT
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                first_msg = await asyncio.wait_for(writer.read_message(), max(remaining, 0))
+            except asyncio.TimeoutError:
+                username = f"{addr[0]}:{addr[1]}"
+                break
+            if first_msg is None:
+                return
+
+            if first_msg.kind == "HELLO":
+                proto = negotiate_proto(first_msg)
+                history_bulk = wants_bulk_history(first_msg)
+                slices = wants_slices(first_msg)
+                compress = wants_compression(first_msg)
+                first_msg.release()
+            elif first_msg.kind == "USERNAME":
+                username = parse_username(first_msg, addr)
+                first_msg.release()
+                break
+            elif not buffer_early_message(buffered_messages, first_msg, addr):
+                return
+
+        # --- Giai đoạn 2: Đăng ký client, khởi động writer và xử lý buffer ---
+        queue, data_event, space_event = new_outbound_queue_async(asyncio.get_running_loop(), writer, slices)
+        async_space_events[queue] = space_event
+        writer_job = asyncio.create_task(writer_task(writer, queue, data_event))
+        registered = True
+        pending = list(buffered_messages)
+        await wait_for_blocked_async(register_client(writer, username, addr, queue, buffered_messages, proto,
+                                                     history_bulk, compress, offline=False), async_space_events)
+        release_messages(pending)
+        # Đọc log (đĩa, có thể chờ luồng ghi) trong executor: không chặn các kết nối khác trên event loop
+        loop = asyncio.get_running_loop()
+        if history is not None:
+            with clients_lock:
+                session = clients.get(writer)
+            blocked = await loop.run_in_executor(None, deliver_offline, session, history_bulk)
+            await wait_for_blocked_async(blocked, async_space_events)
+
+        # --- Giai đoạn 3: Vòng lặp chính ---
+        while True:
+            data = await writer.read_message()
+            if data is None:
+                break
+            try:
+                if data.kind == "HISTORY":
+                    # Chỉ đọc đĩa trong executor; lock, kiểm tra và gửi vẫn trên event loop
+                    frames_in.add(data.kind, wire_size(data))
+                    query = history_query(writer, username, data)
+                    blocked = []
+                    if query is not None:
+                        reply = await loop.run_in_executor(None, read_history, query)
+                        blocked = send_to_conn(writer, reply)
+                else:
+                    blocked = route_message(writer, username, data)
+                if blocked:
+                    await wait_for_blocked_async(blocked, async_space_events)
+            except Exception as e:
+                print(f"Lỗi xử lý message từ {username}: {e}")
+                break
+            finally:
+                data.release()
+
+    except Exception as e:
+        print(f"Lỗi client {addr}: {e}")
+    finally:
+        # --- Giai đoạn 4: Dọn dẹp ---
+        if registered:
+            unregister_client(writer, username, addr)
+            async_space_events.pop(queue, None)
+            await writer_job
+        release_messages(buffered_messages)
+        writer.release_pending()
+        try:
+            writer.close()
+        except Exception:
+            pass
+
 # ================================
 # === HÀM KHỞI ĐỘNG SERVER ===
 # ================================
 
-def start_server():
+def close_history():
+    """Ghi nốt các bản ghi lịch sử đang chờ trước khi tắt."""
+    if history is not None:
+        history.close()
+
+def start_server(host=HOST, port=PORT, reuse_port=False):
     # Tạo socket server
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     
     # Thiết lập SO_REUSEADDR để cho phép tái sử dụng địa chỉ/port ngay lập tức
     # Tránh lỗi "Address already in use" khi khởi động lại server nhanh
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # Chế độ nhiều worker: các worker cùng bind một cổng, kernel chia kết nối mới cho chúng
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     
     # Gắn socket vào địa chỉ HOST và PORT
-    server_socket.bind((HOST, PORT))
+    server_socket.bind((host, port))
     
     # Bắt đầu lắng nghe kết nối
     server_socket.listen()
-    print(f"[ĐANG LẮNG NGHE] Server tại {HOST}:{PORT}")
+    print(f"[ĐANG LẮNG NGHE] Server tại {host}:{port}")
 
     try:
         # Vòng lặp vô tận để chấp nhận kết nối mới
@@ -343,19 +1358,223 @@ def start_server():
     finally:
         # Đóng socket chính của server
         server_socket.close()
+        close_history()
         print("[ĐÃ ĐÓNG] Server đã đóng hoàn toàn.")
 
-# --- Điểm khởi chạy của chương trình ---
-if __name__ == "__main__":
-    start_server()
+async def serve_async(host=HOST, port=PORT, reuse_port=False):
+    """Event loop server: mọi kết nối chạy như coroutine trong CÙNG một luồng."""
+    global event_loop
+    loop = event_loop = asyncio.get_running_loop()
+    tasks = set()  # Giữ tham chiếu tới task của từng kết nối (tránh bị GC giữa chừng)
 
+    def on_connect(conn):
+        task = loop.create_task(handle_client_async(conn))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
 
+    server = await loop.create_server(lambda: FrameConnection(receive_pool, on_connect, admission.connection()),
+                                      host, port, reuse_address=True, reuse_port=reuse_port or None)
+    print(f"[ĐANG LẮNG NGHE] Server (asyncio) tại {host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        event_loop = None
 
+def start_async_server(host=HOST, port=PORT, reuse_port=False):
+    try:
+        asyncio.run(serve_async(host, port, reuse_port))
+    except KeyboardInterrupt:
+        print("\n[ĐÓNG SERVER] Server đang tắt...")
+    finally:
+        close_history()
+        print("[ĐÃ ĐÓNG] Server đã đóng hoàn toàn.")
 
+def start_stats_server(port, host=STATS_HOST):
+    """
+    Cổng thống kê cục bộ (luồng riêng, dùng được với cả 2 engine). Mỗi kết nối gửi một dòng yêu cầu:
+    "json" -> JSON của stats_snapshot(), dòng khác / không gửi gì -> dạng text của metrics.format_text.
+    Yêu cầu HTTP GET (ví dụ Prometheus scrape "/metrics", hoặc "/json") được trả lời kèm header HTTP.
+    """
+    server_socket = socket.create_server((host, port))
+    threading.Thread(target=_stats_loop, args=(server_socket,), daemon=True).start()
+    print(f"[THỐNG KÊ] Cổng số liệu tại {host}:{server_socket.getsockname()[1]}")
+    return server_socket
 
+def _stats_loop(server_socket):
+    while True:
+        try:
+            conn, _ = server_socket.accept()
+        except OSError:
+            break  # socket đã đóng
+        with conn:
+            conn.settimeout(STATS_REQUEST_TIMEOUT)
+            try:
+                request = conn.recv(1024).split(b"\r\n", 1)[0].strip()
+            except OSError:
+                request = b""
+            try:
+                as_json = b"json" in request.lower()
+                snapshot = call_in_loop(stats_snapshot)
+                body = (json.dumps(snapshot) if as_json else metrics.format_text(snapshot)).encode('utf-8')
+                if request.startswith(b"GET "):
+                    content_type = "application/json" if as_json else "text/plain; version=0.0.4"
+                    body = (f"HTTP/1.0 200 OK\r\nContent-Type: {content_type}\r\n"
+                            f"Content-Length: {len(body)}\r\n\r\n").encode('utf-8') + body
+                conn.sendall(body)
+            except Exception as e:
+                print(f"[THỐNG KÊ] Lỗi: {e}")
+
+# Các engine có thể chọn khi khởi động: python server.py --engine asyncio
+ENGINES = {
+    "thread": start_server,      # 1 luồng / client (mặc định, như cũ)
+    "asyncio": start_async_server,  # 1 event loop cho tất cả client
+}
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="LAN voice chat server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="thread",
+                        help="thread: 1 luồng/kết nối; asyncio: event loop, phù hợp hàng nghìn kết nối")
+    parser.add_argument("--queue-max-bytes", type=int, default=OUTBOUND_MAX_BYTES,
+                        help="số byte tối đa chờ gửi cho mỗi kết nối")
+    parser.add_argument("--overflow-policy", choices=outbound.POLICIES, default=OVERFLOW_POLICY,
+                        help="khi hàng đợi gửi đầy: drop (bỏ tin), disconnect (ngắt người nhận), "
+                             "backpressure (bắt người gửi chờ)")
+    parser.add_argument("--backpressure-timeout", type=float, default=BACKPRESSURE_TIMEOUT)
+    parser.add_argument("--slice-bytes", type=int, default=SLICE_BYTES,
+                        help="cắt tin lớn thành lát cỡ này khi gửi tới client hỗ trợ, để tin chữ chen vào giữa "
+                             "(0 = không cắt)")
+    parser.add_argument("--compression", default=format_methods(COMPRESSION_METHODS), metavar="zlib,lzma",
+                        help="kiểu nén payload chấp nhận khi client đề nghị ('none' = không nén)")
+    parser.add_argument("--history-dir", default=HISTORY_DIR,
+                        help="thư mục lưu lịch sử tin nhắn và tin chờ giao cho user offline")
+    parser.add_argument("--no-history", action="store_true", help="không lưu lịch sử / tin offline")
+    parser.add_argument("--history-fsync", action="store_true",
+                        help="fsync sau mỗi lô ghi lịch sử (bền hơn khi mất điện, chậm hơn)")
+    parser.add_argument("--stats-port", type=int, default=0,
+                        help=f"mở cổng số liệu đo trên {STATS_HOST} (0 = tắt; gửi 'json' để nhận JSON)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="số tiến trình worker cùng phục vụ cổng (SO_REUSEPORT, định tuyến qua bus.py); "
+                             "worker i mở cổng số liệu --stats-port + i")
+    parser.add_argument("--cluster-port", type=int, default=0,
+                        help="cổng nhận kết nối từ các node server khác trong cụm (0 = không nhận)")
+    parser.add_argument("--peers", nargs="*", default=[], metavar="HOST:PORT",
+                        help="--cluster-port của các node khác để nối tới (mỗi cặp node chỉ cần một bên)")
+    parser.add_argument("--node-id", help="tên node trong cụm (mặc định <hostname>:<cổng chat>)")
+    parser.add_argument("--max-frame", nargs="*", default=[], metavar="KIND=BYTES",
+                        help="giới hạn payload theo loại tin, ví dụ TEXTMSG=65536 FILE=2097152 "
+                             "(mặc định xem admission.DEFAULT_MAX_FRAME)")
+    parser.add_argument("--max-frame-default", type=int, default=admission.default_max,
+                        help="giới hạn payload của các loại tin còn lại")
+    parser.add_argument("--inflight-max-bytes", type=int, default=INFLIGHT_MAX_BYTES,
+                        help="tổng payload tối đa đang giữ trong buffer nhận của mọi kết nối (0 = không giới hạn)")
+    parser.add_argument("--rate-frames", type=float, default=0,
+                        help="số frame/giây tối đa mỗi kết nối được gửi lên (0 = không giới hạn)")
+    parser.add_argument("--rate-bytes", type=float, default=0,
+                        help="số byte/giây tối đa mỗi kết nối được gửi lên (0 = không giới hạn)")
+    args = parser.parse_args(argv)
+    try:
+        args.max_frame = parse_frame_limits(args.max_frame)
+    except ValueError as e:
+        parser.error(str(e))
+    unknown = sorted(set(args.max_frame) - set(TYPE_CODES))
+    if unknown:
+        parser.error(f"loại tin không xác định trong --max-frame: {', '.join(unknown)}")
+    unknown = sorted({name.strip() for name in args.compression.split(",")} - set(METHODS) - {"none", ""})
+    if unknown:
+        parser.error(f"kiểu nén không xác định trong --compression: {', '.join(unknown)}")
+    return args
 
+def configure(args):
+    """Áp dụng cấu hình từ dòng lệnh vào các biến toàn cục của server."""
+    global OUTBOUND_MAX_BYTES, OVERFLOW_POLICY, BACKPRESSURE_TIMEOUT, SLICE_BYTES, INFLIGHT_MAX_BYTES, admission
+    global COMPRESSION_METHODS, history
+    OUTBOUND_MAX_BYTES = args.queue_max_bytes
+    OVERFLOW_POLICY = args.overflow_policy
+    BACKPRESSURE_TIMEOUT = args.backpressure_timeout
+    SLICE_BYTES = args.slice_bytes
+    COMPRESSION_METHODS = parse_methods(args.compression)
+    INFLIGHT_MAX_BYTES = receive_pool.budget = args.inflight_max_bytes
+    admission = AdmissionPolicy(receive_pool, args.max_frame, args.max_frame_default, args.rate_frames, args.rate_bytes)
+    if not args.no_history:
+        history = MessageLog(args.history_dir, fsync=args.history_fsync)
 
+def start_cluster(args):
+    """Nối node này vào cụm (--cluster-port / --peers): client ở các node khác hiện trong USERLIST chung."""
+    global bus
+    node = args.node_id or f"{socket.gethostname()}:{args.port}"
+    bus = ClusterNode(node, deliver_from_bus, schedule_presence_update, args.host, args.cluster_port, args.peers)
 
+# ================================
+# === CHẾ ĐỘ NHIỀU WORKER ===
+# ================================
+
+def run_worker(args, index, address):
+    """Thân của một tiến trình worker: nối bus tới hub rồi chạy engine trên cổng dùng chung."""
+    global bus, worker_index
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    configure(args)
+    worker_index = index
+    bus = bus_module.BusLink(str(index), deliver_from_bus, schedule_presence_update, address, undelivered_from_bus)
+    if args.stats_port:
+        start_stats_server(args.stats_port + index)
+    ENGINES[args.engine](args.host, args.port, reuse_port=True)
+
+def start_workers(args):
+    """
+    Tiến trình chính của --workers N: mở RoutingHub rồi chạy N worker, khởi động lại worker bị chết.
+    Lịch sử tin nhắn bị tắt: một MessageLog chỉ có một tiến trình ghi.
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        sys.exit("--workers cần SO_REUSEPORT (Linux / BSD / macOS)")
+    if not args.no_history:
+        print("[WORKER] Chế độ nhiều worker: tắt lịch sử tin nhắn / tin offline (--no-history).")
+        args.no_history = True
+    hub = bus_module.RoutingHub()
+    hub.start()
+    context = multiprocessing.get_context("spawn")
+    workers = {}
 
+    def spawn(index):
+        process = context.Process(target=run_worker, args=(args, index, hub.address), daemon=True)
+        process.start()
+        workers[index] = process
+        print(f"[WORKER] Worker {index} (pid {process.pid}) tại {args.host}:{args.port}")
 
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        for index in range(args.workers):
+            spawn(index)
+        while True:
+            time.sleep(1)
+            for index, process in list(workers.items()):
+                if not process.is_alive():
+                    print(f"[WORKER] Worker {index} đã dừng (mã {process.exitcode}), khởi động lại...")
+                    spawn(index)
+    except (KeyboardInterrupt, SystemExit):
+        print("\n[ĐÓNG SERVER] Server đang tắt...")
+    finally:
+        for process in workers.values():
+            process.terminate()
+        for process in workers.values():
+            process.join(5)
+        hub.close()
+        print("[ĐÃ ĐÓNG] Server đã đóng hoàn toàn.")
+
+# --- Điểm khởi chạy của chương trình ---
+if __name__ == "__main__":
+    args = parse_args()
+    clustered = args.cluster_port or args.peers
+    if args.workers > 1:
+        if clustered:
+            sys.exit("--workers chưa dùng chung được với --cluster-port / --peers")
+        start_workers(args)
+        sys.exit(0)
+    configure(args)
+    if clustered:
+        start_cluster(args)
+    if args.stats_port:
+        start_stats_server(args.stats_port)
+    ENGINES[args.engine](args.host, args.port)
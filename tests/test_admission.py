@@ -0,0 +1,63 @@
+import pytest
+
+import admission
+from admission import (BUDGET_RETRY_INTERVAL, CONTROL_FRAME_BYTES, AdmissionPolicy, FrameRejected, RateLimiter,
+                       parse_frame_limits)
+from protocol import BufferPool, ProtocolError
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_parse_frame_limits():
+    assert parse_frame_limits(["textmsg=65536", " FILE =0"]) == {"TEXTMSG": 65536, "FILE": 0}
+    for bad in (["TEXTMSG"], ["=5"], ["TEXTMSG=abc"]):
+        with pytest.raises(ValueError):
+            parse_frame_limits(bad)
+
+
+def test_rate_limiter_allows_a_burst_then_waits(clock):
+    limiter = RateLimiter(frame_rate=10, byte_rate=0)
+    assert [limiter.charge(0) for _ in range(10)] == [0.0] * 10
+    assert limiter.charge(0) == pytest.approx(0.1)
+    clock[0] += 5.0  # nạp lại nhưng không vượt dung lượng bucket
+    assert limiter.charge(0) == 0.0
+    assert limiter.frame_tokens == pytest.approx(10 * admission.RATE_BURST - 1)
+
+
+def test_rate_limiter_allows_debt_for_large_frames(clock):
+    limiter = RateLimiter(frame_rate=0, byte_rate=1000)
+    assert limiter.charge(3000) == pytest.approx(2.0)  # frame lớn hơn bucket: đi được, chờ trả nợ
+    clock[0] += 2.0
+    assert limiter.charge(0) == 0.0
+
+
+def test_per_kind_limits_and_budget_cap():
+    policy = AdmissionPolicy(BufferPool(budget=4 * 1024 * 1024), {"TEXTMSG": 100})
+    assert policy.limit_for("TEXTMSG") == 100
+    assert policy.limit_for("FILE") == 4 * 1024 * 1024       # mặc định 32 MB, bị chặn bởi ngân sách chung
+    assert policy.limit_for("USERNAME") == CONTROL_FRAME_BYTES
+    conn = policy.connection()
+    assert conn.admit("TEXTMSG", 100) == 0.0
+    with pytest.raises(FrameRejected) as error:
+        conn.admit("TEXTMSG", 101)
+    assert isinstance(error.value, ProtocolError)
+    assert policy.stats()["rejected"] == 1
+
+
+def test_throttling_and_budget_waits_are_counted(clock):
+    policy = AdmissionPolicy(BufferPool(), frame_rate=1)
+    conn = policy.connection()
+    assert conn.admit("TEXTMSG", 10) == 0.0
+    assert conn.admit("TEXTMSG", 10) == pytest.approx(1.0)
+    assert conn.budget_full(True) == conn.budget_full(False) == BUDGET_RETRY_INTERVAL
+    stats = policy.stats()
+    assert stats["throttled"] == 1 and stats["throttled_s"] == 1.0 and stats["budget_waits"] == 1
+    # Mỗi kết nối có bucket riêng
+    assert policy.connection().admit("TEXTMSG", 10) == 0.0
+    # Không cấu hình tốc độ: không có limiter
+    assert AdmissionPolicy(BufferPool()).connection().limiter is None
@@ -0,0 +1,70 @@
+import os
+import time
+
+import pytest
+
+from attachments import AttachmentMissing, AttachmentStore
+
+
+def test_put_is_content_addressed_and_deduplicated(tmp_path):
+    store = AttachmentStore(str(tmp_path), max_bytes=1000)
+    first = store.put(b"hello")
+    again = store.put(memoryview(b"hello"))
+    assert first.digest == again.digest and first.size == 5
+    assert store.total == 5 and len(os.listdir(tmp_path)) == 1
+    with store.open(first) as data:
+        assert bytes(data) == b"hello"
+
+
+def test_lru_eviction_keeps_recently_used(tmp_path):
+    store = AttachmentStore(str(tmp_path), max_bytes=250)
+    a, b = store.put(b"a" * 100), store.put(b"b" * 100)
+    with store.open(a):
+        pass  # a vừa được dùng: b là cũ nhất
+    c = store.put(b"c" * 100)
+    assert a in store and c in store and b not in store
+    assert store.total == 200
+    with pytest.raises(AttachmentMissing):
+        with store.open(b):
+            pass
+
+
+def test_oversized_attachment_is_kept_alone(tmp_path):
+    store = AttachmentStore(str(tmp_path), max_bytes=50)
+    small = store.put(b"s" * 10)
+    big = store.put(b"B" * 100)
+    assert big in store and small not in store
+
+
+def test_reload_restores_lru_order_and_cleans_partial_writes(tmp_path):
+    store = AttachmentStore(str(tmp_path), max_bytes=1000)
+    old, new = store.put(b"old"), store.put(b"new")
+    past = time.time() - 100
+    os.utime(os.path.join(tmp_path, old.digest), (past, past))
+    (tmp_path / "x.tmp").write_bytes(b"partial")
+
+    reloaded = AttachmentStore(str(tmp_path), max_bytes=1000)
+    assert not (tmp_path / "x.tmp").exists()
+    assert reloaded.total == 6 and old in reloaded and new in reloaded
+    reloaded.max_bytes = 4
+    reloaded.put(b"z")
+    assert old not in reloaded and new in reloaded
+
+
+def test_missing_file_on_disk_is_reported(tmp_path):
+    store = AttachmentStore(str(tmp_path))
+    attachment = store.put(b"data")
+    os.remove(os.path.join(tmp_path, attachment.digest))
+    with pytest.raises(AttachmentMissing):
+        with store.open(attachment):
+            pass
+    assert attachment not in store and store.total == 0
+
+
+def test_save_to_and_empty_attachment(tmp_path):
+    store = AttachmentStore(str(tmp_path / "cache"))
+    attachment = store.put(b"payload")
+    store.save_to(attachment, str(tmp_path / "out.bin"))
+    assert (tmp_path / "out.bin").read_bytes() == b"payload"
+    with store.open(store.put(b"")) as data:
+        assert bytes(data) == b""
@@ -0,0 +1,92 @@
+import queue
+import socket
+import time
+
+import pytest
+
+from bus import BusLink, RoutingHub
+from protocol import encode_frame
+
+
+def wait_until(predicate, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class Worker:
+    """BusLink kèm hàng đợi các tin nhận được (chép ra bytes rồi trả buffer)."""
+
+    def __init__(self, name, address):
+        self.inbox = queue.Queue()
+        self.returned = queue.Queue()
+        self.link = BusLink(name, self._collect(self.inbox), lambda: None, address, self._collect(self.returned))
+
+    @staticmethod
+    def _collect(target):
+        def on_message(msg):
+            target.put((msg.kind, msg.sender, msg.receiver, bytes(msg.body)))
+            msg.release()
+        return on_message
+
+    def send(self, kind, sender, receiver, body):
+        self.link.publish(encode_frame(f"{kind}::{sender}::{receiver}::{body}".encode("utf-8")), receiver, [])
+
+
+@pytest.fixture
+def hub(tmp_path):
+    hub = RoutingHub(str(tmp_path / "hub.sock"))
+    hub.start()
+    yield hub
+    hub.close()
+
+
+def test_directory_and_private_routing(hub):
+    a, b = Worker("0", hub.address), Worker("1", hub.address)
+    b.link.announce(True, "bob")
+    assert wait_until(lambda: a.link.hosts("bob"))
+    assert a.link.remote_names() == ["bob"] and not b.link.hosts("bob")
+    a.send("TEXTMSG", "alice", "bob", "xin chao")
+    assert b.inbox.get(timeout=2) == ("TEXTMSG", "alice", "bob", b"xin chao")
+    b.link.announce(False, "bob")
+    assert wait_until(lambda: not a.link.hosts("bob"))
+    a.link.close()
+    b.link.close()
+
+
+def test_broadcast_reaches_workers_with_users_only(hub):
+    a, b, idle = Worker("0", hub.address), Worker("1", hub.address), Worker("2", hub.address)
+    b.link.announce(True, "bob")
+    assert wait_until(lambda: a.link.hosts("bob"))
+    a.send("TEXTMSG", "alice", "ALL", "moi nguoi")
+    assert b.inbox.get(timeout=2)[3] == b"moi nguoi"
+    time.sleep(0.2)
+    assert idle.inbox.empty() and a.inbox.empty()
+    for worker in (a, b, idle):
+        worker.link.close()
+
+
+def test_private_message_to_vanished_user_returns_to_sender(hub):
+    a, b = Worker("0", hub.address), Worker("1", hub.address)
+    a.send("TEXTMSG", "alice", "ghost", "ai do?")
+    assert a.returned.get(timeout=2) == ("TEXTMSG", "alice", "ghost", b"ai do?")
+    assert wait_until(lambda: hub.unroutable == 1)
+    assert a.link.stats()["undelivered"] == 1 and a.inbox.empty() and b.inbox.empty()
+    # Tin tới phòng không còn ai: bỏ, không trả về
+    a.send("TEXTMSG", "alice", "#trong", "khong ai")
+    assert wait_until(lambda: hub.unroutable == 2)
+    assert a.returned.empty()
+    a.link.close()
+    b.link.close()
+
+
+def test_worker_drop_removes_its_names(hub):
+    a, b = Worker("0", hub.address), Worker("1", hub.address)
+    b.link.announce(True, "bob")
+    assert wait_until(lambda: a.link.hosts("bob"))
+    b.link.sock.shutdown(socket.SHUT_RDWR)  # worker chết
+    assert wait_until(lambda: not a.link.hosts("bob"))
+    a.link.close()
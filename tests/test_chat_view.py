@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+pytest.importorskip("customtkinter")
+
+from chat_view import HeightIndex, _WheelDispatcher  # noqa: E402
+
+
+def check(index, heights):
+    """So offset() / find() với tổng tiền tố tính thẳng trên list."""
+    y = 0
+    for i, h in enumerate(heights):
+        assert index.offset(i) == y
+        assert index.find(y) == i
+        if h > 1:
+            assert index.find(y + h - 1) == i
+        y += h
+    assert index.offset(len(heights)) == y == index.total
+
+
+def test_append_small():
+    index, heights = HeightIndex(), []
+    for _ in range(15):
+        index.append(1)
+        heights.append(1)
+        check(index, heights)
+    assert index.offset(4) == 4
+
+
+def test_append_prepend_set_random():
+    rng = random.Random(0)
+    index, heights = HeightIndex(), []
+    for step in range(600):
+        op = rng.random()
+        if op < 0.6 or not heights:
+            h = rng.randint(1, 80)
+            index.append(h)
+            heights.append(h)
+        elif op < 0.8:
+            page = [rng.randint(1, 80) for _ in range(rng.randint(1, 40))]
+            index.prepend(page)
+            heights[:0] = page
+        else:
+            i = rng.randrange(len(heights))
+            heights[i] = rng.randint(1, 80)
+            index.set(i, heights[i])
+        check(index, heights)
+
+
+class FakeRoot:
+    def __init__(self):
+        self.bindings = []
+
+    def bind_all(self, sequence, handler, add=None):
+        self.bindings.append(sequence)
+        self.handler = handler
+
+
+class FakeView:
+    def __init__(self, path):
+        self.path = path
+        self.events = []
+
+    def _on_wheel(self, event):
+        if not event.widget.startswith(self.path):
+            return False
+        self.events.append(event)
+        return True
+
+
+class Event:
+    def __init__(self, widget):
+        self.widget = widget
+
+
+def test_wheel_handler_bound_once_per_root():
+    root = FakeRoot()
+    first, second = FakeView(".tab1"), FakeView(".tab2")
+    for view in (first, second):
+        _WheelDispatcher.for_root(root).add(view)
+    assert len(root.bindings) == 3
+    root.handler(Event(".tab2.row"))
+    assert (len(first.events), len(second.events)) == (0, 1)
+    _WheelDispatcher.for_root(root).remove(second)
+    root.handler(Event(".tab2.row"))
+    assert len(second.events) == 1
+    assert _WheelDispatcher.for_root(root).views == [first]
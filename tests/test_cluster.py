@@ -0,0 +1,179 @@
+import os
+import queue
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from cluster import ClusterNode, parse_address
+from protocol import FrameAssembler, encode_frame, encode_header, recv_message
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class Node:
+    def __init__(self, name, peers=()):
+        self.port = free_port()
+        self.inbox = queue.Queue()
+        self.cluster = ClusterNode(name, self._collect, lambda: None, "127.0.0.1", self.port,
+                                   [f"127.0.0.1:{p}" for p in peers])
+
+    def _collect(self, msg):
+        self.inbox.put((msg.kind, msg.sender, msg.receiver, bytes(msg.body)))
+        msg.release()
+
+    def publish(self, sender, receiver, body):
+        frame = encode_frame(f"TEXTMSG::{sender}::{receiver}::{body}".encode("utf-8"))
+        return self.cluster.publish(frame, receiver, [])
+
+
+@pytest.fixture
+def nodes():
+    created = []
+
+    def make(name, peers=()):
+        node = Node(name, peers)
+        created.append(node)
+        return node
+
+    yield make
+    for node in created:
+        node.cluster.close()
+
+
+def test_parse_address():
+    assert parse_address("10.0.0.1:13345") == ("10.0.0.1", 13345)
+    assert parse_address("13345") == ("127.0.0.1", 13345)
+
+
+def test_names_known_before_link_are_sent_on_connect(nodes):
+    a = nodes("a")
+    a.cluster.announce(True, "alice")
+    b = nodes("b", peers=[a.port])
+    assert wait_until(lambda: b.cluster.hosts("alice"))
+    b.cluster.announce(True, "bob")
+    assert wait_until(lambda: a.cluster.hosts("bob"))
+    a.cluster.announce(False, "alice")
+    assert wait_until(lambda: not b.cluster.hosts("alice"))
+    assert b.cluster.remote_names() == []
+
+
+def test_private_goes_only_to_hosting_node_and_all_to_nodes_with_users(nodes):
+    a = nodes("a")
+    b = nodes("b", peers=[a.port])
+    c = nodes("c", peers=[a.port, b.port])
+    b.cluster.announce(True, "bob")
+    assert wait_until(lambda: a.cluster.hosts("bob") and len(a.cluster.links) == 2 and len(b.cluster.links) == 2)
+
+    assert a.publish("alice", "bob", "rieng") == 1
+    assert b.inbox.get(timeout=2) == ("TEXTMSG", "alice", "bob", b"rieng")
+    assert a.publish("alice", "ALL", "chung") == 1  # c chưa có user nào
+    assert b.inbox.get(timeout=2)[3] == b"chung"
+    time.sleep(0.2)
+    assert c.inbox.empty()
+    assert a.publish("alice", "nobody", "mat") == 0
+
+
+def test_mutual_dial_keeps_one_link():
+    a_port, b_port = free_port(), free_port()
+    a = ClusterNode("a", lambda msg: msg.release(), lambda: None, "127.0.0.1", a_port, [f"127.0.0.1:{b_port}"])
+    b = ClusterNode("b", lambda msg: msg.release(), lambda: None, "127.0.0.1", b_port, [f"127.0.0.1:{a_port}"])
+
+    def same_connection():
+        link_a, link_b = a.links.get("b"), b.links.get("a")
+        try:
+            return link_a is not None and link_b is not None and \
+                link_a.sock.getsockname() == link_b.sock.getpeername()
+        except OSError:
+            return False
+
+    try:
+        # Hai bên cùng giữ kết nối do node có ID nhỏ hơn ("a") mở (a nối lại sau RECONNECT_INTERVAL nếu b
+        # chưa mở cổng lúc a khởi động)
+        assert wait_until(lambda: same_connection() and a.links["b"].dialed, timeout=10)
+        assert not b.links["a"].dialed
+        a.announce(True, "alice")
+        assert wait_until(lambda: b.hosts("alice"))
+    finally:
+        a.close()
+        b.close()
+
+
+def test_self_connection_is_ignored(nodes):
+    a = nodes("a")
+    port = a.port
+    same = ClusterNode("a", lambda msg: msg.release(), lambda: None, "127.0.0.1", free_port(), [f"127.0.0.1:{port}"])
+    try:
+        time.sleep(0.5)
+        assert same.links == {} and a.cluster.links == {}
+    finally:
+        same.close()
+
+
+def test_two_server_nodes_route_across_the_cluster(tmp_path):
+    ports = [free_port() for _ in range(4)]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    commands = [["--port", str(ports[0]), "--cluster-port", str(ports[1]), "--node-id", "n0"],
+                ["--port", str(ports[2]), "--cluster-port", str(ports[3]), "--node-id", "n1",
+                 "--peers", f"127.0.0.1:{ports[1]}"]]
+    servers = [subprocess.Popen([sys.executable, "server.py", "--host", "127.0.0.1", "--no-history"] + extra,
+                                cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+               for extra in commands]
+    socks = []
+    try:
+        def connect(port, name):
+            deadline = time.monotonic() + 10
+            while True:
+                try:
+                    sock = socket.create_connection(("127.0.0.1", port), timeout=1)
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.05)
+            socks.append(sock)
+            payload = f"USERNAME::{name}".encode()
+            sock.sendall(encode_header(len(payload)) + payload)
+            return sock
+
+        alice, bob = connect(ports[0], "alice"), connect(ports[2], "bob")
+        assembler = FrameAssembler()
+
+        def lists():
+            bob.settimeout(0.3)
+            out = []
+            try:
+                while True:
+                    msg = recv_message(bob, assembler)
+                    out.append((msg.kind, bytes(msg.raw).decode()))
+                    msg.release()
+            except socket.timeout:
+                return out
+
+        assert wait_until(lambda: any(kind == "USERLIST" and "alice" in text for kind, text in lists()), 10)
+        for payload in (b"TEXTMSG::alice::bob::qua node", b"TEXTMSG::alice::ALL::chung"):
+            alice.sendall(encode_header(len(payload)) + payload)
+        time.sleep(0.3)
+        assert [text for kind, text in lists() if kind == "TEXTMSG"] == \
+            ["TEXTMSG::alice::bob::qua node", "TEXTMSG::alice::ALL::chung"]
+    finally:
+        for sock in socks:
+            sock.close()
+        for server in servers:
+            server.terminate()
+            server.wait(5)
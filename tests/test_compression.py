@@ -0,0 +1,70 @@
+import lzma
+import os
+import zlib
+
+import pytest
+
+from compression import (FLAG_LZMA, FLAG_ZLIB, SIZE_HEADER, CompressionError, Inflater, compress, format_methods,
+                         inflate, looks_compressed, original_size, parse_methods)
+
+TEXT = "Xin chào, đây là một tin nhắn khá dài được lặp lại nhiều lần. ".encode("utf-8") * 200
+
+
+def test_parse_and_format_methods():
+    assert parse_methods(" ZLIB , lzma,unknown") == FLAG_ZLIB | FLAG_LZMA
+    assert parse_methods("") == parse_methods(None) == 0
+    assert format_methods(FLAG_ZLIB | FLAG_LZMA) == "zlib,lzma" and format_methods(0) == ""
+
+
+def test_looks_compressed():
+    assert looks_compressed(os.urandom(8192))
+    assert looks_compressed(b"\x00\x00\x00\x18ftypmp42" + b"\x00" * 1000)
+    assert looks_compressed(b"PK\x03\x04" + b"a" * 1000)
+    assert not looks_compressed(TEXT)
+
+
+@pytest.mark.parametrize("method, flag", [("zlib", FLAG_ZLIB), ("lzma", FLAG_LZMA)])
+def test_compress_round_trip(method, flag):
+    body, flags = compress([b"name.txt::", TEXT], method, sample=TEXT)
+    assert flags == flag and len(body) < len(TEXT) and original_size(body) == len(TEXT) + 10
+    assert bytes(inflate(memoryview(body), flags)) == b"name.txt::" + TEXT
+
+
+def test_compress_skips_small_incompressible_and_unknown():
+    assert compress([b"short"], "zlib") == (None, 0)
+    assert compress([os.urandom(8192)], "zlib") == (None, 0)
+    assert compress([TEXT], "brotli") == (None, 0)
+
+
+def test_inflater_streams_pieces_of_any_size():
+    body, flags = compress([TEXT], "zlib")
+    for step in (1, 3, 4, 5, 1000):
+        inflater = Inflater(flags)
+        view = memoryview(body)
+        for i in range(0, len(body), step):
+            inflater.feed(view[i:i + step])
+        assert bytes(inflater.finish()) == TEXT
+
+
+def test_bomb_is_rejected_before_and_while_inflating():
+    bomb = SIZE_HEADER.pack(10 * 1024 * 1024) + zlib.compress(b"\x00" * 10 * 1024 * 1024)
+    with pytest.raises(CompressionError, match="vượt giới hạn"):
+        inflate(bomb, FLAG_ZLIB, max_size=1024 * 1024)
+    # Khai báo nhỏ nhưng dữ liệu bung ra lớn hơn: dừng ở kích thước khai báo + 1 byte
+    liar = SIZE_HEADER.pack(100) + lzma.compress(b"\x00" * 10 * 1024 * 1024)
+    inflater = Inflater(FLAG_LZMA)
+    with pytest.raises(CompressionError, match="dài hơn"):
+        inflater.feed(liar)
+    assert len(inflater.out) <= 101
+
+
+def test_corrupt_or_truncated_bodies():
+    body, flags = compress([TEXT], "zlib")
+    with pytest.raises(CompressionError):
+        inflate(body[:len(body) // 2], flags)
+    with pytest.raises(CompressionError):
+        inflate(body[:SIZE_HEADER.size] + b"not zlib at all", flags)
+    with pytest.raises(CompressionError, match="thiếu header"):
+        inflate(b"\x00\x01", flags)
+    with pytest.raises(CompressionError):
+        Inflater(FLAG_ZLIB | FLAG_LZMA)
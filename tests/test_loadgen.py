@@ -0,0 +1,80 @@
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from loadgen import LatencyRecorder, merge_results
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_latency_recorder_keeps_a_bounded_sample():
+    recorder = LatencyRecorder(random.Random(1), cap=100)
+    for i in range(1000):
+        recorder.add(i / 1000, 10)
+    assert recorder.count == 1000 and recorder.nbytes == 10000 and len(recorder.samples) == 100
+    summary = recorder.summary()
+    assert summary["max_ms"] == 999.0
+    assert 300 < summary["p50_ms"] < 700  # mẫu ngẫu nhiên đều trên cả dải
+    assert LatencyRecorder(random.Random(1)).summary() == {"messages": 0, "bytes": 0}
+
+
+def part(expected, delivered, **extra):
+    base = {"users": 2, "connect_failed": 0, "ready": True, "connect_s": 0.1, "send_s": 1.0, "total_s": 2.0,
+            "cpu_s": 0.5, "expected": expected, "unresolved": 0, "foreign": 0,
+            "sent": {"TEXTMSG": (expected, expected * 10)}, "delivered": delivered}
+    base.update(extra)
+    return base
+
+
+def test_merge_results_combines_workers_and_skips_failed_ones():
+    args = SimpleNamespace(seed=1, output=None, users=4)
+    parts = [part(3, {"TEXTMSG": (3, 30, 0.002, [0.001, 0.001, 0.002])}),
+             part(1, {"TEXTMSG": (0, 0, 0.0, [])}, total_s=4.0),
+             {"error": "ConnectionError: boom"}]
+    results = merge_results(args, 3, parts, None, None)
+    assert results["users"] == 4 and results["worker_errors"] == ["ConnectionError: boom"]
+    assert results["sent"]["TEXTMSG"] == {"messages": 4, "bytes": 40}
+    assert results["delivery_ratio"] == 0.75
+    assert results["total_s"] == 4.0 and results["latency"]["max_ms"] == 2.0
+    with pytest.raises(ConnectionError):
+        merge_results(args, 1, [{"error": "x"}], None, None)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_small_run_against_server(tmp_path):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, "server.py", "--engine", "asyncio", "--host", "127.0.0.1",
+                               "--port", str(port), "--no-history"],
+                              cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+        out = subprocess.run([sys.executable, "loadgen.py", "--port", str(port), "--users", "4", "--duration", "1",
+                              "--rate", "5", "--workload", "text", "--drain", "1", "--server-pid", str(server.pid),
+                              "--output", "-"], cwd=ROOT, capture_output=True, timeout=60, check=True)
+    finally:
+        server.terminate()
+        server.wait(5)
+    results = json.loads(out.stdout[out.stdout.index(b"{"):])
+    assert results["users"] == 4 and results["ready"] and not results["worker_errors"]
+    assert results["sent"]["TEXTMSG"]["messages"] > 0
+    assert results["delivery_ratio"] == 1.0
@@ -0,0 +1,138 @@
+import json
+import os
+
+import numpy as np
+
+from message_log import CURSORS_FILE, MessageLog, conversation_key
+from protocol import Message
+from voice_codec import CODEC_ULAW, encode_voice, new_voice_id, voice_chunk_parts
+
+
+def text(sender, receiver, body):
+    return Message("TEXTMSG", sender, receiver, body.encode("utf-8"))
+
+
+def chunk(sender, receiver, vid, index, final):
+    pcm = np.zeros(800, dtype=np.int16)
+    body = b"".join(bytes(p) for p in voice_chunk_parts(vid, index, final, encode_voice(pcm, 16000, CODEC_ULAW)))
+    return Message("VOICECHUNK", sender, receiver, body)
+
+
+def bodies(records):
+    return [bytes(r.body).decode() for r in records]
+
+
+def test_conversation_key():
+    assert conversation_key("bob", "ALL") == "ALL"
+    assert conversation_key("bob", "#room") == "#room"
+    assert conversation_key("bob", "alice") == conversation_key("alice", "bob") == ("alice", "bob")
+
+
+def test_history_pages_and_reload_across_segments(tmp_path):
+    log = MessageLog(str(tmp_path), segment_bytes=200)
+    for i in range(30):
+        log.append(text("a", "ALL", f"m{i}"))
+    log.append(text("a", "b", "rieng"))
+    records, more = log.history("ALL", limit=10)
+    assert bodies(records) == [f"m{i}" for i in range(20, 30)] and more
+    older, more = log.history("ALL", before=records[0].seq, limit=50)
+    assert bodies(older) == [f"m{i}" for i in range(20)] and not more
+    assert bodies(log.history(("a", "b"))[0]) == ["rieng"]
+    log.close()
+    assert len([n for n in os.listdir(tmp_path) if n.endswith(".log")]) > 1
+
+    reloaded = MessageLog(str(tmp_path), segment_bytes=200)
+    assert reloaded.next_seq == 32
+    assert bodies(reloaded.history("ALL", limit=3)[0]) == ["m27", "m28", "m29"]
+    reloaded.close()
+
+
+def test_max_bytes_keeps_newest_records(tmp_path):
+    log = MessageLog(str(tmp_path))
+    for i in range(5):
+        log.append(text("a", "ALL", f"{i}" * 10))
+    records, more = log.history("ALL", max_bytes=25)
+    assert bodies(records) == ["3" * 10, "4" * 10] and more
+    log.close()
+
+
+def test_torn_tail_is_truncated_on_load(tmp_path):
+    log = MessageLog(str(tmp_path))
+    for i in range(3):
+        log.append(text("a", "ALL", f"m{i}"))
+    log.close()
+    (segment,) = [tmp_path / n for n in os.listdir(tmp_path) if n.endswith(".log")]
+    size = segment.stat().st_size
+    with open(segment, "r+b") as f:
+        f.truncate(size - 2)  # bản ghi cuối ghi dở
+
+    reloaded = MessageLog(str(tmp_path))
+    assert bodies(reloaded.history("ALL")[0]) == ["m0", "m1"]
+    seq = reloaded.append(text("a", "ALL", "m2 again"))
+    assert seq == 3
+    assert bodies(reloaded.history("ALL")[0]) == ["m0", "m1", "m2 again"]
+    reloaded.close()
+
+
+def test_old_segments_are_dropped(tmp_path):
+    log = MessageLog(str(tmp_path), segment_bytes=150, max_segments=2)
+    for i in range(40):
+        log.append(text("a", "ALL", f"m{i}"))
+    records, more = log.history("ALL", limit=100)
+    assert records[-1].seq == 40 and records[0].seq > 1 and not more
+    assert log.stats()["segments"] == 2
+    log.close()
+
+
+def test_offline_mailbox_and_cursors_survive_restart(tmp_path):
+    log = MessageLog(str(tmp_path), flush_interval=0.01)
+    first = log.append(text("a", "bob", "1"), offline=True)
+    log.append(text("a", "bob", "2"), offline=True)
+    log.append(text("a", "carol", "khac"), offline=True)
+    assert bodies(log.take_offline("bob")) == ["1", "2"]
+    log.mark_delivered("bob", first)
+    assert bodies(log.take_offline("bob")) == ["2"]
+    log.close()  # luồng ghi lưu con trỏ trước khi dừng
+    assert json.loads((tmp_path / CURSORS_FILE).read_text()) == {"bob": first}
+
+    reloaded = MessageLog(str(tmp_path))
+    assert bodies(reloaded.take_offline("bob")) == ["2"]
+    assert bodies(reloaded.take_offline("carol")) == ["khac"]
+    assert reloaded.take_offline("nobody") == []
+    reloaded.close()
+
+
+def test_page_never_splits_a_streamed_voice_message(tmp_path):
+    log = MessageLog(str(tmp_path))
+    vid = new_voice_id()
+    log.append(text("b", "ALL", "t1"))                 # 1
+    log.append(chunk("a", "ALL", vid, 0, False))       # 2
+    log.append(text("b", "ALL", "x"))                  # 3
+    log.append(chunk("a", "ALL", vid, 1, False))       # 4
+    log.append(chunk("a", "ALL", vid, 2, True))        # 5
+    log.append(text("b", "ALL", "t2"))                 # 6
+
+    # Trang 3 tin mới nhất bắt đầu giữa tin thoại: dời lên sau đoạn cuối
+    records, more = log.history("ALL", limit=3)
+    assert [r.seq for r in records] == [6] and more
+    # Trang kế chứa trọn tin thoại (cùng tin xen giữa)
+    records, more = log.history("ALL", before=6, limit=3)
+    assert [r.seq for r in records] == [2, 3, 4, 5] and more
+    records, more = log.history("ALL", before=2, limit=3)
+    assert [r.seq for r in records] == [1] and not more
+    log.close()
+
+    reloaded = MessageLog(str(tmp_path))  # chỉ mục đầu tin dựng lại khi khởi động
+    assert [r.seq for r in reloaded.history("ALL", limit=3)[0]] == [6]
+    reloaded.close()
+
+
+def test_read_waits_for_pending_records(tmp_path):
+    log = MessageLog(str(tmp_path), flush_interval=60)
+    seq = log.append(text("a", "ALL", "chua ghi"))
+    assert log.flushed_seq <= seq
+    assert bodies(log.read([seq])) == ["chua ghi"]  # read() đánh thức luồng ghi, không đợi 60 s
+    assert log.flushed_seq > seq
+    assert log.sync()
+    log.close()
+    assert log.append(text("a", "ALL", "sau close")) is None
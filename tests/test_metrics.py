@@ -0,0 +1,105 @@
+import threading
+import time
+
+import metrics
+from metrics import Histogram, KindCounters, RelayTrace, TimedLock, format_text
+
+
+def test_histogram_percentiles_are_bucket_upper_bounds():
+    hist = Histogram()
+    for _ in range(90):
+        hist.observe(0.0001)   # 100 µs -> bucket < 128 µs
+    for _ in range(10):
+        hist.observe(0.01)     # 10 ms -> bucket < 16.384 ms
+    assert hist.count == 100
+    assert hist.percentile(0.5) == 128e-6
+    assert hist.percentile(0.99) == 16384e-6
+    snap = hist.snapshot()
+    assert snap["max_ms"] == 10.0
+    assert snap["p99_ms"] == 10.0  # không vượt giá trị lớn nhất đã thấy
+    assert abs(snap["avg_ms"] - (90 * 0.1 + 10 * 10) / 100) < 1e-9
+
+
+def test_empty_histogram_and_huge_values():
+    hist = Histogram()
+    assert hist.percentile(0.5) == 0.0 and hist.snapshot()["avg_ms"] == 0.0
+    hist.observe(1e6)  # rơi vào bucket cuối, không IndexError
+    assert hist.buckets[-1] == 1
+
+
+def test_kind_counters_totals_and_rate_window(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(metrics.time, "monotonic", lambda: now[0])
+    counters = KindCounters()
+    counters.add("TEXTMSG", 100)
+    counters.add("TEXTMSG", 50, frames=2)
+    now[0] += 1
+    counters.add("FILE", 1000)
+    snap = counters.snapshot()
+    assert snap["TEXTMSG"]["frames"] == 3 and snap["TEXTMSG"]["bytes"] == 150
+    # chỉ tính các giây đã trọn vẹn: giây hiện tại (FILE) chưa vào tốc độ
+    assert snap["TEXTMSG"]["bytes_per_s"] == 150 / metrics.RATE_WINDOW
+    assert snap["FILE"]["bytes_per_s"] == 0
+    now[0] += metrics.RATE_WINDOW + 1
+    counters.add("TEXTMSG", 1)
+    snap = counters.snapshot()
+    assert snap["TEXTMSG"]["frames"] == 4 and snap["TEXTMSG"]["frames_per_s"] == 0
+
+
+def test_timed_lock_counts_contention():
+    lock = TimedLock(Histogram())
+    with lock:
+        pass
+    assert lock.acquired == 1 and lock.contended == 0
+
+    held = threading.Event()
+
+    def holder():
+        with lock:
+            held.set()
+            time.sleep(0.05)
+
+    thread = threading.Thread(target=holder)
+    thread.start()
+    held.wait()
+    with lock:
+        pass
+    thread.join()
+    snap = lock.snapshot()
+    assert snap["acquired"] == 3 and snap["contended"] == 1
+    assert snap["wait"]["count"] == 1 and snap["wait"]["max_ms"] > 10
+
+
+def test_relay_trace_observes_on_last_release():
+    hist = Histogram()
+    trace = RelayTrace(hist)
+    trace.retain()
+    trace.retain()
+    trace.release()
+    trace.release()
+    assert hist.count == 0
+    trace.release()
+    assert hist.count == 1
+
+
+def snapshot():
+    empty = Histogram().snapshot()
+    return {
+        "uptime_s": 5, "connections": 2, "users": 1, "rooms": 0,
+        "frames": {"in": {"TEXTMSG": {"frames": 3, "bytes": 30}}, "out": {}},
+        "relay_latency": empty,
+        "lock": {"acquired": 7, "contended": 1, "wait": empty},
+        "queues": {"frames": 1, "bytes": 10, "largest_bytes": 10, "dropped": 0,
+                   "connections": [{"user": 'a"b', "addr": "127.0.0.1:1", "frames": 1, "bytes": 10, "dropped": 0}]},
+        "history": {"next_seq": 4},
+    }
+
+
+def test_format_text_lines():
+    lines = format_text(snapshot()).splitlines()
+    assert "voicechat_users 1" in lines
+    assert 'voicechat_in_frames{kind="TEXTMSG"} 3' in lines
+    assert "voicechat_lock_contended 1" in lines
+    assert 'voicechat_conn_queue_bytes{user="a\\"b",addr="127.0.0.1:1"} 10' in lines
+    assert "voicechat_history_next_seq 4" in lines
+    assert all(line.startswith("voicechat_") for line in lines)
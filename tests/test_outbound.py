@@ -0,0 +1,192 @@
+import threading
+import time
+
+from outbound import FAIR_QUANTUM, POLICY_BACKPRESSURE, POLICY_DISCONNECT, POLICY_DROP, STARVATION_LIMIT, OutboundQueue
+from protocol import (FLAG_MORE, PRIORITY_BULK, PRIORITY_INTERACTIVE, PRIORITY_STREAM, BufferPool, Frame,
+                      SliceJoiner, build_message_v2, decode_v2_header, encode_v2)
+
+
+def frame(n, fill=b"x"):
+    return Frame(fill * n)
+
+
+def drain(queue):
+    out = []
+    while True:
+        f = queue.get_nowait()
+        if f is None:
+            return out
+        out.append(f)
+        f.release()
+
+
+def test_fifo_and_byte_accounting():
+    q = OutboundQueue(max_bytes=100)
+    frames = [frame(10, bytes([65 + i])) for i in range(3)]
+    for f in frames:
+        assert q.offer(f)
+    assert len(q) == 3 and q.nbytes == 30
+    assert drain(q) == frames
+    assert len(q) == 0 and q.nbytes == 0
+
+
+def test_oversized_frame_accepted_when_empty():
+    q = OutboundQueue(max_bytes=10, policy=POLICY_DROP)
+    assert q.offer(frame(50))
+    assert q.offer(frame(1))
+    assert q.dropped == 1 and len(q) == 1
+
+
+def test_drop_policy_counts_dropped():
+    q = OutboundQueue(max_bytes=20, policy=POLICY_DROP)
+    assert q.offer(frame(15))
+    assert q.offer(frame(15))
+    assert q.dropped == 1 and len(q) == 1 and not q.closed
+
+
+def test_disconnect_policy_closes_queue():
+    reasons = []
+    q = OutboundQueue(max_bytes=20, policy=POLICY_DISCONNECT)
+    q.on_close = reasons.append
+    q.offer(frame(15))
+    q.offer(frame(15))
+    assert q.closed and reasons == ["overflow"]
+    assert q.get_nowait() is None
+
+
+def test_backpressure_offer_refuses_then_put_wait_succeeds():
+    q = OutboundQueue(max_bytes=20, policy=POLICY_BACKPRESSURE)
+    assert q.offer(frame(15))
+    blocked = frame(15)
+    assert not q.offer(blocked)
+    threading.Timer(0.05, lambda: drain(q)).start()
+    assert q.put_wait(blocked, timeout=2)
+    assert len(q) == 1
+
+
+def test_backpressure_timeout_closes_queue():
+    q = OutboundQueue(max_bytes=20, policy=POLICY_BACKPRESSURE)
+    q.offer(frame(15))
+    start = time.monotonic()
+    assert not q.put_wait(frame(15), timeout=0.05)
+    assert time.monotonic() - start < 1
+    assert q.closed and q.close_reason == "backpressure timeout"
+
+
+def test_get_blocks_until_data_or_close():
+    q = OutboundQueue()
+    threading.Timer(0.05, q.offer, (frame(3),)).start()
+    got = q.get(timeout=2)
+    assert got is not None and len(got) == 3
+    threading.Timer(0.05, q.close).start()
+    assert q.get(timeout=2) is None
+
+
+def test_close_releases_pooled_buffers():
+    pool = BufferPool()
+    buf = pool.acquire(100)
+    q = OutboundQueue()
+    q.offer(Frame(buf.view, owner=buf))
+    buf.release()  # người đọc xong, còn hàng đợi giữ
+    assert pool.in_use == 100
+    q.close()
+    assert pool.in_use == 0
+
+
+def tagged(tag, n=10, priority=PRIORITY_INTERACTIVE, flow=None):
+    f = Frame(tag.encode() * n)
+    f.priority, f.flow = priority, flow
+    return f
+
+
+def tags(frames):
+    return [bytes(f.parts[0][:1]).decode() for f in frames]
+
+
+def test_higher_priority_class_goes_first_and_keeps_flow_order():
+    q = OutboundQueue()
+    for f in (tagged("b", priority=PRIORITY_BULK), tagged("s", priority=PRIORITY_STREAM),
+              tagged("i"), tagged("j"), tagged("c", priority=PRIORITY_BULK)):
+        q.offer(f)
+    assert tags(drain(q)) == ["i", "j", "s", "b", "c"]
+
+
+def test_lower_class_is_not_starved():
+    q = OutboundQueue()
+    q.offer(tagged("b", priority=PRIORITY_BULK))
+    for _ in range(STARVATION_LIMIT + 5):
+        q.offer(tagged("i"))
+    order = tags(drain(q))
+    assert order.index("b") == STARVATION_LIMIT
+
+
+def test_deficit_round_robin_shares_bytes_between_senders():
+    q = OutboundQueue(max_bytes=64 * FAIR_QUANTUM)
+    for _ in range(8):
+        q.offer(tagged("a", FAIR_QUANTUM // 2, PRIORITY_BULK, flow="big"))
+    for _ in range(4):
+        q.offer(tagged("b", 100, PRIORITY_BULK, flow="small"))
+    order = tags(drain(q))
+    # mỗi lượt: tối đa FAIR_QUANTUM byte của "big" rồi tới "small", không phải cả 8 frame của "big" trước
+    assert order.index("b") <= 2 and order[-1] == "a"
+    assert order.count("a") == 8 and order.count("b") == 4
+
+
+def v2_frame(kind, body, sender_id=1, priority=None):
+    frame = encode_v2(kind, body, sender_id=sender_id, receiver_id=0)
+    if priority is not None:
+        frame.priority = priority
+    return frame
+
+
+def as_message(piece):
+    header = bytes(piece.parts[0])
+    kind, flags, length, sender_id, receiver_id = decode_v2_header(header)
+    body = b"".join(bytes(p) for p in piece.parts[1:])
+    assert len(body) == length
+    return build_message_v2(kind, flags, sender_id, receiver_id, memoryview(body))
+
+
+def test_large_v2_frames_are_sliced_and_text_slips_in_between():
+    q = OutboundQueue(slice_bytes=1000)
+    body = bytes(range(256)) * 20  # 5120 bytes -> 6 lát
+    sent = []
+    big = v2_frame("FILE", body)
+    big.on_sent = lambda: sent.append("file")
+    q.offer(big)
+    first = q.get_nowait()
+    assert decode_v2_header(bytes(first.parts[0]))[1] & FLAG_MORE
+    q.offer(v2_frame("TEXTMSG", b"chen ngang", sender_id=2))
+    second = q.get_nowait()
+    assert as_message(second).kind == "TEXTMSG"  # chỉ phải chờ một lát
+    pieces = [first] + [q.get_nowait() for _ in range(5)]
+    assert q.get_nowait() is None and q.nbytes == 0 and len(q) == 0
+    assert [p.on_sent for p in pieces[:-1]] == [None] * 5 and pieces[-1].on_sent is big.on_sent
+
+    joiner = SliceJoiner()
+    messages = [joiner.feed(as_message(p)) for p in pieces]
+    assert messages[:-1] == [None] * 5
+    assert bytes(messages[-1].body) == body and not messages[-1].flags & FLAG_MORE
+    for p in pieces + [second]:
+        p.release()
+
+
+def test_slice_joiner_keeps_interleaved_messages_apart():
+    joiner = SliceJoiner()
+
+    def piece(kind, sender_id, body, more):
+        return build_message_v2(kind, FLAG_MORE if more else 0, sender_id, 0, memoryview(body))
+
+    assert joiner.feed(piece("FILE", 1, b"aa", True)) is None
+    assert joiner.feed(piece("FILE", 2, b"xx", True)) is None
+    text = joiner.feed(piece("TEXTMSG", 3, b"hi", False))
+    assert bytes(text.body) == b"hi"
+    assert bytes(joiner.feed(piece("FILE", 2, b"yy", False)).body) == b"xxyy"
+    assert bytes(joiner.feed(piece("FILE", 1, b"bb", False)).body) == b"aabb"
+
+
+def test_v1_frames_are_never_sliced():
+    q = OutboundQueue(slice_bytes=10)
+    f = Frame(b"0000000100", b"x" * 100)
+    q.offer(f)
+    assert q.get_nowait() is f
@@ -0,0 +1,44 @@
+from presence import DELTA, SNAPSHOT, PresenceTracker, encode_delta, encode_snapshot, parse_presence
+
+
+def test_snapshot_round_trip_strips_commas_from_names():
+    body = encode_snapshot(4, [(1, "alice"), (2, "bob,by")])
+    assert parse_presence(body) == (SNAPSHOT, 4, [(1, "alice"), (2, "bobby")], [])
+
+
+def test_delta_round_trip():
+    body = encode_delta(7, [(3, "carol")], [(1, "alice"), (2, "bob")])
+    assert body == b"delta::7::+3:carol,-1:alice,-2:bob"
+    assert parse_presence(body) == (DELTA, 7, [(3, "carol")], [(1, "alice"), (2, "bob")])
+
+
+def test_parse_presence_rejects_or_skips_malformed_input():
+    assert parse_presence(b"other::1::1:a") is None
+    assert parse_presence(b"delta::x::+1:a") is None
+    assert parse_presence(b"delta::2::1:a,+x:b,+2:c") == (DELTA, 2, [(2, "c")], [])
+    assert parse_presence(b"snapshot::0::") == (SNAPSHOT, 0, [], [])
+
+
+def test_tracker_diff_coalesces_changes_between_flushes():
+    tracker = PresenceTracker()
+    assert tracker.diff([(1, "alice"), (2, "bob")]) == ([(1, "alice"), (2, "bob")], [])
+    assert tracker.version == 1
+    # carol vào rồi ra giữa hai lần diff: không tạo ra thay đổi nào
+    assert tracker.diff([(1, "alice"), (2, "bob")]) == ([], [])
+    assert tracker.version == 1
+    assert tracker.diff([(2, "bob"), (4, "dave")]) == ([(4, "dave")], [(1, "alice")])
+    assert tracker.version == 2
+    assert tracker.snapshot() == [(2, "bob"), (4, "dave")]
+
+
+def test_client_applying_deltas_matches_snapshot():
+    tracker = PresenceTracker()
+    users = {}
+    for online in ([(1, "a"), (2, "b")], [(2, "b"), (3, "c")], [(3, "c")], [(3, "c"), (5, "e"), (6, "f")]):
+        joined, left = tracker.diff(online)
+        _, _, joined, left = parse_presence(encode_delta(tracker.version, joined, left))
+        for user_id, name in left:
+            users.pop(user_id, None)
+        users.update(joined)
+    _, _, snapshot, _ = parse_presence(encode_snapshot(tracker.version, tracker.snapshot()))
+    assert users == dict(snapshot)
@@ -0,0 +1,255 @@
+import socket
+import threading
+
+import pytest
+
+from protocol import (ALL_ID, DIRECT_PAYLOAD_BYTES, PROTO_V1, PROTO_V2, V2_HEADER, BufferPool, FrameAssembler, Message,
+                      MessageFrames, ProtocolError, decode_v2_header, encode_frame, encode_message, encode_v2,
+                      format_options, parse_options, parse_v1, recv_message, sendmsg_all)
+
+
+def read_exactly(sock, n):
+    data = bytearray()
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return bytes(data)
+
+
+# ---------- đóng gói một lần, gửi scatter-gather (user-004) ----------
+
+def test_message_frames_encodes_once_per_version():
+    msg = parse_v1(b"TEXTMSG::alice::ALL::hello")
+    frames = MessageFrames(msg)
+    first = frames.frame_for(PROTO_V1)
+    assert frames.frame_for(PROTO_V1) is first
+    assert b"".join(bytes(p) for p in first.buffers()) == b"26        TEXTMSG::alice::ALL::hello"
+
+
+def test_encode_frame_keeps_payload_without_copy():
+    payload = bytearray(b"x" * 1000)
+    frame = encode_frame(payload)
+    assert frame.parts[1] is payload
+    assert len(frame) == 10 + 1000
+
+
+def test_sendmsg_all_sends_every_buffer_in_order():
+    left, right = socket.socketpair()
+    left.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    buffers = [bytes([i]) * (50_000 + i) for i in range(5)]
+    expected = b"".join(buffers)
+    received = []
+    reader = threading.Thread(target=lambda: received.append(read_exactly(right, len(expected))))
+    reader.start()
+    sendmsg_all(left, buffers)
+    reader.join(5)
+    left.close()
+    right.close()
+    assert received == [expected]
+
+
+def test_message_frames_without_raw_builds_v1_payload():
+    msg = Message("TEXTMSG", "alice", "bob", memoryview(b"hi"))
+    frame = MessageFrames(msg).frame_for(PROTO_V1)
+    assert b"".join(bytes(p) for p in frame.buffers()).endswith(b"TEXTMSG::alice::bob::hi")
+
+
+# ---------- framing v2 và thương lượng phiên bản (user-005) ----------
+
+def joined(frame):
+    return b"".join(bytes(p) for p in frame.buffers())
+
+
+def test_v2_header_round_trip():
+    frame = encode_v2("TEXTMSG", b"hello", sender_id=3, receiver_id=7, flags=0x01)
+    data = joined(frame)
+    assert len(data) == V2_HEADER.size + 5
+    assert decode_v2_header(data[:V2_HEADER.size]) == ("TEXTMSG", 0x01, 5, 3, 7)
+    assert data[V2_HEADER.size:] == b"hello"
+
+
+def test_v2_header_rejects_bad_magic_and_type():
+    header = bytearray(joined(encode_v2("TEXTMSG"))[:V2_HEADER.size])
+    bad_magic = bytes([0x00]) + bytes(header[1:])
+    with pytest.raises(ProtocolError):
+        decode_v2_header(bad_magic)
+    header[2] = 250
+    with pytest.raises(ProtocolError):
+        decode_v2_header(bytes(header))
+
+
+def test_v1_header_starts_with_digit_v2_does_not():
+    assert joined(encode_frame(b"USERLIST::a"))[:1].isdigit()
+    assert not joined(encode_v2("USERLIST", b"a"))[:1].isdigit()
+
+
+def test_parse_v1_routed_message_keeps_separators_in_body():
+    msg = parse_v1(b"TEXTMSG::alice::bob::a::b::c")
+    assert (msg.kind, msg.sender, msg.receiver, bytes(msg.body)) == ("TEXTMSG", "alice", "bob", b"a::b::c")
+
+
+def test_parse_v1_control_and_malformed_messages():
+    msg = parse_v1(b"USERLIST::a,b")
+    assert (msg.kind, bytes(msg.body)) == ("USERLIST", b"a,b")
+    msg = parse_v1(b"OPENPRIVATE::alice::bob")
+    assert (msg.sender, msg.receiver, bytes(msg.body)) == ("alice", "bob", b"")
+    msg = parse_v1(b"TEXTMSG::alice")
+    assert msg.sender is None and msg.receiver is None
+    assert parse_v1(b"garbage").kind == "garbage"
+
+
+def test_encode_message_uses_ids_for_v2():
+    ids = {"alice": 4, "bob": 9}
+    msg = parse_v1(b"TEXTMSG::alice::bob::hi")
+    data = joined(encode_message(msg, PROTO_V2, ids.__getitem__))
+    assert decode_v2_header(data[:V2_HEADER.size])[3:] == (4, 9)
+    msg = parse_v1(b"TEXTMSG::alice::ALL::hi")
+    data = joined(encode_message(msg, PROTO_V2, ids.__getitem__))
+    assert decode_v2_header(data[:V2_HEADER.size])[4] == ALL_ID
+
+
+def test_options_round_trip():
+    text = format_options({"proto": 2, "id": 5, "compress": "zlib,lzma"})
+    assert parse_options(text) == {"proto": "2", "id": "5", "compress": "zlib,lzma"}
+    assert parse_options(" ; proto = 2 ;") == {"proto": "2"}
+
+
+# ---------- nhận bằng recv_into, đọc trước nhiều frame (user-006) ----------
+
+class CountingSocket:
+    """Bọc socket thật, đếm số lần recv_into."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.calls = 0
+
+    def recv_into(self, buf):
+        self.calls += 1
+        return self.sock.recv_into(buf)
+
+
+class WaitOnce:
+    """Admission giả: bắt chờ một lần cho mỗi frame, ghi lại loại tin đã thấy."""
+
+    def __init__(self):
+        self.kinds = []
+
+    def admit(self, kind, length):
+        self.kinds.append(kind)
+        return 0.001
+
+    def budget_full(self, first):
+        return 0.001
+
+
+def mixed_stream():
+    ids = {"alice": 1, "bob": 2}
+    bodies = [b"", b"hi", b"a::b", b"x" * 3000, b"y" * (DIRECT_PAYLOAD_BYTES * 3)]
+    data, expected = bytearray(), []
+    for i, body in enumerate(bodies * 2):
+        msg = Message("TEXTMSG", "alice", "bob", body)
+        data += joined(MessageFrames(msg, ids.__getitem__).frame_for(PROTO_V2 if i % 2 else PROTO_V1))
+        expected.append(body)
+    return bytes(data), expected
+
+
+def feed(assembler, data, step):
+    """Ghi 'data' vào assembler mỗi lần tối đa 'step' bytes, trả về body các tin ghép được."""
+    got, pos = [], 0
+
+    def collect(msg):
+        while msg is not None:
+            got.append(bytes(msg.body))
+            msg.release()
+            msg = assembler.pop()
+
+    while pos < len(data) or assembler.wait:
+        if assembler.wait:
+            collect(assembler.resume())
+            continue
+        buf = assembler.buffer()
+        n = min(len(buf), step, len(data) - pos)
+        buf[:n] = data[pos:pos + n]
+        pos += n
+        collect(assembler.advance(n))
+    return got
+
+
+@pytest.mark.parametrize("step", [1, 7, 100, 5000, 1 << 20])
+def test_assembler_handles_any_split(step):
+    data, expected = mixed_stream()
+    pool = BufferPool()
+    assert feed(FrameAssembler(pool), data, step) == expected
+    assert pool.in_use == 0
+
+
+def test_assembler_waits_for_admission_before_each_payload():
+    data, expected = mixed_stream()
+    admission = WaitOnce()
+    assert feed(FrameAssembler(BufferPool(), admission), data, 1 << 20) == expected
+    assert admission.kinds == ["TEXTMSG"] * len(expected)
+
+
+def test_recv_message_parses_many_frames_from_one_read():
+    left, right = socket.socketpair()
+    ids = {"alice": 1, "ALL": ALL_ID}
+    frames = [MessageFrames(Message("TEXTMSG", "alice", "ALL", b"m%d" % i), ids.__getitem__).frame_for(PROTO_V2)
+              for i in range(100)]
+    left.sendall(b"".join(joined(f) for f in frames))
+    left.close()
+    sock, assembler = CountingSocket(right), FrameAssembler(BufferPool())
+    bodies = []
+    while (msg := recv_message(sock, assembler)) is not None:
+        bodies.append(bytes(msg.body))
+    right.close()
+    assert bodies == [b"m%d" % i for i in range(100)]
+    assert sock.calls < 10
+
+
+def test_large_payload_is_received_directly_into_pool_buffer():
+    body = b"z" * (DIRECT_PAYLOAD_BYTES * 4)
+    data = joined(encode_frame(b"TEXTMSG::a::b::" + body))
+    assembler = FrameAssembler(BufferPool())
+    buf = assembler.buffer()
+    buf[:20] = data[:20]
+    assert assembler.advance(20) is None
+    direct = assembler.buffer()
+    assert len(direct) == len(data) - 20
+    direct[:] = data[20:]
+    assert bytes(assembler.advance(len(direct)).body) == body
+
+
+def test_assembler_rejects_bad_v1_header():
+    assembler = FrameAssembler()
+    buf = assembler.buffer()
+    buf[:10] = b"12ab      "
+    with pytest.raises(ProtocolError):
+        assembler.advance(10)
+
+
+def test_discard_returns_partial_payload_to_pool():
+    pool = BufferPool()
+    assembler = FrameAssembler(pool)
+    data = joined(encode_frame(b"TEXTMSG::a::b::" + b"q" * 100))
+    buf = assembler.buffer()
+    buf[:50] = data[:50]
+    assembler.advance(50)
+    assert pool.in_use == 115
+    assembler.discard()
+    assert pool.in_use == 0
+
+
+def test_buffer_pool_reuses_and_respects_budget():
+    pool = BufferPool(min_size=1024, max_size=8192, budget=4096)
+    first = pool.acquire(1000)
+    data = first.data
+    first.release()
+    again = pool.acquire(900)
+    assert again.data is data and len(again.view) == 900
+    assert pool.try_acquire(4000) is None
+    again.release()
+    big = pool.acquire(10_000)
+    big.release()
+    assert pool.stats() == {1024: 1} and pool.in_use == 0
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("sounddevice")
+
+from recorder import INITIAL_SECONDS, RingRecorder  # noqa: E402
+
+RATE = 1000
+
+
+def block(start, n):
+    return np.arange(start, start + n, dtype=np.int16).reshape(-1, 1)
+
+
+def read_all(recorder):
+    """Đọc hết phần chưa đọc (có thể qua hai lần peek khi quay vòng)."""
+    out = []
+    while True:
+        view = recorder.peek()
+        if not len(view):
+            return np.concatenate(out) if out else np.empty((0, 1), dtype=np.int16)
+        out.append(view.copy())
+        recorder.consume(len(view))
+
+
+def test_ring_wraps_without_growing_when_reader_keeps_up():
+    recorder = RingRecorder(RATE, max_seconds=60)
+    capacity = recorder.capacity
+    assert capacity == INITIAL_SECONDS * RATE
+    written = 0
+    for _ in range(10):
+        recorder.write(block(written, 700))
+        written += 700
+        assert read_all(recorder)[:, 0].tolist() == list(range(written - 700, written))
+    assert recorder.capacity == capacity
+    assert recorder.total_frames == written
+
+
+def test_ring_grows_and_keeps_order_when_reader_is_slow():
+    recorder = RingRecorder(RATE, max_seconds=60)
+    recorder.write(block(0, 1500))
+    recorder.consume(len(recorder.peek()[:1000]))
+    recorder.write(block(1500, 1500))   # quay vòng: 500 frame cuối nằm ở đầu ring
+    recorder.write(block(3000, 3000))   # phần chưa đọc vượt dung lượng: nới ring
+    assert recorder.capacity >= 5000
+    assert read_all(recorder)[:, 0].tolist() == list(range(1000, 6000))
+
+
+def test_ring_stops_at_max_duration():
+    recorder = RingRecorder(RATE, max_seconds=3)
+    for i in range(5):
+        recorder.write(block(i * 1000, 1000))
+    assert recorder.limit_reached
+    assert recorder.total_frames == 3 * RATE
+    assert recorder.capacity == 3 * RATE
+    assert recorder.duration == 3.0
+    assert len(read_all(recorder)) == 3 * RATE
@@ -0,0 +1,83 @@
+import time
+
+from registry import ClientRegistry, Session
+
+
+def session(conn, name, accept=0):
+    return Session(conn, name, ("127.0.0.1", conn), queue=None, accept=accept)
+
+
+def test_lookup_by_name_and_conn():
+    reg = ClientRegistry()
+    a, b = session(1, "alice"), session(2, "bob")
+    reg.add(a)
+    reg.add(b)
+    assert reg.sessions_for("alice") == [a]
+    assert reg.get(2) is b
+    assert 1 in reg and len(reg) == 2
+    assert reg.sessions_for("nobody") == []
+
+
+def test_duplicate_names_share_routing_and_listed_once():
+    reg = ClientRegistry()
+    first, second = session(1, "alice"), session(2, "alice")
+    reg.add(first)
+    reg.add(second)
+    reg.add(session(3, "bob"))
+    assert reg.sessions_for("alice") == [first, second]
+    assert reg.names() == ["alice", "bob"]
+    assert reg.remove(1) is first
+    assert reg.is_online("alice")
+    reg.remove(2)
+    assert not reg.is_online("alice") and reg.names() == ["bob"]
+
+
+def test_remove_unknown_conn():
+    reg = ClientRegistry()
+    assert reg.remove(42) is None
+
+
+def test_iteration_in_join_order():
+    reg = ClientRegistry()
+    sessions = [session(i, f"u{i}") for i in range(5)]
+    for s in sessions:
+        reg.add(s)
+    reg.remove(2)
+    assert list(reg) == [sessions[0], sessions[1], sessions[3], sessions[4]]
+
+
+
+def test_ids_stable_while_online_and_resolvable_after_release():
+    reg = ClientRegistry(reuse_delay=60)
+    reg.add(session(1, "alice"))
+    alice = reg.id_for("alice")
+    assert reg.id_for("alice") == alice and reg.name_for(alice) == "alice"
+    reg.release_id("alice")  # vẫn online: không nhả
+    assert reg.id_for("alice") == alice
+    reg.remove(1)
+    reg.release_id("alice")
+    assert reg.name_for(alice) == "alice"  # tin đến trễ vẫn phân giải được
+    assert reg.id_for("bob") != alice      # chưa hết thời gian chờ
+    assert reg.id_for("alice") == alice    # quay lại: lấy lại ID cũ
+
+
+def test_released_ids_are_reused_after_delay():
+    reg = ClientRegistry(reuse_delay=0.05)
+    first = [reg.id_for(f"user{i}") for i in range(10)]
+    for i in range(10):
+        reg.release_id(f"user{i}")
+    time.sleep(0.06)
+    second = [reg.id_for(f"other{i}") for i in range(10)]
+    assert sorted(second) == sorted(first)
+    assert reg.name_for(second[0]) == "other0"
+    assert reg.id_for("ALL") == 0
+
+
+def test_needs_plain_tracks_accept_masks():
+    reg = ClientRegistry()
+    reg.add(session(1, "a", accept=0b11))
+    assert not reg.needs_plain(0b01)
+    reg.add(session(2, "b", accept=0))
+    assert reg.needs_plain(0b01)
+    reg.remove(2)
+    assert not reg.needs_plain(0b01)
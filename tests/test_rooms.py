@@ -0,0 +1,38 @@
+from registry import Session
+from rooms import RoomIndex, is_room, valid_room
+
+
+def session(conn, name):
+    return Session(conn, name, ("127.0.0.1", conn), queue=None)
+
+
+def test_room_names():
+    assert is_room("#dev") and not is_room("dev") and not is_room("") and not is_room(None)
+    assert valid_room("#dev-team_1")
+    for bad in ("#", "dev", "#a b", "#a:b", "#a;b", "#a,b", "#a=b", "#" + "x" * 65):
+        assert not valid_room(bad), bad
+
+
+def test_membership_is_per_connection():
+    index = RoomIndex()
+    alice_home, alice_phone, bob = session(1, "alice"), session(2, "alice"), session(3, "bob")
+    assert index.join("#dev", alice_home) and index.join("#dev", bob)
+    assert not index.join("#dev", alice_home)
+    index.join("#dev", alice_phone)
+    index.join("#ops", alice_phone)
+    assert index.members("#dev") == ["alice", "bob"]  # tên không lặp, theo thứ tự vào phòng
+    assert len(index.sessions_for("#dev")) == 3
+    assert index.is_member("#ops", 2) and not index.is_member("#ops", 1)
+    assert index.rooms_of(2) == ["#dev", "#ops"]
+
+
+def test_leave_and_disconnect_clean_up_empty_rooms():
+    index = RoomIndex()
+    a, b = session(1, "a"), session(2, "b")
+    index.join("#dev", a)
+    index.join("#ops", a)
+    index.join("#dev", b)
+    assert index.leave("#dev", 2) and not index.leave("#dev", 2)
+    assert index.leave_all(1) == ["#dev", "#ops"]
+    assert len(index) == 0 and index.rooms_of(1) == [] and index.sessions_for("#dev") == []
+    assert not index.leave("#none", 1)
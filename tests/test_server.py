@@ -0,0 +1,196 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from presence import DELTA, SNAPSHOT, parse_presence
+from protocol import PROTO_V2, FrameAssembler, encode_header, encode_v2, parse_options, recv_message
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(params=["thread", "asyncio"])
+def server(request, tmp_path):
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, "server.py", "--engine", request.param, "--host", "127.0.0.1",
+                             "--port", str(port), "--history-dir", str(tmp_path / "history")],
+                            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                proc.kill()
+                raise
+            time.sleep(0.05)
+    yield port
+    proc.terminate()
+    proc.wait(5)
+
+
+class Peer:
+    """Client v1 tối giản: gửi payload, đọc các tin nhận được."""
+
+    def __init__(self, port, name=None):
+        self.sock = socket.create_connection(("127.0.0.1", port))
+        self.assembler = FrameAssembler()
+        if name is not None:
+            self.send(f"USERNAME::{name}")
+
+    def send(self, text):
+        payload = text.encode("utf-8")
+        self.sock.sendall(encode_header(len(payload)) + payload)
+
+    def received(self, kind, timeout=1.0):
+        """Payload các tin 'kind' nhận được cho tới khi im lặng 'timeout' giây."""
+        self.sock.settimeout(timeout)
+        out = []
+        try:
+            while True:
+                msg = recv_message(self.sock, self.assembler)
+                if msg is None:
+                    break
+                if msg.kind == kind:
+                    out.append(bytes(msg.raw).decode("utf-8"))
+                msg.release()
+        except socket.timeout:
+            pass
+        return out
+
+    def close(self):
+        self.sock.close()
+
+
+def test_broadcast_skips_sender_and_private_reaches_one(server):
+    alice, bob, carol = Peer(server, "alice"), Peer(server, "bob"), Peer(server, "carol")
+    time.sleep(0.3)
+    alice.send("TEXTMSG::alice::ALL::xin chao")
+    alice.send("TEXTMSG::alice::bob::rieng")
+    assert bob.received("TEXTMSG") == ["TEXTMSG::alice::ALL::xin chao", "TEXTMSG::alice::bob::rieng"]
+    assert carol.received("TEXTMSG", 0.3) == ["TEXTMSG::alice::ALL::xin chao"]
+    assert alice.received("TEXTMSG", 0.3) == []
+    for peer in (alice, bob, carol):
+        peer.close()
+
+
+def test_early_messages_are_echoed_to_sender(server):
+    early = Peer(server)
+    early.send("TEXTMSG::early::ALL::truoc USERNAME")
+    time.sleep(0.2)
+    early.send("USERNAME::early")
+    assert early.received("TEXTMSG") == ["TEXTMSG::early::ALL::truoc USERNAME"]
+    early.close()
+
+
+def test_v1_sender_name_cannot_be_spoofed(server):
+    mallory, watcher = Peer(server, "mallory"), Peer(server, "watcher")
+    time.sleep(0.3)
+    mallory.send("TEXTMSG::bob::ALL::gia danh")
+    assert watcher.received("TEXTMSG") == ["TEXTMSG::mallory::ALL::gia danh"]
+    mallory.close()
+    watcher.close()
+
+
+def test_hello_negotiates_v2_and_routes_by_id(server):
+    v2 = Peer(server)
+    v2.send("HELLO::proto=2")
+    v2.send("USERNAME::neo")
+    v2.sock.settimeout(2)
+    hello = recv_message(v2.sock, v2.assembler)
+    options = parse_options(bytes(hello.raw).decode().split("::", 1)[1])
+    assert hello.kind == "HELLO" and options["proto"] == str(PROTO_V2)
+    old = Peer(server, "old")
+    time.sleep(0.3)
+    frame = encode_v2("TEXTMSG", b"tu v2", sender_id=999)  # sender_id khai man bị bỏ qua
+    v2.sock.sendall(b"".join(bytes(p) for p in frame.buffers()))
+    assert old.received("TEXTMSG") == ["TEXTMSG::neo::ALL::tu v2"]
+    v2.close()
+    old.close()
+
+
+def test_userlist_lists_everyone(server):
+    alice = Peer(server, "alice")
+    time.sleep(0.2)
+    bob = Peer(server, "bob")
+    lists = alice.received("USERLIST")
+    assert lists and sorted(lists[-1].split("::", 1)[1].split(",")) == ["alice", "bob"]
+    alice.close()
+    bob.close()
+
+
+def test_v2_client_gets_snapshot_then_deltas(server):
+    v2 = Peer(server)
+    v2.send("HELLO::proto=2")
+    v2.send("USERNAME::neo")
+    v2.sock.settimeout(1)
+    updates = []
+
+    def drain():
+        try:
+            while True:
+                msg = recv_message(v2.sock, v2.assembler)
+                if msg.kind == "PRESENCE":
+                    updates.append(parse_presence(msg.body))
+                msg.release()
+        except socket.timeout:
+            pass
+
+    drain()
+    assert updates[0][:1] == (SNAPSHOT,) and [name for _, name in updates[-1][2]] == ["neo"]
+    bob = Peer(server, "bob")
+    drain()
+    kind, version, joined, left = updates[-1]
+    assert kind == DELTA and [name for _, name in joined] == ["bob"] and left == []
+    bob.close()
+    drain()
+    kind, next_version, joined, left = updates[-1]
+    assert kind == DELTA and joined == [] and [name for _, name in left] == ["bob"]
+    assert next_version == version + 1
+    v2.close()
+
+
+def test_offline_private_messages_are_delivered_once(server):
+    alice = Peer(server, "alice")
+    time.sleep(0.3)
+    alice.send("TEXTMSG::alice::bob::luc offline 1")
+    alice.send("TEXTMSG::alice::bob::luc offline 2")
+    time.sleep(0.3)
+    bob = Peer(server, "bob")
+    assert bob.received("TEXTMSG") == ["TEXTMSG::alice::bob::luc offline 1", "TEXTMSG::alice::bob::luc offline 2"]
+    bob.close()
+    time.sleep(0.3)
+    again = Peer(server, "bob")
+    assert again.received("TEXTMSG") == []
+    again.close()
+    alice.close()
+
+
+def test_room_messages_reach_members_only(server):
+    alice, bob, carol = Peer(server, "alice"), Peer(server, "bob"), Peer(server, "carol")
+    alice.send("JOIN::#dev")
+    time.sleep(0.1)
+    bob.send("JOIN::#dev")
+    rooms = bob.received("ROOM")
+    assert rooms and rooms[-1].startswith("ROOM::room=#dev;id=") and rooms[-1].endswith(";members=alice,bob")
+    assert alice.received("ROOM", 0.3)[-1].endswith("members=alice,bob")
+    alice.send("TEXTMSG::alice::#dev::trong phong")
+    carol.send("TEXTMSG::carol::#dev::khong phai thanh vien")
+    assert bob.received("TEXTMSG") == ["TEXTMSG::alice::#dev::trong phong"]
+    assert carol.received("TEXTMSG", 0.3) == []
+    bob.send("LEAVE::#dev")
+    assert alice.received("ROOM")[-1].endswith("members=alice")
+    alice.send("TEXTMSG::alice::#dev::con lai minh toi")
+    assert bob.received("TEXTMSG", 0.3) == []
+    for peer in (alice, bob, carol):
+        peer.close()
@@ -0,0 +1,84 @@
+import os
+
+from transfer import (CHUNK_SIZE, WINDOW_CHUNKS, IncomingTransfer, OutgoingTransfer, chunk_parts, encode_offer,
+                      encode_offset, new_transfer_id, parse_chunk, parse_offer, parse_offset, valid_tid)
+
+
+def test_transfer_id_validation():
+    assert valid_tid(new_transfer_id())
+    for bad in ["", "../../etc/passwd", "A" * 32, "0" * 31, "0" * 33, "0" * 31 + "/"]:
+        assert not valid_tid(bad)
+
+
+def test_offer_round_trip_and_rejects_bad_tid():
+    tid = new_transfer_id()
+    assert parse_offer(encode_offer(tid, 1234, "a::b.txt")) == (tid, 1234, "a::b.txt")
+    assert parse_offer(encode_offer("../../x", 10, "f")) is None
+    assert parse_offer(encode_offer(tid, -1, "f")) is None
+    assert parse_offer(b"nonsense") is None
+
+
+def test_offset_round_trip():
+    tid = new_transfer_id()
+    assert parse_offset(encode_offset(tid, 65536)) == (tid, 65536)
+    assert parse_offset(b"tid::x") is None
+
+
+def test_chunk_round_trip_and_rejects_bad_tid():
+    tid = new_transfer_id()
+    head, data = chunk_parts(tid, 128, b"payload::with::separators")
+    parsed = parse_chunk(head + data)
+    assert parsed[:2] == (tid, 128)
+    assert bytes(parsed[2]) == b"payload::with::separators"
+    bad_head, _ = chunk_parts("../../x", 0, b"")
+    assert parse_chunk(bad_head + b"data") is None
+    assert parse_chunk(b"no separators") is None
+
+
+def test_incoming_resumes_from_part_file(tmp_path):
+    tid = new_transfer_id()
+    incoming = IncomingTransfer(tid, "alice", "f.bin", 10, directory=tmp_path)
+    assert incoming.write(0, b"12345")
+    incoming.close()
+    assert IncomingTransfer.resumable(tid, directory=tmp_path)
+
+    resumed = IncomingTransfer(tid, "alice", "f.bin", 10, directory=tmp_path)
+    assert resumed.received == 5
+    assert not resumed.write(0, b"12345")  # chunk cũ còn trên đường truyền
+    assert resumed.write(5, b"67890")
+    assert resumed.complete
+    assert not IncomingTransfer.resumable(tid, directory=tmp_path)
+    with open(resumed.path, "rb") as f:
+        assert f.read() == b"1234567890"
+
+
+def test_incoming_rejects_chunk_past_offered_size(tmp_path):
+    incoming = IncomingTransfer(new_transfer_id(), "alice", "f.bin", 4, directory=tmp_path)
+    assert not incoming.write(0, b"too long")
+    assert incoming.received == 0
+    assert os.path.getsize(incoming.part_path) == 0
+    incoming.discard()
+    assert not os.path.exists(incoming.part_path)
+
+
+def test_outgoing_window_and_resume_offset(tmp_path):
+    path = tmp_path / "big.bin"
+    size = CHUNK_SIZE * (WINDOW_CHUNKS + 3) + 10
+    path.write_bytes(os.urandom(size))
+    outgoing = OutgoingTransfer(str(path), "bob")
+    outgoing.accept("bob", 0)
+    chunks = outgoing.next_chunks("bob")
+    assert len(chunks) == WINDOW_CHUNKS
+    assert outgoing.next_chunks("bob") == []  # cửa sổ đầy cho tới khi có ACK
+    assert outgoing.ack("bob", CHUNK_SIZE * 2) == CHUNK_SIZE * 2 / size
+    assert [offset for offset, _ in outgoing.next_chunks("bob")] == [CHUNK_SIZE * WINDOW_CHUNKS,
+                                                                     CHUNK_SIZE * (WINDOW_CHUNKS + 1)]
+
+    # Người nhận tiếp tục từ kích thước file .part của mình
+    outgoing.accept("bob", CHUNK_SIZE * (WINDOW_CHUNKS + 3))
+    (offset, data), = outgoing.next_chunks("bob")
+    assert offset == CHUNK_SIZE * (WINDOW_CHUNKS + 3) and len(data) == 10
+    outgoing.ack("bob", size)
+    assert outgoing.done("bob") and outgoing.unfinished_peers() == []
+    assert outgoing.ack("carol", 10) is None
+    outgoing.close()
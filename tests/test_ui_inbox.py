@@ -0,0 +1,60 @@
+import threading
+import time
+
+from ui_inbox import UiInbox
+
+
+def test_drain_runs_in_post_order():
+    inbox, seen = UiInbox(), []
+    for i in range(5):
+        inbox.post(seen.append, i)
+    assert inbox.drain() == 5
+    assert seen == [0, 1, 2, 3, 4] and len(inbox) == 0
+    assert inbox.drain() == 0
+
+
+def test_post_latest_keeps_position_and_newest_value():
+    inbox, seen = UiInbox(), []
+    inbox.post(seen.append, "a")
+    inbox.post_latest("progress", seen.append, 10)
+    inbox.post(seen.append, "b")
+    inbox.post_latest("progress", seen.append, 90)
+    inbox.drain()
+    assert seen == ["a", 90, "b"]
+    assert inbox.stats()["coalesced"] == 1
+    # Sau khi đã chạy, cùng key được xếp hàng lại bình thường
+    inbox.post_latest("progress", seen.append, 100)
+    inbox.drain()
+    assert seen[-1] == 100
+
+
+def test_drain_respects_time_budget():
+    inbox = UiInbox(budget=0.01)
+    for _ in range(50):
+        inbox.post(time.sleep, 0.002)
+    first = inbox.drain()
+    assert 0 < first < 50
+    while len(inbox):
+        inbox.drain()
+    assert inbox.stats()["executed"] == 50
+
+
+def test_failing_job_does_not_stop_the_batch():
+    inbox, seen = UiInbox(), []
+    inbox.post(lambda: 1 / 0)
+    inbox.post(seen.append, "after")
+    assert inbox.drain() == 2 and seen == ["after"]
+
+
+def test_post_from_many_threads():
+    inbox, seen = UiInbox(), []
+    threads = [threading.Thread(target=lambda n=n: [inbox.post(seen.append, n) for _ in range(200)])
+               for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    while len(inbox):
+        inbox.drain()
+    assert len(seen) == 800
+    assert inbox.stats()["peak_depth"] <= 800
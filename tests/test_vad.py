@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from vad import FRAME_MS, HANGOVER, PREROLL, SilenceTrimmer, VoiceActivityDetector
+
+RATE = 16000
+
+
+def tone(seconds, amplitude=8000, freq=300):
+    t = np.arange(int(seconds * RATE)) / RATE
+    return (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.int16)
+
+
+def quiet(seconds, amplitude=20, seed=0):
+    return (amplitude * np.random.default_rng(seed).standard_normal(int(seconds * RATE))).astype(np.int16)
+
+
+def trim(signal, blocks, channels=1):
+    trimmer = SilenceTrimmer(RATE, channels)
+    out, pos = [], 0
+    for size in blocks:
+        out += trimmer.push(signal[pos:pos + size])
+        pos += size
+    out += trimmer.flush()
+    return (np.concatenate(out) if out else np.zeros((0, channels), np.int16)), trimmer
+
+
+def test_thresholds_must_be_ordered():
+    with pytest.raises(ValueError):
+        VoiceActivityDetector(start_db=-50, stop_db=-40)
+
+
+def test_features_energy_and_zero_crossings():
+    frame = RATE * FRAME_MS // 1000
+    frames = np.stack([np.zeros(frame, np.int16), tone(FRAME_MS / 1000, 32767)[:frame],
+                       np.tile(np.array([1000, -1000], np.int16), frame // 2)]).reshape(3, frame, 1)
+    energy_db, zcr = VoiceActivityDetector.features(frames)
+    assert energy_db[0] < -150 and energy_db[1] == pytest.approx(-3.0, abs=0.1)
+    assert zcr[2] == pytest.approx(1.0) and zcr[1] < 0.1
+
+
+def test_hysteresis_and_state_across_batches():
+    vad = VoiceActivityDetector()
+    no_zcr = np.zeros(6)
+    # -40 dB chỉ kéo dài một đoạn nói đã bắt đầu, không tự bắt đầu
+    speech = vad.classify(np.array([-60.0, -30, -40, -40, -60, -40]), no_zcr)
+    assert speech.tolist() == [False, True, True, True, False, False]
+    vad.classify(np.array([-30.0]), np.zeros(1))
+    assert vad.classify(np.array([-40.0, -40]), np.zeros(2)).tolist() == [True, True]
+    # phụ âm xát: nhỏ hơn stop_db nhưng đổi dấu nhiều vẫn giữ đoạn nói
+    assert vad.classify(np.array([-48.0, -48]), np.array([0.5, 0.1])).tolist() == [True, False]
+
+
+def test_trimmer_drops_edges_and_shortens_long_pauses():
+    signal = np.concatenate([quiet(1.0), tone(0.5), quiet(2.0, seed=1), tone(0.5), quiet(1.0, seed=2)])
+    out, trimmer = trim(signal, [len(signal)])
+    kept = len(out) / RATE
+    assert 1.0 < kept <= 1.0 + 2 * (HANGOVER + PREROLL) + 0.1
+    assert trimmer.removed_seconds == pytest.approx(len(signal) / RATE - kept)
+    # mọi mẫu to đều được giữ
+    assert np.count_nonzero(np.abs(out) > 1000) == np.count_nonzero(np.abs(signal) > 1000)
+
+
+def test_streaming_blocks_match_one_shot():
+    signal = np.concatenate([quiet(0.5), tone(0.4), quiet(0.2, seed=1), tone(0.3), quiet(1.0, seed=2)])
+    one, _ = trim(signal, [len(signal)])
+    rng = np.random.default_rng(7)
+    sizes = []
+    left = len(signal)
+    while left:
+        sizes.append(min(left, int(rng.integers(1, 3000))))
+        left -= sizes[-1]
+    many, _ = trim(signal, sizes)
+    assert np.array_equal(one, many)
+
+
+def test_silence_only_and_stereo():
+    out, trimmer = trim(quiet(2.0), [4000] * 8)
+    assert len(out) == 0 and trimmer.removed_seconds == pytest.approx(2.0)
+    stereo = np.repeat(np.concatenate([quiet(0.5), tone(0.3), quiet(0.5)]), 2).reshape(-1, 2)
+    out, _ = trim(stereo, [len(stereo)], channels=2)
+    assert out.shape[1] == 2 and 0.3 <= len(out) / RATE < 0.3 + HANGOVER + PREROLL + 0.05
+    assert SilenceTrimmer(RATE).flush() == []
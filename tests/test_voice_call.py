@@ -0,0 +1,91 @@
+import time
+
+import numpy as np
+
+from voice_call import (FRAME_SAMPLES, CallSession, JitterBuffer, decode_packet, encode_packet, encode_signal,
+                        parse_signal)
+from voice_codec import CODEC_ULAW
+
+
+def frame(value):
+    return np.full(FRAME_SAMPLES, value, dtype=np.int16)
+
+
+def push_in_time(buffer, seqs, start=100.0):
+    """Đẩy các khung như thể chúng đến đúng nhịp (không jitter)."""
+    for seq in seqs:
+        buffer.push(seq & 0xFFFF, seq * FRAME_SAMPLES, frame(seq % 1000), arrival=start + seq * buffer.frame_time)
+
+
+def test_packet_round_trip_and_rejects_foreign_datagrams():
+    packet = encode_packet(CODEC_ULAW, 70000, 2 ** 33 + 5, 42, 7, b"abc")
+    codec_id, seq, timestamp, call_id, ssrc, payload = decode_packet(packet)
+    assert (codec_id, seq, timestamp, call_id, ssrc, bytes(payload)) == (CODEC_ULAW, 70000 & 0xFFFF, 5, 42, 7, b"abc")
+    assert decode_packet(b"\x00" * 20) is None
+    assert decode_packet(b"short") is None
+
+
+def test_signal_round_trip():
+    assert parse_signal(encode_signal(123, "10.0.0.1", 5000)) == (123, ("10.0.0.1", 5000))
+    assert parse_signal(b"1::host") is None
+    assert parse_signal(b"x::host::port") is None
+
+
+def test_jitter_buffer_reorders_and_drops_late_frames():
+    buffer = JitterBuffer()
+    push_in_time(buffer, [1, 0, 2])
+    assert [buffer.pop()[0][0] for _ in range(3)] == [0, 1, 2]
+    push_in_time(buffer, [1])
+    assert buffer.late == 1
+    push_in_time(buffer, [3, 3])
+    assert buffer.duplicates == 1
+
+
+def test_jitter_buffer_conceals_loss_then_goes_silent():
+    buffer = JitterBuffer()
+    push_in_time(buffer, [5])
+    assert buffer.pop()[1] == "ok"
+    states = [buffer.pop() for _ in range(JitterBuffer.PLC_FRAMES + 1)]
+    assert all(state == "concealed" for _, state in states)
+    assert states[0][0][0] == 3  # khung trước, nhỏ dần (5 * 0.6)
+    assert not states[-1][0].any()
+
+
+def test_jitter_buffer_handles_sequence_wraparound():
+    buffer = JitterBuffer()
+    played = []
+    for seq in range(65533, 65540):
+        push_in_time(buffer, [seq])
+        played.append(buffer.pop())
+    assert [state for _, state in played] == ["ok"] * 7
+    assert [int(samples[0]) for samples, _ in played] == [seq % 1000 for seq in range(65533, 65540)]
+    assert buffer.late == 0
+
+
+def test_jitter_raises_target_delay():
+    steady, jittery = JitterBuffer(), JitterBuffer()
+    push_in_time(steady, range(50))
+    for seq in range(50):
+        jittery.push(seq, seq * FRAME_SAMPLES, frame(1), arrival=100.0 + seq * 0.02 + (0.06 if seq % 2 else 0))
+    assert steady.target_frames() == 1
+    assert jittery.target_frames() > steady.target_frames()
+
+
+def test_call_sessions_exchange_frames_over_udp():
+    a = CallSession(1, bind=("127.0.0.1", 0))
+    b = CallSession(1, bind=("127.0.0.1", 0))
+    try:
+        a.add_peer(("127.0.0.1", b.port))
+        for _ in range(5):
+            a.send_frame(frame(1000))
+        deadline = time.monotonic() + 2
+        while not b.buffers and time.monotonic() < deadline:
+            time.sleep(0.01)
+        (buffer,) = b.buffers.values()
+        while buffer.received < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert buffer.received == 5
+        assert abs(int(b.mix_frame()[0]) - 1000) < 50
+    finally:
+        a.close()
+        b.close()
@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+
+from voice_codec import (CODEC_ADPCM, CODEC_PCM16, CODEC_ULAW, CODECS, VOICE_HEADER, IncomingVoice, StreamResampler,
+                         VoiceStreamEncoder, decode_voice, encode_voice, join_voice, parse_voice_chunk,
+                         parse_voice_header, resample, voice_chunk_parts, voice_duration)
+
+RATE = 16000
+
+
+def tone(seconds=0.25, rate=RATE, freq=440.0, amplitude=8000):
+    t = np.arange(int(seconds * rate)) / rate
+    return (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.int16)
+
+
+def snr_db(reference, decoded):
+    noise = reference.astype(np.float64) - decoded.astype(np.float64)
+    return 10 * np.log10(np.sum(reference.astype(np.float64) ** 2) / max(np.sum(noise ** 2), 1e-9))
+
+
+# ---------- codec (user-008) ----------
+
+def test_pcm16_round_trip_is_exact():
+    samples = tone()
+    decoded, rate = decode_voice(encode_voice(samples, RATE, CODEC_PCM16))
+    assert rate == RATE
+    assert np.array_equal(decoded, samples)
+
+
+def test_ulaw_matches_reference_points():
+    codec = CODECS[CODEC_ULAW]
+    # Giá trị từ bảng G.711 (g711.c): 0 -> 0xFF, đỉnh dương -> 0x80, đỉnh âm -> 0x00
+    assert codec.encode(np.array([0, 32767, -32768], dtype=np.int16)) == bytes([0xFF, 0x80, 0x00])
+    assert codec.decode(bytes([0xFF, 0x7F]), 2).tolist() == [0, 0]
+
+
+@pytest.mark.parametrize("codec_id, min_snr", [(CODEC_ULAW, 30), (CODEC_ADPCM, 20)])
+def test_lossy_codecs_round_trip(codec_id, min_snr):
+    samples = tone()
+    body = encode_voice(samples, RATE, codec_id)
+    decoded, rate = decode_voice(body)
+    assert rate == RATE and len(decoded) == len(samples)
+    assert snr_db(samples, decoded) > min_snr
+
+
+def test_compressed_sizes():
+    samples = tone(seconds=1.0)
+    assert len(encode_voice(samples, RATE, CODEC_ULAW)) == VOICE_HEADER.size + RATE
+    assert len(encode_voice(samples, RATE, CODEC_ADPCM)) == VOICE_HEADER.size + 4 + RATE // 2
+
+
+def test_encode_resamples_to_codec_rate():
+    body = encode_voice(tone(seconds=0.5, rate=44100), 44100, CODEC_ULAW)
+    codec_id, channels, rate, n_samples, offset = parse_voice_header(body)
+    assert (codec_id, channels, rate, n_samples, offset) == (CODEC_ULAW, 1, 16000, 8000, VOICE_HEADER.size)
+    assert voice_duration(body) == pytest.approx(0.5)
+    decoded, rate = decode_voice(body, output_rate=44100)
+    assert rate == 44100 and len(decoded) == 22050
+
+
+def test_legacy_body_without_header_is_raw_pcm():
+    samples = tone(rate=44100)
+    body = samples.astype('<i2').tobytes()
+    assert parse_voice_header(body) is None
+    decoded, rate = decode_voice(body)
+    assert rate == 44100 and np.array_equal(decoded, samples)
+    assert voice_duration(body) == pytest.approx(len(samples) / 44100)
+
+
+def test_resample_keeps_tone_frequency():
+    out = resample(tone(seconds=1.0, rate=44100, freq=1000), 44100, RATE)
+    assert len(out) == RATE
+    assert np.argmax(np.abs(np.fft.rfft(out))) == 1000
+
+
+# ---------- ghi và gửi dần (user-010) ----------
+
+def test_voice_chunk_round_trip():
+    head, body = voice_chunk_parts("abc", 3, True, b"data::x")
+    vid, seq, final, view = parse_voice_chunk(head + body)
+    assert (vid, seq, final, bytes(view)) == ("abc", 3, True, b"data::x")
+    assert parse_voice_chunk(b"abc::x::1::data") is None
+    assert parse_voice_chunk(b"abc::1") is None
+
+
+def test_stream_resampler_matches_one_shot():
+    samples = tone(seconds=2.0, rate=44100)
+    resampler = StreamResampler(44100, RATE)
+    pieces = [out for i in range(0, len(samples), 1000) for out in resampler.push(samples[i:i + 1000])]
+    streamed = np.concatenate(pieces + [resampler.flush()])
+    whole = resample(samples, 44100, RATE)
+    assert len(streamed) == len(whole)
+    # Biên đoạn không có tiếng "tách": khác biệt nhỏ so với đổi tần số cả bản ghi một lần
+    assert np.max(np.abs(streamed[200:-200].astype(np.int32) - whole[200:-200])) < 200
+
+
+@pytest.mark.parametrize("codec_id", [CODEC_ULAW, CODEC_ADPCM])
+def test_streamed_chunks_join_into_one_message(codec_id):
+    samples = tone(seconds=1.6, rate=44100)
+    encoder = VoiceStreamEncoder(44100, codec_id)
+    bodies = [body for i in range(0, len(samples), 4410) for body in encoder.push(samples[i:i + 4410])]
+    bodies.append(encoder.flush())
+    assert len(bodies) >= 3
+    assert all(decode_voice(body)[1] == RATE for body in bodies)  # mỗi đoạn giải mã được ngay
+    joined = join_voice(bodies)
+    assert parse_voice_header(joined)[0] == codec_id
+    assert voice_duration(joined) == pytest.approx(sum(voice_duration(b) for b in bodies))
+    assert voice_duration(joined) == pytest.approx(1.6, abs=0.01)
+
+
+def test_join_voice_mixed_codecs_falls_back_to_pcm():
+    first = encode_voice(tone(), RATE, CODEC_ULAW)
+    second = encode_voice(tone(rate=44100), 44100, CODEC_PCM16)
+    joined = join_voice([first, second])
+    assert parse_voice_header(joined)[:3] == (CODEC_PCM16, 1, 44100)
+    assert voice_duration(joined) == pytest.approx(0.5, abs=0.01)
+
+
+def test_incoming_voice_ignores_duplicates_and_stops_at_final():
+    voice = IncomingVoice("vid", "alice", "ALL")
+    assert not voice.add(0, b"a", False)
+    assert not voice.add(0, b"a", False)
+    assert voice.add(1, b"b", True)
+    assert voice.add(2, b"c", False)
+    assert voice.bodies == [b"a", b"b"]
+    assert voice.wait_chunk(1) == b"b"
+    assert voice.wait_chunk(2, timeout=0.01) is None
@@ -0,0 +1,254 @@
+import os
+import re
+import tempfile
+import threading
+import uuid
+
+# === TRUYỀN FILE DẠNG LUỒNG (chia chunk, tiếp tục được sau khi mất kết nối) ===
+#
+# File lớn không còn đi trong MỘT frame FILE (cả file nằm trong RAM của người gửi,
+# server và từng người nhận). Thay vào đó:
+#   FILEOFFER::gui::nhan::<tid>::<size>::<ten_file>       người gửi đề nghị
+#   FILEACCEPT::nhan::gui::<tid>::<offset>                người nhận đồng ý, offset = số byte đã có
+#   FILECHUNK::gui::nhan::<tid>::<offset>::<du_lieu>      từng chunk CHUNK_SIZE bytes
+#   FILEACK::nhan::gui::<tid>::<offset>                   đã ghi xong tới offset
+#   FILECANCEL::ai_do::ben_kia::<tid>::<ly_do>            từ chối / hủy
+# Người gửi chỉ để tối đa WINDOW_CHUNKS chunk chưa được ACK, nên mỗi lúc chỉ vài trăm KB
+# nằm trên đường truyền; tin nhắn khác đi xen giữa các chunk.
+# Server chỉ chuyển tiếp từng chunk như tin nhắn bình thường, không bao giờ giữ cả file.
+# Mất kết nối: người nhận giữ file .part; khi hai bên gặp lại, người gửi đề nghị lại cùng
+# <tid> và người nhận trả lời FILEACCEPT với offset = kích thước file .part (tiếp tục từ đó).
+# <tid> nằm trong tên file trên đĩa của người nhận nên phải đúng dạng uuid4().hex; đề nghị / chunk
+# có tid khác (ví dụ "../../x") bị bỏ.
+
+CHUNK_SIZE = 64 * 1024
+WINDOW_CHUNKS = 8
+STREAM_THRESHOLD = 1024 * 1024  # File lớn hơn ngưỡng này được gửi dạng luồng
+
+# Thư mục chứa file đang nhận dở (.part) và file đã nhận xong
+TRANSFER_DIR = os.path.join(tempfile.gettempdir(), "voicechat_transfers")
+
+
+TID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+def new_transfer_id():
+    return uuid.uuid4().hex
+
+
+def valid_tid(tid):
+    return TID_PATTERN.fullmatch(tid) is not None
+
+
+def encode_offer(tid, size, filename):
+    return f"{tid}::{size}::{filename}".encode('utf-8')
+
+
+def parse_offer(body):
+    """body FILEOFFER -> (tid, size, filename), hoặc None nếu sai định dạng."""
+    tid, _, rest = str(body, 'utf-8', errors='ignore').partition("::")
+    size, _, filename = rest.partition("::")
+    try:
+        size = int(size)
+    except ValueError:
+        return None
+    if not valid_tid(tid) or size < 0:
+        return None
+    return tid, size, filename
+
+
+def encode_offset(tid, offset):
+    """body FILEACCEPT / FILEACK."""
+    return f"{tid}::{offset}".encode('utf-8')
+
+
+def parse_offset(body):
+    """body FILEACCEPT / FILEACK -> (tid, offset), hoặc None nếu sai định dạng."""
+    tid, _, offset = str(body, 'utf-8', errors='ignore').partition("::")
+    try:
+        return tid, int(offset)
+    except ValueError:
+        return None
+
+
+def encode_cancel(tid, reason):
+    return f"{tid}::{reason}".encode('utf-8')
+
+
+def parse_cancel(body):
+    tid, _, reason = str(body, 'utf-8', errors='ignore').partition("::")
+    return tid, reason
+
+
+def chunk_parts(tid, offset, data):
+    """Các phần body FILECHUNK (gửi không nối lại): "<tid>::<offset>::" + dữ liệu."""
+    return f"{tid}::{offset}::".encode('utf-8'), data
+
+
+def parse_chunk(body):
+    """body FILECHUNK -> (tid, offset, memoryview(du_lieu)), hoặc None nếu sai định dạng."""
+    view = memoryview(body)
+    head = bytes(view[:96])
+    first = head.find(b"::")
+    second = head.find(b"::", first + 2)
+    if first < 0 or second < 0:
+        return None
+    try:
+        offset = int(head[first + 2:second])
+    except ValueError:
+        return None
+    tid = head[:first].decode('utf-8', errors='ignore')
+    if not valid_tid(tid):
+        return None
+    return tid, offset, view[second + 2:]
+
+
+class OutgoingTransfer:
+    """
+    File đang gửi (phía người gửi). Đọc từng chunk từ đĩa khi cần, không nạp cả file.
+    Một đề nghị gửi "ALL" có thể được nhiều người nhận chấp nhận: mỗi người một luồng
+    với offset riêng trong 'peers' {ten: [da_gui, da_ack]}.
+    Thread-safe (luồng nhận cập nhật ACK, luồng gửi đọc chunk).
+    """
+
+    def __init__(self, path, receiver, tid=None):
+        self.tid = tid or new_transfer_id()
+        self.path = path
+        self.filename = os.path.basename(path).replace("::", "_")
+        self.size = os.path.getsize(path)
+        self.receiver = receiver
+        self.peers = {}
+        self._file = None
+        self._lock = threading.Lock()
+
+    def offer_body(self):
+        return encode_offer(self.tid, self.size, self.filename)
+
+    def accept(self, peer, offset):
+        """Người nhận chấp nhận (hoặc tiếp tục) từ 'offset': bắt đầu lại cửa sổ gửi từ đó."""
+        with self._lock:
+            offset = max(0, min(offset, self.size))
+            self.peers[peer] = [offset, offset]
+
+    def ack(self, peer, offset):
+        """Cập nhật offset đã ACK. Trả về tiến độ (0..1) hoặc None nếu peer không thuộc transfer."""
+        with self._lock:
+            state = self.peers.get(peer)
+            if state is None:
+                return None
+            state[1] = max(state[1], min(offset, state[0]))
+            return self._progress(state)
+
+    def remove(self, peer):
+        with self._lock:
+            self.peers.pop(peer, None)
+            self._close_if_idle()
+
+    def unfinished_peers(self):
+        with self._lock:
+            return [peer for peer, state in self.peers.items() if state[1] < self.size]
+
+    def done(self, peer):
+        with self._lock:
+            state = self.peers.get(peer)
+            return state is not None and state[1] >= self.size
+
+    def next_chunks(self, peer):
+        """
+        Các chunk (offset, bytes) được phép gửi tiếp cho 'peer' mà không vượt cửa sổ.
+        Đánh dấu luôn là đã gửi.
+        """
+        chunks = []
+        with self._lock:
+            state = self.peers.get(peer)
+            if state is None:
+                return chunks
+            while state[0] < self.size and state[0] - state[1] < WINDOW_CHUNKS * CHUNK_SIZE:
+                if self._file is None:
+                    self._file = open(self.path, "rb")
+                self._file.seek(state[0])
+                data = self._file.read(min(CHUNK_SIZE, self.size - state[0]))
+                if not data:
+                    break  # File bị cắt ngắn trong lúc gửi
+                chunks.append((state[0], data))
+                state[0] += len(data)
+            self._close_if_idle()
+        return chunks
+
+    def _progress(self, state):
+        return state[1] / self.size if self.size else 1.0
+
+    def _close_if_idle(self):
+        if self._file is not None and all(state[0] >= self.size for state in self.peers.values()):
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class IncomingTransfer:
+    """
+    File đang nhận (phía người nhận). Chunk được ghi thẳng xuống file .part trên đĩa,
+    nên bộ nhớ không phụ thuộc kích thước file. Kích thước file .part chính là offset
+    để tiếp tục sau khi mất kết nối (kể cả khi client khởi động lại).
+    """
+
+    def __init__(self, tid, sender, filename, size, directory=TRANSFER_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.tid = tid
+        self.sender = sender
+        self.filename = filename
+        self.size = size
+        self.part_path = os.path.join(directory, f"{tid}.part")
+        self.path = os.path.join(directory, f"{tid}_{filename}")
+        self._file = open(self.part_path, "ab")
+        self.received = self._file.tell()
+
+    @staticmethod
+    def resumable(tid, directory=TRANSFER_DIR):
+        """Đã có file .part của transfer này (đang nhận dở)?"""
+        return os.path.exists(os.path.join(directory, f"{tid}.part"))
+
+    @property
+    def complete(self):
+        return self.received >= self.size
+
+    def progress(self):
+        return self.received / self.size if self.size else 1.0
+
+    def write(self, offset, data):
+        """
+        Ghi chunk bắt đầu tại 'offset'. Chunk trùng / lệch (ví dụ còn bay trên đường truyền
+        lúc tiếp tục lại) hoặc vượt kích thước đã đề nghị bị bỏ qua. Trả về True nếu đã ghi.
+        """
+        if offset != self.received or self._file is None or offset + len(data) > self.size:
+            return False
+        self._file.write(data)
+        self.received += len(data)
+        if self.complete:
+            self.finish()
+        return True
+
+    def finish(self):
+        """Đóng file và đổi .part thành tên cuối cùng."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.replace(self.part_path, self.path)
+
+    def close(self):
+        """Dừng nhận (mất kết nối / hủy) nhưng giữ file .part để tiếp tục sau."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        self.close()
+        try:
+            os.remove(self.part_path)
+        except OSError:
+            pass
@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import deque
+
+# === HỘP THƯ GIAO DIỆN (luồng mạng -> luồng Tk) ===
+#
+# Trước đây luồng nhận gọi self.after(0, lambda ...) cho từng frame: một đợt tin nhắn dồn dập
+# làm ngập hàng đợi sự kiện của Tk (mỗi after là một lệnh Tcl + một sự kiện timer) và giao diện
+# không nhận được phím / chuột cho tới khi chạy hết. Giờ các luồng nền chỉ bỏ việc vào UiInbox
+# (deque, không đụng tới Tk); luồng giao diện rút ra theo nhịp UI_TICK_MS, mỗi lần tối đa
+# UI_DRAIN_BUDGET giây, phần còn lại để nhịp sau. ChatView gộp mọi append() trong một lần rút
+# thành một lần vẽ (after_idle), nên mỗi đợt chỉ vẽ lại một lần.
+# post_latest(key, ...) thay thế việc cùng key còn đang chờ (ví dụ tiến độ truyền tệp): chỉ
+# giá trị mới nhất được vẽ, giữ nguyên vị trí trong hàng đợi.
+
+UI_TICK_MS = 16            # ~60 lần / giây
+UI_DRAIN_BUDGET = 0.008    # giây giao diện dành cho việc từ luồng nền trong mỗi nhịp
+STATS_SMOOTHING = 0.1      # hệ số trung bình trượt (EWMA) của thời gian rút
+
+
+class UiInbox:
+    """
+    Hàng đợi việc cần chạy trên luồng giao diện. post() / post_latest() gọi từ luồng bất kỳ,
+    drain() chỉ gọi từ luồng Tk.
+    """
+
+    def __init__(self, budget=UI_DRAIN_BUDGET):
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._queue = deque()   # entry: [key, fn, args]
+        self._latest = {}       # key -> entry đang chờ
+        # thống kê
+        self.posted = 0
+        self.coalesced = 0
+        self.executed = 0
+        self.batches = 0
+        self.peak_depth = 0
+        self.last_drain = 0.0
+        self.max_drain = 0.0
+        self.avg_drain = 0.0
+        self.last_batch = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def post(self, fn, *args):
+        with self._lock:
+            self._queue.append([None, fn, args])
+            self._posted_locked()
+
+    def post_latest(self, key, fn, *args):
+        """Như post(), nhưng nếu việc cùng 'key' chưa chạy thì chỉ thay tham số của nó."""
+        with self._lock:
+            entry = self._latest.get(key)
+            if entry is not None:
+                entry[1], entry[2] = fn, args
+                self.coalesced += 1
+                return
+            entry = self._latest[key] = [key, fn, args]
+            self._queue.append(entry)
+            self._posted_locked()
+
+    def _posted_locked(self):
+        self.posted += 1
+        if len(self._queue) > self.peak_depth:
+            self.peak_depth = len(self._queue)
+
+    def drain(self):
+        """Chạy các việc đang chờ trong tối đa 'budget' giây; trả về số việc đã chạy."""
+        if not self._queue:
+            return 0
+        start = time.perf_counter()
+        deadline = start + self.budget
+        count = 0
+        while True:
+            with self._lock:
+                if not self._queue:
+                    break
+                key, fn, args = entry = self._queue.popleft()
+                if key is not None and self._latest.get(key) is entry:
+                    del self._latest[key]
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"❌ Lỗi khi cập nhật giao diện: {e}")
+            count += 1
+            if time.perf_counter() >= deadline:
+                break
+        elapsed = time.perf_counter() - start
+        self.executed += count
+        self.batches += 1
+        self.last_batch = count
+        self.last_drain = elapsed
+        self.max_drain = max(self.max_drain, elapsed)
+        self.avg_drain += STATS_SMOOTHING * (elapsed - self.avg_drain)
+        return count
+
+    def stats(self):
+        """Số liệu hàng đợi: độ sâu hiện tại / đỉnh, số việc, thời gian mỗi lần rút (ms)."""
+        return {
+            "depth": len(self._queue),
+            "peak_depth": self.peak_depth,
+            "posted": self.posted,
+            "coalesced": self.coalesced,
+            "executed": self.executed,
+            "batches": self.batches,
+            "last_batch": self.last_batch,
+            "last_drain_ms": self.last_drain * 1000,
+            "avg_drain_ms": self.avg_drain * 1000,
+            "max_drain_ms": self.max_drain * 1000,
+        }
@@ -0,0 +1,136 @@
+import numpy as np
+
+# === PHÁT HIỆN TIẾNG NÓI (VAD) VÀ CẮT KHOẢNG LẶNG KHI GHI ÂM ===
+#
+# Bản ghi được chia thành khung FRAME_MS; mỗi khung có năng lượng (dBFS, sau khi bỏ DC) và tỉ lệ
+# đổi dấu (zero-crossing rate), tính cho cả lô khung bằng NumPy, không lặp Python theo mẫu / khung.
+# Quyết định có trễ (hysteresis, kiểu Schmitt trigger):
+# - khung "to" (>= start_db) bắt đầu một đoạn nói;
+# - đoạn nói kéo dài khi khung còn "hoạt động": >= stop_db, hoặc >= zcr_db với ZCR >= zcr_min
+#   (phụ âm xát như "s", "x" nhỏ tiếng nhưng đổi dấu nhiều); khung đầu tiên không hoạt động kết thúc đoạn.
+# Khung được giữ nếu nằm trong 'hangover' giây sau hoặc 'preroll' giây trước một khung nói: khoảng lặng
+# đầu / cuối bị bỏ, khoảng ngừng dài bị rút còn tối đa hangover + preroll giây; khoảng ngừng ngắn giữa
+# các từ giữ nguyên. Ngưỡng mặc định hợp với micro có nền nhiễu dưới zcr_db; phòng ồn nên nâng ngưỡng.
+
+FRAME_MS = 20
+START_DB = -35.0
+STOP_DB = -45.0
+ZCR_DB = -50.0
+ZCR_MIN = 0.3
+HANGOVER = 0.3   # giây giữ lại sau tiếng nói
+PREROLL = 0.15   # giây giữ lại trước tiếng nói (không mất đầu âm tiết)
+
+
+class VoiceActivityDetector:
+    """Đánh dấu khung nói / lặng cho các lô khung liên tiếp của MỘT luồng (trạng thái trễ nối qua các lô)."""
+
+    def __init__(self, start_db=START_DB, stop_db=STOP_DB, zcr_db=ZCR_DB, zcr_min=ZCR_MIN):
+        if stop_db > start_db:
+            raise ValueError("stop_db phải <= start_db")
+        self.start_db = start_db
+        self.stop_db = stop_db
+        self.zcr_db = zcr_db
+        self.zcr_min = zcr_min
+        self.speaking = False  # trạng thái sau khung cuối cùng đã xét
+
+    @staticmethod
+    def features(frames):
+        """frames (k, n, kênh) -> (năng lượng dBFS, ZCR) của từng khung, mỗi mảng dài k."""
+        scale = 1.0 / (np.iinfo(frames.dtype).max + 1) if frames.dtype.kind in "iu" else 1.0
+        x = frames.mean(axis=2, dtype=np.float32) * np.float32(scale)
+        x -= x.mean(axis=1, keepdims=True)
+        rms = np.sqrt(np.mean(x * x, axis=1))
+        energy_db = 20 * np.log10(np.maximum(rms, 1e-10))
+        zcr = np.count_nonzero(np.diff(np.signbit(x), axis=1), axis=1) / max(frames.shape[1] - 1, 1)
+        return energy_db, zcr
+
+    def classify(self, energy_db, zcr):
+        """Mảng bool: khung nào là tiếng nói (theo thứ tự, nối tiếp lô trước)."""
+        loud = energy_db >= self.start_db
+        active = loud | (energy_db >= self.stop_db) | ((energy_db >= self.zcr_db) & (zcr >= self.zcr_min))
+        idx = np.arange(len(loud))
+        # chỉ số khung "to" / "không hoạt động" gần nhất tính tới mỗi khung; trạng thái của lô trước
+        # là một sự kiện ảo ở chỉ số -1
+        last_on = np.maximum.accumulate(np.where(loud, idx, -2))
+        last_off = np.maximum.accumulate(np.where(active, -2, idx))
+        if self.speaking:
+            last_on = np.maximum(last_on, -1)
+        else:
+            last_off = np.maximum(last_off, -1)
+        speech = active & (last_on > last_off)
+        if len(speech):
+            self.speaking = bool(speech[-1])
+        return speech
+
+
+class SilenceTrimmer:
+    """
+    Cắt khoảng lặng của một bản ghi đang diễn ra: push() từng block mẫu (frames, kênh), nhận lại các
+    đoạn mẫu được giữ (mảng mới, block đầu vào có thể là view vào ring buffer). Các khung cuối còn chờ
+    biết có tiếng nói ngay sau không (preroll) nên bị giữ lại tới lần push sau / flush().
+    """
+
+    def __init__(self, sample_rate, channels=1, frame_ms=FRAME_MS, hangover=HANGOVER, preroll=PREROLL, **thresholds):
+        self.channels = channels
+        self.frame = max(1, int(sample_rate * frame_ms / 1000))
+        self.hangover = int(round(hangover * 1000 / frame_ms))
+        self.preroll = int(round(preroll * 1000 / frame_ms))
+        self.sample_rate = sample_rate
+        self.detector = VoiceActivityDetector(**thresholds)
+        self._buffer = None          # mẫu chưa quyết định (khung chờ preroll + phần khung dở)
+        self._pending = np.zeros(0, dtype=bool)  # nhãn nói / lặng của các khung đầu _buffer
+        self._last_speech = -(1 << 30)  # chỉ số khung nói gần nhất, tính từ đầu _buffer
+        self.input_frames = 0        # số mẫu (mỗi kênh) đã nhận
+        self.output_frames = 0       # số mẫu đã giữ
+
+    @property
+    def removed_seconds(self):
+        return (self.input_frames - self.output_frames) / self.sample_rate
+
+    def push(self, block):
+        """Thêm một block; trả về list các đoạn mẫu được giữ (có thể rỗng)."""
+        block = np.asarray(block).reshape(-1, self.channels)
+        self.input_frames += len(block)
+        self._buffer = block.copy() if self._buffer is None else np.concatenate((self._buffer, block))
+        return self._emit(final=False)
+
+    def flush(self):
+        """Kết thúc bản ghi: quyết định nốt các khung còn chờ (không còn tiếng nói phía sau)."""
+        if self._buffer is None:
+            return []
+        out = self._emit(final=True)
+        # phần khung dở ở cuối: giữ nếu còn trong hangover của tiếng nói
+        tail = self._buffer
+        if len(tail) and self._last_speech >= -self.hangover:
+            out.append(tail)
+            self.output_frames += len(tail)
+        self._buffer = None
+        self._pending = np.zeros(0, dtype=bool)
+        self._last_speech = -(1 << 30)
+        return out
+
+    def _emit(self, final):
+        n = self.frame
+        total = len(self._buffer) // n
+        known = len(self._pending)
+        if total > known:
+            frames = self._buffer[known * n:total * n].reshape(total - known, n, self.channels)
+            speech = np.concatenate((self._pending, self.detector.classify(*self.detector.features(frames))))
+        else:
+            speech = self._pending
+        # khung i quyết định được khi đã biết 'preroll' khung sau nó (flush: mọi khung)
+        decided = total if final else max(total - self.preroll, 0)
+        if not decided:
+            self._pending = speech
+            return []
+        big = 1 << 30
+        idx = np.arange(total)
+        last = np.maximum(np.maximum.accumulate(np.where(speech, idx, -big)), self._last_speech)
+        following = np.minimum.accumulate(np.where(speech, idx, big)[::-1])[::-1]
+        keep = ((idx - last <= self.hangover) | (following - idx <= self.preroll))[:decided]
+        kept = self._buffer[:decided * n].reshape(decided, n, self.channels)[keep].reshape(-1, self.channels)
+        self._last_speech = int(last[decided - 1]) - decided if last[decided - 1] > -big else -big
+        self._buffer = self._buffer[decided * n:]
+        self._pending = speech[decided:]
+        self.output_frames += len(kept)
+        return [kept] if len(kept) else []
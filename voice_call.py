@@ -0,0 +1,328 @@
+import heapq
+import math
+import random
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+from voice_codec import CODEC_ULAW, CODECS
+
+# === GỌI THOẠI TRỰC TIẾP QUA UDP ===
+#
+# Âm thanh đi thành từng khung 20 ms qua UDP (mất gói thì bỏ qua, không chờ gửi lại như TCP).
+# Mỗi gói: [HEADER 16 bytes][khung âm thanh đã mã hóa bằng voice_codec]
+#   magic (1B, 0xC5) | codec (1B) | seq (2B) | timestamp (4B, đơn vị mẫu) | call_id (4B) | ssrc (4B)
+# 'ssrc' phân biệt từng người nói trong cùng cuộc gọi (gọi nhóm: mỗi người gửi tới mọi người khác).
+#
+# Báo hiệu đi qua server TCP như OPENPRIVATE (CALLINVITE / CALLACCEPT / CALLEND),
+# body "call_id::ip::port" là địa chỉ UDP của người gửi tin báo hiệu.
+
+CALL_RATE = 16000
+FRAME_MS = 20
+FRAME_SAMPLES = CALL_RATE * FRAME_MS // 1000
+
+CALL_MAGIC = 0xC5
+CALL_HEADER = struct.Struct("!BBHIII")
+
+
+def encode_packet(codec_id, seq, timestamp, call_id, ssrc, payload):
+    return CALL_HEADER.pack(CALL_MAGIC, codec_id, seq & 0xFFFF, timestamp & 0xFFFFFFFF, call_id, ssrc) + payload
+
+
+def decode_packet(packet):
+    """Gói UDP -> (codec_id, seq, timestamp, call_id, ssrc, payload), hoặc None nếu không phải gói thoại."""
+    if len(packet) < CALL_HEADER.size:
+        return None
+    magic, codec_id, seq, timestamp, call_id, ssrc = CALL_HEADER.unpack_from(packet)
+    if magic != CALL_MAGIC or codec_id not in CODECS:
+        return None
+    return codec_id, seq, timestamp, call_id, ssrc, memoryview(packet)[CALL_HEADER.size:]
+
+
+def encode_signal(call_id, host, port):
+    """body CALLINVITE / CALLACCEPT / CALLEND."""
+    return f"{call_id}::{host}::{port}".encode('utf-8')
+
+
+def parse_signal(body):
+    """body báo hiệu -> (call_id, (host, port)), hoặc None nếu sai định dạng."""
+    parts = str(body, 'utf-8', errors='ignore').split("::")
+    if len(parts) != 3:
+        return None
+    try:
+        return int(parts[0]), (parts[1], int(parts[2]))
+    except ValueError:
+        return None
+
+
+def new_call_id():
+    return random.getrandbits(32)
+
+
+class JitterBuffer:
+    """
+    Bộ đệm chống jitter thích ứng của MỘT người nói.
+
+    - Ước lượng jitter theo RFC 3550 (J += (|D| - J) / 16) từ thời điểm đến và timestamp của gói.
+    - Độ trễ phát mục tiêu = min_delay + 3 * jitter (giới hạn trong [min_delay, max_delay]):
+      mạng ổn định thì trễ thấp, mạng giật thì đệm nhiều hơn.
+    - Gói đến trễ (sau khi khung của nó đã phát) bị bỏ; gói đến lộn xộn được xếp lại theo seq.
+    - Khung bị mất được che (PLC): lặp lại khung tốt gần nhất, nhỏ dần, rồi im lặng.
+    - Đệm nhiều hơn mục tiêu quá xa (ví dụ sau một đợt giật): bỏ bớt khung cũ để đuổi kịp.
+    - Hết sạch dữ liệu lâu hơn PLC_FRAMES khung: quay lại trạng thái đệm ban đầu.
+
+    push() được gọi từ luồng nhận UDP, pop() từ luồng phát âm thanh (mỗi FRAME_MS một lần).
+    """
+
+    PLC_FRAMES = 3      # Số khung được che bằng khung trước trước khi chuyển sang im lặng
+    PLC_DECAY = 0.6
+
+    def __init__(self, frame_samples=FRAME_SAMPLES, rate=CALL_RATE, min_delay=0.02, max_delay=0.3):
+        self.frame_samples = frame_samples
+        self.rate = rate
+        self.frame_time = frame_samples / rate
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.jitter = 0.0
+        self._frames = {}          # seq mở rộng -> mảng int16
+        self._next_seq = None      # seq sẽ phát tiếp theo (None: đang đệm lúc bắt đầu)
+        self._highest = None
+        self._prev_transit = None
+        self._last_good = None
+        self._concealed_run = 0
+        self._lock = threading.Lock()
+        self.received = 0
+        self.late = 0
+        self.duplicates = 0
+        self.concealed = 0
+        self.dropped = 0
+        self.played = 0
+
+    def _extend(self, seq):
+        """seq 16 bit -> seq mở rộng (xử lý tràn 65535 -> 0) theo seq lớn nhất đã thấy."""
+        if self._highest is None:
+            return seq
+        delta = (seq - self._highest) & 0xFFFF
+        if delta >= 0x8000:
+            delta -= 0x10000
+        return self._highest + delta
+
+    def target_frames(self):
+        delay = min(self.max_delay, max(self.min_delay, self.min_delay + 3 * self.jitter))
+        return max(1, math.ceil(delay / self.frame_time))
+
+    def push(self, seq, timestamp, samples, arrival=None):
+        arrival = time.monotonic() if arrival is None else arrival
+        with self._lock:
+            seq = self._extend(seq)
+            transit = arrival - timestamp / self.rate
+            if self._prev_transit is not None:
+                self.jitter += (abs(transit - self._prev_transit) - self.jitter) / 16
+            self._prev_transit = transit
+            if self._next_seq is not None and seq < self._next_seq:
+                self.late += 1
+                return
+            if seq in self._frames:
+                self.duplicates += 1
+                return
+            self._frames[seq] = samples
+            self.received += 1
+            if self._highest is None or seq > self._highest:
+                self._highest = seq
+
+    def pop(self):
+        """Khung tiếp theo để phát: (mảng int16, trạng thái "ok" / "concealed" / "buffering")."""
+        with self._lock:
+            if self._next_seq is None:
+                # Chờ đủ độ trễ mục tiêu trước khi bắt đầu phát
+                if len(self._frames) < self.target_frames():
+                    return self._silence(), "buffering"
+                self._next_seq = min(self._frames)
+            # Đuổi kịp: đệm vượt mục tiêu quá 2 khung thì bỏ khung cũ nhất
+            while self._highest - self._next_seq + 1 > self.target_frames() + 2:
+                if self._frames.pop(self._next_seq, None) is not None:
+                    self.dropped += 1
+                self._next_seq += 1
+            frame = self._frames.pop(self._next_seq, None)
+            self._next_seq += 1
+            if frame is not None:
+                self._last_good = frame
+                self._concealed_run = 0
+                self.played += 1
+                return frame, "ok"
+            self.concealed += 1
+            self._concealed_run += 1
+            if self._concealed_run > self.PLC_FRAMES and not self._frames:
+                # Hết sạch dữ liệu (mạng mất hẳn, không phải vài gói lẻ): đệm lại từ đầu,
+                # nếu không các gói đến sau sẽ luôn bị coi là trễ
+                self._next_seq = None
+            if self._last_good is None or self._concealed_run > self.PLC_FRAMES:
+                return self._silence(), "concealed"
+            gain = self.PLC_DECAY ** self._concealed_run
+            return (self._last_good * gain).astype(np.int16), "concealed"
+
+    def _silence(self):
+        return np.zeros(self.frame_samples, dtype=np.int16)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "received": self.received,
+                "played": self.played,
+                "concealed": self.concealed,
+                "late": self.late,
+                "duplicates": self.duplicates,
+                "dropped": self.dropped,
+                "jitter_ms": self.jitter * 1000,
+                "target_delay_ms": self.target_frames() * self.frame_time * 1000,
+            }
+
+
+class NetworkSimulator:
+    """
+    Giả lập mạng xấu cho gói UDP gửi đi (chạy thử qua loopback):
+    mất gói với xác suất 'loss', trễ ngẫu nhiên thêm 0..'jitter' giây (nên gói có thể đến lộn xộn).
+    """
+
+    def __init__(self, loss=0.0, jitter=0.0, seed=None):
+        self.loss = loss
+        self.jitter = jitter
+        self._rng = random.Random(seed)
+        self._queue = []
+        self._counter = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self.sent = 0
+        self.lost = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def sendto(self, sock, packet, addr):
+        if self._rng.random() < self.loss:
+            self.lost += 1
+            return
+        self.sent += 1
+        if not self.jitter:
+            sock.sendto(packet, addr)
+            return
+        due = time.monotonic() + self._rng.uniform(0, self.jitter)
+        with self._cond:
+            self._counter += 1
+            heapq.heappush(self._queue, (due, self._counter, sock, packet, addr))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and (not self._queue or self._queue[0][0] > time.monotonic()):
+                    timeout = self._queue[0][0] - time.monotonic() if self._queue else None
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+                _, _, sock, packet, addr = heapq.heappop(self._queue)
+            try:
+                sock.sendto(packet, addr)
+            except OSError:
+                pass
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+
+class CallSession:
+    """
+    Một cuộc gọi (1-1 hoặc nhóm, dạng lưới: mỗi người gửi thẳng tới mọi người khác).
+    Không phụ thuộc thiết bị âm thanh: bên ngoài gọi send_frame() với mỗi khung ghi được
+    và mix_frame() mỗi khi cần một khung để phát (client dùng callback của sounddevice).
+    """
+
+    def __init__(self, call_id, codec_id=CODEC_ULAW, bind=("0.0.0.0", 0), simulator=None):
+        self.call_id = call_id
+        self.ssrc = random.getrandbits(32)
+        self.codec = CODECS[codec_id]
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(bind)
+        self.sock.settimeout(0.2)  # để luồng nhận thấy close()
+        self.port = self.sock.getsockname()[1]
+        self.simulator = simulator
+        self.peers = set()          # địa chỉ UDP (host, port) của những người khác trong cuộc gọi
+        self.buffers = {}           # ssrc -> JitterBuffer
+        self._seq = 0
+        self._timestamp = 0
+        self._lock = threading.Lock()
+        self._running = True
+        self.sent = 0
+        threading.Thread(target=self._receive_loop, daemon=True).start()
+
+    def add_peer(self, addr):
+        with self._lock:
+            self.peers.add(addr)
+
+    def remove_peer(self, addr):
+        with self._lock:
+            self.peers.discard(addr)
+
+    def send_frame(self, samples):
+        """Mã hóa và gửi một khung FRAME_SAMPLES mẫu int16 tới mọi người trong cuộc gọi."""
+        payload = self.codec.encode(np.asarray(samples, dtype=np.int16).reshape(-1))
+        packet = encode_packet(self.codec.codec_id, self._seq, self._timestamp, self.call_id, self.ssrc, payload)
+        self._seq += 1
+        self._timestamp += FRAME_SAMPLES
+        with self._lock:
+            peers = list(self.peers)
+        for addr in peers:
+            try:
+                if self.simulator is not None:
+                    self.simulator.sendto(self.sock, packet, addr)
+                else:
+                    self.sock.sendto(packet, addr)
+                self.sent += 1
+            except OSError:
+                pass
+
+    def _receive_loop(self):
+        while self._running:
+            try:
+                packet = self.sock.recv(2048)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            decoded = decode_packet(packet)
+            if decoded is None:
+                continue
+            codec_id, seq, timestamp, call_id, ssrc, payload = decoded
+            if call_id != self.call_id or ssrc == self.ssrc:
+                continue
+            samples = CODECS[codec_id].decode(payload, FRAME_SAMPLES)
+            buffer = self.buffers.get(ssrc)
+            if buffer is None:
+                buffer = self.buffers.setdefault(ssrc, JitterBuffer())
+            buffer.push(seq, timestamp, samples)
+
+    def mix_frame(self):
+        """Một khung để phát: cộng khung của mọi người nói (đã qua jitter buffer), giới hạn int16."""
+        buffers = list(self.buffers.values())
+        if not buffers:
+            return np.zeros(FRAME_SAMPLES, dtype=np.int16)
+        if len(buffers) == 1:
+            return buffers[0].pop()[0]
+        mixed = np.zeros(FRAME_SAMPLES, dtype=np.int32)
+        for buffer in buffers:
+            mixed += buffer.pop()[0]
+        return np.clip(mixed, -32768, 32767).astype(np.int16)
+
+    def stats(self):
+        return {"sent": self.sent, "peers": len(self.peers),
+                "streams": {ssrc: buf.stats() for ssrc, buf in list(self.buffers.items())}}
+
+    def close(self):
+        self._running = False
+        try:
+            self.sock.close()
+        except OSError:
+            pass
@@ -0,0 +1,430 @@
+import math
+import struct
+import threading
+import uuid
+
+import numpy as np
+
+# === CODEC CHO PAYLOAD VOICEMSG ===
+#
+# Body VOICEMSG mới bắt đầu bằng một sub-header 12 bytes:
+#   magic "VC" (2B) | codec_id (1B) | channels (1B) | sample_rate (4B) | n_samples (4B)
+# rồi tới dữ liệu đã mã hóa. Body KHÔNG có sub-header (client cũ) là PCM int16 thô
+# ở tần số mặc định (44.1 kHz), nên client mới vẫn phát được tin nhắn thoại cũ.
+# Thời lượng = n_samples / sample_rate, đọc từ sub-header, không phải giải mã.
+#
+# Codec có sẵn (có thể thêm bằng register_codec):
+#   0 pcm16  : PCM int16, giữ nguyên tần số (88 KB/s ở 44.1 kHz)
+#   1 ulaw   : giảm xuống 16 kHz + G.711 μ-law 8 bit (16 KB/s, ~5.5 lần nhỏ hơn)
+#   2 adpcm  : giảm xuống 16 kHz + IMA-ADPCM 4 bit (8 KB/s, ~11 lần nhỏ hơn)
+
+VOICE_MAGIC = b"VC"
+VOICE_HEADER = struct.Struct("!2sBBII")
+
+CODEC_PCM16 = 0
+CODEC_ULAW = 1
+CODEC_ADPCM = 2
+
+DEFAULT_RATE = 44100  # Tần số của body cũ không có sub-header
+
+
+def resample(samples, src_rate, dst_rate):
+    """
+    Đổi tần số lấy mẫu bằng FFT (cắt/chèn phổ), vector hóa hoàn toàn.
+    Cắt phổ cũng chính là bộ lọc chống aliasing khi giảm tần số.
+    """
+    samples = np.asarray(samples)
+    if src_rate == dst_rate or len(samples) == 0:
+        return samples.astype(np.int16, copy=False)
+    n = len(samples)
+    m = max(1, int(round(n * dst_rate / src_rate)))
+    spectrum = np.fft.rfft(samples.astype(np.float32))
+    keep = min(len(spectrum), m // 2 + 1)
+    out = np.fft.irfft(spectrum[:keep], m) * (m / n)
+    return np.clip(np.round(out), -32768, 32767).astype(np.int16)
+
+
+class Codec:
+    """
+    Codec giọng nói: encode(int16 mono) -> bytes, decode(bytes, n_samples) -> int16.
+    'rate' là tần số codec làm việc (None = giữ tần số gốc).
+    """
+
+    codec_id = None
+    name = None
+    rate = None
+    # Nối dữ liệu đã mã hóa của nhiều đoạn liên tiếp = mã hóa cả đoạn dài (mỗi mẫu mã hóa độc lập)
+    concatenable = True
+
+    def encode(self, samples):
+        raise NotImplementedError
+
+    def decode(self, data, n_samples):
+        raise NotImplementedError
+
+
+class Pcm16Codec(Codec):
+    codec_id = CODEC_PCM16
+    name = "pcm16"
+
+    def encode(self, samples):
+        return samples.astype('<i2', copy=False).tobytes()
+
+    def decode(self, data, n_samples):
+        return np.frombuffer(data, dtype='<i2', count=n_samples).astype(np.int16)
+
+
+class MuLawCodec(Codec):
+    """G.711 μ-law (bit-exact với bản tham chiếu g711.c), tính trên cả mảng bằng NumPy."""
+
+    codec_id = CODEC_ULAW
+    name = "ulaw"
+    rate = 16000
+
+    BIAS = 0x84
+    # Giới hạn trên của từng segment (đơn vị mẫu 14 bit đã cộng bias 0x21)
+    SEGMENT_END = np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF])
+
+    def encode(self, samples):
+        x = samples.astype(np.int32) >> 2
+        negative = x < 0
+        magnitude = np.minimum(np.where(negative, -x, x), 8159) + 0x21
+        segment = np.searchsorted(self.SEGMENT_END, magnitude)
+        value = (segment << 4) | ((magnitude >> (segment + 1)) & 0x0F)
+        value = np.where(segment >= 8, 0x7F, value)  # Vượt segment cuối: giá trị lớn nhất
+        return (value ^ np.where(negative, 0x7F, 0xFF)).astype(np.uint8).tobytes()
+
+    def decode(self, data, n_samples):
+        code = ~np.frombuffer(data, dtype=np.uint8, count=n_samples).astype(np.int32) & 0xFF
+        exponent = (code >> 4) & 0x07
+        magnitude = (((code & 0x0F) << 3) + self.BIAS) << exponent
+        x = magnitude - self.BIAS
+        return np.where(code & 0x80, -x, x).astype(np.int16)
+
+
+_IMA_INDEX = (-1, -1, -1, -1, 2, 4, 6, 8, -1, -1, -1, -1, 2, 4, 6, 8)
+_IMA_STEPS = (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767,
+)
+
+
+class ImaAdpcmCodec(Codec):
+    """
+    IMA-ADPCM 4 bit/mẫu (2 mẫu/byte, nibble thấp trước), một block cho cả tin nhắn:
+    4 byte đầu là predictor (int16) + step index ban đầu.
+    Mỗi mẫu phụ thuộc trạng thái của mẫu trước nên vòng lặp không vector hóa được;
+    vòng lặp dùng int Python trên list (nhanh hơn nhiều so với truy cập từng phần tử NumPy).
+    """
+
+    codec_id = CODEC_ADPCM
+    name = "adpcm"
+    rate = 16000
+    concatenable = False  # mỗi đoạn có predictor / step index ban đầu riêng
+
+    def encode(self, samples):
+        pcm = samples.tolist()
+        predictor = pcm[0] if pcm else 0
+        index = 0
+        codes = bytearray(len(pcm))
+        for i, sample in enumerate(pcm):
+            step = _IMA_STEPS[index]
+            diff = sample - predictor
+            code = 0
+            if diff < 0:
+                code = 8
+                diff = -diff
+            delta = step >> 3
+            if diff >= step:
+                code |= 4
+                diff -= step
+                delta += step
+            if diff >= step >> 1:
+                code |= 2
+                diff -= step >> 1
+                delta += step >> 1
+            if diff >= step >> 2:
+                code |= 1
+                delta += step >> 2
+            predictor = predictor - delta if code & 8 else predictor + delta
+            predictor = -32768 if predictor < -32768 else 32767 if predictor > 32767 else predictor
+            index += _IMA_INDEX[code]
+            index = 0 if index < 0 else 88 if index > 88 else index
+            codes[i] = code
+        nibbles = np.frombuffer(bytes(codes), dtype=np.uint8)
+        if len(nibbles) % 2:
+            nibbles = np.append(nibbles, np.uint8(0))
+        packed = (nibbles[0::2] | (nibbles[1::2] << 4)).astype(np.uint8)
+        first = pcm[0] if pcm else 0
+        return struct.pack("<hBx", first, 0) + packed.tobytes()
+
+    def decode(self, data, n_samples):
+        predictor, index = struct.unpack_from("<hB", data)
+        packed = np.frombuffer(data, dtype=np.uint8, offset=4)
+        nibbles = np.empty(len(packed) * 2, dtype=np.uint8)
+        nibbles[0::2] = packed & 0x0F
+        nibbles[1::2] = packed >> 4
+        out = [0] * n_samples
+        for i, code in enumerate(nibbles[:n_samples].tolist()):
+            step = _IMA_STEPS[index]
+            delta = step >> 3
+            if code & 4:
+                delta += step
+            if code & 2:
+                delta += step >> 1
+            if code & 1:
+                delta += step >> 2
+            predictor = predictor - delta if code & 8 else predictor + delta
+            predictor = -32768 if predictor < -32768 else 32767 if predictor > 32767 else predictor
+            index += _IMA_INDEX[code]
+            index = 0 if index < 0 else 88 if index > 88 else index
+            out[i] = predictor
+        return np.array(out, dtype=np.int16)
+
+
+CODECS = {}
+CODEC_NAMES = {}
+
+
+def register_codec(codec):
+    """Thêm codec (ID phải thống nhất giữa các client)."""
+    CODECS[codec.codec_id] = codec
+    CODEC_NAMES[codec.name] = codec.codec_id
+
+
+for _codec in (Pcm16Codec(), MuLawCodec(), ImaAdpcmCodec()):
+    register_codec(_codec)
+
+
+def encode_voice(samples, sample_rate, codec_id=CODEC_ULAW, channels=1):
+    """PCM int16 mono ở 'sample_rate' -> body VOICEMSG (sub-header + dữ liệu đã mã hóa)."""
+    codec = CODECS[codec_id]
+    samples = np.asarray(samples, dtype=np.int16).reshape(-1)
+    rate = codec.rate or sample_rate
+    samples = resample(samples, sample_rate, rate)
+    header = VOICE_HEADER.pack(VOICE_MAGIC, codec.codec_id, channels, rate, len(samples))
+    return header + codec.encode(samples)
+
+
+def parse_voice_header(body):
+    """(codec_id, channels, sample_rate, n_samples, offset dữ liệu), hoặc None nếu là PCM thô kiểu cũ."""
+    if len(body) < VOICE_HEADER.size:
+        return None
+    magic, codec_id, channels, rate, n_samples = VOICE_HEADER.unpack_from(body)
+    if magic != VOICE_MAGIC or codec_id not in CODECS or not rate:
+        return None
+    return codec_id, channels, rate, n_samples, VOICE_HEADER.size
+
+
+def decode_voice(body, output_rate=None, default_rate=DEFAULT_RATE):
+    """
+    Body VOICEMSG -> (mảng int16, tần số). Body cũ không có sub-header được coi là PCM thô
+    ở 'default_rate'. Nếu có 'output_rate', âm thanh được đổi về tần số đó
+    (nhiều thiết bị âm thanh không phát trực tiếp được 16 kHz).
+    """
+    header = parse_voice_header(body)
+    if header is None:
+        usable = len(body) - len(body) % 2
+        samples = np.frombuffer(body, dtype='<i2', count=usable // 2).astype(np.int16)
+        rate = default_rate
+    else:
+        codec_id, _, rate, n_samples, offset = header
+        samples = CODECS[codec_id].decode(memoryview(body)[offset:], n_samples)
+    if output_rate and output_rate != rate:
+        return resample(samples, rate, output_rate), output_rate
+    return samples, rate
+
+
+def voice_duration(body, default_rate=DEFAULT_RATE, channels=1):
+    """Thời lượng (giây) của body VOICEMSG, chỉ đọc sub-header (không giải mã)."""
+    header = parse_voice_header(body)
+    if header is None:
+        return len(body) / (default_rate * 2 * channels)
+    _, channels, rate, n_samples, _ = header
+    return n_samples / (rate * max(channels, 1))
+
+
+# === TIN NHẮN THOẠI DẠNG LUỒNG ===
+#
+# Trong lúc còn đang ghi âm, người gửi gửi dần từng đoạn ~0.5 s:
+#   VOICECHUNK::gui::nhan::<vid>::<seq>::<final>::<body VOICEMSG của đoạn>
+# Mỗi đoạn có sub-header codec riêng nên giải mã (và phát) được ngay khi tới.
+# Đoạn cuối có final = 1; người nhận ghép các đoạn thành một body VOICEMSG duy nhất (join_voice).
+
+STREAM_CHUNK_SECONDS = 0.5
+
+
+def new_voice_id():
+    return uuid.uuid4().hex
+
+
+def voice_chunk_parts(vid, seq, final, body):
+    """Các phần body VOICECHUNK (gửi không nối lại)."""
+    return f"{vid}::{seq}::{int(final)}::".encode('utf-8'), body
+
+
+def parse_voice_chunk(body):
+    """body VOICECHUNK -> (vid, seq, final, memoryview(body đoạn)), hoặc None nếu sai định dạng."""
+    view = memoryview(body)
+    head = bytes(view[:96])
+    fields = head.split(b"::", 3)
+    if len(fields) < 4:
+        return None
+    try:
+        seq, final = int(fields[1]), fields[2] == b"1"
+    except ValueError:
+        return None
+    offset = len(fields[0]) + len(fields[1]) + len(fields[2]) + 6
+    return fields[0].decode('utf-8', errors='ignore'), seq, final, view[offset:]
+
+
+class StreamResampler:
+    """
+    Đổi tần số một luồng mẫu đến dần (ghi âm / phát trực tiếp) mà không có tiếng "tách" ở biên đoạn.
+    Đổi tần số bằng FFT trên từng đoạn riêng coi đoạn là tuần hoàn, nên mỗi đoạn được đổi kèm 'guard'
+    mẫu ngữ cảnh hai bên rồi cắt bỏ phần thừa; một đoạn chỉ ra khi đã có thêm 'guard' mẫu phía sau.
+    Độ dài đoạn và 'guard' là bội của src / gcd(src, dst) (441 mẫu cho 44.1 -> 16 kHz) để số mẫu
+    sau khi đổi luôn nguyên, không bị trôi.
+    """
+
+    def __init__(self, src_rate, dst_rate, chunk_seconds=STREAM_CHUNK_SECONDS):
+        self.src_rate = src_rate
+        self.dst_rate = dst_rate
+        block = src_rate // math.gcd(src_rate, dst_rate)
+        self.chunk = max(1, round(chunk_seconds * src_rate / block)) * block
+        self.guard = max(1, math.ceil(0.01 * src_rate / block)) * block  # >= 10 ms
+        self._buffer = np.empty(0, dtype=np.int16)
+        self._context = 0  # số mẫu đầu _buffer là ngữ cảnh đã xử lý
+
+    def push(self, samples):
+        """
+        Thêm mẫu; trả về list các đoạn (int16, ở dst_rate) đã đủ ngữ cảnh để xuất.
+        Các đoạn luôn là mảng mới: 'samples' có thể là view vào buffer sẽ bị ghi đè (ring buffer ghi âm).
+        """
+        samples = np.asarray(samples, dtype=np.int16).reshape(-1)
+        if self.src_rate == self.dst_rate:
+            return [samples.copy()] if len(samples) else []
+        self._buffer = np.concatenate((self._buffer, samples))
+        out = []
+        while len(self._buffer) - self._context >= self.chunk + self.guard:
+            end = self._context + self.chunk
+            out.append(self._resample(self._buffer[:end + self.guard], self._context, self.chunk))
+            keep = min(end, self.guard)
+            self._buffer = self._buffer[end - keep:]
+            self._context = keep
+        return out
+
+    def flush(self):
+        """Phần còn lại (có thể rỗng), gọi khi luồng kết thúc."""
+        out = self._resample(self._buffer, self._context, len(self._buffer) - self._context)
+        self._buffer = np.empty(0, dtype=np.int16)
+        self._context = 0
+        return out
+
+    def _resample(self, window, context, length):
+        out = resample(window, self.src_rate, self.dst_rate)
+        start = context * self.dst_rate // self.src_rate
+        return out[start:start + int(round(length * self.dst_rate / self.src_rate))]
+
+
+class VoiceStreamEncoder:
+    """Mã hóa dần một bản ghi đang diễn ra thành các body đoạn (mỗi đoạn giải mã độc lập)."""
+
+    def __init__(self, sample_rate, codec_id=CODEC_ULAW, channels=1, chunk_seconds=STREAM_CHUNK_SECONDS):
+        self.codec = CODECS[codec_id]
+        self.channels = channels
+        self.rate = self.codec.rate or sample_rate
+        self._resampler = StreamResampler(sample_rate, self.rate, chunk_seconds)
+        self._pending = []  # đoạn đã đổi tần số, gom cho đủ chunk_seconds (khi không cần đổi tần số)
+        self._pending_samples = 0
+        self._chunk = int(chunk_seconds * self.rate)
+
+    def push(self, samples):
+        """Thêm mẫu ghi được; trả về list body các đoạn đã đủ để gửi."""
+        for out in self._resampler.push(samples):
+            self._pending.append(out)
+            self._pending_samples += len(out)
+        bodies = []
+        if self._pending_samples >= self._chunk:
+            bodies.append(self._encode(np.concatenate(self._pending)))
+            self._pending, self._pending_samples = [], 0
+        return bodies
+
+    def flush(self):
+        """Body đoạn cuối (phần còn lại, có thể rỗng)."""
+        self._pending.append(self._resampler.flush())
+        body = self._encode(np.concatenate(self._pending))
+        self._pending, self._pending_samples = [], 0
+        return body
+
+    def _encode(self, samples):
+        header = VOICE_HEADER.pack(VOICE_MAGIC, self.codec.codec_id, self.channels, self.rate, len(samples))
+        return header + self.codec.encode(samples)
+
+
+class IncomingVoice:
+    """
+    Tin nhắn thoại đang nhận dần (phía người nhận): các body đoạn theo thứ tự.
+    Luồng nhận thêm đoạn, luồng phát trực tiếp chờ đoạn kế tiếp bằng wait_chunk().
+    """
+
+    def __init__(self, vid, sender, chat_name):
+        self.vid = vid
+        self.sender = sender
+        self.chat_name = chat_name
+        self.bodies = []
+        self.final = False
+        self._next_seq = 0
+        self._cond = threading.Condition()
+
+    def add(self, seq, body, final):
+        """Thêm đoạn 'seq' (đoạn trùng bị bỏ qua). Trả về True nếu tin nhắn đã đủ."""
+        with self._cond:
+            if seq >= self._next_seq and not self.final:
+                self.bodies.append(body)
+                self._next_seq = seq + 1
+            self.final = self.final or final
+            self._cond.notify_all()
+            return self.final
+
+    def finish(self):
+        """Dừng nhận (người gửi mất kết nối): giữ các đoạn đã có."""
+        with self._cond:
+            self.final = True
+            self._cond.notify_all()
+
+    def wait_chunk(self, index, timeout=None):
+        """Body đoạn thứ 'index', chờ nếu chưa tới; None nếu tin nhắn đã hết."""
+        with self._cond:
+            self._cond.wait_for(lambda: index < len(self.bodies) or self.final, timeout)
+            return self.bodies[index] if index < len(self.bodies) else None
+
+    def duration(self):
+        return sum(voice_duration(body) for body in self.bodies)
+
+
+def join_voice(bodies):
+    """
+    Ghép các body đoạn (cùng một tin nhắn) thành một body VOICEMSG.
+    Cùng codec nối được: chỉ nối dữ liệu và cộng n_samples, không mã hóa lại.
+    Ngược lại (ví dụ ADPCM): giải mã, nối và mã hóa lại một lần.
+    """
+    headers = [parse_voice_header(body) for body in bodies]
+    first = headers[0] if headers else None
+    if first is not None and all(h is not None and h[:3] == first[:3] for h in headers):
+        codec_id, channels, rate = first[:3]
+        if CODECS[codec_id].concatenable:
+            n_samples = sum(h[3] for h in headers)
+            data = [memoryview(body)[h[4]:] for body, h in zip(bodies, headers)]
+            return VOICE_HEADER.pack(VOICE_MAGIC, codec_id, channels, rate, n_samples) + b"".join(data)
+        samples = np.concatenate([decode_voice(body)[0] for body in bodies])
+        return encode_voice(samples, rate, codec_id, channels)
+    # Đoạn khác codec / khác tần số: đưa hết về PCM16 ở tần số mặc định
+    samples = np.concatenate([decode_voice(body, output_rate=DEFAULT_RATE)[0] for body in bodies]) \
+        if bodies else np.empty(0, dtype=np.int16)
+    return encode_voice(samples, DEFAULT_RATE, CODEC_PCM16)